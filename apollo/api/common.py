@@ -4,6 +4,7 @@ from flask_apispec import MethodResource, Ref, marshal_with, use_kwargs
 from webargs import fields
 
 from apollo.api.decorators import protect
+from apollo.dal.pagination import paginate
 from apollo.settings import API_PAGE_SIZE
 
 
@@ -11,15 +12,22 @@ from apollo.settings import API_PAGE_SIZE
 class BaseListResource(MethodResource):
     schema = None
 
-    @use_kwargs({"page": fields.Int(missing=1)}, location="query")
+    @use_kwargs({"page": fields.Int(missing=1), "cursor": fields.Str(missing=None)}, location="query")
     @protect
     def get(self, **kwargs):
         page = kwargs.get("page")
         query_items = self.get_items(**kwargs)
+        pager = paginate(query_items, page=page, per_page=API_PAGE_SIZE, cursor=kwargs.get("cursor"))
 
         envelope = {
-            "meta": {"page": page, "total": query_items.count()},
-            "objects": self.schema.dump(query_items.paginate(page=page, per_page=API_PAGE_SIZE).items, many=True),
+            "meta": {
+                "page": pager.page,
+                "total": pager.total,
+                "approximate": pager.approximate,
+                "next": pager.next_cursor,
+                "previous": pager.prev_cursor,
+            },
+            "objects": self.schema.dump(pager.items, many=True),
         }
 
         return jsonify(envelope)
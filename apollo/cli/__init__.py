@@ -1,9 +1,13 @@
 """CLI module."""
 
+from .events import events_cli
 from .messages import messages_cli
+from .submissions import submissions_cli
 from .users import users_cli
 
 __all__ = [
+    "events_cli",
     "messages_cli",
+    "submissions_cli",
     "users_cli",
 ]
@@ -0,0 +1,31 @@
+"""Events CLI options."""
+
+from zipfile import ZipFile
+
+import click
+from flask.cli import AppGroup, with_appcontext
+
+from apollo.deployments.models import Deployment
+from apollo.deployments.serializers import EventArchiveSerializer
+
+events_cli = AppGroup("events", short_help="Event commands.")
+
+
+@events_cli.command("import-archive")
+@with_appcontext
+@click.argument("archive_file", type=click.Path(exists=True, dir_okay=False))
+@click.option("-d", "--deployment", "deployment_id", type=int, help="Import the event into this deployment ID.")
+def import_archive(archive_file, deployment_id):
+    """Import an event from an event archive."""
+    if deployment_id is None:
+        deployment = Deployment.query.first()
+    else:
+        deployment = Deployment.query.filter(Deployment.id == deployment_id).first()
+
+    if deployment is None:
+        raise click.ClickException("The deployment does not exist.")
+
+    with ZipFile(archive_file) as zip_file:
+        event = EventArchiveSerializer().deserialize(zip_file, deployment)
+
+    click.echo(f"Imported {event.name} (ID {event.id}).")
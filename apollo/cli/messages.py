@@ -45,3 +45,15 @@ def replay(source_file):
             messages_count += 1
 
     click.echo(f"{messages_count} messages replayed.")
+
+
+@messages_cli.command("requeue")
+@with_appcontext
+@click.option("--minutes", type=int, default=5, help="Requeue messages pending for at least this many minutes.")
+def requeue(minutes):
+    """Restarts the processing of the queued inbound messages."""
+    from apollo.messaging.tasks import requeue_inbound_messages
+
+    senders_count = requeue_inbound_messages(minutes)
+
+    click.echo(f"Messages of {senders_count} senders requeued.")
@@ -0,0 +1,104 @@
+"""Submissions CLI options."""
+
+import click
+from flask.cli import AppGroup, with_appcontext
+
+from apollo.core import db
+from apollo.deployments.models import Event
+from apollo.formsframework.models import Form
+from apollo.submissions import indexes
+from apollo.submissions.coverage import rebuild_coverage
+from apollo.submissions.qa.status import rebuild_qa_status
+
+submissions_cli = AppGroup("submissions", short_help="Submission commands.")
+
+
+@submissions_cli.command("rebuild-coverage")
+@with_appcontext
+@click.option("-e", "--event", "event_id", type=int, help="Only rebuild the counters for this event ID.")
+@click.option("-f", "--form", "form_id", type=int, help="Only rebuild the counters for this form ID.")
+def rebuild_coverage_counters(event_id, form_id):
+    """Rebuild the response rate dashboard counters."""
+    events = db.session.query(Event)
+    if event_id is not None:
+        events = events.filter(Event.id == event_id)
+
+    rebuilt = 0
+    for event in events:
+        forms = [form for form in event.forms if form.form_type in ("CHECKLIST", "SURVEY")]
+        if form_id is not None:
+            forms = [form for form in forms if form.id == form_id]
+
+        for form in forms:
+            rebuild_coverage(event, form)
+            rebuilt += 1
+            click.echo(f"Rebuilt coverage counters for {form.name} in {event.name}.")
+
+    click.echo(f"{rebuilt} coverage counter set(s) rebuilt.")
+
+
+@submissions_cli.command("rebuild-qa-status")
+@with_appcontext
+@click.option("-f", "--form", "form_id", type=int, help="Only rebuild the statuses for this form ID.")
+def rebuild_qa_statuses(form_id):
+    """Rebuild the stored quality assurance statuses."""
+    forms = db.session.query(Form).filter(Form.form_type.in_(("CHECKLIST", "SURVEY")))
+    if form_id is not None:
+        forms = forms.filter(Form.id == form_id)
+
+    rebuilt = 0
+    for form in forms:
+        rebuild_qa_status(form)
+        rebuilt += 1
+        click.echo(f"Rebuilt QA statuses for {form.name}.")
+
+    click.echo(f"{rebuilt} form(s) rebuilt.")
+
+
+@submissions_cli.command("data-indexes")
+@with_appcontext
+@click.option("-f", "--form", "form_id", type=int, help="Only propose the indexes of this form ID.")
+@click.option("--create", is_flag=True, help="Create the missing indexes and drop the unused ones.")
+def data_indexes(form_id, create):
+    """Propose expression indexes for the fields of the forms."""
+    forms = db.session.query(Form).order_by(Form.id)
+    if form_id is not None:
+        forms = forms.filter(Form.id == form_id)
+    forms = forms.all()
+    existing = set(indexes.existing_indexes(form_id))
+
+    for form in forms:
+        if form.is_hidden:
+            continue
+
+        for proposal in indexes.propose_indexes(form):
+            status = "exists" if proposal.name in existing else "missing"
+            click.echo(f"{form.name} {proposal.tag} ({', '.join(proposal.reasons)}), {status}:")
+            click.echo(f"  {indexes.create_statement(proposal)}")
+
+    if not create:
+        return
+
+    # the indexes of the deleted forms are dropped as well
+    form_ids = {form.id for form in forms}
+    form_ids.update(indexes.index_form_id(name) for name in existing if indexes.index_form_id(name))
+    for index_form_id in sorted(form_ids):
+        created, dropped = indexes.sync_indexes(index_form_id)
+        for name in created:
+            click.echo(f"Created {name}.")
+        for name in dropped:
+            click.echo(f"Dropped {name}.")
+
+
+@submissions_cli.command("data-index-usage")
+@with_appcontext
+def data_index_usage():
+    """Report the usage of the expression indexes of the form fields."""
+    usages = indexes.index_usage()
+    for usage in usages:
+        click.echo(
+            f"{usage.name} (form {usage.form_id}): {usage.scans} scans, "
+            f"{usage.tuples_read} tuples read, {usage.size // 1024} kB"
+        )
+
+    click.echo(f"{len(usages)} index(es).")
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""Keyset pagination with estimated result counts.
+
+Paginating the submission and participant lists with `OFFSET` reads and
+discards every row before the requested page, and counting the results runs
+the whole filtered query, so deep pages of large events are slow. Instead,
+pages are requested with an opaque cursor holding the sort key of the last
+(or first) row of the previous page, and are read with a condition starting
+after it. The sort key is made of the `ORDER BY` terms of the query, with
+the primary key of its first entity appended so that every row has a unique
+key. Pages requested without a cursor are read with `OFFSET`.
+
+Results are counted exactly up to `PAGINATION_EXACT_COUNT_LIMIT` rows.
+Larger counts are estimated by the query planner and cached for the query,
+with its filters, for `PAGINATION_COUNT_CACHE_TIMEOUT` seconds.
+"""
+
+import hashlib
+import json
+import logging
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+import sqlalchemy as sa
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from redis.exceptions import RedisError
+from sqlalchemy.sql import operators
+from sqlalchemy_utils import Choice
+
+from apollo import settings
+from apollo.core import db, red
+
+logger = logging.getLogger(__name__)
+
+NEXT = "n"
+PREVIOUS = "p"
+
+_KEY_LABEL = "keyset_{}"
+
+
+class Pagination(object):
+    """A page of results.
+
+    Has the attributes of the Flask-SQLAlchemy pagination used by the
+    templates, and the cursors of the previous and next pages.
+    """
+
+    def __init__(self, page, per_page, items, total, has_next, approximate=False, next_cursor=None, prev_cursor=None):
+        """Initializes the page."""
+        self.page = page
+        self.per_page = per_page
+        self.items = items
+        self.total = total
+        self.has_next = has_next
+        self.approximate = approximate
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def prev_num(self):
+        return self.page - 1 if self.has_prev else None
+
+    @property
+    def next_num(self):
+        return self.page + 1 if self.has_next else None
+
+    @property
+    def pages(self):
+        return -(-self.total // self.per_page) if self.per_page else 0
+
+
+class SortKey(object):
+    """A term of the sort key of a query."""
+
+    def __init__(self, expression, descending=False, nulls_last=None):
+        """Initializes the term.
+
+        Without an explicit position, nulls are sorted like PostgreSQL
+        does: last in ascending order and first in descending order.
+        """
+        self.expression = expression
+        self.descending = descending
+        self.nulls_last = (not descending) if nulls_last is None else nulls_last
+
+    @property
+    def nullable(self):
+        return not (isinstance(self.expression, sa.Column) and not self.expression.nullable)
+
+    def reversed(self):
+        return SortKey(self.expression, not self.descending, not self.nulls_last)
+
+    def ordering(self):
+        term = sa.desc(self.expression) if self.descending else sa.asc(self.expression)
+        return sa.nullslast(term) if self.nulls_last else sa.nullsfirst(term)
+
+    def equals(self, value):
+        return self.expression.is_(None) if value is None else self.expression == value
+
+    def follows(self, value):
+        """Condition for the values sorted after a value."""
+        if value is None:
+            return sa.false() if self.nulls_last else self.expression.isnot(None)
+
+        condition = self.expression < value if self.descending else self.expression > value
+        if self.nulls_last and self.nullable:
+            return sa.or_(condition, self.expression.is_(None))
+
+        return condition
+
+
+def _sort_key(clause):
+    descending = False
+    nulls_last = None
+    while isinstance(clause, sa.sql.elements.UnaryExpression) and clause.modifier is not None:
+        if clause.modifier is operators.desc_op:
+            descending = True
+        elif clause.modifier in (operators.nulls_last_op, operators.nulls_first_op):
+            nulls_last = clause.modifier is operators.nulls_last_op
+        clause = clause.element
+
+    if isinstance(clause, sa.sql.elements.TextClause):
+        clause = sa.literal_column(clause.text)
+    elif isinstance(clause, sa.sql.elements.Label):
+        clause = clause.element
+
+    return SortKey(clause, descending, nulls_last)
+
+
+def sort_keys(query, unique=False):
+    """Returns the sort key of a query.
+
+    The primary key of the first entity of the query is appended to its
+    `ORDER BY` terms, unless `unique` is set because they are already
+    unique for every row.
+    """
+    keys = [_sort_key(clause) for clause in query._order_by_clauses]
+    if not unique:
+        entity = query.column_descriptions[0]["entity"]
+        keys.extend(SortKey(column) for column in sa.inspect(entity).primary_key)
+
+    return keys
+
+
+def _fingerprint(keys):
+    payload = "|".join(f"{key.expression}:{key.descending}:{key.nulls_last}" for key in keys)
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()[:8]
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"t": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"n": str(value)}
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Choice):
+        # the values of choice columns are compared by their code
+        return {"c": value.code}
+
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if "t" in value:
+            return datetime.fromisoformat(value["t"])
+        if "d" in value:
+            return date.fromisoformat(value["d"])
+        if "n" in value:
+            return Decimal(value["n"])
+        if "c" in value:
+            return value["c"]
+
+    return value
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config["SECRET_KEY"], salt="apollo.pagination")
+
+
+def encode_cursor(direction, keys, values):
+    """Returns the opaque cursor of the rows before or after a sort key."""
+    return _serializer().dumps([direction, _fingerprint(keys), [_encode_value(value) for value in values]])
+
+
+def decode_cursor(cursor, keys):
+    """Returns the direction and the sort key values of a cursor.
+
+    Returns None if the cursor is invalid or was not made for the sort key
+    of the query, e.g. because the sort order was changed.
+    """
+    if not cursor:
+        return None
+
+    try:
+        direction, fingerprint, values = _serializer().loads(cursor)
+    except (BadSignature, TypeError, ValueError):
+        return None
+
+    if direction not in (NEXT, PREVIOUS) or fingerprint != _fingerprint(keys) or len(values) != len(keys):
+        return None
+
+    try:
+        return direction, [_decode_value(value) for value in values]
+    except (TypeError, ValueError):
+        return None
+
+
+def after(keys, values):
+    """Condition for the rows sorted after the given sort key values."""
+    if all(not key.descending and not key.nullable for key in keys):
+        # an index on the columns can be used for a row comparison
+        if len(keys) == 1:
+            return keys[0].expression > values[0]
+        return sa.tuple_(*[key.expression for key in keys]) > sa.tuple_(*values)
+
+    conditions = []
+    for index, (key, value) in enumerate(zip(keys, values)):
+        equal = [keys[i].equals(values[i]) for i in range(index)]
+        conditions.append(sa.and_(*equal, key.follows(value)))
+
+    return sa.or_(*conditions)
+
+
+def _cache_key(query):
+    compiled = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"render_postcompile": True})
+    payload = json.dumps([compiled.string, compiled.params], default=str, sort_keys=True)
+    return compiled, f"apollo:count:{hashlib.md5(payload.encode('utf-8')).hexdigest()}"
+
+
+def _planner_estimate(compiled):
+    connection = db.session.connection()
+    plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled.string}", compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count_results(query):
+    """Returns the number of results of a query and if it is estimated.
+
+    The results are counted up to `PAGINATION_EXACT_COUNT_LIMIT`; larger
+    counts are estimated by the query planner and cached.
+    """
+    query = query.order_by(None)
+    compiled, key = _cache_key(query)
+    try:
+        cached = red.get(key)
+    except RedisError:
+        logger.exception("Could not read the cached count %s", key)
+        cached = None
+    if cached:
+        return json.loads(cached), True
+
+    limit = settings.PAGINATION_EXACT_COUNT_LIMIT
+    count = db.session.execute(sa.select(sa.func.count()).select_from(query.limit(limit + 1).subquery())).scalar()
+    if count <= limit:
+        return count, False
+
+    count = max(_planner_estimate(compiled), count)
+    try:
+        red.set(key, json.dumps(count), settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+    except RedisError:
+        logger.exception("Could not store the cached count %s", key)
+
+    return count, True
+
+
+def page_query(query, keys, decoded=None, offset=0):
+    """Returns the query of the rows of a page, with their sort key values.
+
+    :param decoded: (Optional) the decoded cursor of the page; without it,
+                    the rows start at `offset`
+    """
+    if decoded is not None and decoded[0] == PREVIOUS:
+        ordering = [key.reversed() for key in keys]
+    else:
+        ordering = keys
+
+    statement = query.add_columns(
+        *[key.expression.label(_KEY_LABEL.format(index)) for index, key in enumerate(keys)]
+    ).order_by(None)
+    statement = statement.order_by(*[key.ordering() for key in ordering])
+    if decoded is not None:
+        return statement.filter(after(ordering, decoded[1]))
+
+    return statement.offset(offset)
+
+
+def paginate(query, page=1, per_page=None, cursor=None, unique=False):
+    """Returns a page of the results of a query.
+
+    :param page: The page number, which is used for display only when a
+                 cursor is given
+    :param cursor: (Optional) the cursor of the previous or next page
+    :param unique: Whether the `ORDER BY` terms of the query are unique
+                   for every row; see :function:`sort_keys`
+    """
+    per_page = per_page or settings.PAGE_SIZE
+    page = max(page or 1, 1)
+    keys = sort_keys(query, unique)
+    entity_count = len(query.column_descriptions)
+    decoded = decode_cursor(cursor, keys)
+
+    statement = page_query(query, keys, decoded, (page - 1) * per_page)
+    rows = statement.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if decoded is not None and decoded[0] == PREVIOUS:
+        rows.reverse()
+        has_next = True
+        # the first page can be reached by going back from a deep page
+        if not has_more:
+            page = 1
+    else:
+        has_next = has_more
+
+    if entity_count == 1:
+        # the joins of a query can repeat the rows of an entity
+        items = list({id(row[0]): row[0] for row in rows}.values())
+    else:
+        items = rows
+
+    total, approximate = count_results(query)
+    if rows:
+        first = list(rows[0][entity_count:])
+        last = list(rows[-1][entity_count:])
+        prev_cursor = encode_cursor(PREVIOUS, keys, first) if page > 1 else None
+        next_cursor = encode_cursor(NEXT, keys, last) if has_next else None
+    else:
+        prev_cursor = next_cursor = None
+
+    return Pagination(page, per_page, items, total, has_next, approximate, next_cursor, prev_cursor)
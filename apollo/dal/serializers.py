@@ -1,12 +1,252 @@
 # -*- coding: utf-8 -*-
+"""Event archive serialization.
+
+The members of an event archive are newline delimited JSON files. When an
+archive is written, every member is built by a worker thread, with its own
+application context and database session, from queries read in chunks with
+keyset pagination, and the finished members are copied into the ZIP file in
+the order they were added.
+
+When an archive is read, the large members are copied in parallel into
+staging tables with COPY, each on its own connection, and are then inserted
+into the model tables with set-based statements in the current transaction.
+"""
+
 import abc
+import json
+import os
+import re
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile, TemporaryFile
+from uuid import uuid4
+
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+
+from apollo import settings
+from apollo.core import db
+
+ARCHIVE_CHUNK_SIZE = 1000
+
+# staged members larger than this are spooled to disk before they are copied
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
 
 
 class ArchiveSerializer(abc.ABC):
     @abc.abstractmethod
-    def serialize(self, obj, zip_file):
-        pass
+    def serialize(self, event, archive):
+        """Adds the members for an event to an `ArchiveWriter`."""
 
     @abc.abstractmethod
-    def deserialize(self, zip_file):
-        pass
+    def deserialize(self, archive, event):
+        """Loads the members of an `ArchiveReader` for a new event."""
+
+
+def keyset_chunks(query, *columns, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """Yields the results of a query in chunks.
+
+    The results are paginated on the given columns, which must be unique
+    together, so every chunk is read starting after the last row of the
+    previous one instead of scanning the rows skipped by an offset.
+    """
+    query = query.order_by(None).order_by(*columns)
+    key = sa.tuple_(*columns) if len(columns) > 1 else columns[0]
+
+    chunk = query.limit(chunk_size).all()
+    while chunk:
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+
+        values = [getattr(chunk[-1], column.key) for column in columns]
+        last = sa.tuple_(*values) if len(columns) > 1 else values[0]
+        chunk = query.filter(key > last).limit(chunk_size).all()
+
+
+def serialize_chunks(serializer, chunks):
+    """Yields the serialized records of the objects in each chunk."""
+    for chunk in chunks:
+        yield [serializer.serialize_one(obj) for obj in chunk]
+
+
+class ArchiveWriter(object):
+    """Writes the members of a ZIP archive in parallel."""
+
+    def __init__(self, zip_file, max_workers=None):
+        """Creates a writer of the members of an open ZIP file."""
+        self.zip_file = zip_file
+        self.max_workers = max_workers or settings.ARCHIVE_WORKERS
+        self.members = []
+
+    def add(self, name, records, *args):
+        """Adds a member to the archive.
+
+        `records` is called with `args` in a worker thread and must return
+        an iterable of chunks (lists) of JSON serializable records. Since it
+        runs with its own database session, it should be passed the ids of
+        the objects to serialize rather than the objects themselves.
+        """
+        self.members.append((name, records, args))
+
+    @staticmethod
+    def _write_member(app, records, args):
+        with app.app_context():
+            fileobj = TemporaryFile()
+            try:
+                for chunk in records(*args):
+                    lines = "".join(f"{json.dumps(record)}\n" for record in chunk)
+                    fileobj.write(lines.encode("utf-8"))
+            except Exception:
+                fileobj.close()
+                raise
+
+        return fileobj
+
+    def write(self, progress=None):
+        """Builds the members and writes them to the archive.
+
+        `progress` is called with the number of written and total members
+        after each member is written.
+        """
+        app = current_app._get_current_object()
+        total = len(self.members)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._write_member, app, records, args) for _, records, args in self.members]
+            try:
+                for index, (member, future) in enumerate(zip(self.members, futures), 1):
+                    with future.result() as fileobj:
+                        size = fileobj.seek(0, os.SEEK_END)
+                        fileobj.seek(0)
+                        with self.zip_file.open(member[0], "w", force_zip64=size > zipfile.ZIP64_LIMIT) as f:
+                            shutil.copyfileobj(fileobj, f)
+
+                    if progress is not None:
+                        progress(index, total)
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+
+
+class ArchiveReader(object):
+    """Reads the members of a ZIP archive.
+
+    The staging tables are unlogged tables created on separate connections,
+    so they are dropped when the reader is closed, after rolling back the
+    current transaction if it is closed because of an error.
+    """
+
+    def __init__(self, zip_file, max_workers=None):
+        """Creates a reader of the members of an open ZIP file."""
+        self.zip_file = zip_file
+        self.max_workers = max_workers or settings.ARCHIVE_WORKERS
+        self.prefix = f"archive_{uuid4().hex[:8]}"
+        self.names = set(zip_file.namelist())
+        self.tables = {}
+
+    def __contains__(self, name):
+        """Whether the archive has a member."""
+        return name in self.names
+
+    def __enter__(self):
+        """Returns the reader."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Closes the reader, rolling back the transaction on errors."""
+        if exc_type is not None:
+            db.session.rollback()
+        self.close()
+
+    def records(self, name):
+        """Yields the records of a member of the archive."""
+        if name not in self:
+            return
+
+        with self.zip_file.open(name) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _stage_member(self, engine, name, table_name):
+        with SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as buffer:
+            with self.zip_file.open(name) as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        # backslashes are escape characters in the COPY
+                        # text format
+                        buffer.write(line.replace(b"\\", b"\\\\") + b"\n")
+            buffer.seek(0)
+
+            with engine.begin() as connection:
+                connection.execute(sa.text(f'CREATE UNLOGGED TABLE "{table_name}" (record jsonb NOT NULL)'))
+                cursor = connection.connection.cursor()
+                try:
+                    cursor.copy_expert(f'COPY "{table_name}" (record) FROM STDIN', buffer)
+                finally:
+                    cursor.close()
+
+    def stage(self, *names):
+        """Copies the records of the members into staging tables."""
+        engine = db.engine
+        pending = {}
+        for name in names:
+            if name in self and name not in self.tables:
+                stem = re.sub(r"\W", "_", os.path.splitext(name)[0])
+                pending[name] = f"{self.prefix}_{stem}"
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(self._stage_member, engine, name, table_name) for name, table_name in pending.items()
+            ]
+            try:
+                for name, future in zip(pending, futures):
+                    future.result()
+                    self.tables[name] = pending[name]
+            finally:
+                # tables created by the members that failed are dropped too
+                for name, table_name in pending.items():
+                    self.tables.setdefault(name, table_name)
+
+    def table(self, name):
+        """Returns the staging table of a member, or None if it is absent."""
+        table_name = self.tables.get(name)
+        if table_name is None:
+            return None
+
+        return sa.table(table_name, sa.column("record", JSONB))
+
+    def close(self):
+        """Drops the staging tables."""
+        if not self.tables:
+            return
+
+        with db.engine.begin() as connection:
+            for table_name in self.tables.values():
+                connection.execute(sa.text(f'DROP TABLE IF EXISTS "{table_name}"'))
+        self.tables = {}
+
+
+def staged_uuid(value):
+    """Returns the UUID of a staged JSON value."""
+    return sa.cast(value.astext, UUID(as_uuid=True))
+
+
+def staged_json(value):
+    """Returns a staged JSON value, with JSON nulls as SQL nulls."""
+    return sa.func.nullif(value, sa.cast(sa.literal("null"), JSONB))
+
+
+def staged_timestamp(value):
+    """Returns the UTC timestamp of a staged UNIX timestamp."""
+    return sa.func.timezone("UTC", sa.func.to_timestamp(sa.cast(value.astext, sa.Float)))
+
+
+def random_uuid():
+    """Returns a random UUID for the staged records without one."""
+    return sa.cast(sa.func.md5(sa.func.concat(sa.func.random(), sa.func.clock_timestamp())), UUID(as_uuid=True))
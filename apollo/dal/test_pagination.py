@@ -0,0 +1,75 @@
+from datetime import datetime
+
+from sqlalchemy import BigInteger, desc, nullslast
+from sqlalchemy.dialects import postgresql
+from sqlalchemy_utils import Choice
+
+from apollo.dal import pagination
+from apollo.locations.models import Location
+from apollo.participants.models import Participant
+from apollo.submissions.models import Submission
+
+
+def _sql(query):
+    return str(query.statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def test_cursors(app):
+    """Tests that cursors only apply to the sort order they were made for."""
+    query = Submission.query.order_by(nullslast(desc(Submission.participant_updated)))
+    keys = pagination.sort_keys(query)
+    values = [datetime(2024, 5, 1, 10, 30), 42]
+
+    cursor = pagination.encode_cursor(pagination.NEXT, keys, values)
+    assert pagination.decode_cursor(cursor, keys) == (pagination.NEXT, values)
+    assert pagination.decode_cursor(cursor[:-1], keys) is None
+    assert pagination.decode_cursor(cursor, pagination.sort_keys(Submission.query)) is None
+    assert pagination.decode_cursor(None, keys) is None
+
+    # choices are encoded by their code
+    query = Participant.query.order_by(Participant.gender)
+    keys = pagination.sort_keys(query)
+    cursor = pagination.encode_cursor(pagination.NEXT, keys, [Choice("F", "Female"), 3])
+    assert pagination.decode_cursor(cursor, keys) == (pagination.NEXT, ["F", 3])
+    sql = _sql(pagination.page_query(query, keys, (pagination.NEXT, ["F", 3])))
+    assert "participant.gender > 'F'" in sql
+
+
+def test_keyset_conditions(app):
+    """Tests the conditions of the rows after and before a cursor."""
+    query = Submission.query.join(Participant, Submission.participant_id == Participant.id).order_by(
+        nullslast(desc(Submission.participant_updated)), Participant.participant_id.cast(BigInteger)
+    )
+    keys = pagination.sort_keys(query)
+    timestamp = datetime(2024, 5, 1)
+
+    sql = _sql(pagination.page_query(query, keys, (pagination.NEXT, [timestamp, 12, 5])))
+    assert (
+        "WHERE submission.participant_updated < '2024-05-01 00:00:00' OR submission.participant_updated IS NULL "
+        "OR submission.participant_updated = '2024-05-01 00:00:00' AND "
+        "(CAST(participant.participant_id AS BIGINT) > 12 OR CAST(participant.participant_id AS BIGINT) IS NULL) "
+        "OR submission.participant_updated = '2024-05-01 00:00:00' AND "
+        "CAST(participant.participant_id AS BIGINT) = 12 AND submission.id > 5 "
+        "ORDER BY submission.participant_updated DESC NULLS LAST, "
+        "CAST(participant.participant_id AS BIGINT) ASC NULLS LAST, submission.id ASC NULLS LAST"
+    ) in sql
+
+    # the previous page is read in the reverse order, from a null value
+    sql = _sql(pagination.page_query(query, keys, (pagination.PREVIOUS, [None, 12, 5])))
+    assert "WHERE submission.participant_updated IS NOT NULL OR" in sql
+    assert "ORDER BY submission.participant_updated ASC NULLS FIRST" in sql
+
+    sql = _sql(pagination.page_query(Submission.query, pagination.sort_keys(Submission.query), None, 50))
+    assert sql.endswith("ORDER BY submission.id ASC NULLS LAST\n LIMIT ALL OFFSET 50")
+
+    query = Location.query.order_by(Location.code).distinct(Location.code)
+    sql = _sql(pagination.page_query(query, pagination.sort_keys(query, unique=True), (pagination.NEXT, ["0042"])))
+    assert "WHERE location.code > '0042' ORDER BY location.code ASC NULLS LAST" in sql
+
+
+def test_pagination_attributes():
+    """Tests the page attributes used by the templates."""
+    pager = pagination.Pagination(3, 25, [], 120, has_next=True, approximate=True)
+
+    assert (pager.has_prev, pager.prev_num, pager.next_num, pager.pages) == (True, 2, 4, 5)
+    assert pagination.Pagination(1, 25, [], 0, has_next=False).prev_num is None
@@ -1,10 +1,15 @@
+import csv
 from contextlib import suppress
+from tempfile import SpooledTemporaryFile
 
 from sqlalchemy.orm import Query
 from sqlalchemy.sql import visitors
 
 from apollo.dal.models import BaseModel
 
+# rows copied with `copy_rows` are spooled to disk beyond this size
+COPY_SPOOL_SIZE = 16 * 1024 * 1024
+
 
 def has_model(query: Query, model: BaseModel) -> bool:
     '''
@@ -32,3 +37,32 @@ def has_model(query: Query, model: BaseModel) -> bool:
                     return True
 
     return False
+
+
+def copy_rows(connection, table_name, columns, rows):
+    """Copies rows into a table with COPY.
+
+    This is much faster than inserting the rows with INSERT statements.
+    `connection` is a SQLAlchemy connection and `rows` an iterable of tuples
+    with a value for each of the columns. None values, as well as empty
+    strings, are copied as NULL. Returns the number of rows copied.
+    """
+    count = 0
+    with SpooledTemporaryFile(
+            max_size=COPY_SPOOL_SIZE, mode='w+', newline='') as buffer:
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+        buffer.seek(0)
+
+        column_list = ', '.join(f'"{column}"' for column in columns)
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(
+                f'COPY "{table_name}" ({column_list}) FROM STDIN '
+                f'WITH (FORMAT csv)', buffer)
+        finally:
+            cursor.close()
+
+    return count
@@ -1,44 +1,103 @@
 # -*- coding: utf-8 -*-
 import calendar
-import json
+from datetime import datetime, timezone
 
-from apollo.dal.serializers import ArchiveSerializer
+from apollo.core import db
+from apollo.dal.serializers import ArchiveReader, ArchiveSerializer, ArchiveWriter, keyset_chunks, serialize_chunks
 from apollo.deployments.models import Event
+from apollo.formsframework.models import Form
 from apollo.formsframework.serializers import FormSerializer
 from apollo.locations.serializers import LocationSetArchiveSerializer
 from apollo.messaging.serializers import MessageArchiveSerializer
 from apollo.participants.serializers import ParticipantSetArchiveSerializer
+from apollo.submissions.coverage import rebuild_coverage
 from apollo.submissions.serializers import SubmissionArchiveSerializer
 
 
 class EventArchiveSerializer(ArchiveSerializer):
     __model__ = Event
 
-    def deserialize(self, zip_file):
-        return super().deserialize(zip_file)
-
-    def serialize(self, event, zip_file):
-        with zip_file.open('event.ndjson', 'w') as f:
-            data = self.serialize_one(event)
-            line = f'{json.dumps(data)}\n'
-            f.write(line.encode('utf-8'))
-
-        form_serializer = FormSerializer()
-        location_set_serializer = LocationSetArchiveSerializer()
-        message_serializer = MessageArchiveSerializer()
-        participant_set_serializer = ParticipantSetArchiveSerializer()
-        submission_serializer = SubmissionArchiveSerializer()
-
-        with zip_file.open('forms.ndjson', 'w') as f:
-            for form in event.forms:
-                data = form_serializer.serialize_one(form)
-                line = f'{json.dumps(data)}\n'
-                f.write(line.encode('utf-8'))
-
-        location_set_serializer.serialize(event, zip_file)
-        message_serializer.serialize(event, zip_file)
-        participant_set_serializer.serialize(event, zip_file)
-        submission_serializer.serialize(event, zip_file)
+    # the members that are bulk loaded through staging tables
+    STAGED_MEMBERS = (
+        'location_types.ndjson',
+        'location_type_paths.ndjson',
+        'locations.ndjson',
+        'location_paths.ndjson',
+        'participant_partners.ndjson',
+        'participant_roles.ndjson',
+        'participants.ndjson',
+        'phone-contacts.ndjson',
+        'submissions.ndjson',
+        'messages.ndjson',
+    )
+
+    def deserialize(self, zip_file, deployment):
+        """Creates a new event in the deployment from an event archive.
+
+        The records are inserted in a single transaction, which is committed
+        before the coverage counters of the event forms are rebuilt.
+        """
+        with ArchiveReader(zip_file) as archive:
+            data = next(archive.records('event.ndjson'), None)
+            if data is None:
+                raise ValueError('The archive contains no event')
+
+            archive.stage(*self.STAGED_MEMBERS)
+
+            event = Event(
+                name=data['name'],
+                start=datetime.fromtimestamp(data['start'], timezone.utc),
+                end=datetime.fromtimestamp(data['end'], timezone.utc),
+                deployment_id=deployment.id)
+            db.session.add(event)
+
+            LocationSetArchiveSerializer().deserialize(archive, event)
+            ParticipantSetArchiveSerializer().deserialize(archive, event)
+
+            form_serializer = FormSerializer()
+            for data in archive.records('forms.ndjson'):
+                form = form_serializer.deserialize_one(data)
+                form.deployment_id = deployment.id
+                event.forms.append(form)
+            db.session.flush()
+
+            SubmissionArchiveSerializer().deserialize(archive, event)
+            MessageArchiveSerializer().deserialize(archive, event)
+
+            db.session.commit()
+
+        for form in event.forms:
+            rebuild_coverage(event, form)
+
+        return event
+
+    def serialize(self, event, zip_file, progress=None):
+        """Writes the archive of an event to a ZIP file.
+
+        `progress` is called with the number of written and total archive
+        members after each member is written.
+        """
+        archive = ArchiveWriter(zip_file)
+        archive.add('event.ndjson', self.serialize_event, event.id)
+        archive.add('forms.ndjson', self.serialize_forms, event.id)
+
+        LocationSetArchiveSerializer().serialize(event, archive)
+        MessageArchiveSerializer().serialize(event, archive)
+        ParticipantSetArchiveSerializer().serialize(event, archive)
+        SubmissionArchiveSerializer().serialize(event, archive)
+
+        archive.write(progress)
+
+    def serialize_event(self, event_id):
+        event = Event.query.filter_by(id=event_id).one()
+
+        yield [self.serialize_one(event)]
+
+    def serialize_forms(self, event_id):
+        query = Form.query.filter(Form.events.any(Event.id == event_id))
+
+        yield from serialize_chunks(
+            FormSerializer(), keyset_chunks(query, Form.id))
 
     def serialize_one(self, obj):
         if not isinstance(obj, self.__model__):
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from celery import shared_task
+
+from apollo.deployments.models import Event
+from apollo.deployments.serializers import EventArchiveSerializer
+from apollo.users.exports import run_export
+
+
+@shared_task(bind=True)
+def export_event_archive(self, export_id, event_id, locale=None, channel=None):
+    """Export the archive of an event to a zip file."""
+    event = Event.query.filter_by(id=event_id).first()
+
+    def write(fileobj, report_progress):
+        with ZipFile(fileobj, "w", ZIP_DEFLATED) as zip_file:
+            EventArchiveSerializer().serialize(event, zip_file, report_progress)
+
+    run_export(self, export_id, write, locale)
@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
+import json
 import pathlib
 from datetime import datetime, timezone
+from io import BytesIO
 from unittest import mock
+from zipfile import ZipFile
+
+from flask import current_app
 
 from apollo import services
+from apollo.dal.serializers import ArchiveWriter
 from apollo.testutils import fixtures
 
 DEFAULT_FIXTURES_PATH = pathlib.Path(__file__).parent / "fixtures"
@@ -56,3 +62,31 @@ def test_overlapping_events(app):
         assert event1 not in events
         assert event2 not in events
         assert len(events) == 1
+
+
+def test_archive_writer(app):
+    """Tests that the archive members are written in the order added."""
+
+    def numbers(start, stop):
+        # the members are built in worker threads with an app context
+        assert current_app.config["TESTING"]
+        for chunk_start in range(start, stop, 2):
+            yield [{"number": number} for number in range(chunk_start, min(chunk_start + 2, stop))]
+
+    progress = mock.Mock()
+    buffer = BytesIO()
+    with ZipFile(buffer, "w") as zip_file:
+        archive = ArchiveWriter(zip_file, max_workers=2)
+        archive.add("first.ndjson", numbers, 0, 5)
+        archive.add("second.ndjson", numbers, 5, 6)
+        archive.add("empty.ndjson", numbers, 0, 0)
+        archive.write(progress)
+
+    with ZipFile(buffer) as zip_file:
+        assert zip_file.namelist() == ["first.ndjson", "second.ndjson", "empty.ndjson"]
+        records = [json.loads(line) for line in zip_file.read("first.ndjson").splitlines()]
+        assert records == [{"number": number} for number in range(5)]
+        assert zip_file.read("second.ndjson") == b'{"number": 5}\n'
+        assert zip_file.read("empty.ndjson") == b""
+
+    assert progress.call_args_list == [mock.call(1, 3), mock.call(2, 3), mock.call(3, 3)]
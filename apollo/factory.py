@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import json
 import typing
 from importlib import import_module
 
@@ -41,9 +42,39 @@ TASK_DESCRIPTIONS = {
     "apollo.submissions.tasks.init_submissions": _("Generate Checklists"),
     "apollo.users.tasks.import_users": _("Import Users"),
     "apollo.submissions.tasks.init_survey_submissions": _("Generate Surveys"),
+    "apollo.submissions.tasks.export_submissions": _("Export Submissions"),
+    "apollo.submissions.tasks.export_quality_assurance": _("Export Quality Assurance"),
+    "apollo.messaging.tasks.export_messages": _("Export Messages"),
+    "apollo.deployments.tasks.export_event_archive": _("Export Event Archive"),
 }
 
 
+def publish_task_status(task: Task, status: str, progress: typing.Optional[typing.Dict] = None) -> None:
+    """Publish the status of a task to the channel it was started with.
+
+    The status is stored in a hash keyed by the channel (the session id of
+    the user that started the task) for the task list, and published to the
+    channel for the server-sent events stream.
+    """
+    channel = (task.request.kwargs or {}).get("channel")
+    if not channel:
+        return
+
+    task_info = {
+        "id": task.request.id,
+        "description": str(TASK_DESCRIPTIONS.get(task.name, task.name)),
+        "status": status,
+        "progress": progress or {},
+    }
+    payload = json.dumps(task_info)
+
+    pipeline = red.pipeline()
+    pipeline.hset(channel, task.request.id, payload)
+    pipeline.expire(channel, settings.TASK_STATUS_TTL)
+    pipeline.publish(channel, payload)
+    pipeline.execute()
+
+
 def configure_image_storage(base_config: typing.Dict) -> None:
     """Configure the image storage backend."""
     # depots should only be configured once
@@ -215,6 +246,15 @@ def make_celery(app: Flask) -> Celery:
             with app.app_context():
                 return self.run(*args, **kwargs)
 
+        def update_state(self, task_id=None, state=None, meta=None, **kwargs):
+            super().update_state(task_id=task_id, state=state, meta=meta, **kwargs)
+            if task_id is None or task_id == self.request.id:
+                self.request.progress = meta
+                publish_task_status(self, state, meta)
+
+        def after_return(self, status, retval, task_id, args, kwargs, einfo):
+            publish_task_status(self, status, getattr(self.request, "progress", None))
+
     celery = Celery(app.name, task_cls=FlaskTask)
     celery.config_from_object(app.config["CELERY"])
     celery.set_default()
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 import math
 import re
+import threading
 from datetime import datetime
 from functools import partial
 
+import cachetools
 import wtforms
 from flask import g
 from flask_babel import lazy_gettext as _
@@ -24,6 +26,11 @@ from .custom_fields import IntegerSplitterField
 
 ugly_phone = re.compile("[^0-9]*")
 
+QUESTIONNAIRE_CACHE_SIZE = 256
+
+_questionnaire_cache = cachetools.LRUCache(maxsize=QUESTIONNAIRE_CACHE_SIZE)
+_questionnaire_lock = threading.Lock()
+
 
 def update_submission_version(submission):
     """Version control for submissions."""
@@ -356,12 +363,9 @@ class BaseQuestionnaireForm(wtforms.Form):
         return submission
 
 
-def build_questionnaire(form, data=None):
-    """Builds a questionnaire for use in text parsing."""
+def _questionnaire_fields(form):
+    """Returns the fields of a questionnaire for the responses to a form."""
     fields = {"groups": []}
-    fields["participant"] = wtforms.StringField(
-        "Participant", filters=[partial(filter_participants, form)], validators=[wtforms.validators.data_required()]
-    )
 
     for group in form.data["groups"]:
         groupspec = (group["name"], [])
@@ -411,6 +415,61 @@ def build_questionnaire(form, data=None):
 
         fields["groups"].append(groupspec)
 
+    return fields
+
+
+def _filter_form_participants(form_id, participant_id):
+    """Returns a valid participant for the form with the given id."""
+    if not participant_id:
+        return None
+
+    return filter_participants(db.session.get(Form, form_id), participant_id)
+
+
+def _compile_questionnaire(form):
+    fields = _questionnaire_fields(form)
+    # the cached classes are shared across sessions, so the participant
+    # filter looks the form up by id instead of holding on to the instance
+    fields["participant"] = wtforms.StringField(
+        "Participant",
+        filters=[partial(_filter_form_participants, form.id)],
+        validators=[wtforms.validators.data_required()],
+    )
+
+    return type("QuestionnaireForm", (BaseQuestionnaireForm,), fields)
+
+
+def _compiled_questionnaire(form):
+    """Returns the questionnaire class of a form.
+
+    The classes are cached for every version of a saved form, since the
+    version identifier of a form changes whenever it is saved.
+    """
+    key = (form.id, form.version_identifier)
+    if key[0] is None or key[1] is None:
+        return None
+
+    with _questionnaire_lock:
+        form_class = _questionnaire_cache.get(key)
+    if form_class is None:
+        form_class = _compile_questionnaire(form)
+        with _questionnaire_lock:
+            _questionnaire_cache[key] = form_class
+
+    return form_class
+
+
+def build_questionnaire(form, data=None):
+    """Builds a questionnaire for use in text parsing."""
+    form_class = _compiled_questionnaire(form)
+    if form_class is not None:
+        return form_class(data)
+
+    # forms that are not saved yet have no stable id and version
+    fields = _questionnaire_fields(form)
+    fields["participant"] = wtforms.StringField(
+        "Participant", filters=[partial(filter_participants, form)], validators=[wtforms.validators.data_required()]
+    )
     form_class = type("QuestionnaireForm", (BaseQuestionnaireForm,), fields)
 
     return form_class(data)
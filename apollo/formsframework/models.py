@@ -84,6 +84,7 @@ class Form(Resource):
     calculate_moe = db.Column(db.Boolean)
     accredited_voters_tag = db.Column(db.String)
     quality_checks_enabled = db.Column(db.Boolean, default=False)
+    qa_status_signature = db.Column(db.String)
     invalid_votes_tag = db.Column(db.String)
     registered_voters_tag = db.Column(db.String)
     blank_votes_tag = db.Column(db.String)
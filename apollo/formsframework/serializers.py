@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+from uuid import UUID
+
 from apollo.formsframework.models import Form
 
 
@@ -6,7 +8,10 @@ class FormSerializer(object):
     __model__ = Form
 
     def deserialize_one(self, data):
-        return self.__model__(**data)
+        kwargs = data.copy()
+        kwargs['uuid'] = UUID(data['uuid'])
+
+        return self.__model__(**kwargs)
 
     def serialize_one(self, obj):
         if not isinstance(obj, self.__model__):
@@ -85,6 +85,22 @@ def test_incident_parsing(incident_form, mocker):
     assert flag is False
 
 
+def test_questionnaire_cache(checklist_form, mocker):
+    """Test that saved forms reuse their questionnaire classes."""
+    mocker.patch("apollo.formsframework.forms.filter_form").return_value = [checklist_form]
+    checklist_form.id = 1
+    checklist_form.version_identifier = "v1"
+
+    q1 = build_questionnaire(checklist_form, MultiDict({"AA": "2"}))
+    q2 = build_questionnaire(checklist_form, MultiDict({"AA": "3"}))
+    assert type(q1) is type(q2)
+    assert (q1.AA.data, q2.AA.data) == (2, 3)
+
+    # saving a form changes its version
+    checklist_form.version_identifier = "v2"
+    assert type(build_questionnaire(checklist_form, MultiDict())) is not type(q1)
+
+
 def test_numeric_comparisons():
     """Tests numeric comparisons."""
     comparator = Comparator()
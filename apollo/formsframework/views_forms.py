@@ -2,7 +2,7 @@
 import json
 from io import BytesIO
 
-from flask import Blueprint, abort, flash, g, jsonify, redirect, request, send_file, session, url_for
+from flask import Blueprint, abort, current_app, flash, g, jsonify, redirect, request, send_file, session, url_for
 from flask_babel import gettext as _
 from flask_security import current_user
 from slugify import slugify
@@ -14,7 +14,15 @@ from apollo.formsframework.api import views as api_views
 from apollo.formsframework.forms import FormForm, FormImportForm, make_questionnaire_hidden_toggle_form
 from apollo.formsframework.models import FormBuilderSerializer
 from apollo.frontend.forms import make_checklist_init_form, make_survey_init_form
-from apollo.submissions.tasks import init_submissions, init_survey_submissions
+from apollo.submissions.coverage import coverage_signature
+from apollo.submissions.qa.status import qa_signature
+from apollo.submissions.tasks import (
+    init_submissions,
+    init_survey_submissions,
+    rebuild_coverage,
+    rebuild_qa_status,
+    sync_submission_indexes,
+)
 from apollo.users.models import UserUpload
 from apollo.utils import current_timestamp, generate_identifier, strip_bom_header
 
@@ -96,6 +104,30 @@ def survey_init():
     return redirect(url_for("formsview.index"))
 
 
+def _refresh_coverage(form, previous_signature):
+    """Schedule a rebuild of the response rate counters if they went stale."""
+    if coverage_signature(form) == previous_signature:
+        return
+
+    for event in form.events:
+        rebuild_coverage.delay(event.id, form.id)
+
+
+def _refresh_qa_status(form):
+    """Schedule a rebuild of the stored QA statuses if they went stale."""
+    signature = qa_signature(form) if form.quality_checks else None
+    if signature == form.qa_status_signature:
+        return
+
+    rebuild_qa_status.delay(form.id)
+
+
+def _refresh_submission_indexes(form):
+    """Schedule an update of the expression indexes of the form fields."""
+    if current_app.config.get("SUBMISSION_DATA_INDEXES"):
+        sync_submission_indexes.delay(form.id)
+
+
 def form_builder(view, id):
     """Form builder view."""
     template_name = "admin/formbuilder.html"
@@ -111,7 +143,11 @@ def form_builder(view, id):
         data = request.get_json()
 
         if data:
+            previous_signature = coverage_signature(form)
             FormBuilderSerializer.deserialize(form, data)
+            _refresh_coverage(form, previous_signature)
+            _refresh_qa_status(form)
+            _refresh_submission_indexes(form)
 
         return ""
 
@@ -171,8 +207,12 @@ def edit_form(view, form_id):
 
         return view.render(template_name, **context)
 
+    previous_signature = coverage_signature(form)
     web_form.populate_obj(form)
     form.save()
+    _refresh_coverage(form, previous_signature)
+    _refresh_qa_status(form)
+    _refresh_submission_indexes(form)
 
     return redirect(url_for("formsview.index"))
 
@@ -206,6 +246,9 @@ def forms_list(view):
         models.Form.query.filter(models.Form.id.in_(posted_form_ids)).update({"is_hidden": hide_forms})
         db.session.commit()
         db.session.expire_all()
+        # the indexes of the archived forms are dropped
+        for form in posted_data.get("forms"):
+            _refresh_submission_indexes(form)
 
     all_forms = query.all()
     checklist_forms = query.filter(models.Form.form_type == "CHECKLIST").all()
@@ -297,6 +340,7 @@ def sort_quality_controls(view, form_id):
 
                 form.quality_checks = qc_list
                 form.save()
+                _refresh_qa_status(form)
 
                 return jsonify({})
         except ValueError:
@@ -358,6 +402,8 @@ def quality_control_edit(view, form_id, qc=None):
                 form.quality_checks = [quality_control]
 
             form.save()
+            _refresh_qa_status(form)
+            _refresh_submission_indexes(form)
 
             if request.accept_mimetypes.accept_json:
                 data = {}
@@ -438,6 +484,8 @@ def quality_control_delete(view, form_id, qc):
                     break
 
             form.save()
+            _refresh_qa_status(form)
+            _refresh_submission_indexes(form)
             return "true"
 
     return "false"
@@ -469,5 +517,6 @@ def import_form_schema():
         roles = models.Role.query.filter_by(deployment_id=g.event.deployment_id).all()
         form.roles = roles
         form.save()
+        _refresh_submission_indexes(form)
 
     return redirect(url_for("formsview.index"))
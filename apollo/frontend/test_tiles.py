@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from flask_babel import force_locale
+from sqlalchemy.dialects import postgresql
+
+from apollo.frontend import tiles
+from apollo.submissions.models import Submission
+
+
+def _sql(statement):
+    return str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def test_tile_coordinates():
+    """Tests the parsing of the layers and the bounds of the tiles."""
+    assert tiles.parse_layer("locations-3") == ("locations", 3)
+    assert tiles.parse_layer("submissions-12") == ("submissions", 12)
+    assert tiles.parse_layer("participants-1") is None
+    assert tiles.parse_layer("locations-x") is None
+
+    assert tiles.valid_tile(2, 3, 0)
+    assert not tiles.valid_tile(2, 4, 0)
+    assert not tiles.valid_tile(-1, 0, 0)
+
+    assert tiles.tile_bbox(0, 0, 0) == (-180.0, -tiles.MAX_LATITUDE, 180.0, tiles.MAX_LATITUDE)
+    west, south, east, north = tiles.tile_bbox(1, 1, 1)
+    # the bounds include the buffer of the tile
+    assert west < 0 < east == 180.0
+    assert south == -tiles.MAX_LATITUDE and 0 < north
+
+
+def test_tile_statements(app):
+    """Tests the statements of the location and submission tiles."""
+    location_type = SimpleNamespace(id=3, location_set_id=1)
+    sql = _sql(tiles.location_tile_statement(location_type, 6, 33, 31))
+    assert sql.startswith("SELECT ST_AsMVT(features, 'locations-3', 4096, 'geom')")
+    assert "ST_AsMVTGeom(ST_Transform(location.geom, 3857), ST_TileEnvelope(6, 33, 31), 4096, 64) AS geom" in sql
+    assert "location.location_set_id = 1 AND location.location_type_id = 3 AND (location.geom && " in sql
+
+    query = Submission.query.filter(Submission.form_id == 5)
+    sql = _sql(tiles.submission_tile_statement(SimpleNamespace(id=5), query, 6, 33, 31))
+    assert sql.startswith("SELECT ST_AsMVT(features, 'submissions-5', 4096, 'geom')")
+    assert "WHERE submission.id IN (SELECT submission.id \nFROM submission \nWHERE submission.form_id = 5)" in sql
+
+
+def test_tile_cache(app):
+    """Tests that the tiles are cached under the version of their layer."""
+    assert tiles.version_tag([1, "a"]) == tiles.version_tag([1, "a"])
+    assert tiles.version_tag([1, "a"]) != tiles.version_tag([2, "a"])
+
+    # the tiles have the location names in the current locale
+    location_type = SimpleNamespace(location_set=SimpleNamespace(ancestry_version=1))
+    with force_locale("en"):
+        version = tiles.location_version(location_type)
+    with force_locale("fr"):
+        assert tiles.location_version(location_type) != version
+
+    with mock.patch.object(tiles, "red") as red, mock.patch.object(tiles, "db") as db:
+        red.get.return_value = None
+        db.session.execute.return_value.scalar.return_value = memoryview(b"tile")
+        assert tiles.get_tile("locations-3", "abc", None, 1, 0, 1) == b"tile"
+        red.set.assert_called_once_with("apollo:tile:locations-3:abc:1:0:1", b"tile", tiles.settings.TILE_CACHE_TIMEOUT)
+
+        red.get.return_value = b""
+        assert tiles.get_tile("locations-3", "abc", None, 1, 0, 1) == b""
+        assert db.session.execute.call_count == 1
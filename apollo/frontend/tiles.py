@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Mapbox vector tiles of the locations and submissions.
+
+The tiles are encoded by PostGIS with `ST_AsMVT`, from the points within
+the web mercator envelope of the tile (with a buffer, so that the symbols
+of the points near the edges are not cut). There is a layer of locations
+for every location type, named `locations-<location type id>`, and a layer
+of submissions for every form, named `submissions-<form id>`, which takes
+the filters of the submission list.
+
+Encoded tiles are cached in Redis for `TILE_CACHE_TIMEOUT` seconds, under
+a key made of the data version of their layer: the ancestry version of the
+location set for the locations, and the version of the form with the last
+update of its submissions for the submissions. The version includes the
+locale, since the tiles have the location names in the current locale.
+Tiles of outdated versions are not read again and expire.
+"""
+
+import hashlib
+import json
+import logging
+import math
+
+import sqlalchemy as sa
+from flask_babel import get_locale
+from redis.exceptions import RedisError
+
+from apollo import settings
+from apollo.core import db, red
+from apollo.locations.models import Location
+from apollo.participants.models import Participant
+from apollo.submissions import maps
+from apollo.submissions.models import Submission
+
+logger = logging.getLogger(__name__)
+
+LOCATION_LAYER = "locations"
+SUBMISSION_LAYER = "submissions"
+
+# size of the tiles in tile coordinates, and of their buffer
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+MAX_ZOOM = 24
+# latitude of the edges of the web mercator projection
+MAX_LATITUDE = 85.0511287798066
+
+
+def parse_layer(layer):
+    """Parses a `<kind>-<id>` layer name, or returns None."""
+    kind, _, identifier = (layer or "").partition("-")
+    if kind not in (LOCATION_LAYER, SUBMISSION_LAYER) or not identifier.isdigit():
+        return None
+
+    return kind, int(identifier)
+
+
+def valid_tile(z, x, y):
+    """Whether the tile coordinates exist at their zoom level."""
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z
+
+
+def _latitude(y, z):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / 2**z))))
+
+
+def tile_bbox(z, x, y):
+    """Returns the `west,south,east,north` bounding box of a tile and its buffer."""
+    buffer = TILE_BUFFER / TILE_EXTENT
+    tiles = 2**z
+    west = (x - buffer) / tiles * 360.0 - 180.0
+    east = (x + 1 + buffer) / tiles * 360.0 - 180.0
+    north = _latitude(max(y - buffer, 0), z)
+    south = _latitude(min(y + 1 + buffer, tiles), z)
+
+    return max(west, -180.0), max(south, -MAX_LATITUDE), min(east, 180.0), min(north, MAX_LATITUDE)
+
+
+def _tile_statement(layer, source, geom, columns, conditions, z, x, y):
+    envelope = sa.func.ST_TileEnvelope(z, x, y)
+    features = (
+        sa.select(
+            sa.func.ST_AsMVTGeom(sa.func.ST_Transform(geom, 3857), envelope, TILE_EXTENT, TILE_BUFFER).label("geom"),
+            *columns,
+        )
+        .select_from(source)
+        .where(*conditions)
+        .subquery("features")
+    )
+
+    return sa.select(sa.func.ST_AsMVT(sa.literal_column(features.name), layer, TILE_EXTENT, "geom")).select_from(
+        features
+    )
+
+
+def location_tile_statement(location_type, z, x, y):
+    """Returns the statement of a tile of the locations of a location type."""
+    west, south, east, north = tile_bbox(z, x, y)
+    conditions = [
+        Location.location_set_id == location_type.location_set_id,
+        Location.location_type_id == location_type.id,
+        Location.geom.op("&&")(sa.func.ST_MakeEnvelope(west, south, east, north, 4326)),
+    ]
+    columns = [
+        Location.id,
+        Location.code,
+        Location.name.label("name"),
+        Location.registered_voters,
+    ]
+
+    return _tile_statement(
+        f"{LOCATION_LAYER}-{location_type.id}", Location, Location.geom, columns, conditions, z, x, y
+    )
+
+
+def submission_tile_statement(form, query, z, x, y):
+    """Returns the statement of a tile of the submissions of a (filtered) query."""
+    columns = [
+        Submission.id,
+        Location.name.label("location"),
+        maps.participant_name().label("participant"),
+        Participant.participant_id,
+        sa.func.extract("epoch", Submission.participant_updated).cast(sa.BigInteger).label("last_updated"),
+    ]
+    source = sa.outerjoin(Submission, Location, Location.id == Submission.location_id).outerjoin(
+        Participant, Participant.id == Submission.participant_id
+    )
+    conditions = maps.submission_filter(query, tile_bbox(z, x, y))
+
+    return _tile_statement(f"{SUBMISSION_LAYER}-{form.id}", source, Submission.geom, columns, conditions, z, x, y)
+
+
+def location_version(location_type):
+    """Returns the data version of the location layer of a location type."""
+    return [location_type.location_set.ancestry_version, str(get_locale())]
+
+
+def submission_version(form, event):
+    """Returns the data version of the submission layer of a form.
+
+    It changes with the form and with every update of its submissions in
+    the event, with the location names of the location set and with the
+    locale of the names.
+    """
+    watermark = (
+        db.session.query(sa.func.max(Submission.updated))
+        .filter(
+            Submission.event_id == event.id,
+            Submission.form_id == form.id,
+            Submission.submission_type == "O",
+        )
+        .scalar()
+    )
+    ancestry_version = event.location_set.ancestry_version if event.location_set else None
+
+    return [form.version_identifier, watermark.isoformat() if watermark else None, ancestry_version, str(get_locale())]
+
+
+def version_tag(version):
+    """Returns the digest of a layer version, with any filters of the layer."""
+    payload = json.dumps(version, default=str, sort_keys=True)
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+def get_tile(layer, tag, statement, z, x, y):
+    """Returns the encoded tile of a statement, from the cache if possible."""
+    key = f"apollo:tile:{layer}:{tag}:{z}:{x}:{y}"
+    try:
+        cached = red.get(key)
+    except RedisError:
+        logger.exception("Could not read the cached tile %s", key)
+        cached = None
+    if cached is not None:
+        return cached
+
+    tile = bytes(db.session.execute(statement).scalar() or b"")
+    try:
+        red.set(key, tile, settings.TILE_CACHE_TIMEOUT)
+    except RedisError:
+        logger.exception("Could not store the cached tile %s", key)
+
+    return tile
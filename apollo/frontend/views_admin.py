@@ -2,11 +2,10 @@
 from datetime import datetime
 from io import BytesIO
 from urllib.parse import urlencode
-from zipfile import ZIP_DEFLATED, ZipFile
 
 import magic
 import pytz
-from flask import flash, g, redirect, request, send_file, session
+from flask import flash, g, redirect, request, session, url_for
 from flask_admin import BaseView, expose, form
 from flask_admin.actions import action
 from flask_admin.contrib.sqla import ModelView
@@ -28,7 +27,7 @@ from wtforms import BooleanField, PasswordField, SelectField, SelectMultipleFiel
 from apollo import models, services, settings
 from apollo.constants import LANGUAGE_CHOICES
 from apollo.core import admin, db, security
-from apollo.deployments.serializers import EventArchiveSerializer
+from apollo.deployments import tasks
 from apollo.formsframework.views_forms import (
     checklist_init,
     edit_form,
@@ -60,6 +59,7 @@ from apollo.participants.views_participants import (
     participant_list,
     participant_list_import,
 )
+from apollo.users.exports import start_export
 from apollo.utils import resize_image
 
 app_time_zone = pytz.timezone(settings.TIMEZONE)
@@ -470,16 +470,17 @@ class EventAdminView(HiddenObjectMixin, BaseAdminView):
     @expose("/download/<int:event_id>")
     def download(self, event_id):
         event = services.events.find(id=event_id).first_or_404()
-        eas = EventArchiveSerializer()
-
-        fp = BytesIO()
-        with ZipFile(fp, "w", ZIP_DEFLATED) as zf:
-            eas.serialize(event, zf)
-
-        fp.seek(0)
         fname = slugify(f'event archive {event.name.lower()} {datetime.utcnow().strftime("%Y %m %d %H%M%S")}')  # noqa
 
-        return send_file(fp, attachment_filename=f"{fname}.zip", as_attachment=True)
+        start_export(
+            tasks.export_event_archive,
+            _("Export Event Archive"),
+            f"{fname}.zip",
+            "application/zip",
+            event_id=event.id,
+        )
+
+        return redirect(url_for("users.export_list"))
 
     def get_one(self, pk):
         model_class = self.model
@@ -17,6 +17,7 @@ from ..frontend import permissions, route
 from ..frontend.dashboard import event_days, get_coverage, get_daily_progress, get_stratified_daily_progress
 from ..frontend.helpers import get_checklist_form_dashboard_menu, get_concurrent_events_list_menu, get_event, set_event
 from ..locations.models import Location, LocationType
+from ..submissions import coverage
 from ..submissions.filters import make_dashboard_filter
 from ..submissions.models import Submission
 
@@ -114,8 +115,19 @@ def main_dashboard(form_id=None):
 
     query_filterset = filter_class(query, request.args)
 
+    # the materialized counters only cover unfiltered submissions
+    use_counters = (
+        form is not None
+        and "participant" not in session
+        and not any(request.args.get(name) for name in query_filterset.declared_filters)
+        and coverage.counters_available(event, form)
+    )
+
     if not group_slug:
-        data = get_coverage(query_filterset.qs, form)
+        if use_counters:
+            data = coverage.get_global_coverage(event, form)
+        else:
+            data = get_coverage(query_filterset.qs, form)
         if form and form.show_progress and not stratified_progress:
             daily_progress = get_daily_progress(query_filterset.qs, event)
         elif form and form.show_progress and stratified_progress:
@@ -227,7 +239,11 @@ def main_dashboard(form_id=None):
         else:
             group = None
 
-        data = get_coverage(query_filterset.qs, form, group, location_type)
+        if use_counters and group is not None:
+            counter_location = location if session.get("dashboard_data_view") == "locations" else None
+            data = coverage.get_group_coverage(event, form, group, location_type, counter_location)
+        else:
+            data = get_coverage(query_filterset.qs, form, group, location_type)
 
     context = {
         "args": {"sample": args.get("sample")},
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from flask import Blueprint, Response, abort, g, request, session
+from flask_security import login_required
+
+from apollo import models
+from apollo.frontend import permissions, route, tiles
+from apollo.submissions import filters
+
+bp = Blueprint("tiles", __name__)
+
+MVT_MIMETYPE = "application/vnd.mapbox-vector-tile"
+
+
+def _submission_query(event, form):
+    """Returns the submissions of a form, like the submission list."""
+    query = (
+        models.Submission.query.select_from(models.Submission, models.Location, models.Participant)
+        .filter(
+            models.Submission.submission_type == "O",
+            models.Submission.form == form,
+            models.Submission.event_id == event.id,
+        )
+        .join(models.Location, models.Submission.location_id == models.Location.id)
+        .join(models.Participant, models.Submission.participant_id == models.Participant.id)
+    )
+
+    # field coordinators only see the submissions of their locations
+    participant = models.Participant.query.get(session["participant"]) if "participant" in session else None
+    if participant:
+        location_query = (
+            models.Location.query.with_entities(models.Location.id)
+            .join(models.LocationPath, models.Location.id == models.LocationPath.descendant_id)
+            .filter(models.LocationPath.ancestor_id == participant.location_id)
+        )
+        query = query.filter(models.Submission.location_id.in_(location_query))
+
+    filter_class = filters.make_submission_list_filter(event, form)
+
+    return filter_class(query, request.args).qs
+
+
+@route(bp, "/tiles/<layer>/<int:z>/<int:x>/<int:y>.mvt")
+@login_required
+def tile(layer, z, x, y):
+    """Returns a vector tile of a location or submission layer."""
+    parsed = tiles.parse_layer(layer)
+    if parsed is None or not tiles.valid_tile(z, x, y):
+        abort(404)
+
+    kind, identifier = parsed
+    event = g.event
+    if kind == tiles.LOCATION_LAYER:
+        location_type = models.LocationType.query.filter_by(
+            id=identifier, location_set_id=event.location_set_id
+        ).first_or_404()
+        tag = tiles.version_tag(tiles.location_version(location_type))
+        statement = tiles.location_tile_statement(location_type, z, x, y)
+    else:
+        form = (
+            models.Form.query.filter_by(id=identifier, is_hidden=False)
+            .filter(models.Form.events.contains(event))
+            .first_or_404()
+        )
+        if not permissions.can_access_resource(form):
+            abort(403)
+
+        version = tiles.submission_version(form, event)
+        version.extend([sorted(request.args.items(multi=True)), session.get("participant")])
+        tag = tiles.version_tag(version)
+        statement = tiles.submission_tile_statement(form, _submission_query(event, form), z, x, y)
+
+    # the tile is unchanged while the version of its layer is the same
+    if tag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(tiles.get_tile(layer, tag, statement, z, x, y), mimetype=MVT_MIMETYPE)
+    response.set_etag(tag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+    return response
@@ -22,7 +22,8 @@ from apollo.core import red, uploads
 from apollo.frontend import route
 from apollo.frontend.forms import file_upload_form
 from apollo.users import forms, tasks
-from apollo.users.models import UserUpload
+from apollo.users.exports import send_export
+from apollo.users.models import UserExport, UserUpload
 
 bp = Blueprint("users", __name__)
 
@@ -62,7 +63,7 @@ def task_list():
     session_id = session.get("_id")
 
     # extract the data from Redis
-    stringified_data = red.lrange(session_id, 0, -1)
+    stringified_data = red.hvals(session_id) if session_id else []
     raw_data = [json.loads(d) for d in stringified_data]
 
     tasks = {"results": raw_data}
@@ -70,6 +71,31 @@ def task_list():
     return jsonify(tasks)
 
 
+@route(bp, "/user/exports")
+@login_required
+def export_list():
+    """Lists the exports of the current user."""
+    breadcrumbs = [_("Exports")]
+    user = current_user._get_current_object()
+    user_exports = UserExport.query.filter(UserExport.user == user).order_by(UserExport.created.desc()).limit(50).all()
+
+    context = {"breadcrumbs": breadcrumbs, "channel": session.get("_id"), "exports": user_exports}
+
+    return render_template("frontend/export_list.html", **context)
+
+
+@route(bp, "/user/exports/<int:export_id>")
+@login_required
+def export_download(export_id):
+    """Downloads a completed export of the current user."""
+    user = current_user._get_current_object()
+    export = UserExport.query.filter(
+        UserExport.id == export_id, UserExport.user == user, UserExport.status == "COMPLETED"
+    ).first_or_404()
+
+    return send_export(export)
+
+
 def import_users():
     """Import users from a CSV file."""
     form = file_upload_form(request.form)
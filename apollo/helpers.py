@@ -3,6 +3,7 @@ import importlib
 import pkgutil
 
 import magic
+import numpy as np
 import pandas as pd
 from flask import Blueprint
 from loguru import logger
@@ -23,6 +24,12 @@ EXCEL_MIMETYPES = [
     "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
 ]
 
+# strings that could be accepted by `int` and `float`; the values matching
+# them are still converted with `int` and `float`, so that the validation
+# of the import files does not change
+INTEGER_PATTERN = r"\s*[+-]?[\d_]+\s*"
+FLOAT_PATTERN = r"\s*[+-]?(?:[\d_]*\.?[\d_]*(?:e[+-]?[\d_]+)?|nan|inf|infinity)\s*"
+
 
 def register_blueprints(app, package_name, package_path):
     """Register all Blueprint instances on the specified Flask application.
@@ -78,3 +85,67 @@ def load_source_file(source_file):
         df = pd.DataFrame()
 
     return df
+
+
+def _converted(converter, value):
+    try:
+        return converter(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def coerce_column(column, converter, pattern):
+    """Converts the values of an import file column.
+
+    Only the strings matching `pattern` (and any values that are not
+    strings) are converted with `converter`, which saves trying to convert
+    the many blank or otherwise invalid strings of a large import file one
+    by one. Returns an object array of the converted values, with None for
+    the values that could not be converted, and a mask of the valid values.
+    """
+    column = pd.Series(column, dtype=object).reset_index(drop=True)
+    strings = column.map(lambda value: isinstance(value, str)).to_numpy(dtype=bool)
+    candidates = np.ones(len(column), dtype=bool)
+    candidates[strings] = column[strings].str.fullmatch(pattern, case=False).to_numpy(dtype=bool)
+
+    values = np.full(len(column), None, dtype=object)
+    values[candidates] = [_converted(converter, value) for value in column.to_numpy()[candidates]]
+    valid = np.not_equal(values, None)
+
+    return values, valid
+
+
+def parse_integers(column):
+    """Converts an import file column with `int`."""
+    return coerce_column(column, int, INTEGER_PATTERN)
+
+
+def parse_floats(column):
+    """Converts an import file column with `float`."""
+    return coerce_column(column, float, FLOAT_PATTERN)
+
+
+def truthy(column):
+    """Returns a mask of the truthy values of an import file column."""
+    return pd.Series(column, dtype=object).astype(bool).to_numpy()
+
+
+def valid_values(column):
+    """Returns a mask of the values of an import file column that are set.
+
+    A value is set if it is truthy and not null.
+    """
+    column = pd.Series(column, dtype=object)
+    return column.notna().to_numpy() & truthy(column)
+
+
+def source_column(data_frame, column_name):
+    """Returns a column of an import file by position, as objects.
+
+    Columns that are not mapped, or not in the file, are returned as
+    columns of None, like the cells read with `Series.get`.
+    """
+    if column_name is None or column_name not in data_frame.columns:
+        return pd.Series([None] * len(data_frame), dtype=object)
+
+    return data_frame[column_name].astype(object).reset_index(drop=True)
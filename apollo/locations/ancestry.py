@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Denormalized location ancestry.
+
+The analysis data frames need the name of every ancestor of the location
+of each submission, one column per location type. Instead of aggregating
+the location closure table for every submission, the ancestry of each
+location is stored in the `location_ancestry` table, so the analysis
+queries only need a single join on the location id.
+"""
+
+import sqlalchemy as sa
+from flask_babel import get_locale
+from sqlalchemy.dialects.postgresql import JSONB, insert
+
+from apollo.core import db
+from apollo.dal.models import get_default_locale
+from apollo.locations.models import Location, LocationAncestry, LocationPath, LocationSet, LocationType
+
+
+def update_location_ancestry(location_set_id, location_id=None):
+    """Rebuilds the ancestry of the locations in a location set.
+
+    If `location_id` is given, only the ancestry of that location and its
+    descendants is rebuilt. The ancestry version of the location set is
+    incremented, which invalidates the cached analysis data frames. The
+    statements run in the current transaction.
+    """
+    descendants = sa.select(LocationPath.descendant_id).where(LocationPath.location_set_id == location_set_id)
+    if location_id is not None:
+        descendants = descendants.where(LocationPath.ancestor_id == location_id)
+
+    db.session.execute(
+        sa.delete(LocationAncestry)
+        .where(
+            LocationAncestry.location_set_id == location_set_id,
+            LocationAncestry.location_id.in_(descendants),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    source = (
+        sa.select(
+            LocationPath.descendant_id,
+            sa.literal(location_set_id),
+            sa.func.jsonb_object_agg(
+                sa.cast(Location.location_type_id, sa.String),
+                sa.func.coalesce(Location.name_translations, sa.literal({}, JSONB)),
+            ),
+        )
+        .join(Location, Location.id == LocationPath.ancestor_id)
+        .where(LocationPath.location_set_id == location_set_id, LocationPath.descendant_id.in_(descendants))
+        .group_by(LocationPath.descendant_id)
+    )
+    db.session.execute(
+        insert(LocationAncestry)
+        .from_select(["location_id", "location_set_id", "ancestors"], source)
+        .on_conflict_do_nothing(index_elements=["location_id"])
+    )
+
+    db.session.execute(
+        sa.update(LocationSet)
+        .where(LocationSet.id == location_set_id)
+        .values(ancestry_version=LocationSet.ancestry_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def ancestor_name(location_type_ids):
+    """Returns the SQL expression for the name of the ancestor location.
+
+    The name is read from the ancestry of `LocationAncestry` for the first of
+    the given location types found. Like the translated name of a location,
+    it falls back to the default locale and then to any available name.
+    """
+    default_locale = get_default_locale(None, "name_translations")
+    current_locale = str(get_locale() or default_locale)
+
+    names = []
+    for location_type_id in location_type_ids:
+        translations = LocationAncestry.ancestors[str(location_type_id)]
+        names.extend(
+            [
+                translations.op("->>")(current_locale),
+                translations.op("->>")(default_locale),
+                sa.func.jsonb_path_query_first(translations, "$.*").op("#>>")(sa.literal_column("'{}'")),
+            ]
+        )
+
+    return sa.func.coalesce(*names, type_=sa.String)
+
+
+def ancestry_columns(location_set_ids):
+    """Returns the labelled ancestor name columns of the location sets.
+
+    There is one column for each location type name, so location types with
+    the same name in different location sets share a column.
+    """
+    location_types = (
+        LocationType.query.filter(LocationType.location_set_id.in_(location_set_ids)).order_by(LocationType.id).all()
+    )
+
+    type_ids = {}
+    for location_type in location_types:
+        if not location_type.name:
+            continue
+        type_ids.setdefault(location_type.name, []).append(location_type.id)
+
+    return [ancestor_name(ids).label(name) for name, ids in type_ids.items()]
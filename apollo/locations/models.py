@@ -26,6 +26,8 @@ class LocationSet(BaseModel):
         backref=db.backref('location_sets', cascade='all, delete',
                            passive_deletes=True))
     is_finalized = db.Column(db.Boolean, default=False)
+    ancestry_version = db.Column(
+        db.Integer, default=0, nullable=False, server_default='0')
 
     def __str__(self):
         return self.name or ''
@@ -371,6 +373,23 @@ class LocationPath(db.Model):
                            passive_deletes=True))
 
 
+class LocationAncestry(db.Model):
+    """Denormalized ancestry of a location.
+
+    `ancestors` maps the id of every location type in the hierarchy of the
+    location (including its own type) to the name translations of the
+    ancestor location of that type. The rows are rebuilt from the location
+    paths by `apollo.locations.ancestry.update_location_ancestry`.
+    """
+    __tablename__ = 'location_ancestry'
+
+    location_id = db.Column(db.Integer, db.ForeignKey(
+        'location.id', ondelete='CASCADE'), primary_key=True)
+    location_set_id = db.Column(db.Integer, db.ForeignKey(
+        'location_set.id', ondelete='CASCADE'), nullable=False, index=True)
+    ancestors = db.Column(JSONB, nullable=False)
+
+
 class LocationDataField(Resource):
     __mapper_args__ = {'polymorphic_identity': 'location_data_field'}
     __tablename__ = 'location_data_field'
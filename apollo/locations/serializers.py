@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
-import json
+from uuid import UUID
 
+import sqlalchemy as sa
 from geoalchemy2.shape import to_shape
-from apollo.dal.serializers import ArchiveSerializer
+from sqlalchemy.orm import aliased, joinedload
+
+from apollo.core import db
+from apollo.dal.serializers import (
+    ArchiveSerializer, keyset_chunks, serialize_chunks, staged_json,
+    staged_uuid)
+from apollo.locations.ancestry import update_location_ancestry
 from apollo.locations.models import (
     Location, LocationDataField, LocationPath, LocationSet, LocationType,
     LocationTypePath)
@@ -192,71 +199,215 @@ class LocationTypePathSerializer(object):
 class LocationSetArchiveSerializer(ArchiveSerializer):
     __model__ = LocationSet
 
-    def deserialize(self, zip_file):
-        pass
-
-    def serialize(self, event, zip_file):
-        location_set = event.location_set
-
-        if location_set:
-            self.serialize_location_set(location_set, zip_file)
-            self.serialize_location_types(
-                location_set.location_types, zip_file)
-            self.serialize_location_type_paths(
-                location_set.location_type_paths, zip_file)
-            self.serialize_locations(location_set.locations, zip_file)
-            self.serialize_location_paths(
-                location_set.location_paths, zip_file)
-            self.serialize_extra_fields(location_set.extra_fields, zip_file)
-
-    def serialize_location_set(self, obj, zip_file):
-        serializer = LocationSetSerializer()
-        data = serializer.serialize_one(obj)
-
-        with zip_file.open('location_set.ndjson', 'w') as f:
-            f.write(json.dumps(data).encode('utf-8'))
-
-    def serialize_location_types(self, location_types, zip_file):
-        serializer = LocationTypeSerializer()
-
-        with zip_file.open('location_types.ndjson', 'w') as f:
-            for location_type in location_types:
-                data = serializer.serialize_one(location_type)
-                line = f'{json.dumps(data)}\n'
-                f.write(line.encode('utf-8'))
-
-    def serialize_location_paths(self, location_paths, zip_file):
-        serializer = LocationPathSerializer()
-
-        with zip_file.open('location_paths.ndjson', 'w') as f:
-            for location_path in location_paths:
-                data = serializer.serialize_one(location_path)
-                line = f'{json.dumps(data)}\n'
-                f.write(line.encode('utf-8'))
-
-    def serialize_location_type_paths(self, location_type_paths, zip_file):
-        serializer = LocationTypePathSerializer()
-
-        with zip_file.open('location_type_paths.ndjson', 'w') as f:
-            for location_type_path in location_type_paths:
-                data = serializer.serialize_one(location_type_path)
-                line = f'{json.dumps(data)}\n'
-                f.write(line.encode('utf-8'))
-
-    def serialize_locations(self, locations, zip_file):
-        serializer = LocationSerializer()
-
-        with zip_file.open('locations.ndjson', 'w') as f:
-            for location in locations:
-                data = serializer.serialize_one(location)
-                line = f'{json.dumps(data)}\n'
-                f.write(line.encode('utf-8'))
-
-    def serialize_extra_fields(self, extra_fields, zip_file):
-        serializer = LocationDataFieldSerializer()
-
-        with zip_file.open('location_data_fields.ndjson', 'w') as f:
-            for extra_field in extra_fields:
-                data = serializer.serialize_one(extra_field)
-                line = f'{json.dumps(data)}\n'
-                f.write(line.encode('utf-8'))
+    def deserialize(self, archive, event):
+        data = next(archive.records('location_set.ndjson'), None)
+        if data is None:
+            return
+
+        location_set = LocationSet(
+            uuid=UUID(data['uuid']), name=data['name'], slug=data['slug'],
+            deployment_id=event.deployment_id)
+        db.session.add(location_set)
+        db.session.flush()
+        event.location_set = location_set
+
+        self.deserialize_location_types(archive, location_set)
+        self.deserialize_location_type_paths(archive, location_set)
+        self.deserialize_locations(archive, location_set)
+        self.deserialize_location_paths(archive, location_set)
+        self.deserialize_extra_fields(archive, location_set)
+
+        update_location_ancestry(location_set.id)
+
+        return location_set
+
+    def deserialize_location_types(self, archive, location_set):
+        table = archive.table('location_types.ndjson')
+        if table is None:
+            return
+
+        record = table.c.record
+        query = sa.select(
+            staged_uuid(record['uuid']),
+            staged_json(record['name']),
+            sa.cast(record['is_administrative'].astext, sa.Boolean),
+            sa.cast(record['is_political'].astext, sa.Boolean),
+            sa.cast(record['has_registered_voters'].astext, sa.Boolean),
+            record['slug'].astext,
+            sa.literal(location_set.id))
+        db.session.execute(sa.insert(LocationType).from_select(
+            ['uuid', 'name_translations', 'is_administrative',
+             'is_political', 'has_registered_voters', 'slug',
+             'location_set_id'], query))
+
+    def deserialize_location_type_paths(self, archive, location_set):
+        table = archive.table('location_type_paths.ndjson')
+        if table is None:
+            return
+
+        record = table.c.record
+        ancestor = aliased(LocationType)
+        descendant = aliased(LocationType)
+        query = sa.select(
+            sa.literal(location_set.id), ancestor.id, descendant.id,
+            sa.cast(record['depth'].astext, sa.Integer)
+        ).select_from(table).join(ancestor, sa.and_(
+            ancestor.location_set_id == location_set.id,
+            ancestor.uuid == staged_uuid(record['ancestor_location_type']))
+        ).join(descendant, sa.and_(
+            descendant.location_set_id == location_set.id,
+            descendant.uuid == staged_uuid(
+                record['descendant_location_type'])))
+        db.session.execute(sa.insert(LocationTypePath).from_select(
+            ['location_set_id', 'ancestor_id', 'descendant_id', 'depth'],
+            query))
+
+    def deserialize_locations(self, archive, location_set):
+        table = archive.table('locations.ndjson')
+        if table is None:
+            return
+
+        record = table.c.record
+        query = sa.select(
+            staged_uuid(record['uuid']),
+            staged_json(record['name']),
+            record['code'].astext,
+            sa.cast(record['registered_voters'].astext, sa.Integer),
+            sa.func.ST_SetSRID(sa.func.ST_MakePoint(
+                sa.cast(record['lon'].astext, sa.Float),
+                sa.cast(record['lat'].astext, sa.Float)), 4326),
+            staged_json(record['extra_data']),
+            sa.literal(location_set.id),
+            LocationType.id
+        ).select_from(table).join(LocationType, sa.and_(
+            LocationType.location_set_id == location_set.id,
+            LocationType.uuid == staged_uuid(record['location_type'])))
+        db.session.execute(sa.insert(Location).from_select(
+            ['uuid', 'name_translations', 'code', 'registered_voters',
+             'geom', 'extra_data', 'location_set_id', 'location_type_id'],
+            query))
+
+    def deserialize_location_paths(self, archive, location_set):
+        table = archive.table('location_paths.ndjson')
+        if table is None:
+            return
+
+        record = table.c.record
+        ancestor = aliased(Location)
+        descendant = aliased(Location)
+        query = sa.select(
+            sa.literal(location_set.id), ancestor.id, descendant.id,
+            sa.cast(record['depth'].astext, sa.Integer)
+        ).select_from(table).join(ancestor, sa.and_(
+            ancestor.location_set_id == location_set.id,
+            ancestor.uuid == staged_uuid(record['ancestor_location']))
+        ).join(descendant, sa.and_(
+            descendant.location_set_id == location_set.id,
+            descendant.uuid == staged_uuid(record['descendant_location'])))
+        db.session.execute(sa.insert(LocationPath).from_select(
+            ['location_set_id', 'ancestor_id', 'descendant_id', 'depth'],
+            query))
+
+    def deserialize_extra_fields(self, archive, location_set):
+        for data in archive.records('location_data_fields.ndjson'):
+            db.session.add(LocationDataField(
+                uuid=UUID(data['uuid']), name=data['name'],
+                label=data['label'],
+                visible_in_lists=data['visible_in_lists'],
+                location_set_id=location_set.id,
+                deployment_id=location_set.deployment_id))
+        db.session.flush()
+
+    def serialize(self, event, archive):
+        location_set_id = event.location_set_id
+
+        if location_set_id:
+            archive.add(
+                'location_set.ndjson', self.serialize_location_set,
+                location_set_id)
+            archive.add(
+                'location_types.ndjson', self.serialize_location_types,
+                location_set_id)
+            archive.add(
+                'location_type_paths.ndjson',
+                self.serialize_location_type_paths, location_set_id)
+            archive.add(
+                'locations.ndjson', self.serialize_locations,
+                location_set_id)
+            archive.add(
+                'location_paths.ndjson', self.serialize_location_paths,
+                location_set_id)
+            archive.add(
+                'location_data_fields.ndjson', self.serialize_extra_fields,
+                location_set_id)
+
+    # the related objects of the serialized ones are eagerly loaded with
+    # only their uuids
+    def serialize_location_set(self, location_set_id):
+        location_set = LocationSet.query.filter_by(id=location_set_id).one()
+
+        yield [LocationSetSerializer().serialize_one(location_set)]
+
+    def serialize_location_types(self, location_set_id):
+        query = LocationType.query.filter_by(
+            location_set_id=location_set_id
+        ).options(
+            joinedload(LocationType.location_set).load_only(
+                LocationSet.uuid))
+
+        yield from serialize_chunks(
+            LocationTypeSerializer(), keyset_chunks(query, LocationType.id))
+
+    def serialize_location_type_paths(self, location_set_id):
+        query = LocationTypePath.query.filter_by(
+            location_set_id=location_set_id
+        ).options(
+            joinedload(LocationTypePath.location_set).load_only(
+                LocationSet.uuid),
+            joinedload(LocationTypePath.ancestor_location_type).load_only(
+                LocationType.uuid),
+            joinedload(LocationTypePath.descendant_location_type).load_only(
+                LocationType.uuid))
+
+        yield from serialize_chunks(
+            LocationTypePathSerializer(),
+            keyset_chunks(
+                query, LocationTypePath.ancestor_id,
+                LocationTypePath.descendant_id))
+
+    def serialize_locations(self, location_set_id):
+        query = Location.query.filter_by(
+            location_set_id=location_set_id
+        ).options(
+            joinedload(Location.location_set).load_only(LocationSet.uuid),
+            joinedload(Location.location_type).load_only(LocationType.uuid))
+
+        yield from serialize_chunks(
+            LocationSerializer(), keyset_chunks(query, Location.id))
+
+    def serialize_location_paths(self, location_set_id):
+        query = LocationPath.query.filter_by(
+            location_set_id=location_set_id
+        ).options(
+            joinedload(LocationPath.location_set).load_only(
+                LocationSet.uuid),
+            joinedload(LocationPath.ancestor_location).load_only(
+                Location.uuid),
+            joinedload(LocationPath.descendant_location).load_only(
+                Location.uuid))
+
+        yield from serialize_chunks(
+            LocationPathSerializer(),
+            keyset_chunks(
+                query, LocationPath.ancestor_id, LocationPath.descendant_id))
+
+    def serialize_extra_fields(self, location_set_id):
+        query = LocationDataField.query.filter_by(
+            location_set_id=location_set_id
+        ).options(
+            joinedload(LocationDataField.location_set).load_only(
+                LocationSet.uuid))
+
+        yield from serialize_chunks(
+            LocationDataFieldSerializer(),
+            keyset_chunks(query, LocationDataField.id))
@@ -1,28 +1,55 @@
 # -*- coding: utf-8 -*-
+import json
 import logging
 import numbers
 import os
-from hashlib import sha256
 from itertools import chain
+from uuid import uuid4
 
-import cachetools
+import numpy as np
+import pandas as pd
 from celery import shared_task
 from flask import render_template_string
 from flask_babel import gettext
 from flask_babel import gettext as _
 from pandas import isnull, to_numeric
-from sqlalchemy import and_, exists, func
-from sqlalchemy.sql import select
+from sqlalchemy import Float, Integer, String, and_, case, column, func, literal, null, select, table, text
+from sqlalchemy.dialects.postgresql import JSONB, UUID, insert
 
 from apollo import helpers
 from apollo.core import db, uploads
+from apollo.dal.utils import copy_rows
 from apollo.messaging.tasks import send_email
 
 from ..users.models import UserUpload
+from .ancestry import update_location_ancestry
 from .models import Location, LocationGroup, LocationPath, LocationSet, LocationType, LocationTypePath, locations_groups
 
 logger = logging.getLogger(__name__)
 
+# the import progress is reported after every batch of rows
+PROGRESS_BATCH_SIZE = 1000
+
+# the checks of the cells of each location type, in the order in which
+# their issues are logged
+CHECK_MAPPING, CHECK_CODE, CHECK_NAME, CHECK_COORDINATES, CHECK_REGISTERED_VOTERS = range(5)
+
+STAGED_LOCATION = table(
+    "staged_location",
+    column("uuid", UUID(as_uuid=True)),
+    column("code", String),
+    column("location_type_id", Integer),
+    column("name_translations", JSONB),
+    column("registered_voters", Integer),
+    column("longitude", Float),
+    column("latitude", Float),
+    column("extra_data", JSONB),
+)
+STAGED_LOCATION_PATH = table(
+    "staged_location_path", column("row_number", Integer), column("location_type_id", Integer), column("code", String)
+)
+STAGED_LOCATION_GROUP = table("staged_location_group", column("code", String), column("location_group_id", Integer))
+
 email_template = """
 Notification
 ------------
@@ -31,55 +58,171 @@ Your location import task has been completed.
 """
 
 
-class LocationCache:
-    def __init__(self, maxsize=50):
-        """Initializer."""
-        self.cache = cachetools.LRUCache(maxsize=maxsize)
+def _without_smart_quotes(column):
+    """Returns the strings of a column without smart quotes.
 
-    def _cache_key(self, location_code, location_type, location_name):
-        # remove smart quotes
-        location_code = (
-            str(location_code).replace("\u2018", "").replace("\u2019", "").replace("\u201c", "").replace("\u201d", "")
-        )
-        location_type = (
-            str(location_type).replace("\u2018", "").replace("\u2019", "").replace("\u201c", "").replace("\u201d", "")
+    The names and codes of the imported rows are compared without them.
+    """
+    return column.astype(str).str.replace("[\u2018\u2019\u201c\u201d]", "", regex=True)
+
+
+def _stage_locations(connection, locations, path_codes, memberships):
+    """Copies the imported locations into temporary staging tables."""
+    connection.execute(
+        text(
+            "CREATE TEMPORARY TABLE staged_location (uuid uuid, code varchar, location_type_id integer, "
+            "name_translations jsonb, registered_voters integer, longitude float, latitude float, "
+            "extra_data jsonb) ON COMMIT DROP"
         )
-        location_name = (
-            str(location_name).replace("\u2018", "").replace("\u2019", "").replace("\u201c", "").replace("\u201d", "")
+    )
+    connection.execute(
+        text(
+            "CREATE TEMPORARY TABLE staged_location_path (row_number integer, location_type_id integer, "
+            "code varchar) ON COMMIT DROP"
         )
+    )
+    connection.execute(
+        text("CREATE TEMPORARY TABLE staged_location_group (code varchar, location_group_id integer) ON COMMIT DROP")
+    )
 
-        plain_key = f"{location_code}:{location_type}:{location_name}"
-        return sha256(plain_key.encode("utf-8")).hexdigest()
+    copy_rows(
+        connection,
+        "staged_location",
+        STAGED_LOCATION.c.keys(),
+        (
+            (
+                uuid4(),
+                code,
+                record["location_type_id"],
+                json.dumps(record["name_translations"]),
+                record["registered_voters"],
+                record["longitude"],
+                record["latitude"],
+                json.dumps(record["extra_data"]) if record["extra_data"] else None,
+            )
+            for code, record in locations.items()
+        ),
+    )
+    copy_rows(connection, "staged_location_path", STAGED_LOCATION_PATH.c.keys(), path_codes)
+    copy_rows(connection, "staged_location_group", STAGED_LOCATION_GROUP.c.keys(), memberships)
 
-    def get(self, location_code, location_type, location_name):
-        cache_key = self._cache_key(location_code, location_type, location_name)
-        return self.cache.get(cache_key, None)
 
-    def has(self, location_code, location_type, location_name):
-        cache_key = self._cache_key(location_code, location_type, location_name)
-        return cache_key in self.cache
+def _write_locations(connection, location_set):
+    """Upserts the staged locations and adds their paths and groups."""
+    staged = STAGED_LOCATION
+    location_table = Location.__table__
 
-    def set(self, location_obj):
-        cache_key = self._cache_key(
-            location_obj.code or "", location_obj.location_type.name or "", location_obj.name or ""
+    has_coordinates = and_(staged.c.longitude.isnot(None), staged.c.latitude.isnot(None))
+    geom = case(
+        (has_coordinates, func.ST_SetSRID(func.ST_MakePoint(staged.c.longitude, staged.c.latitude), 4326)),
+        else_=null(),
+    )
+    source = select(
+        staged.c.uuid,
+        staged.c.code,
+        staged.c.location_type_id,
+        literal(location_set.id),
+        staged.c.name_translations,
+        func.coalesce(staged.c.registered_voters, 0),
+        geom,
+        staged.c.extra_data,
+    )
+    stmt = insert(location_table).from_select(
+        [
+            "uuid",
+            "code",
+            "location_type_id",
+            "location_set_id",
+            "name_translations",
+            "registered_voters",
+            "geom",
+            "extra_data",
+        ],
+        source,
+    )
+    # the type of existing locations is kept, and so is their extra data
+    # if no extra data was imported for them
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["location_set_id", "code"],
+        set_={
+            "name_translations": stmt.excluded.name_translations,
+            "registered_voters": stmt.excluded.registered_voters,
+            "geom": stmt.excluded.geom,
+            "extra_data": func.coalesce(stmt.excluded.extra_data, location_table.c.extra_data),
+        },
+    )
+    connection.execute(stmt)
+
+    # the closure paths between the locations of each row are derived from
+    # the paths between their location types. the first row with a path
+    # sets its depth, as the paths of the existing locations are kept
+    ancestor_codes = STAGED_LOCATION_PATH.alias("ancestor_codes")
+    descendant_codes = STAGED_LOCATION_PATH.alias("descendant_codes")
+    ancestors = location_table.alias("ancestors")
+    descendants = location_table.alias("descendants")
+    paths = (
+        select(literal(location_set.id), ancestors.c.id, descendants.c.id, LocationTypePath.depth)
+        .distinct(ancestors.c.id, descendants.c.id)
+        .select_from(ancestor_codes)
+        .join(descendant_codes, descendant_codes.c.row_number == ancestor_codes.c.row_number)
+        .join(
+            LocationTypePath,
+            and_(
+                LocationTypePath.ancestor_id == ancestor_codes.c.location_type_id,
+                LocationTypePath.descendant_id == descendant_codes.c.location_type_id,
+            ),
+        )
+        .join(
+            ancestors, and_(ancestors.c.location_set_id == location_set.id, ancestors.c.code == ancestor_codes.c.code)
         )
-        self.cache[cache_key] = location_obj
+        .join(
+            descendants,
+            and_(descendants.c.location_set_id == location_set.id, descendants.c.code == descendant_codes.c.code),
+        )
+        .where(LocationTypePath.location_set_id == location_set.id)
+        .order_by(ancestors.c.id, descendants.c.id, ancestor_codes.c.row_number)
+    )
+    connection.execute(
+        insert(LocationPath.__table__)
+        .from_select(["location_set_id", "ancestor_id", "descendant_id", "depth"], paths)
+        .on_conflict_do_nothing(index_elements=["ancestor_id", "descendant_id"])
+    )
 
-    def set_by_dict(self, **data):
-        cache_key = self._cache_key(data.get("code", ""), data.get("loc_type_name", ""), data.get("name", ""))
-        self.cache[cache_key] = data.get("id")
+    memberships = (
+        select(location_table.c.id, STAGED_LOCATION_GROUP.c.location_group_id)
+        .distinct()
+        .select_from(STAGED_LOCATION_GROUP)
+        .join(
+            location_table,
+            and_(
+                location_table.c.location_set_id == location_set.id,
+                location_table.c.code == STAGED_LOCATION_GROUP.c.code,
+            ),
+        )
+    )
+    connection.execute(
+        insert(locations_groups)
+        .from_select(["location_id", "location_group_id"], memberships)
+        .on_conflict_do_nothing(index_elements=["location_id", "location_group_id"])
+    )
 
 
 def update_locations(connection, data_frame, header_mapping, location_set, task):
-    """Add or update location data in the database as required."""
-    cache = LocationCache()
+    """Add or update location data in the database as required.
+
+    The columns of the data frame are validated and normalized first, a
+    location type at a time and before any database work. The resulting
+    locations, along with the location codes of each row and the
+    group memberships, are then copied into staging tables, from which the
+    locations are upserted and their closure paths and group memberships
+    are added with set-based statements.
+    """
     mapped_locales = [k.rsplit("_", 1)[-1] for k in header_mapping.keys() if "name" in k]
 
     total_records = data_frame.shape[0]
     processed_records = 0
     error_records = 0
     warning_records = 0
-    total_locations = 0
     error_log = []
 
     mapped_location_type_ids = [int(k[:-5]) for k in header_mapping.keys() if k.endswith("_code")]
@@ -111,149 +254,207 @@ def update_locations(connection, data_frame, header_mapping, location_set, task)
         .all()
     )
 
-    all_loc_type_paths = (
-        LocationTypePath.query.filter_by(location_set_id=location_set.id)
-        .with_entities(LocationTypePath.ancestor_id, LocationTypePath.descendant_id, LocationTypePath.depth)
-        .all()
-    )
-
     extra_field_cache = {fi.id: fi.name for fi in location_set.extra_fields} if location_set.extra_fields else {}
 
-    location_table = Location.__table__
-    location_path_table = LocationPath.__table__
+    def report_progress():
+        task.update_state(
+            state="PROGRESS",
+            meta={
+                "total_records": total_records,
+                "processed_records": processed_records,
+                "error_records": error_records,
+                "warning_records": warning_records,
+                "error_log": error_log,
+            },
+        )
+
+    # the columns of each location type are validated as a whole. the log
+    # entries are collected as (row, location type, check, label, message)
+    # tuples, so that they are logged in the order the cells are checked
+    log_entries = []
+    checked_rows = []
+    all_rows = np.arange(total_records)
+
+    for order, loc_type in enumerate(location_types):
+        name_column_keys = [f"{loc_type.id}_name_{locale}" for locale in mapped_locales]
+        code_column_key = f"{loc_type.id}_code"
+
+        if header_mapping.get(name_column_keys[0]) is None or header_mapping.get(code_column_key) is None:
+            log_entries.extend(
+                (
+                    row,
+                    order,
+                    CHECK_MAPPING,
+                    "WARNING",
+                    gettext(
+                        "No code or name present for row %(row)d for %(level)s", row=(row + 1), level=loc_type.name
+                    ),
+                )
+                for row in all_rows
+            )
+            continue
+
+        names = helpers.source_column(data_frame, header_mapping.get(name_column_keys[0]))
+        codes = helpers.source_column(data_frame, header_mapping.get(code_column_key))
+
+        # sanity check because numeric 0 is (probably) a valid code
+        # but is a falsy value
+        codes = codes.mask(codes.eq(0), "0")
+
+        # the other columns of rows without a name and a code are likely
+        # blank, so they are skipped
+        has_name = helpers.truthy(names)
+        checked = has_name | helpers.truthy(codes)
+        parsed_codes, valid_codes = helpers.parse_integers(codes)
+
+        log_entries.extend(
+            (
+                row,
+                order,
+                CHECK_CODE,
+                "ERROR",
+                gettext("Invalid (non-numeric) location code (%(loc_code)s)", loc_code=codes.iat[row]),
+            )
+            for row in np.flatnonzero(checked & ~valid_codes)
+        )
+        # it's an issue if either is missing, too
+        log_entries.extend(
+            (row, order, CHECK_NAME, "WARNING", gettext("Missing name or code for row %(row)d", row=(row + 1)))
+            for row in np.flatnonzero(checked & valid_codes & ~has_name)
+        )
+
+        rows = np.flatnonzero(checked & valid_codes & has_name)
+        checked_rows.append(
+            pd.DataFrame(
+                {
+                    "row": rows,
+                    "order": order,
+                    "location_type_id": loc_type.id,
+                    "code": [str(code) for code in parsed_codes[rows]],
+                    "location_type": _without_smart_quotes(pd.Series(loc_type.name, index=rows)),
+                    "name": _without_smart_quotes(names.iloc[rows]).to_numpy(),
+                }
+            )
+        )
+
+    if checked_rows:
+        valid_rows = pd.concat(checked_rows, ignore_index=True).sort_values(["row", "order"], kind="stable")
+    else:
+        valid_rows = pd.DataFrame(columns=["row", "order", "location_type_id", "code", "location_type", "name"])
+
+    # the location codes of every row, from which the closure paths are
+    # derived. the locations themselves are only read from the first row
+    # they appear in
+    path_codes = list(zip(valid_rows["row"].tolist(), valid_rows["location_type_id"].tolist(), valid_rows["code"]))
+    new_rows = valid_rows[~valid_rows.duplicated(["code", "location_type", "name"])]
+
+    # the columns of the locations of each type, which are read for the
+    # rows the locations are imported from
+    type_columns = []
+    memberships = set()
+    for order, loc_type in enumerate(location_types):
+        type_rows = new_rows[new_rows["order"] == order]
+        if type_rows.empty:
+            continue
+
+        rows = type_rows["row"].to_numpy()
+        codes = type_rows["code"].tolist()
+
+        if loc_type.has_coordinates:
+            latitudes, valid_latitudes = helpers.parse_floats(
+                helpers.source_column(data_frame, header_mapping.get(f"{loc_type.id}_lat"))
+            )
+            longitudes, valid_longitudes = helpers.parse_floats(
+                helpers.source_column(data_frame, header_mapping.get(f"{loc_type.id}_lon"))
+            )
+            invalid_coordinates = ~(valid_latitudes & valid_longitudes)
+            latitudes[invalid_coordinates] = longitudes[invalid_coordinates] = None
+            log_entries.extend(
+                (
+                    row,
+                    order,
+                    CHECK_COORDINATES,
+                    "WARNING",
+                    gettext("Invalid coordinate data for row %(row)d. Data will not be used.", row=(row + 1)),
+                )
+                for row in rows[invalid_coordinates[rows]]
+            )
+        else:
+            latitudes = longitudes = np.full(total_records, None, dtype=object)
+
+        if loc_type.has_registered_voters:
+            registered_voters, valid_registered_voters = helpers.parse_integers(
+                helpers.source_column(data_frame, header_mapping.get(f"{loc_type.id}_rv"))
+            )
+            log_entries.extend(
+                (
+                    row,
+                    order,
+                    CHECK_REGISTERED_VOTERS,
+                    "WARNING",
+                    gettext(
+                        "Invalid number of registered voters for row %(row)d. Data will not be used.", row=(row + 1)
+                    ),
+                )
+                for row in rows[~valid_registered_voters[rows]]
+            )
+        else:
+            registered_voters = np.full(total_records, None, dtype=object)
+
+        name_columns = [
+            helpers.source_column(data_frame, header_mapping.get(f"{loc_type.id}_name_{locale}"))
+            for locale in mapped_locales
+        ]
+        translations = [
+            (locale, helpers.valid_values(column), column.astype(str).str.strip().to_numpy())
+            for locale, column in zip(mapped_locales, name_columns)
+        ]
+
+        # each level should have its own extra data column
+        extra_columns = [
+            (extra_field_cache[field_id], helpers.source_column(data_frame, column).to_numpy())
+            for field_id in extra_field_cache.keys()
+            for column in [header_mapping.get(f"{loc_type.id}:{field_id}")]
+            if column
+        ]
+
+        type_columns.append(
+            (order, loc_type, type_rows, latitudes, longitudes, registered_voters, translations, extra_columns)
+        )
+
+        # update group info
+        for group_col, group_id in new_groups_map.get(loc_type.id, {}).items():
+            group_flags = to_numeric(data_frame[group_col], errors="coerce").to_numpy()[rows]
+            memberships.update((code, group_id) for code, flag in zip(codes, group_flags) if not isnull(flag) and flag)
 
     # due to the way the reports are presented, one only wants to report
     # (counts of) errors/warnings once per row of data, even if multiple
     # issues arise per row, since there's no way to enforce a specific
     # spreadsheet structure
-
-    for idx in data_frame.index:
-        current_row = data_frame.iloc[idx]
-        location_path_helper_map = {}
-        error_this_row = False
-        warning_this_row = False
-
-        for loc_type in location_types:
-            name_column_keys = [f"{loc_type.id}_name_{locale}" for locale in mapped_locales]
-            code_column_key = f"{loc_type.id}_code"
-
-            if header_mapping.get(name_column_keys[0]) is None or header_mapping.get(code_column_key) is None:
-                warning_records += 0 if warning_this_row else 1
-                error_log.append(
-                    {
-                        "label": "WARNING",
-                        "message": gettext(
-                            "No code or name present for row %(row)d for %(level)s",
-                            row=(idx + 1),
-                            level=loc_type.name,
-                        ),
-                    }
-                )
-                warning_this_row = True
-                continue
-
-            lat_column_key = f"{loc_type.id}_lat" if loc_type.has_coordinates else None
-            lon_column_key = f"{loc_type.id}_lon" if loc_type.has_coordinates else None
-            reg_voters_column_key = f"{loc_type.id}_rv" if loc_type.has_registered_voters else None
-
-            name_columns = [header_mapping.get(col) for col in name_column_keys]
-            code_column = header_mapping.get(code_column_key)
-            lat_column = header_mapping.get(lat_column_key)
-            lon_column = header_mapping.get(lon_column_key)
-            reg_voters_column = header_mapping.get(reg_voters_column_key)
-
-            location_names = [current_row.get(col) for col in name_columns]
-            location_code = current_row.get(code_column)
-
-            # sanity check because numeric 0 is (probably) a valid code
-            # but is a falsy value
-            if location_code == 0:
-                location_code = str(location_code)
-
-            if not location_names[0] and not location_code:
-                # the other columns are likely blank
-                continue
-
-            try:
-                location_code = str(int(location_code))
-            except (TypeError, ValueError):
-                error_records += 0 if error_this_row else 1
-                message = gettext("Invalid (non-numeric) location code (%(loc_code)s)", loc_code=location_code)
-                error_log.append({"label": "ERROR", "message": message})
-                error_this_row = True
-                continue
-
-            # it's an issue if either is missing, too
-            if not location_names[0] or not location_code:
-                warning_records += 0 if warning_this_row else 1
-                error_log.append(
-                    {"label": "WARNING", "message": gettext("Missing name or code for row %(row)d", row=(idx + 1))}
-                )
-                warning_this_row = True
-                continue
-
-            # if we have the location in the cache, then continue
-            if cache.has(location_code, loc_type.name, location_names[0]):
-                location_path_helper_map[loc_type.id] = cache.get(location_code, loc_type.name, location_names[0])
-                continue
-
-            location_lat = current_row.get(lat_column)
-            location_lon = current_row.get(lon_column)
-            location_rv = current_row.get(reg_voters_column)
-
-            if loc_type.has_coordinates:
-                try:
-                    location_lat = float(location_lat)
-                    location_lon = float(location_lon)
-                except (TypeError, ValueError):
-                    warning_records += 0 if warning_this_row else 1
-                    error_log.append(
-                        {
-                            "label": "WARNING",
-                            "message": gettext(
-                                "Invalid coordinate data for row %(row)d. Data will not be used.", row=(idx + 1)
-                            ),
-                        }
-                    )
-                    location_lat = location_lon = None
-                    warning_this_row = True
-            else:
-                location_lat = location_lon = None
-
-            if loc_type.has_registered_voters:
-                try:
-                    location_rv = int(location_rv)
-                except (TypeError, ValueError):
-                    warning_records += 0 if warning_this_row else 1
-                    error_log.append(
-                        {
-                            "label": "WARNING",
-                            "message": gettext(
-                                "Invalid number of registered voters for row %(row)d. Data will not be used.",
-                                row=(idx + 1),
-                            ),
-                        }
-                    )
-                    location_rv = None
-                    warning_this_row = True
-            else:
-                location_rv = 0
-
-            # set GPS data if we have valid data
-            if location_lat is not None and location_lon is not None:
-                geom_spec = "SRID=4326; POINT({longitude:f} {latitude:f})".format(
-                    longitude=location_lon, latitude=location_lat
-                )
-            else:
-                geom_spec = None
-
-            # each level should have its own extra data column
-            extra_data = {}
-            for field_id in extra_field_cache.keys():
-                column_key = "{}:{}".format(loc_type.id, field_id)
-                column = header_mapping.get(column_key)
-                if column:
-                    value = current_row.get(column)
+    log_entries.sort(key=lambda entry: entry[:3])
+    error_rows = set()
+    warning_rows = set()
+    logged = 0
+
+    records = []
+    for batch_start in range(0, total_records, PROGRESS_BATCH_SIZE):
+        batch_end = min(batch_start + PROGRESS_BATCH_SIZE, total_records)
+
+        for (
+            order,
+            loc_type,
+            type_rows,
+            latitudes,
+            longitudes,
+            registered_voters,
+            translations,
+            extra_columns,
+        ) in type_columns:
+            batch_rows = type_rows[(type_rows["row"] >= batch_start) & (type_rows["row"] < batch_end)]
+            for row, code in zip(batch_rows["row"].tolist(), batch_rows["code"].tolist()):
+                extra_data = {}
+                for field_name, values in extra_columns:
+                    value = values[row]
                     if isnull(value):
                         continue
                     if isinstance(value, numbers.Number):
@@ -263,132 +464,43 @@ def update_locations(connection, data_frame, header_mapping, location_set, task)
                             value = float(value)
                     else:
                         value = str(value)
-                    extra_data[extra_field_cache[field_id]] = value
-
-            # collate all fields
-            kwargs = {
-                "location_type_id": loc_type.id,
-                "location_set_id": location_set.id,
-                "geom": geom_spec,
-                "code": location_code,
-                "name_translations": {
-                    locale: str(name).strip()
-                    for locale, name in zip(mapped_locales, location_names)
-                    if name and not isnull(name)
-                },
-            }
-            if location_rv:
-                kwargs.update({"registered_voters": location_rv})
-            if extra_data:
-                kwargs.update({"extra_data": extra_data})
-
-            # is this location in the database?
-            s = select(location_table.c.id).where(
-                and_(location_table.c.location_set_id == location_set.id, location_table.c.code == kwargs["code"])
-            )
-            result = connection.execute(s)
-            location_data = result.first()
-
-            # create it if it isn't
-            if location_data is None:
-                stmt = location_table.insert().values(**kwargs)
-                result = connection.execute(stmt)
-                location_id = result.inserted_primary_key[0]
-                result.close()
-
-                # add the self-referential path
-                stmt = location_path_table.insert().values(
-                    ancestor_id=location_id, descendant_id=location_id, location_set_id=location_set.id, depth=0
-                )
-                result = connection.execute(stmt)
-                result.close()
-            else:
-                # update it if it is
-                location_id = location_data[0]
-                update_kwargs = {
-                    "registered_voters": kwargs.get("registered_voters"),
-                    "name_translations": kwargs.get("name_translations"),
-                    "geom": kwargs.get("geom"),
+                    extra_data[field_name] = value
+
+                record = {
+                    "location_type_id": loc_type.id,
+                    "name_translations": {locale: values[row] for locale, valid, values in translations if valid[row]},
+                    "registered_voters": registered_voters[row] or None,
+                    "longitude": longitudes[row],
+                    "latitude": latitudes[row],
+                    "extra_data": extra_data,
                 }
-                if extra_data:
-                    update_kwargs["extra_data"] = extra_data
-
-                stmt = location_table.update().where(location_table.c.id == location_id).values(**update_kwargs)
-
-                connection.execute(stmt)
-
-            total_locations += 1
-            cache.set_by_dict(loc_type_name=loc_type.name, code=location_code, name=location_names[0], id=location_id)
-
-            # update location path info for this row
-            location_path_helper_map[loc_type.id] = location_id
-
-            # update group info
-            if loc_type.id not in new_groups_map:
-                continue
-
-            for group_col in group_columns:
-                group_flag = to_numeric(current_row[group_col], errors="coerce")
-                if not isnull(group_flag) and group_flag:
-                    group_id = new_groups_map[loc_type.id][group_col]
-                    result = None
-
-                    stmt = (
-                        exists()
-                        .where(
-                            and_(
-                                locations_groups.c.location_id == location_id,
-                                locations_groups.c.location_group_id == group_id,
-                            )
-                        )
-                        .select()
-                    )
-                    result = connection.execute(stmt).scalar()
-
-                    if not result:
-                        stmt = locations_groups.insert().values(location_id=location_id, location_group_id=group_id)
-                        result = connection.execute(stmt)
-                        result.close()
-
-        for ans_type_id, des_type_id, depth in all_loc_type_paths:
-            ancestor_id = location_path_helper_map.get(ans_type_id)
-            descendant_id = location_path_helper_map.get(des_type_id)
-            path_result = None
-
-            if ancestor_id is None or descendant_id is None:
-                continue
-
-            stmt = (
-                exists()
-                .where(
-                    and_(
-                        location_path_table.c.ancestor_id == ancestor_id,
-                        location_path_table.c.descendant_id == descendant_id,
-                        location_path_table.c.location_set_id == location_set.id,
-                    )
-                )
-                .select()
-            )
-            path_result = connection.execute(stmt).scalar()
+                records.append((row, order, code, record))
 
-            if not path_result:
-                stmt = location_path_table.insert().values(
-                    ancestor_id=ancestor_id, descendant_id=descendant_id, location_set_id=location_set.id, depth=depth
-                )
-                result = connection.execute(stmt)
-                result.close()
+        while logged < len(log_entries) and log_entries[logged][0] < batch_end:
+            row, _order, _check, label, message = log_entries[logged]
+            error_log.append({"label": label, "message": message})
+            (error_rows if label == "ERROR" else warning_rows).add(row)
+            logged += 1
 
-        processed_records += 1
-        task.update_state(
-            state="PROGRESS",
-            meta={
-                "total_records": total_records,
-                "processed_records": processed_records,
-                "error_records": error_records,
-                "warning_records": warning_records,
-                "error_log": error_log,
-            },
-        )
+        processed_records = batch_end
+        error_records = len(error_rows)
+        warning_records = len(warning_rows)
+        report_progress()
+
+    # collate all fields. a location imported again from a later row with
+    # a different name is updated, but keeps its type
+    locations = {}
+    for _row, _order, code, record in sorted(records, key=lambda item: item[:2]):
+        previous = locations.get(code)
+        if previous:
+            record["location_type_id"] = previous["location_type_id"]
+        locations[code] = record
+
+    if locations:
+        _stage_locations(connection, locations, path_codes, memberships)
+        _write_locations(connection, location_set)
+
+    report_progress()
 
 
 @shared_task(bind=True)
@@ -415,6 +527,9 @@ def import_locations(self, upload_id, mappings, location_set_id, channel=None):
     with engine.begin() as connection:
         update_locations(connection, dataframe, mappings, location_set, self)
 
+    update_location_ancestry(location_set_id)
+    db.session.commit()
+
     os.remove(filepath)
     upload.delete()
 
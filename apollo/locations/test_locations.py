@@ -0,0 +1,358 @@
+from types import SimpleNamespace
+from unittest import mock
+
+import pandas as pd
+import pytest
+from flask_babel import force_locale
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
+
+from apollo import models
+from apollo.core import db
+from apollo.locations import tasks
+from apollo.locations.ancestry import ancestor_name, ancestry_columns, update_location_ancestry
+
+
+def _import_locations(data_frame, header_mapping, location_types):
+    """Runs the location import without writing the locations."""
+    task = mock.Mock()
+    location_set = SimpleNamespace(id=1, extra_fields=[])
+    with (
+        mock.patch.object(tasks, "LocationType") as location_type_model,
+        mock.patch.object(tasks, "_stage_locations") as stage_locations,
+        mock.patch.object(tasks, "_write_locations"),
+        mock.patch.object(tasks, "PROGRESS_BATCH_SIZE", 2),
+    ):
+        query = location_type_model.query.filter.return_value.join.return_value.order_by.return_value
+        query.group_by.return_value.all.return_value = location_types
+        tasks.update_locations(None, data_frame, header_mapping, location_set, task)
+
+    return task, stage_locations
+
+
+def test_import_validation(app):
+    """Tests the validation of the cells of a location import file."""
+    region = SimpleNamespace(id=1, name="Region", has_coordinates=False, has_registered_voters=False)
+    station = SimpleNamespace(id=2, name="Station", has_coordinates=True, has_registered_voters=True)
+    data_frame = pd.DataFrame(
+        {
+            "region_code": ["1", "1", "x", "2", ""],
+            "region_name": ["North", "North", "South", "East", ""],
+            "station_code": ["011", "12", "13", "14", ""],
+            "station_name": ["S1", "S2", "S3", "", ""],
+            "lat": ["1.5", "a", "2", "", ""],
+            "lon": ["2", "3", "4", "", ""],
+            "rv": ["10", "z", "1e3", "", ""],
+        }
+    )
+    header_mapping = {
+        "1_code": "region_code",
+        "1_name_en": "region_name",
+        "2_code": "station_code",
+        "2_name_en": "station_name",
+        "2_lat": "lat",
+        "2_lon": "lon",
+        "2_rv": "rv",
+    }
+
+    task, stage_locations = _import_locations(data_frame, header_mapping, [region, station])
+
+    meta = task.update_state.call_args.kwargs["meta"]
+    assert meta["error_log"] == [
+        {"label": "WARNING", "message": "Invalid coordinate data for row 2. Data will not be used."},
+        {"label": "WARNING", "message": "Invalid number of registered voters for row 2. Data will not be used."},
+        {"label": "ERROR", "message": "Invalid (non-numeric) location code (x)"},
+        {"label": "WARNING", "message": "Invalid number of registered voters for row 3. Data will not be used."},
+        {"label": "WARNING", "message": "Missing name or code for row 4"},
+    ]
+    assert (meta["processed_records"], meta["error_records"], meta["warning_records"]) == (5, 1, 3)
+
+    # the progress is reported after every batch of rows
+    assert task.update_state.call_count == 4
+
+    locations, path_codes, memberships = stage_locations.call_args.args[1:]
+    assert sorted(locations) == ["1", "11", "12", "13", "2"]
+    assert locations["11"]["name_translations"] == {"en": "S1"}
+    assert (locations["11"]["latitude"], locations["11"]["longitude"]) == (1.5, 2.0)
+    assert locations["11"]["registered_voters"] == 10
+    assert locations["12"]["latitude"] is None and locations["12"]["registered_voters"] is None
+    assert path_codes == [(0, 1, "1"), (0, 2, "11"), (1, 1, "1"), (1, 2, "12"), (2, 2, "13"), (3, 1, "2")]
+    assert memberships == set()
+
+
+def test_unmapped_location_types(app):
+    """Tests that the rows are logged for location types without columns."""
+    region = SimpleNamespace(id=1, name="Region", has_coordinates=False, has_registered_voters=False)
+    data_frame = pd.DataFrame({"name": ["North", "South"]})
+
+    task, stage_locations = _import_locations(data_frame, {"1_name_en": "name"}, [region])
+
+    meta = task.update_state.call_args.kwargs["meta"]
+    assert [entry["message"] for entry in meta["error_log"]] == [
+        "No code or name present for row 1 for Region",
+        "No code or name present for row 2 for Region",
+    ]
+    assert meta["warning_records"] == 2
+    stage_locations.assert_not_called()
+
+
+def _create_location_set(name):
+    """Creates a location set with region and station location types."""
+    location_set = models.LocationSet(name=name, deployment=models.Deployment(name=name, hostnames=[name]))
+    region_type = models.LocationType(name_translations={"en": "Region"}, location_set=location_set)
+    station_type = models.LocationType(
+        name_translations={"en": "Station"}, location_set=location_set, has_coordinates=True
+    )
+    db.session.add_all([region_type, station_type])
+    db.session.flush()
+
+    db.session.add_all(
+        [
+            models.LocationTypePath(
+                location_set=location_set, ancestor_id=ancestor.id, descendant_id=descendant.id, depth=depth
+            )
+            for ancestor, descendant, depth in (
+                (region_type, region_type, 0),
+                (station_type, station_type, 0),
+                (region_type, station_type, 1),
+            )
+        ]
+    )
+    db.session.commit()
+
+    return location_set, region_type, station_type
+
+
+def _write_import(data_frame, header_mapping, location_set):
+    """Imports the locations of a data frame in a single transaction."""
+    tasks.update_locations(db.session.connection(), data_frame, dict(header_mapping), location_set, mock.Mock())
+    db.session.commit()
+
+
+def _imported_locations(location_set):
+    """Returns the imported locations of a location set by their code."""
+    return {location.code: location for location in models.Location.query.filter_by(location_set=location_set)}
+
+
+def _coordinates(location):
+    """Returns the longitude and the latitude of a location."""
+    return tuple(
+        db.session.query(func.ST_X(models.Location.geom), func.ST_Y(models.Location.geom))
+        .filter(models.Location.id == location.id)
+        .one()
+    )
+
+
+def _location_paths(location_set):
+    """Returns the paths between the locations of a location set by code."""
+    ancestors = aliased(models.Location)
+    descendants = aliased(models.Location)
+    return set(
+        db.session.query(ancestors.code, descendants.code, models.LocationPath.depth)
+        .join(ancestors, ancestors.id == models.LocationPath.ancestor_id)
+        .join(descendants, descendants.id == models.LocationPath.descendant_id)
+        .filter(models.LocationPath.location_set_id == location_set.id)
+    )
+
+
+@pytest.mark.usefixtures("db")
+def test_location_import():
+    """Tests that imported locations are written with their paths and groups."""
+    location_set, region_type, station_type = _create_location_set("locations")
+    header_mapping = {
+        f"{region_type.id}_code": "region_code",
+        f"{region_type.id}_name_en": "region_name",
+        f"{station_type.id}_code": "station_code",
+        f"{station_type.id}_name_en": "station_name",
+        f"{station_type.id}_lat": "lat",
+        f"{station_type.id}_lon": "lon",
+        "groups": {str(station_type.id): ["Urban"]},
+    }
+    data_frame = pd.DataFrame(
+        {
+            "region_code": ["1", "1", "2"],
+            "region_name": ["North", "North", "South"],
+            "station_code": ["11", "12", "21"],
+            "station_name": ["S1", "S2", "S3"],
+            "lat": ["1.5", "", "3"],
+            "lon": ["2.5", "", "4"],
+            "Urban": ["1", "0", ""],
+        }
+    )
+    _write_import(data_frame, header_mapping, location_set)
+
+    locations = _imported_locations(location_set)
+    assert sorted(locations) == ["1", "11", "12", "2", "21"]
+    assert locations["1"].location_type_id == region_type.id
+    assert locations["11"].location_type_id == station_type.id
+    assert locations["11"].name_translations == {"en": "S1"}
+    assert _coordinates(locations["11"]) == (2.5, 1.5)
+    assert locations["12"].geom is None
+    assert _location_paths(location_set) == {
+        ("1", "1", 0),
+        ("2", "2", 0),
+        ("11", "11", 0),
+        ("12", "12", 0),
+        ("21", "21", 0),
+        ("1", "11", 1),
+        ("1", "12", 1),
+        ("2", "21", 1),
+    }
+    assert [group.name for group in locations["11"].groups] == ["Urban"]
+    assert locations["12"].groups == []
+    assert locations["21"].groups == []
+
+    # the locations that are imported again are updated in place, but keep
+    # their type and their paths
+    data_frame = pd.DataFrame(
+        {
+            "region_code": ["1", "12", "2"],
+            "region_name": ["Northern", "Twelve", "South"],
+            "station_code": ["11", "", "13"],
+            "station_name": ["Station 1", "", "S4"],
+            "lat": ["5", "", "6"],
+            "lon": ["7", "", "8"],
+            "Urban": ["0", "", "1"],
+        }
+    )
+    _write_import(data_frame, header_mapping, location_set)
+    db.session.expire_all()
+
+    locations = _imported_locations(location_set)
+    assert sorted(locations) == ["1", "11", "12", "13", "2", "21"]
+    assert locations["1"].name_translations == {"en": "Northern"}
+    assert locations["11"].name_translations == {"en": "Station 1"}
+    assert _coordinates(locations["11"]) == (7.0, 5.0)
+    assert locations["12"].name_translations == {"en": "Twelve"}
+    assert locations["12"].location_type_id == station_type.id
+    assert _location_paths(location_set) == {
+        ("1", "1", 0),
+        ("2", "2", 0),
+        ("11", "11", 0),
+        ("12", "12", 0),
+        ("13", "13", 0),
+        ("21", "21", 0),
+        ("1", "11", 1),
+        ("1", "12", 1),
+        ("2", "13", 1),
+        ("2", "21", 1),
+    }
+
+    # the groups are created again on every import
+    assert locations["11"].groups == []
+    assert [group.name for group in locations["13"].groups] == ["Urban"]
+
+
+def _create_locations(location_set, region_type, station_type):
+    """Creates two regions with a station each, and their paths."""
+    regions = [
+        models.Location(
+            name_translations=name_translations, code=code, location_set=location_set, location_type=region_type
+        )
+        for code, name_translations in (("1", {"en": "North", "fr": "Nord"}), ("2", {"en": "South"}))
+    ]
+    stations = [
+        models.Location(
+            name_translations={"es": f"Estación {code}"},
+            code=code,
+            location_set=location_set,
+            location_type=station_type,
+        )
+        for code in ("11", "21")
+    ]
+    db.session.add_all([*regions, *stations])
+    db.session.flush()
+
+    db.session.add_all(
+        [
+            models.LocationPath(
+                location_set=location_set, ancestor_id=ancestor.id, descendant_id=descendant.id, depth=depth
+            )
+            for region, station in zip(regions, stations)
+            for ancestor, descendant, depth in ((region, region, 0), (station, station, 0), (region, station, 1))
+        ]
+    )
+    db.session.commit()
+
+    return regions, stations
+
+
+def _ancestry(location_set):
+    """Returns the stored ancestry of the locations of a location set by code."""
+    return dict(
+        db.session.query(models.Location.code, models.LocationAncestry.ancestors)
+        .join(models.LocationAncestry, models.LocationAncestry.location_id == models.Location.id)
+        .filter(models.LocationAncestry.location_set_id == location_set.id)
+    )
+
+
+@pytest.mark.usefixtures("db")
+def test_location_ancestry():
+    """Tests that the ancestry of the locations is rebuilt."""
+    location_set, region_type, station_type = _create_location_set("ancestry")
+    regions, stations = _create_locations(location_set, region_type, station_type)
+    region, station = str(region_type.id), str(station_type.id)
+
+    update_location_ancestry(location_set.id)
+    db.session.commit()
+
+    assert _ancestry(location_set) == {
+        "1": {region: {"en": "North", "fr": "Nord"}},
+        "2": {region: {"en": "South"}},
+        "11": {region: {"en": "North", "fr": "Nord"}, station: {"es": "Estación 11"}},
+        "21": {region: {"en": "South"}, station: {"es": "Estación 21"}},
+    }
+    db.session.refresh(location_set)
+    assert location_set.ancestry_version == 1
+
+    # only the subtree of a renamed location is rebuilt
+    regions[0].name_translations = {"en": "Northern"}
+    regions[1].name_translations = {"en": "Southern"}
+    db.session.commit()
+    update_location_ancestry(location_set.id, regions[0].id)
+    db.session.commit()
+
+    ancestry = _ancestry(location_set)
+    assert ancestry["1"] == {region: {"en": "Northern"}}
+    assert ancestry["11"][region] == {"en": "Northern"}
+    assert ancestry["21"][region] == {"en": "South"}
+    db.session.refresh(location_set)
+    assert location_set.ancestry_version == 2
+
+    # and of a moved location
+    models.LocationPath.query.filter_by(ancestor_id=regions[1].id, descendant_id=stations[1].id).delete()
+    db.session.add(
+        models.LocationPath(location_set=location_set, ancestor_id=regions[0].id, descendant_id=stations[1].id, depth=1)
+    )
+    db.session.commit()
+    update_location_ancestry(location_set.id, stations[1].id)
+    db.session.commit()
+
+    ancestry = _ancestry(location_set)
+    assert ancestry["21"] == {region: {"en": "Northern"}, station: {"es": "Estación 21"}}
+    assert ancestry["2"] == {region: {"en": "South"}}
+    db.session.refresh(location_set)
+    assert location_set.ancestry_version == 3
+
+
+@pytest.mark.usefixtures("db")
+def test_ancestor_names():
+    """Tests that the ancestor names fall back like the location names."""
+    location_set, region_type, station_type = _create_location_set("ancestor-names")
+    _create_locations(location_set, region_type, station_type)
+    update_location_ancestry(location_set.id)
+    db.session.commit()
+
+    def names(location_type):
+        return dict(
+            db.session.query(models.Location.code, ancestor_name([location_type.id]))
+            .join(models.LocationAncestry, models.LocationAncestry.location_id == models.Location.id)
+            .filter(models.Location.location_type_id == station_type.id)
+        )
+
+    with force_locale("fr"):
+        # the names fall back to the default locale, and then to any name
+        assert names(region_type) == {"11": "Nord", "21": "South"}
+        assert names(station_type) == {"11": "Estación 11", "21": "Estación 21"}
+
+        assert [column.name for column in ancestry_columns([location_set.id])] == ["Region", "Station"]
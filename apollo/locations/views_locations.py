@@ -28,6 +28,7 @@ from sqlalchemy.orm.attributes import flag_modified
 import apollo.locations.api.views as api_views
 from apollo import services, utils
 from apollo.core import db, docs, uploads
+from apollo.dal.pagination import paginate
 from apollo.frontend import permissions
 from apollo.frontend.forms import (
     DummyForm,
@@ -35,6 +36,7 @@ from apollo.frontend.forms import (
     generate_location_edit_form,
 )
 from apollo.locations import filters, forms, tasks
+from apollo.locations.ancestry import update_location_ancestry
 from apollo.locations.utils import import_graph
 
 from ..users.models import UserUpload
@@ -97,6 +99,7 @@ def locations_list(view, location_set_id):
     args = request.args.to_dict(flat=False)
     args.update(location_set_id=location_set_id)
     page = int(args.pop('page', [1])[0])
+    cursor = args.pop('cursor', [None])[0]
 
     # NOTE: this was ordered by location type
     subset = queryset_filter.qs.order_by(Location.code).distinct(Location.code)
@@ -122,8 +125,11 @@ def locations_list(view, location_set_id):
             form=DummyForm(),
             location_set=location_set,
             location_set_id=location_set_id,
-            locations=subset.paginate(
-                page=page, per_page=current_app.config.get('PAGE_SIZE')))
+            # the location codes are unique after the distinct clause
+            locations=paginate(
+                subset, page=page,
+                per_page=current_app.config.get('PAGE_SIZE'), cursor=cursor,
+                unique=True))
 
         return view.render(template_name, **ctx)
 
@@ -151,6 +157,8 @@ def location_edit(view, id):
             # force it to recognize the object as needing an update.
             flag_modified(location, 'name_translations')
             location.save()
+            update_location_ancestry(location.location_set_id, location.id)
+            db.session.commit()
 
             return redirect(url_for(
                 'locationset.locations_list',
@@ -316,6 +324,7 @@ def finalize_location_set(location_set_id):
         _save_location_graph(location_set)
         LocationSet.query.filter(LocationSet.id == location_set_id).update({
             'is_finalized': True})
+        update_location_ancestry(location_set_id)
         db.session.commit()
     return redirect(url_for('locationset.builder',
                     location_set_id=location_set_id))
@@ -6,6 +6,7 @@ import wtforms
 from flask import g
 
 from apollo import models, services
+from apollo.messaging import lookups
 
 
 class MessagesFilterForm(wtf.FlaskForm):
@@ -81,6 +82,9 @@ def retrieve_form(prefix, exclamation=False):
                            incident forms
     :returns: a Form instance or None
     """
+    if g.event is not None:
+        return lookups.find_form(g.event, prefix, exclamation)
+
     current_events = services.events.overlapping_events(g.event)
 
     # find the first form that matches the prefix and optionally form type
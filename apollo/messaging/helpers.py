@@ -5,27 +5,24 @@ from flask import g
 from flask_babel import force_locale, gettext
 from werkzeug.datastructures import MultiDict
 
-from apollo import services
 from apollo.deployments.models import Event
 from apollo.formsframework.forms import build_questionnaire
+from apollo.messaging import lookups
 from apollo.messaging.forms import retrieve_form
 from apollo.messaging.utils import (
     get_unsent_codes,
     parse_responses,
     parse_text,
 )
-from apollo.participants.models import Participant, PhoneContact
+from apollo.participants.models import Participant
 
 
 def _get_response_locale(message: str, sender: str, submission, event) -> str:
     if submission and submission.participant:
         locale = submission.participant.locale or ""
     else:
-        participant = lookup_participant(message, sender, event)
-        if participant and participant.locale:
-            locale = participant.locale
-        else:
-            locale = ""
+        details = _lookup_participant_details(message, sender, event)
+        locale = (details[1] if details else None) or ""
 
     return locale
 
@@ -192,16 +189,25 @@ def lookup_participant(message: str, sender: str, event: Event = None) -> Partic
     participant_set_id = event.participant_set_id if event else None
 
     if participant_id:
-        participant = services.participants.find(
-            participant_set_id=participant_set_id, participant_id=participant_id
-        ).first()
+        participant = lookups.find_participant(participant_set_id, participant_id=participant_id)
 
     if not participant:
-        clean_number = sender.replace("+", "")
-        participant = (
-            services.participants.query.join(PhoneContact, Participant.id == PhoneContact.participant_id)
-            .filter(Participant.participant_set_id == participant_set_id, PhoneContact.number == clean_number)
-            .first()
-        )
+        participant = lookups.find_participant(participant_set_id, number=sender)
 
     return participant
+
+
+def _lookup_participant_details(message: str, sender: str, event: Event = None):
+    """Returns the primary key and locale of the participant of a message."""
+    details = None
+    unused, participant_id, unused, unused, unused, unused = parse_text(message)
+
+    participant_set_id = event.participant_set_id if event else None
+
+    if participant_id:
+        details = lookups.participant_details(participant_set_id, participant_id=participant_id)
+
+    if not details:
+        details = lookups.participant_details(participant_set_id, number=sender)
+
+    return details
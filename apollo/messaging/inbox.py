@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Queued processing of inbound messages.
+
+Parsing a message, saving its submission and logging the messages take
+long enough for the gateways to time out and retry during traffic peaks, so
+if `MESSAGING_QUEUE_INBOUND` is enabled the webhooks only add the messages
+to the `inbound_message` table and acknowledge them at once. The messages
+are then processed by Celery workers, which send the replies through the
+configured gateway.
+
+The table doubles as the deduplication log: every message is identified by
+a key derived from the gateway message id, or from its contents if the
+gateway does not provide one, so the retries of a message are ignored.
+The messages of a sender are processed in the order they were received
+by the single worker holding an advisory lock on the sender, and the
+processing is resumable: the reply is
+stored together with the logged messages, so a message whose reply could
+not be sent is not processed again when it is retried.
+"""
+
+import hashlib
+import logging
+import time
+from datetime import datetime
+from uuid import uuid4
+
+import sqlalchemy as sa
+from flask import current_app, g
+from sqlalchemy.dialects.postgresql import insert
+from unidecode import unidecode
+
+from apollo import services
+from apollo.core import db
+from apollo.messaging.helpers import parse_message
+from apollo.messaging.models import InboundMessage
+from apollo.messaging.outgoing import gateway_factory
+
+logger = logging.getLogger(__name__)
+
+# namespace of the advisory locks taken on the senders
+SENDER_LOCK_NAMESPACE = 0x534D53
+
+
+def message_key(gateway, sender, text, timestamp=None, message_id=None):
+    """Returns the key identifying a message across the gateway retries.
+
+    Messages without a gateway id are identified by their contents and
+    timestamp or, without a timestamp, by the deduplication window they
+    were received in.
+    """
+    if message_id:
+        return f"{gateway}:{message_id}"
+
+    if timestamp is None:
+        window = max(current_app.config.get("MESSAGING_DEDUPLICATION_WINDOW") or 1, 1)
+        timestamp = f"~{int(time.time()) // window}"
+
+    digest = hashlib.sha256(f"{sender}\x00{text}\x00{timestamp}".encode("utf-8"))
+    return f"{gateway}:{digest.hexdigest()}"
+
+
+def enqueue_message(gateway, event, sender, text, timestamp=None, message_id=None):
+    """Queues an inbound message for processing.
+
+    Returns True if the message was queued and False if it is a retry of
+    a message that was already queued.
+    """
+    from apollo.messaging.tasks import process_inbound_messages
+
+    statement = (
+        insert(InboundMessage.__table__)
+        .values(
+            key=message_key(gateway, sender, text, timestamp, message_id),
+            gateway=gateway,
+            sender=sender,
+            text=text,
+            timestamp=timestamp,
+            event_id=event.id,
+            status="PENDING",
+            attempts=0,
+            created=datetime.utcnow(),
+            uuid=uuid4(),
+        )
+        .on_conflict_do_nothing(index_elements=["key"])
+        .returning(InboundMessage.__table__.c.id)
+    )
+    queued = db.session.execute(statement).scalar() is not None
+    db.session.commit()
+
+    if queued:
+        process_inbound_messages.delay(sender)
+
+    return queued
+
+
+class QueuedMessageForm(object):
+    """Presents a queued message like the validated gateway forms."""
+
+    def __init__(self, inbound_message):
+        """Wraps a queued message."""
+        self.inbound_message = inbound_message
+
+    def get_message(self):
+        return {
+            "sender": self.inbound_message.sender,
+            "text": self.inbound_message.text,
+            "timestamp": self.inbound_message.timestamp or int(self.inbound_message.created.timestamp()),
+        }
+
+
+def _handle_message(inbound_message):
+    """Parses a queued message and logs it with its reply."""
+    from apollo.messaging.views_messaging import update_datastore
+
+    g.event = inbound_message.event
+    g.deployment = inbound_message.event.deployment
+
+    form = QueuedMessageForm(inbound_message)
+    message = form.get_message()
+    reply, submission, had_errors = parse_message(form)
+    event = submission.event if submission else inbound_message.event
+
+    incoming = services.messages.log_message(
+        event=event,
+        sender=message.get("sender"),
+        text=message.get("text"),
+        direction="IN",
+        timestamp=message.get("timestamp"),
+    )
+    outgoing = services.messages.log_message(event=event, recipient=message.get("sender"), text=reply, direction="OUT")
+
+    inbound_message.reply = reply
+    inbound_message.message_id = incoming.id
+    db.session.add(inbound_message)
+    update_datastore(incoming, outgoing, submission, had_errors)
+
+
+def _send_reply(inbound_message):
+    gateway = gateway_factory()
+    if gateway is None:
+        logger.warning("No gateway configured, the reply to message %s was not sent", inbound_message.id)
+        return
+
+    reply = inbound_message.reply
+    if current_app.config.get("TRANSLITERATE_OUTPUT"):
+        reply = unidecode(reply)
+
+    gateway.send(reply, inbound_message.sender)
+
+
+def _next_message(sender):
+    return (
+        InboundMessage.query.filter(InboundMessage.sender == sender, InboundMessage.status == "PENDING")
+        .order_by(InboundMessage.id)
+        .first()
+    )
+
+
+def _process_pending_messages(sender, max_attempts):
+    """Processes the pending messages of a sender until none are left."""
+    processed = 0
+    while (inbound_message := _next_message(sender)) is not None:
+        try:
+            if inbound_message.reply is None:
+                _handle_message(inbound_message)
+            _send_reply(inbound_message)
+        except Exception:
+            db.session.rollback()
+            inbound_message.attempts += 1
+            if inbound_message.attempts < max_attempts:
+                inbound_message.save()
+                raise
+
+            logger.exception("Failed to process message %s", inbound_message.id)
+            inbound_message.status = "FAILED"
+            inbound_message.save()
+            continue
+
+        inbound_message.status = "PROCESSED"
+        inbound_message.processed = datetime.utcnow()
+        inbound_message.save()
+        processed += 1
+
+    return processed
+
+
+def process_messages(sender):
+    """Processes the pending messages of a sender in the order received.
+
+    The messages are processed while holding an advisory lock on the
+    sender. A worker that cannot take the lock returns at once, since the
+    worker holding it processes the messages of the sender until none are
+    pending; the pending messages are checked again once the lock is
+    released, so that the messages queued in the meantime are not left
+    behind. A message that fails is retried until it reaches
+    `MESSAGING_MAX_ATTEMPTS`, after which it is marked as failed and the
+    next message is processed; until then, the error is raised again so
+    that the task is retried.
+
+    Returns the number of processed messages.
+    """
+    max_attempts = current_app.config.get("MESSAGING_MAX_ATTEMPTS") or 1
+    lock_arguments = {"namespace": SENDER_LOCK_NAMESPACE, "sender": sender}
+    processed = 0
+
+    while True:
+        # the lock is held on its own connection, since the session
+        # commits after every message
+        with db.engine.connect() as connection:
+            locked = connection.execute(
+                sa.text("SELECT pg_try_advisory_lock(:namespace, hashtext(:sender))"), lock_arguments
+            ).scalar()
+            if not locked:
+                return processed
+
+            try:
+                processed += _process_pending_messages(sender, max_attempts)
+            finally:
+                connection.execute(sa.text("SELECT pg_advisory_unlock(:namespace, hashtext(:sender))"), lock_arguments)
+                connection.commit()
+
+        if _next_message(sender) is None:
+            return processed
+
+
+def pending_senders(older_than):
+    """Returns the senders with messages pending since before a time."""
+    return [
+        sender
+        for (sender,) in db.session.query(InboundMessage.sender)
+        .filter(InboundMessage.status == "PENDING", InboundMessage.created < older_than)
+        .distinct()
+    ]
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""Cached lookups for the parsing of inbound messages.
+
+Every inbound message looks up the form matching its prefix among the forms
+of the current events, and its participant by participant id or phone
+number, several times while it is parsed and logged. These lookups are
+cached in every process: the forms of the events of a deployment, and the
+ids and locales of the participants matched by participant id or phone
+number, so the participants are loaded by primary key.
+
+The caches are shared by the threads of a process and are cleared through
+Redis pub/sub whenever a change to the forms, events, participants or phone
+contacts is committed, by any process. They are only used while the process
+is subscribed to the invalidation channel, so a process that cannot reach
+Redis reads from the database instead of serving stale lookups.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import cachetools
+import sqlalchemy as sa
+from redis.exceptions import RedisError
+
+from apollo import settings
+from apollo.core import db, red
+from apollo.deployments.models import Event
+from apollo.formsframework.models import Form, events_forms
+from apollo.participants.models import Participant, PhoneContact
+from apollo.utils import current_timestamp
+
+logger = logging.getLogger(__name__)
+
+FORMS = "forms"
+PARTICIPANTS = "participants"
+
+INVALIDATION_CHANNEL = "apollo:messaging:lookups"
+LOOKUP_CACHE_SIZE = 100000
+# delay before subscribing again after losing the connection to Redis
+LISTENER_RETRY_DELAY = 5  # in seconds
+
+_MISSING = object()
+_PENDING_KEY = "apollo.messaging.lookups"
+
+_caches = {
+    FORMS: cachetools.TTLCache(maxsize=LOOKUP_CACHE_SIZE, ttl=settings.MESSAGING_LOOKUP_CACHE_TIMEOUT),
+    PARTICIPANTS: cachetools.TTLCache(maxsize=LOOKUP_CACHE_SIZE, ttl=settings.MESSAGING_LOOKUP_CACHE_TIMEOUT),
+}
+_cache_lock = threading.Lock()
+_listener_lock = threading.Lock()
+_listener = {"pid": None, "subscribed": False}
+# incremented whenever a cache is cleared, so that lookups read from the
+# database before a change was committed are not cached after it
+_generations = {name: 0 for name in _caches}
+
+
+def _clear(*names):
+    with _cache_lock:
+        for name in names:
+            if name in _caches:
+                _caches[name].clear()
+                _generations[name] += 1
+
+
+def _listen():
+    while True:
+        try:
+            pubsub = red.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # invalidations published while not subscribed were missed
+            _clear(*_caches)
+            _listener["subscribed"] = True
+
+            for message in pubsub.listen():
+                _clear(message["data"].decode())
+        except RedisError:
+            logger.exception("Lost the subscription to the lookup invalidations")
+        finally:
+            _listener["subscribed"] = False
+            _clear(*_caches)
+
+        time.sleep(LISTENER_RETRY_DELAY)
+
+
+def _ensure_listener():
+    pid = os.getpid()
+    if _listener["pid"] == pid:
+        return
+
+    with _listener_lock:
+        # forked processes start their own listener with empty caches
+        if _listener["pid"] != pid:
+            _listener["subscribed"] = False
+            _clear(*_caches)
+            threading.Thread(target=_listen, name="lookup-invalidations", daemon=True).start()
+            _listener["pid"] = pid
+
+
+def _get(name, key):
+    """Returns a cached lookup and the generation of the cache."""
+    if not settings.MESSAGING_LOOKUP_CACHE:
+        return _MISSING, None
+
+    _ensure_listener()
+    if not _listener["subscribed"]:
+        return _MISSING, None
+
+    with _cache_lock:
+        return _caches[name].get(key, _MISSING), _generations[name]
+
+
+def _set(name, key, value, generation):
+    with _cache_lock:
+        if _listener["subscribed"] and _generations[name] == generation:
+            _caches[name][key] = value
+
+
+def invalidate(*names):
+    """Clears the lookup caches of every process."""
+    _clear(*names)
+    for name in names:
+        try:
+            red.publish(INVALIDATION_CHANNEL, name)
+        except RedisError:
+            logger.exception("Could not publish the invalidation of the %s lookups", name)
+
+
+def mark_changed(session, *names):
+    """Invalidates the lookup caches when the session is committed.
+
+    The changes made through the ORM are tracked automatically, so this is
+    only needed after bulk statements.
+    """
+    session.info.setdefault(_PENDING_KEY, set()).update(names)
+
+
+def _deployment_forms(deployment_id):
+    """Returns the events of a deployment and the forms of each event."""
+    value, generation = _get(FORMS, deployment_id)
+    if value is not _MISSING:
+        return value
+
+    events = (
+        Event.query.filter(Event.deployment_id == deployment_id, Event.is_hidden == False)  # noqa
+        .with_entities(Event.id, Event.start, Event.end)
+        .all()
+    )
+    forms = {}
+    rows = (
+        db.session.query(events_forms.c.event_id, Form.id, Form.prefix, Form.form_type)
+        .join(Form, Form.id == events_forms.c.form_id)
+        .filter(events_forms.c.event_id.in_([event.id for event in events]))
+        .order_by(Form.id)
+    )
+    for event_id, form_id, prefix, form_type in rows:
+        forms.setdefault(event_id, []).append((form_id, prefix.lower(), form_type.code))
+
+    value = ([tuple(event) for event in events], forms)
+    _set(FORMS, deployment_id, value, generation)
+
+    return value
+
+
+def find_form(event, prefix, exclamation=False):
+    """Returns the form matching a prefix in the events overlapping an event.
+
+    The form is looked up like `retrieve_form` does, from the cached forms
+    of the events of the deployment.
+    """
+    events, forms = _deployment_forms(event.deployment_id)
+    timestamp = current_timestamp()
+    prefix = prefix.lower()
+
+    event_ids = {event_id for event_id, start, end in events if event_id == event.id or start <= timestamp <= end}
+    matches = [
+        form_id
+        for event_id in event_ids
+        for form_id, form_prefix, form_type in forms.get(event_id, [])
+        if form_prefix == prefix and (not exclamation or form_type == "INCIDENT")
+    ]
+    if not matches:
+        return None
+
+    return db.session.get(Form, min(matches))
+
+
+def _participant_key(participant_set_id, participant_id=None, number=None):
+    if participant_id:
+        return participant_set_id, "id", participant_id
+
+    return participant_set_id, "number", number.replace("+", "")
+
+
+def _query_participant(participant_set_id, participant_id=None, number=None):
+    if participant_id:
+        query = Participant.query.filter_by(participant_set_id=participant_set_id, participant_id=participant_id)
+    else:
+        query = Participant.query.join(PhoneContact, Participant.id == PhoneContact.participant_id).filter(
+            Participant.participant_set_id == participant_set_id,
+            PhoneContact.number == number.replace("+", ""),
+        )
+
+    return query
+
+
+def participant_details(participant_set_id, participant_id=None, number=None):
+    """Returns the primary key and locale of a participant, or None.
+
+    The participant is matched by participant id or, without one, by phone
+    number.
+    """
+    key = _participant_key(participant_set_id, participant_id, number)
+    value, generation = _get(PARTICIPANTS, key)
+    if value is not _MISSING:
+        return value
+
+    value = (
+        _query_participant(participant_set_id, participant_id, number)
+        .with_entities(Participant.id, Participant.locale)
+        .first()
+    )
+    value = tuple(value) if value is not None else None
+    _set(PARTICIPANTS, key, value, generation)
+
+    return value
+
+
+def find_participant(participant_set_id, participant_id=None, number=None):
+    """Returns a participant matched by participant id or phone number."""
+    details = participant_details(participant_set_id, participant_id, number)
+    if details is None:
+        return None
+
+    participant = db.session.get(Participant, details[0])
+    if participant is None:
+        # the participant was deleted by a bulk statement
+        _clear(PARTICIPANTS)
+        participant = _query_participant(participant_set_id, participant_id, number).first()
+
+    return participant
+
+
+def _track(name, attributes=None):
+    def listener(mapper, connection, target):
+        state = sa.inspect(target)
+        if attributes is not None and not any(state.attrs[attribute].history.has_changes() for attribute in attributes):
+            return
+
+        if state.session is not None:
+            mark_changed(state.session, name)
+
+    return listener
+
+
+def _publish_changes(session):
+    names = session.info.pop(_PENDING_KEY, None)
+    if names:
+        invalidate(*sorted(names))
+
+
+def _discard_changes(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+for model, name, attributes in (
+    (Event, FORMS, None),
+    (Form, FORMS, None),
+    (Participant, PARTICIPANTS, ("participant_id", "participant_set_id", "locale")),
+    (PhoneContact, PARTICIPANTS, ("number", "participant_id")),
+):
+    sa.event.listen(model, "after_insert", _track(name))
+    sa.event.listen(model, "after_delete", _track(name))
+    sa.event.listen(model, "after_update", _track(name, attributes))
+
+sa.event.listen(sa.orm.Session, "after_commit", _publish_changes)
+sa.event.listen(sa.orm.Session, "after_rollback", _discard_changes)
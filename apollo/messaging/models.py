@@ -63,3 +63,47 @@ class Message(BaseModel):
             sa.func.to_tsvector(sa.literal_column("'english'"), text),
             postgresql_using='gin'),
     )
+
+
+class InboundMessage(BaseModel):
+    """Inbound messages queued for processing by the workers.
+
+    The gateway webhooks only add the messages to this table, and the
+    workers process them in the order they were received for every sender.
+    `key` identifies a message across the retries of the gateway, so that
+    a retried message is only queued once.
+    """
+    STATUSES = (
+        ('PENDING', _('Pending')),
+        ('PROCESSED', _('Processed')),
+        ('FAILED', _('Failed')),
+    )
+
+    __tablename__ = 'inbound_message'
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String, nullable=False, unique=True)
+    gateway = db.Column(db.String, nullable=False)
+    sender = db.Column(db.String, nullable=False)
+    text = db.Column(db.String)
+    timestamp = db.Column(db.Integer)
+    event_id = db.Column(db.Integer, db.ForeignKey(
+        'event.id', ondelete='CASCADE'), nullable=False)
+    status = db.Column(
+        ChoiceType(STATUSES), default=STATUSES[0][0], nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    # the reply is stored together with the logged messages, so that a
+    # message is not processed again if sending the reply fails
+    reply = db.Column(db.String)
+    message_id = db.Column(
+        db.Integer, db.ForeignKey('message.id', ondelete='SET NULL'))
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    processed = db.Column(db.DateTime)
+
+    event = db.relationship('Event')
+    message = db.relationship('Message')
+
+    __table_args__ = (
+        db.Index(
+            'ix_inbound_message_sender_status', 'sender', 'status', 'id'),
+    )
@@ -1,19 +1,114 @@
 # -*- coding: utf-8 -*-
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests as r
 from flask import current_app
+from requests.adapters import HTTPAdapter
+
+_session_lock = threading.Lock()
+_sessions = {}
+
+
+def _session():
+    """Returns the HTTP session of the current process.
+
+    The session keeps the connections to the gateway open, so that sending
+    a message does not open a new connection. It is shared by the threads
+    sending messages, with a pool of `MESSAGING_SEND_CONCURRENCY`
+    connections.
+    """
+    pid = os.getpid()
+    session = _sessions.get(pid)
+    if session is None:
+        with _session_lock:
+            session = _sessions.get(pid)
+            if session is None:
+                session = r.Session()
+                pool_size = current_app.config.get("MESSAGING_SEND_CONCURRENCY") or 1
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                # sessions inherited from a parent process are not reused
+                _sessions.clear()
+                _sessions[pid] = session
+
+    return session
+
+
+class RateLimiter(object):
+    """Limits the number of messages sent per second across threads."""
+
+    def __init__(self, rate):
+        """Initializes the rate limiter.
+
+        :param rate: The number of messages per second, or None for no limit
+        """
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, count=1):
+        """Waits until `count` messages can be sent."""
+        if not self.interval:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.next_time, now)
+            self.next_time = start + count * self.interval
+
+        if start > now:
+            time.sleep(start - now)
 
 
 class Gateway(object):
     """Base Gateway class.
 
     :attr gateway_url: Gateway url
+    :attr batch_size: The maximum number of recipients of a request
     """
 
     gateway_url = ""
+    batch_size = 1
 
     def send(self, text, recipients):
         raise NotImplementedError
 
+    def send_batch(self, text, recipients, sender=""):
+        """Sends a message to a batch of recipients with one request."""
+        for recipient in recipients:
+            self.send(text, recipient, sender)
+
+    def send_many(self, text, recipients, sender="", limiter=None):
+        """Sends a message to many recipients.
+
+        The recipients are sent the message in batches, by
+        `MESSAGING_SEND_CONCURRENCY` threads, at most `MESSAGING_SEND_RATE`
+        messages per second.
+
+        :param limiter: (Optional) a `RateLimiter` shared by several calls
+        :returns: the number of recipients sent the message
+        """
+        recipients = list(recipients)
+        batches = [recipients[i : i + self.batch_size] for i in range(0, len(recipients), self.batch_size)]
+        if limiter is None:
+            limiter = RateLimiter(current_app.config.get("MESSAGING_SEND_RATE"))
+        app = current_app._get_current_object()
+
+        def send_batch(batch):
+            limiter.acquire(len(batch))
+            with app.app_context():
+                self.send_batch(text, batch, sender)
+
+        with ThreadPoolExecutor(max_workers=current_app.config.get("MESSAGING_SEND_CONCURRENCY") or 1) as executor:
+            for _ in executor.map(send_batch, batches):
+                pass
+
+        return len(recipients)
+
 
 class KannelGateway(Gateway):
     """Kannel Gateway class."""
@@ -30,6 +125,7 @@ class KannelGateway(Gateway):
         self.charset = config.get("charset")
         self.coding = config.get("coding")
         self.sender = config.get("from", "")
+        self.batch_size = current_app.config.get("MESSAGING_SEND_BATCH_SIZE") or 1
 
     def send(self, text, recipient, sender=""):
         """Sends the message to the specified recipients using this gateway.
@@ -48,12 +144,19 @@ class KannelGateway(Gateway):
         gateway_params.update({key: getattr(self, key) for key in ["smsc", "charset", "coding"] if getattr(self, key)})
 
         try:
-            resp = r.get(self.gateway_url, params=gateway_params)
+            resp = _session().get(self.gateway_url, params=gateway_params)
         except r.ConnectionError:
             raise
 
         return "OK %s" % (resp.status_code,)
 
+    def send_batch(self, text, recipients, sender=""):
+        """Sends a message to a batch of recipients with one request.
+
+        Kannel accepts several recipients separated by spaces.
+        """
+        return self.send(text, " ".join(recipients), sender)
+
 
 class TelerivetGateway(Gateway):
     """Telerivet Gateway class."""
@@ -67,6 +170,9 @@ class TelerivetGateway(Gateway):
         self.api_key = config.get("api_key")
         self.route_id = config.get("route_id")
         self.priority = config.get("priority")
+        self.batch_size = current_app.config.get("MESSAGING_SEND_BATCH_SIZE") or 1
+        # broadcasts are sent through the project endpoint
+        self.broadcast_url = self.gateway_url.replace("/messages/send", "/send_broadcast")
 
     def send(self, text, recipient, sender=""):
         """Sends the message to the specified recipients using this gateway.
@@ -78,7 +184,24 @@ class TelerivetGateway(Gateway):
         gateway_params = {"to_number": recipient, "content": text}
         gateway_params.update({key: getattr(self, key) for key in ["priority", "route_id"] if getattr(self, key)})
         try:
-            r.post(self.gateway_url, json=gateway_params, auth=(self.api_key, ""))
+            _session().post(self.gateway_url, json=gateway_params, auth=(self.api_key, ""))
+        except r.ConnectionError:
+            raise
+
+        return "OK"
+
+    def send_batch(self, text, recipients, sender=""):
+        """Sends a message to a batch of recipients with one request.
+
+        The message is sent as a Telerivet broadcast.
+        """
+        if len(recipients) == 1:
+            return self.send(text, recipients[0], sender)
+
+        gateway_params = {"to_numbers": list(recipients), "content": text}
+        gateway_params.update({key: getattr(self, key) for key in ["priority", "route_id"] if getattr(self, key)})
+        try:
+            _session().post(self.broadcast_url, json=gateway_params, auth=(self.api_key, ""))
         except r.ConnectionError:
             raise
 
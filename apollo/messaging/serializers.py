@@ -1,8 +1,18 @@
 # -*- coding: utf-8 -*-
 import calendar
-import json
 
-from apollo.dal.serializers import ArchiveSerializer
+import sqlalchemy as sa
+from sqlalchemy.orm import aliased, joinedload
+
+from apollo.core import db
+from apollo.dal.serializers import (
+    ArchiveSerializer,
+    keyset_chunks,
+    random_uuid,
+    serialize_chunks,
+    staged_timestamp,
+    staged_uuid,
+)
 from apollo.messaging.models import Message
 from apollo.participants.models import Participant
 from apollo.submissions.models import Submission
@@ -40,6 +50,7 @@ class MessageSerializer(object):
             raise TypeError('Object is not of type Message')
 
         return {
+            'uuid': obj.uuid.hex,
             'direction': obj.direction.code,
             'recipient': obj.recipient,
             'sender': obj.sender,
@@ -58,14 +69,57 @@ class MessageSerializer(object):
 
 
 class MessageArchiveSerializer(ArchiveSerializer):
-    def deserialize(self, zip_file):
-        return super().deserialize(zip_file)
+    def deserialize(self, archive, event):
+        table = archive.table('messages.ndjson')
+        if table is None:
+            return
+
+        record = table.c.record
+        query = sa.select(
+            sa.func.coalesce(staged_uuid(record['uuid']), random_uuid()),
+            record['direction'].astext,
+            record['recipient'].astext,
+            record['sender'].astext,
+            record['text'].astext,
+            record['message_type'].astext,
+            staged_timestamp(record['received']),
+            staged_timestamp(record['delivered']),
+            sa.literal(event.deployment_id),
+            sa.literal(event.id),
+            Submission.id,
+            Participant.id
+        ).select_from(table).outerjoin(Submission, sa.and_(
+            Submission.event_id == event.id,
+            Submission.uuid == staged_uuid(record['submission']))
+        ).outerjoin(Participant, sa.and_(
+            Participant.participant_set_id == event.participant_set_id,
+            Participant.uuid == staged_uuid(record['participant'])))
+        db.session.execute(sa.insert(Message).from_select(
+            ['uuid', 'direction', 'recipient', 'sender', 'text',
+             'message_type', 'received', 'delivered', 'deployment_id',
+             'event_id', 'submission_id', 'participant_id'], query))
+
+        # the `originating_message` relationship is the reverse of the
+        # `originating_message_id` column: it is the reply to the message
+        message = aliased(Message)
+        db.session.execute(
+            sa.update(Message).where(
+                Message.event_id == event.id,
+                Message.uuid == staged_uuid(record['originating_message']),
+                message.event_id == event.id,
+                message.uuid == staged_uuid(record['uuid'])
+            ).values(
+                originating_message_id=message.id
+            ).execution_options(synchronize_session=False))
+
+    def serialize(self, event, archive):
+        archive.add('messages.ndjson', self.serialize_messages, event.id)
 
-    def serialize(self, event, zip_file):
-        with zip_file.open('messages.ndjson', 'w') as f:
-            serializer = MessageSerializer()
+    def serialize_messages(self, event_id):
+        query = Message.query.filter_by(event_id=event_id).options(
+            joinedload(Message.submission).load_only(Submission.uuid),
+            joinedload(Message.participant).load_only(Participant.uuid),
+            joinedload(Message.originating_message).load_only(Message.uuid))
 
-            for message in event.messages:
-                data = serializer.serialize_one(message)
-                line = f'{json.dumps(data)}\n'
-                f.write(line.encode('utf-8'))
+        yield from serialize_chunks(
+            MessageSerializer(), keyset_chunks(query, Message.id))
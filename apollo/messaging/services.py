@@ -3,12 +3,16 @@ import csv
 from datetime import datetime
 from io import StringIO
 
+import sqlalchemy as sa
 from flask_babel import gettext as _
 
 from apollo import constants
+from apollo.core import db
 from apollo.dal.service import Service
 from apollo.messaging.models import Message
 
+EXPORT_CHUNK_SIZE = 1000
+
 
 class MessageService(Service):
     __model__ = Message
@@ -28,7 +32,28 @@ class MessageService(Service):
             deployment_id=event.deployment_id, event=event, received=msg_time,
             message_type=message_type)
 
-    def export_list(self, query):
+    def log_messages(self, event, direction, text, recipients, sender='',
+                     message_type='SMS'):
+        """Logs a message sent to many recipients with a single insert."""
+        msg_time = datetime.utcnow()
+        rows = [
+            {
+                'direction': direction, 'recipient': recipient,
+                'sender': sender, 'text': text,
+                'deployment_id': event.deployment_id, 'event_id': event.id,
+                'received': msg_time, 'message_type': message_type,
+            }
+            for recipient in recipients
+        ]
+        if rows:
+            db.session.execute(sa.insert(self.__model__), rows)
+            db.session.commit()
+
+        return len(rows)
+
+    def export_list(self, query, progress=None):
+        # `progress`, if given, is called with the number of messages
+        # exported after every chunk
         headers = [
             _('Mobile'), _('Text'), _('Direction'), _('Created'),
             _('Delivered'), _('Type')
@@ -38,9 +63,11 @@ class MessageService(Service):
         writer = csv.writer(output)
         writer.writerow([str(i) for i in headers])
         yield output.getvalue()
-        output.close()
+        output.seek(0)
+        output.truncate()
 
-        for message in query:
+        processed = 0
+        for message in query.yield_per(EXPORT_CHUNK_SIZE):
             # limit to three numbers for export and pad if less than three
             record = [
                 message.sender if message.direction == 'IN'
@@ -53,9 +80,17 @@ class MessageService(Service):
                 if message.delivered else '',
                 message.message_type.value
             ]
-
-            output = StringIO()
-            writer = csv.writer(output)
             writer.writerow([str(i) for i in record])
-            yield output.getvalue()
-            output.close()
+
+            processed += 1
+            if processed % EXPORT_CHUNK_SIZE == 0:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+                if progress is not None:
+                    progress(processed)
+
+        yield output.getvalue()
+        output.close()
+        if progress is not None:
+            progress(processed)
@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+
 from celery import shared_task
 from flask_mail import Message
 from sentry_sdk import capture_exception, capture_message
+from werkzeug.datastructures import MultiDict
 
 from apollo import models, services, settings
 from apollo.core import mail
-from apollo.messaging.outgoing import gateway_factory
+from apollo.messaging import inbox
+from apollo.messaging.filters import MessageFilterSet
+from apollo.messaging.outgoing import RateLimiter, gateway_factory
+from apollo.users.exports import run_export, write_chunks
 
 
 @shared_task()
@@ -30,13 +36,48 @@ def send_message(event, message, recipient, sender=""):
 
 @shared_task()
 def send_messages(event, message, recipients, sender=""):
-    """Send an outgoing message."""
+    """Send an outgoing message to one or more recipients.
+
+    The messages are logged and sent in chunks, each logged with a single
+    insert and sent in batches by the gateway.
+    """
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    recipients = list(dict.fromkeys(recipients))
+
+    gateway = gateway_factory()
+    if not gateway or not recipients:
+        return 0
+
+    event = models.Event.query.filter_by(id=event).one()
+    limiter = RateLimiter(settings.MESSAGING_SEND_RATE)
+    chunk_size = max(gateway.batch_size * settings.MESSAGING_SEND_CONCURRENCY, 1)
+
+    for index in range(0, len(recipients), chunk_size):
+        chunk = recipients[index : index + chunk_size]
+        services.messages.log_messages(event=event, direction="OUT", text=message, recipients=chunk, sender=sender)
+        gateway.send_many(message, chunk, sender, limiter=limiter)
+
+    return len(recipients)
+
+
+@shared_task(bind=True, max_retries=None)
+def process_inbound_messages(self, sender):
+    """Process the queued inbound messages of a sender."""
     try:
-        _ = iter(recipients)
-        items = [(event, message, recipient, sender) for recipient in set(recipients)]
-        send_message.chunks(items, 100).delay()
-    except TypeError:
-        send_message.delay(event, message, recipients, sender)
+        return inbox.process_messages(sender)
+    except Exception as exc:
+        raise self.retry(exc=exc, countdown=min(2**self.request.retries, 300)) from exc
+
+
+@shared_task()
+def requeue_inbound_messages(minutes=5):
+    """Restart the processing of the inbound messages pending for too long."""
+    senders = inbox.pending_senders(datetime.utcnow() - timedelta(minutes=minutes))
+    for sender in senders:
+        process_inbound_messages.delay(sender)
+
+    return len(senders)
 
 
 @shared_task()
@@ -56,3 +97,26 @@ def send_email(subject, body, recipients, sender=None):
         # still log the exception to Sentry,
         # but don't let it be uncaught
         capture_exception()
+
+
+@shared_task(bind=True)
+def export_messages(self, export_id, event_id, args, locale=None, channel=None):
+    """Export the messages of an event and its overlapping events to a CSV file."""
+    event = models.Event.query.filter_by(id=event_id).first()
+
+    def write(fileobj, report_progress):
+        message_events = set(services.events.overlapping_events(event)).union({event})
+        event_ids = [ev.id for ev in message_events]
+        queryset = models.Message.query.filter(
+            models.Message.deployment_id == event.deployment_id, models.Message.event_id.in_(event_ids)
+        ).order_by(models.Message.received.desc(), models.Message.direction.desc())
+        queryset = MessageFilterSet(queryset, MultiDict(args)).qs
+
+        total_records = queryset.order_by(None).count()
+        report_progress(0, total_records)
+        dataset = services.messages.export_list(
+            queryset, progress=lambda processed_records: report_progress(processed_records, total_records)
+        )
+        write_chunks(fileobj, dataset)
+
+    run_export(self, export_id, write, locale)
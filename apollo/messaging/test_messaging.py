@@ -1,17 +1,29 @@
 # -*- coding: utf-8 -*-
 import pathlib
-from datetime import datetime
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
 
 import flask_babel as babel
 import pytest
+import pytz
+import sqlalchemy as sa
 from flask_babel import force_locale
 from mimesis import Generic
 from mimesis.locales import Locale
 
 from apollo import services
+from apollo.core import db
+from apollo.deployments.models import Deployment, Event
 from apollo.formsframework.models import Form
+from apollo.messaging import benchmark, inbox, lookups, outgoing
+from apollo.messaging import services as message_services
 from apollo.messaging.helpers import lookup_participant
-from apollo.messaging.utils import get_unsent_codes, parse_responses, parse_text
+from apollo.messaging.inbox import message_key
+from apollo.messaging.models import InboundMessage
+from apollo.messaging.utils import get_response_parser, get_unsent_codes, parse_responses, parse_text
+from apollo.messaging.views_messaging import increment_message_counts
+from apollo.participants.models import Participant, ParticipantSet
 from apollo.testutils import fixtures
 
 DEFAULT_FIXTURES_PATH = pathlib.Path(__file__).parent / "fixtures"
@@ -61,6 +73,52 @@ def test_leftover_processing(form):
     assert parse_responses("ZX1CV2EA135DBAAA3 THIS IS A TEST ", form)[1] == "ZX1CV2DBA THIS IS A TEST"
 
 
+def test_boolean_response_parsing():
+    """Tests that overlapping boolean tags are matched in field order."""
+    fields = [
+        {"tag": "AA", "type": "integer"},
+        {"tag": "X", "type": "boolean"},
+        {"tag": "XA", "type": "boolean"},
+        {"tag": "YB", "type": "boolean"},
+        {"tag": "Y", "type": "boolean"},
+    ]
+    form = SimpleNamespace(id=1, version_identifier="a", data={"groups": [{"name": "Group", "fields": fields}]})
+
+    assert parse_responses("AA1XAYBZZ2", form) == ({"AA": "1", "X": 1, "YB": 1, "AZZ": "2"}, "")
+    assert parse_responses("xa yb", form) == ({"X": 1, "YB": 1}, "a")
+    assert get_response_parser(form) is get_response_parser(form)
+
+
+def test_malformed_message_parsing(app):
+    """Tests the parsing of the benchmark corpus of malformed messages."""
+    form = benchmark.make_form()
+    with app.app_context():
+        results = {}
+        for text in benchmark.CORPUS:
+            parsed = parse_text(text)
+            results[text] = parsed[:4], parsed[5], parse_responses(parsed[4], form) if parsed[4] else None
+
+    assert results["pb 1234 aa1 ab2 ac3"] == (
+        ("pb", "1234", False, None),
+        None,
+        ({"AA": "1", "AB": "2", "AC": "3"}, ""),
+    )
+    assert results["PB-1234-AA1-AB2-AC3"] == results["PB1234AA1AB2AC3"]
+    assert results["PBI234AAIABOACL"] == (("PB", "1234", False, None), None, ({"AA": "1", "AB": "0", "AC": "1"}, ""))
+    assert results["PB1234\nAA1\r\nAB2\nAC3"] == results["PB1234AA1AB2AC3"]
+    assert results["PB1234 xa xb xd ca12 cb3"][2] == ({"CA": "12", "CB": "3", "XA": 1, "XB": 1, "XD": 1}, "")
+    assert results["PB1234!AA1AB2"][0] == ("PB", "1234", True, None)
+    assert results["PB1234X12AA1AB2"][0] == ("PB", "1234", False, "12")
+    assert results["PB1234AA1AB2ZZ9QQ4"][2] == ({"AA": "1", "AB": "2", "ZZ": "9", "QQ": "4"}, "")
+    assert results["PB1234AA1AB2 JUNK"][2] == ({"AA": "1", "AB": "2"}, "JUNK")
+    assert results["PB1234 AA1 AB2 @ Comment, with punctuation!"][1] == "Comment, with punctuation!"
+    assert results["PB1234EA135DBAAA3"][2] == ({"EA": "135", "AA": "3"}, "DBA")
+    assert results["PB1234AAAB2"][2] == ({"AB": "2"}, "AA")
+    assert results["PB1234AA1AA2"][2] == ({"AA": "2"}, "")
+    assert results["PB AA1AB2"][0] == ("PBAA", "1", False, None)
+    assert results["1234AA1AB2"] == results[""] == ((None, None, None, None), None, None)
+
+
 def test_partial_response(form):
     """Test partial response generation."""
     assert get_unsent_codes(form, ["AA", "BA"]) == ["Comment1"]
@@ -229,3 +287,203 @@ def test_lookup_with_number(app):
     rv2 = lookup_participant(message, phone_number, event3)
     assert rv2.phone_contacts[0].number == phone_number
     assert rv.id != rv2.id
+
+
+def test_export_progress(app):
+    """Tests that the message export reports its progress in chunks."""
+
+    class Query(list):
+        def yield_per(self, count):
+            return iter(self)
+
+    query = Query(
+        SimpleNamespace(
+            sender="",
+            recipient=f"080{i}",
+            direction=SimpleNamespace(code="OUT"),
+            text=f"Message {i}",
+            received=datetime(2024, 1, 1, 8, i),
+            delivered=None,
+            message_type=SimpleNamespace(value="SMS"),
+        )
+        for i in range(3)
+    )
+
+    progress = mock.Mock()
+    with mock.patch.object(message_services, "EXPORT_CHUNK_SIZE", 2):
+        chunks = list(services.messages.export_list(query, progress=progress))
+
+    # the header, one full chunk and the remaining message
+    assert len(chunks) == 3
+    lines = "".join(chunks).splitlines()
+    assert len(lines) == 4
+    assert lines[1].startswith("0800,Message 0,OUT,2024-01-01 08:00:00")
+    assert [c.args for c in progress.call_args_list] == [(2,), (3,)]
+
+
+def test_inbound_message_keys(app):
+    """Tests that the retries of a queued message have the same key."""
+    # the gateway message id identifies the message
+    assert message_key("telerivet", "0801", "AA1", 10, "SM1") == message_key("telerivet", "0801", "AB2", 20, "SM1")
+    assert message_key("telerivet", "0801", "AA1", message_id="SM1") != message_key("kannel", "0801", "AA1", 10, "SM1")
+
+    # otherwise, the contents and timestamp do
+    key = message_key("kannel", "0801", "AA1", 10)
+    assert key == message_key("kannel", "0801", "AA1", 10)
+    assert key != message_key("kannel", "0801", "AA1", 11)
+    assert key != message_key("kannel", "0802", "AA1", 10)
+
+    # and without a timestamp, the deduplication window
+    app.config["MESSAGING_DEDUPLICATION_WINDOW"] = 300
+    with mock.patch("apollo.messaging.inbox.time.time", side_effect=[600, 899, 900]):
+        keys = [message_key("kannel", "0801", "AA1") for _ in range(3)]
+    assert keys[0] == keys[1] != keys[2]
+
+
+def _queue_messages(name, messages):
+    """Queues inbound messages as (sender, text) pairs for a new event."""
+    event = Event(name=name, deployment=Deployment(name=name, hostnames=[name]))
+    inbound_messages = [
+        InboundMessage(key=f"test:{index}", gateway="test", sender=sender, text=text, event=event)
+        for index, (sender, text) in enumerate(messages)
+    ]
+    db.session.add_all(inbound_messages)
+    db.session.commit()
+
+    return inbound_messages
+
+
+@pytest.mark.usefixtures("db")
+def test_inbound_message_processing():
+    """Tests that the queued messages of a sender are processed in order."""
+    inbound_messages = _queue_messages("inbox", [("0801", "AA1"), ("0802", "AA2"), ("0801", "AA3")])
+    replies = []
+
+    def handle_message(inbound_message):
+        inbound_message.reply = f"Thank you {inbound_message.text}"
+
+    with (
+        mock.patch.object(inbox, "_handle_message", side_effect=handle_message),
+        mock.patch.object(inbox, "_send_reply", side_effect=lambda message: replies.append(message.reply)),
+    ):
+        assert inbox.process_messages("0801") == 2
+
+    assert replies == ["Thank you AA1", "Thank you AA3"]
+    assert [message.status.code for message in inbound_messages] == ["PROCESSED", "PENDING", "PROCESSED"]
+    assert inbound_messages[0].processed is not None
+
+
+@pytest.mark.usefixtures("db")
+def test_inbound_message_retries(app):
+    """Tests that failing messages are retried and then marked as failed."""
+    inbound_messages = _queue_messages("retries", [("0801", "AA1"), ("0801", "AA2")])
+
+    def send_reply(inbound_message):
+        if inbound_message.text == "AA1":
+            raise RuntimeError("Gateway error")
+
+    with (
+        mock.patch.dict(app.config, MESSAGING_MAX_ATTEMPTS=2),
+        mock.patch.object(inbox, "_handle_message"),
+        mock.patch.object(inbox, "_send_reply", side_effect=send_reply),
+    ):
+        # the error is raised so that the task is retried, and the messages
+        # after the failing one wait for it
+        with pytest.raises(RuntimeError):
+            inbox.process_messages("0801")
+        assert [(message.status.code, message.attempts) for message in inbound_messages] == [
+            ("PENDING", 1),
+            ("PENDING", 0),
+        ]
+
+        # the lock was released, and the message is marked as failed once
+        # it reaches the maximum number of attempts
+        assert inbox.process_messages("0801") == 1
+        assert [(message.status.code, message.attempts) for message in inbound_messages] == [
+            ("FAILED", 2),
+            ("PROCESSED", 0),
+        ]
+
+
+@pytest.mark.usefixtures("db")
+def test_inbound_message_lock():
+    """Tests that the messages of a sender are left to the lock holder."""
+    inbound_messages = _queue_messages("lock", [("0801", "AA1")])
+    lock_arguments = {"namespace": inbox.SENDER_LOCK_NAMESPACE, "sender": "0801"}
+
+    with db.engine.connect() as connection:
+        connection.execute(sa.text("SELECT pg_advisory_lock(:namespace, hashtext(:sender))"), lock_arguments)
+        with mock.patch.object(inbox, "_send_reply") as send_reply:
+            assert inbox.process_messages("0801") == 0
+        connection.execute(sa.text("SELECT pg_advisory_unlock(:namespace, hashtext(:sender))"), lock_arguments)
+        connection.commit()
+
+    send_reply.assert_not_called()
+    assert inbound_messages[0].status.code == "PENDING"
+
+
+@pytest.mark.usefixtures("db")
+def test_message_counts():
+    """Tests that the message counters are incremented by the database."""
+    deployment = Deployment(name="counts", hostnames=["counts"])
+    participant = Participant(
+        participant_id="1", participant_set=ParticipantSet(name="counts", deployment=deployment), message_count=3
+    )
+    db.session.add(participant)
+    db.session.commit()
+
+    increment_message_counts(participant, had_errors=False)
+    increment_message_counts(participant, had_errors=True)
+    db.session.commit()
+    db.session.refresh(participant)
+
+    # the messages that could not be parsed are not accurate
+    assert (participant.message_count, participant.accurate_message_count) == (5, 1)
+
+
+def test_form_lookup(app):
+    """Tests that forms are looked up in the events overlapping an event."""
+    now = datetime.now(pytz.utc)
+    hour = timedelta(hours=1)
+    events = [(1, now - hour, now + hour), (2, now - 2 * hour, now - hour), (3, now + hour, now + 2 * hour)]
+    forms = {
+        1: [(10, "tc", "CHECKLIST")],
+        2: [(20, "ti", "INCIDENT")],
+        3: [(30, "tc", "CHECKLIST"), (31, "ti", "INCIDENT")],
+    }
+    event = SimpleNamespace(id=2, deployment_id=1)
+
+    with (
+        mock.patch.object(lookups, "_deployment_forms", return_value=(events, forms)),
+        mock.patch.object(lookups.db.session, "get", side_effect=lambda model, form_id: form_id),
+    ):
+        assert lookups.find_form(event, "TC") == 10
+        assert lookups.find_form(event, "ti") == 20
+        assert lookups.find_form(event, "tc", exclamation=True) is None
+        assert lookups.find_form(SimpleNamespace(id=3, deployment_id=1), "tc") == 10
+
+
+def test_bulk_send(app):
+    """Tests that messages to many recipients are sent in batches."""
+    session = mock.Mock()
+    recipients = [f"080{i}" for i in range(5)]
+    config = {"gateway_url": "https://api.telerivet.com/v1/projects/PJ1/messages/send", "api_key": "key"}
+
+    with (
+        app.app_context(),
+        mock.patch.dict(app.config, MESSAGING_SEND_BATCH_SIZE=2, MESSAGING_SEND_CONCURRENCY=2),
+        mock.patch.object(outgoing, "_session", return_value=session),
+    ):
+        kannel = outgoing.KannelGateway({"gateway_url": "http://localhost:13013/cgi-bin/sendsms"})
+        assert kannel.send_many("Hello", recipients) == 5
+        sent = sorted(c.kwargs["params"]["to"] for c in session.get.call_args_list)
+        assert sent == ["0800 0801", "0802 0803", "0804"]
+
+        telerivet = outgoing.TelerivetGateway(config)
+        telerivet.send_many("Hello", recipients)
+        urls = sorted((c.args[0], str(c.kwargs["json"].get("to_numbers"))) for c in session.post.call_args_list)
+        assert urls == [
+            ("https://api.telerivet.com/v1/projects/PJ1/messages/send", "None"),
+            ("https://api.telerivet.com/v1/projects/PJ1/send_broadcast", "['0800', '0801']"),
+            ("https://api.telerivet.com/v1/projects/PJ1/send_broadcast", "['0802', '0803']"),
+        ]
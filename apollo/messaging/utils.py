@@ -1,9 +1,102 @@
 # -*- coding: utf-8 -*-
-from collections import OrderedDict
 import re
+import threading
+from collections import OrderedDict
 
+import cachetools
 from unidecode import unidecode
 
+# regular expression for a valid text message
+MESSAGE_PATTERN = re.compile(
+    r'^(?P<prefix>[A-Z]+)(?P<participant_id>\d+)'
+    r'(?P<exclamation>!?)(?:X(?P<form_serial>\d+))?(?P<responses>[A-Z0-9\s]*)$',  # noqa
+    re.I | re.M)
+NEWLINE_PATTERN = re.compile(r'(\n|\r|\r\n)')
+RESPONSE_PATTERN = re.compile(r'(?P<tag>[A-Z]+)(?P<answer>\d+)', flags=re.I)
+
+PARSER_CACHE_SIZE = 256
+
+_text_parsers = {}
+_response_parsers = cachetools.LRUCache(maxsize=PARSER_CACHE_SIZE)
+_parser_lock = threading.Lock()
+
+
+class TextParser(object):
+    """Parser for the contents of text messages.
+
+    The punctuation characters to remove and the characters to translate
+    are combined into a single translation table.
+    """
+
+    def __init__(self, transliterate=False, punctuations=(),
+                 trans_table=None):
+        """Initializes the parser.
+
+        :param transliterate: Whether to transliterate the data section
+        :param punctuations: The characters removed from the data section
+        :param trans_table: (Optional) translation table applied to the data
+                            section after the punctuation is removed
+        """
+        table = dict(trans_table or {})
+        # the punctuation is removed before the characters are translated
+        table.update(
+            {ord(char): None for char in punctuations if len(char) == 1})
+        self.table = table
+        self.transliterate = transliterate
+
+    def parse(self, text):
+        """Parses a message; see :function:`parse_text`."""
+        prefix = participant_id = exclamation = form_serial = responses = comment = None  # noqa
+        text = str(text)
+
+        data_section, at, comment_section = text.partition('@')
+        if self.transliterate:
+            data_section = unidecode(data_section)
+            if '@' in data_section:
+                data_section, at, rest = data_section.partition('@')
+                comment_section = rest + at + comment_section
+                at = '@'
+
+        # remove unwanted punctuation characters and convert known
+        # characters like i, l to 1 and o to 0. This will not be applied to
+        # the comment section.
+        data_section = data_section.translate(self.table)
+
+        match = MESSAGE_PATTERN.match(data_section)
+
+        # if there's a match, then extract the required features
+        if match:
+            prefix = match.group('prefix') or None
+            participant_id = match.group('participant_id') or None
+            exclamation = True if match.group('exclamation') else False
+            form_serial = match.group('form_serial') or None
+            responses = match.group('responses') or None
+        comment = comment_section.strip() if at else None
+
+        return (
+            prefix, participant_id, exclamation, form_serial, responses,
+            comment)
+
+
+def get_text_parser(config):
+    """Returns the text parser for the settings in a configuration."""
+    transliterate = bool(config.get('TRANSLITERATE_INPUT'))
+    punctuations = config.get('PUNCTUATIONS') or ()
+    trans_table = config.get('TRANS_TABLE') if config.get(
+        'TRANSLATE_CHARS') else None
+    # the settings are kept with the parser, so their ids are not reused
+    key = (transliterate, id(punctuations), id(trans_table))
+
+    cached = _text_parsers.get(key)
+    if cached is None:
+        cached = (
+            punctuations, trans_table,
+            TextParser(transliterate, punctuations, trans_table))
+        with _parser_lock:
+            _text_parsers[key] = cached
+
+    return cached[2]
+
 
 def parse_text(text):
     '''
@@ -30,62 +123,151 @@ def parse_text(text):
     (prefix, participant_id, exclamation, responses, comments)
     '''
     from flask import current_app
-    config = current_app.config
-
-    prefix = participant_id = exclamation = form_serial = responses = comment = None  # noqa
-    text = str(text)
-    # regular expression for a valid text message
-    pattern = re.compile(
-        r'^(?P<prefix>[A-Z]+)(?P<participant_id>\d+)'
-        r'(?P<exclamation>!?)(?:X(?P<form_serial>\d+))?(?P<responses>[A-Z0-9\s]*)$',  # noqa
-        re.I | re.M)
-
-    at_position = text.find("@")
-
-    if config.get('TRANSLITERATE_INPUT'):
-        if at_position != -1:
-            text = unidecode(text[:at_position]) + text[at_position:]
-        else:
-            text = unidecode(text)
-        at_position = text.find('@')
-
-    # remove unwanted punctuation characters and convert known characters
-    # like i, l to 1 and o to 0. This will not be applied to the comment
-    # section.
-    if at_position != -1:
-        data_section = text[:at_position]
-        comment_section = text[at_position:]
-    else:
-        data_section = text
-        comment_section = ''
-
-    data_section_stripped = ''.join(
-        s for s in data_section if s not in config.get('PUNCTUATIONS'))
-
-    if config.get('TRANSLATE_CHARS'):
-        data_section_translated = data_section_stripped.translate(
-            config.get('TRANS_TABLE'))
-    else:
-        data_section_translated = data_section_stripped
-
-    # reconstruct message with translated characters
-    # and punctuation filtered out
-    text = data_section_translated + comment_section
-
-    at_position = text.find("@")
-    match = pattern.match(text[:at_position] if at_position != -1 else text)
-
-    # if there's a match, then extract the required features
-    if match:
-        prefix = match.group('prefix') or None
-        participant_id = match.group('participant_id') or None
-        exclamation = True if match.group('exclamation') else False
-        form_serial = match.group('form_serial') or None
-        responses = match.group('responses') or None
-    comment = text[at_position + 1:].strip() if at_position != -1 else None
-
-    return (
-        prefix, participant_id, exclamation, form_serial, responses, comment)
+
+    return get_text_parser(current_app.config).parse(text)
+
+
+class ResponseParser(object):
+    """Parser for the responses to a form.
+
+    The responses to numeric fields are found by looking up the tags ending
+    each run of letters followed by digits, and the boolean fields are
+    matched with a trie of their tags, which finds the same responses as
+    the alternations of the tags in regular expressions. Forms with tags
+    that are not made of letters only, and responses that are not ASCII
+    text, are parsed with such expressions.
+    """
+
+    def __init__(self, form):
+        """Initializes the parser for a form."""
+        fields = [fi for group in form.data['groups'] for fi in group['fields']
+                  if fi['type'] != 'comment']
+        numeric_fields = [f['tag'] for f in fields if f['type'] != 'boolean']
+        boolean_fields = [f['tag'] for f in fields if f['type'] == 'boolean']
+
+        self.numeric_pattern = re.compile(
+            r'(?P<tag>{})(?P<answer>\d+)'.format('|'.join(numeric_fields)),
+            flags=re.I)
+        self.boolean_pattern = re.compile(
+            r'(?P<tag>{})'.format('|'.join(boolean_fields)),
+            flags=re.I) if boolean_fields else None
+
+        self.numeric_tags = None
+        if numeric_fields and all(_is_letters(tag) for tag in numeric_fields):
+            self.numeric_tags = {tag.upper() for tag in numeric_fields}
+
+        self.boolean_trie = None
+        if boolean_fields and all(_is_letters(tag) for tag in boolean_fields):
+            self.boolean_trie = {}
+            # the first of the tags matching at a position is the one found
+            for order, tag in reversed(list(enumerate(boolean_fields))):
+                node = self.boolean_trie
+                for char in tag.upper():
+                    node = node.setdefault(char, {})
+                node[''] = (order, tag.upper())
+
+    def _numeric_responses(self, substrate, responses):
+        if self.numeric_tags is None or not substrate.isascii():
+            responses.update(
+                (r.group('tag').upper(), r.group('answer')) for r in
+                self.numeric_pattern.finditer(substrate))
+            return self.numeric_pattern.sub('', substrate)
+
+        remainder = []
+        position = 0
+        for match in RESPONSE_PATTERN.finditer(substrate):
+            letters = match.group('tag').upper()
+            # the response starts with the longest tag ending the letters
+            for start in range(len(letters)):
+                if letters[start:] in self.numeric_tags:
+                    responses[letters[start:]] = match.group('answer')
+                    remainder.append(
+                        substrate[position:match.start() + start])
+                    position = match.end()
+                    break
+
+        remainder.append(substrate[position:])
+        return ''.join(remainder)
+
+    def _boolean_responses(self, substrate, responses):
+        if self.boolean_trie is None or not substrate.isascii():
+            responses.update(
+                (r.group('tag').upper(), 1) for r in
+                self.boolean_pattern.finditer(substrate))
+            return self.boolean_pattern.sub('', substrate)
+
+        remainder = []
+        upper = substrate.upper()
+        position = 0
+        index = 0
+        while index < len(upper):
+            node = self.boolean_trie
+            found = None
+            for char in upper[index:]:
+                node = node.get(char)
+                if node is None:
+                    break
+                if '' in node and (found is None or node[''] < found):
+                    found = node['']
+            if found is None:
+                index += 1
+                continue
+
+            tag = found[1]
+            responses[tag] = 1
+            remainder.append(substrate[position:index])
+            index += len(tag)
+            position = index
+
+        remainder.append(substrate[position:])
+        return ''.join(remainder)
+
+    def parse(self, responses_text):
+        """Parses the responses; see :function:`parse_responses`."""
+        substrate = NEWLINE_PATTERN.sub('', responses_text)
+        responses = OrderedDict()
+        # process numeric fields first, and remove the found data
+        substrate = self._numeric_responses(substrate, responses)
+
+        # fix for bug where boolean_fields is an empty iterable
+        if self.boolean_pattern is None:
+            return responses, substrate.strip()
+
+        # next, process boolean fields, and remove the found data
+        substrate = self._boolean_responses(substrate, responses)
+
+        # finally, get any unknown tags
+        responses.update(
+            (r.group('tag').upper(), r.group('answer')) for r in
+            RESPONSE_PATTERN.finditer(substrate))
+
+        # remove all assumed tags
+        substrate = RESPONSE_PATTERN.sub('', substrate)
+
+        return responses, substrate.strip()
+
+
+def _is_letters(tag):
+    return tag.isascii() and tag.isalpha()
+
+
+def get_response_parser(form):
+    """Returns the response parser of a form.
+
+    The parsers are cached for every version of a saved form.
+    """
+    key = (form.id, form.version_identifier)
+    if key[0] is None or key[1] is None:
+        return ResponseParser(form)
+
+    with _parser_lock:
+        parser = _response_parsers.get(key)
+    if parser is None:
+        parser = ResponseParser(form)
+        with _parser_lock:
+            _response_parsers[key] = parser
+
+    return parser
 
 
 def parse_responses(responses_text, form):
@@ -101,46 +283,7 @@ def parse_responses(responses_text, form):
     defined in `form`: numeric fields are first matched, then boolean
     fields are.
     '''
-    fields = [fi for group in form.data['groups'] for fi in group['fields']
-              if fi['type'] != 'comment']
-    numeric_fields = [f['tag'] for f in fields if f['type'] != 'boolean']
-    boolean_fields = [f['tag'] for f in fields if f['type'] == 'boolean']
-
-    substrate = re.sub(r'(\n|\r|\r\n)', '', responses_text)
-    responses = OrderedDict()
-    # process numeric fields first
-    pattern = re.compile(r'(?P<tag>{})(?P<answer>\d+)'.format(
-        '|'.join(numeric_fields)), flags=re.I)
-    responses.update(
-        ((r.group('tag').upper(), r.group('answer')) for r in
-            pattern.finditer(substrate)))
-
-    # remove the found data
-    substrate = pattern.sub('', substrate)
-
-    # fix for bug where boolean_fields is an empty iterable
-    if not boolean_fields:
-        return responses, substrate.strip()
-
-    # next, process boolean fields
-    pattern2 = re.compile(r'(?P<tag>{})'.format('|'.join(boolean_fields)),
-                          flags=re.I)
-    responses.update(
-        ((r.group('tag').upper(), 1) for r in pattern2.finditer(substrate)))
-
-    # remove the found data
-    substrate = pattern2.sub('', substrate)
-
-    # finally, get any unknown tags
-    default_pattern = re.compile(r'(?P<tag>[A-Z]+)(?P<answer>\d+)', flags=re.I)
-    responses.update(
-        (r.group('tag').upper(), r.group('answer')) for r in
-        default_pattern.finditer(substrate))
-
-    # remove all assumed tags
-    substrate = default_pattern.sub('', substrate)
-
-    return responses, substrate.strip()
+    return get_response_parser(form).parse(responses_text)
 
 
 def get_unsent_codes(form, response_keys):
@@ -7,7 +7,7 @@ import pandas as pd
 import sqlalchemy as sa
 from dateutil.parser import parse
 from dateutil.tz import gettz
-from flask import Blueprint, Response, current_app, g, render_template, request, stream_with_context
+from flask import Blueprint, current_app, g, redirect, render_template, request, url_for
 from flask_babel import lazy_gettext as _
 from flask_menu import register_menu
 from flask_security import login_required
@@ -15,10 +15,12 @@ from slugify import slugify
 from sqlalchemy.orm import aliased
 
 from apollo.frontend import permissions, route
-from apollo.messaging.filters import MessageFilterForm, MessageFilterSet
+from apollo.messaging import tasks
+from apollo.messaging.filters import MessageFilterForm
 from apollo.models import Event, Form, Message, Submission
-from apollo.services import events, messages
+from apollo.services import events
 from apollo.settings import TIMEZONE
+from apollo.users.exports import start_export
 
 APP_TZ = gettz(TIMEZONE)
 bp = Blueprint("messages", __name__)
@@ -49,13 +51,17 @@ def message_list():
 
     if request.args.get("export") and permissions.export_messages.can():
         # Export requested
-        queryset_filter = MessageFilterSet(qs, request.args)
-        dataset = messages.export_list(queryset_filter.qs)
         basename = slugify("%s messages %s" % (g.event.name.lower(), datetime.utcnow().strftime("%Y %m %d %H%M%S")))
-        content_disposition = "attachment; filename=%s.csv" % basename
-        return Response(
-            stream_with_context(dataset), headers={"Content-Disposition": content_disposition}, mimetype="text/csv"
+        start_export(
+            tasks.export_messages,
+            _("Export Messages"),
+            "%s.csv" % basename,
+            "text/csv",
+            event_id=g.event.id,
+            args=request.args.to_dict(flat=False),
         )
+
+        return redirect(url_for("users.export_list"))
     else:
         filter_form = MessageFilterForm(request.args)
         filter_form.validate()
@@ -3,6 +3,7 @@ import json
 import re
 from urllib.parse import parse_qsl
 
+import sqlalchemy as sa
 from flask import Blueprint, current_app, g, make_response, request
 from unidecode import unidecode
 from werkzeug.datastructures import MultiDict
@@ -14,6 +15,8 @@ from ..frontend import route
 from ..frontend.helpers import get_event
 from ..messaging.forms import KannelForm, TelerivetForm
 from ..messaging.helpers import lookup_participant, parse_message
+from ..messaging.inbox import enqueue_message
+from ..participants.models import Participant
 
 bp = Blueprint("messaging", __name__)
 
@@ -35,18 +38,32 @@ def update_datastore(inbound, outbound, submission, had_errors):
 
         outbound.participant = participant
         outbound.submission = submission
-
-        if not had_errors:
-            participant.accurate_message_count += 1
-
-        participant.message_count += 1
-        models_to_save.append(participant)
         models_to_save.append(inbound)
 
     db.session.add_all(models_to_save)
+    if participant:
+        increment_message_counts(participant, had_errors)
     db.session.commit()
 
 
+def increment_message_counts(participant, had_errors):
+    """Increments the message counters of a participant.
+
+    The counters are incremented by the database rather than saved from
+    the loaded participant, so that concurrent messages from a participant
+    are all counted, and the row is only locked until the commit.
+    """
+    table = Participant.__table__
+    db.session.execute(
+        table.update()
+        .where(table.c.id == participant.id)
+        .values(
+            message_count=sa.func.coalesce(table.c.message_count, 0) + 1,
+            accurate_message_count=sa.func.coalesce(table.c.accurate_message_count, 0) + (0 if had_errors else 1),
+        )
+    )
+
+
 @route(bp, "/messaging/kannel", methods=["GET"])
 def kannel_view():
     """View for handling inbound messages from Kannel."""
@@ -62,6 +79,15 @@ def kannel_view():
     if form.validate():
         msg = form.get_message()
 
+        if current_app.config.get("MESSAGING_QUEUE_INBOUND"):
+            # the gateway timestamp is used as is, since retries without
+            # one are deduplicated by the time they are received
+            enqueue_message("kannel", g.event, msg.get("sender"), msg.get("text"), form.timestamp.data)
+
+            response = make_response("")
+            response.mimetype = "text/plain"
+            return response
+
         reply, submission, had_errors = parse_message(form)
         event = submission.event if submission else get_event()
 
@@ -100,6 +126,15 @@ def telerivet_view():
     if form.validate():
         msg = form.get_message()
 
+        if current_app.config.get("MESSAGING_QUEUE_INBOUND"):
+            enqueue_message(
+                "telerivet", g.event, msg.get("sender"), msg.get("text"), msg.get("timestamp"), form.id.data
+            )
+
+            http_response = make_response(json.dumps({"messages": []}))
+            http_response.headers["Content-Type"] = "application/json; charset=utf-8"
+            return http_response
+
         response_text, submission, had_errors = parse_message(form)
         event = submission.event if submission else get_event()
 
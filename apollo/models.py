@@ -3,16 +3,17 @@ from apollo.dal.models import Permission, Resource  # noqa
 from apollo.deployments.models import Deployment, Event # noqa
 from apollo.formsframework.models import Form, events_forms # noqa
 from apollo.locations.models import (  # noqa
-    LocationSet, LocationDataField, Location, LocationPath, LocationType,
-    LocationTypePath, LocationGroup, locations_groups)
-from apollo.messaging.models import Message  # noqa
+    LocationSet, LocationDataField, Location, LocationAncestry, LocationPath,
+    LocationType, LocationTypePath, LocationGroup, locations_groups)
+from apollo.messaging.models import InboundMessage, Message  # noqa
 from apollo.participants.models import (  # noqa
     ParticipantSet, ParticipantDataField,
     Participant, ParticipantPartner, ParticipantRole, PhoneContact,
     ContactHistory, Sample, samples_participants)
 from apollo.submissions.models import (  # noqa
-    Submission, SubmissionComment, SubmissionImageAttachment,
+    CoverageCounter, Submission, SubmissionComment, SubmissionImageAttachment,
     SubmissionVersion)
 from apollo.users.models import (  # noqa
-    Role, User, UserUpload, role_resource_permissions, roles_permissions,
-    roles_users, user_resource_permissions, users_permissions)
+    Role, User, UserExport, UserUpload, role_resource_permissions,
+    roles_permissions, roles_users, user_resource_permissions,
+    users_permissions)
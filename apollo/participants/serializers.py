@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
-import json
+from uuid import UUID
 
-from sqlalchemy import String, cast, func
+import sqlalchemy as sa
+from sqlalchemy import Float, String, cast, func
+from sqlalchemy.orm import joinedload, lazyload
 
-from apollo.dal.serializers import ArchiveSerializer
+from apollo.core import db
+from apollo.dal.serializers import (
+    ArchiveSerializer, keyset_chunks, random_uuid, serialize_chunks,
+    staged_json, staged_timestamp, staged_uuid)
 from apollo.locations.models import Location, LocationSet
 from apollo.participants.models import (
     Participant, ParticipantDataField, ParticipantPartner, ParticipantRole,
@@ -169,7 +174,7 @@ class ParticipantRoleSerializer(object):
         kwargs.pop('participant_set')
         kwargs['participant_set_id'] = participant_set_id
 
-        return self.__model__(**data)
+        return self.__model__(**kwargs)
 
     def serialize_one(self, obj):
         if not isinstance(obj, self.__model__):
@@ -183,73 +188,214 @@ class ParticipantRoleSerializer(object):
 
 
 class ParticipantSetArchiveSerializer(ArchiveSerializer):
-    def deserialize(self, zip_file):
-        pass
-
-    def serialize(self, event, zip_file):
-        participant_set = event.participant_set
-
-        if participant_set:
-            self.serialize_participant_set(participant_set, zip_file)
-            self.serialize_extra_fields(participant_set.extra_fields, zip_file)
-            self.serialize_partners(participant_set.participant_partners,
-                                    zip_file)
-            self.serialize_roles(participant_set.participant_roles, zip_file)
-            self.serialize_participants(participant_set.participants, zip_file)
-            self.serialize_participant_phones(participant_set, zip_file)
-
-    def serialize_participant_set(self, obj, zip_file):
-        serializer = ParticipantSetSerializer()
-        data = serializer.serialize_one(obj)
-
-        with zip_file.open('participant_set.ndjson', 'w') as f:
-            f.write(json.dumps(data).encode('utf-8'))
-
-    def serialize_extra_fields(self, extra_fields, zip_file):
-        serializer = ParticipantDataFieldSerializer()
-
-        with zip_file.open('participant_data_fields.ndjson', 'w') as f:
-            for extra_field in extra_fields:
-                data = serializer.serialize_one(extra_field)
-                line = f'{json.dumps(data)}\n'
-                f.write(line.encode('utf-8'))
-
-    def serialize_partners(self, partners, zip_file):
-        serializer = ParticipantPartnerSerializer()
-
-        with zip_file.open('participant_partners.ndjson', 'w') as f:
-            for partner in partners:
-                data = serializer.serialize_one(partner)
-                line = f'{json.dumps(data)}\n'
-                f.write(line.encode('utf-8'))
-
-    def serialize_roles(self, roles, zip_file):
-        serializer = ParticipantRoleSerializer()
-
-        with zip_file.open('participant_roles.ndjson', 'w') as f:
-            for role in roles:
-                data = serializer.serialize_one(role)
-                line = f'{json.dumps(data)}\n'
-                f.write(line.encode('utf-8'))
-
-    def serialize_participants(self, participants, zip_file):
-        serializer = ParticipantSerializer()
-
-        with zip_file.open('participants.ndjson', 'w') as f:
-            for participant in participants:
-                data = serializer.serialize_one(participant)
-                line = f'{json.dumps(data)}\n'
-                f.write(line.encode('utf-8'))
-
-    def serialize_participant_phones(self, participant_set, zip_file):
-        query = participant_set.participants.join(
-            PhoneContact).with_entities(
-                cast(Participant.uuid, String), PhoneContact.number,
-                func.extract('epoch', PhoneContact.created),
-                func.extract('epoch', PhoneContact.updated),
-                PhoneContact.verified)
-
-        with zip_file.open('phone-contacts.ndjson', 'w') as f:
-            for record in query:
-                line = f'{json.dumps(record)}\n'
-                f.write(line.encode('utf-8'))
+    def deserialize(self, archive, event):
+        data = next(archive.records('participant_set.ndjson'), None)
+        if data is None:
+            return
+
+        participant_set = ParticipantSet(
+            uuid=UUID(data['uuid']), name=data['name'], slug=data['slug'],
+            location_set_id=event.location_set.id
+            if event.location_set else None,
+            deployment_id=event.deployment_id)
+        db.session.add(participant_set)
+        db.session.flush()
+        event.participant_set = participant_set
+
+        self.deserialize_extra_fields(archive, participant_set)
+        self.deserialize_partners(archive, participant_set)
+        self.deserialize_roles(archive, participant_set)
+        self.deserialize_participants(archive, participant_set)
+        self.deserialize_participant_phones(archive, participant_set)
+
+        return participant_set
+
+    def deserialize_extra_fields(self, archive, participant_set):
+        for data in archive.records('participant_data_fields.ndjson'):
+            db.session.add(ParticipantDataField(
+                uuid=UUID(data['uuid']), name=data['name'],
+                label=data['label'],
+                visible_in_lists=data['visible_in_lists'],
+                participant_set_id=participant_set.id,
+                deployment_id=participant_set.deployment_id))
+        db.session.flush()
+
+    def _deserialize_named(self, table, model, participant_set):
+        if table is None:
+            return
+
+        record = table.c.record
+        query = sa.select(
+            staged_uuid(record['uuid']), record['name'].astext,
+            sa.literal(participant_set.id))
+        db.session.execute(sa.insert(model).from_select(
+            ['uuid', 'name', 'participant_set_id'], query))
+
+    def deserialize_partners(self, archive, participant_set):
+        self._deserialize_named(
+            archive.table('participant_partners.ndjson'), ParticipantPartner,
+            participant_set)
+
+    def deserialize_roles(self, archive, participant_set):
+        self._deserialize_named(
+            archive.table('participant_roles.ndjson'), ParticipantRole,
+            participant_set)
+
+    def deserialize_participants(self, archive, participant_set):
+        table = archive.table('participants.ndjson')
+        if table is None:
+            return
+
+        record = table.c.record
+        query = sa.select(
+            staged_uuid(record['uuid']),
+            staged_json(record['full_name']),
+            staged_json(record['first_name']),
+            staged_json(record['other_names']),
+            staged_json(record['last_name']),
+            record['participant_id'].astext,
+            record['email'].astext,
+            ParticipantRole.id,
+            Location.id,
+            ParticipantPartner.id,
+            sa.func.nullif(record['gender'].astext, ''),
+            sa.func.nullif(record['locale'].astext, ''),
+            sa.cast(record['message_count'].astext, sa.Integer),
+            sa.cast(record['accurate_message_count'].astext, sa.Integer),
+            sa.cast(record['completion_rating'].astext, sa.Float),
+            record['device_id'].astext,
+            record['password'].astext,
+            staged_json(record['extra_data']),
+            sa.literal(participant_set.id)
+        ).select_from(table).outerjoin(ParticipantRole, sa.and_(
+            ParticipantRole.participant_set_id == participant_set.id,
+            ParticipantRole.uuid == staged_uuid(record['role']))
+        ).outerjoin(Location, sa.and_(
+            Location.location_set_id == participant_set.location_set_id,
+            Location.uuid == staged_uuid(record['location']))
+        ).outerjoin(ParticipantPartner, sa.and_(
+            ParticipantPartner.participant_set_id == participant_set.id,
+            ParticipantPartner.uuid == staged_uuid(record['partner'])))
+        db.session.execute(sa.insert(Participant).from_select(
+            ['uuid', 'full_name_translations', 'first_name_translations',
+             'other_names_translations', 'last_name_translations',
+             'participant_id', 'email', 'role_id', 'location_id',
+             'partner_id', 'gender', 'locale', 'message_count',
+             'accurate_message_count', 'completion_rating', 'device_id',
+             'password', 'extra_data', 'participant_set_id'], query))
+
+    def deserialize_participant_phones(self, archive, participant_set):
+        table = archive.table('phone-contacts.ndjson')
+        if table is None:
+            return
+
+        # the phone contacts are serialized as lists of the participant
+        # uuid, number, created and updated timestamps and verified flag
+        record = table.c.record
+        query = sa.select(
+            random_uuid(),
+            Participant.id,
+            record[1].astext,
+            staged_timestamp(record[2]),
+            staged_timestamp(record[3]),
+            sa.cast(record[4].astext, sa.Boolean)
+        ).select_from(table).join(Participant, sa.and_(
+            Participant.participant_set_id == participant_set.id,
+            Participant.uuid == staged_uuid(record[0])))
+        db.session.execute(sa.insert(PhoneContact).from_select(
+            ['uuid', 'participant_id', 'number', 'created', 'updated',
+             'verified'], query))
+
+    def serialize(self, event, archive):
+        participant_set_id = event.participant_set_id
+
+        if participant_set_id:
+            archive.add(
+                'participant_set.ndjson', self.serialize_participant_set,
+                participant_set_id)
+            archive.add(
+                'participant_data_fields.ndjson', self.serialize_extra_fields,
+                participant_set_id)
+            archive.add(
+                'participant_partners.ndjson', self.serialize_partners,
+                participant_set_id)
+            archive.add(
+                'participant_roles.ndjson', self.serialize_roles,
+                participant_set_id)
+            archive.add(
+                'participants.ndjson', self.serialize_participants,
+                participant_set_id)
+            archive.add(
+                'phone-contacts.ndjson', self.serialize_participant_phones,
+                participant_set_id)
+
+    # the related objects of the serialized ones are eagerly loaded with
+    # only their uuids
+    def serialize_participant_set(self, participant_set_id):
+        participant_set = ParticipantSet.query.filter_by(
+            id=participant_set_id
+        ).options(
+            joinedload(ParticipantSet.location_set).load_only(
+                LocationSet.uuid)
+        ).one()
+
+        yield [ParticipantSetSerializer().serialize_one(participant_set)]
+
+    def serialize_extra_fields(self, participant_set_id):
+        query = ParticipantDataField.query.filter_by(
+            participant_set_id=participant_set_id
+        ).options(
+            joinedload(ParticipantDataField.participant_set).load_only(
+                ParticipantSet.uuid))
+
+        yield from serialize_chunks(
+            ParticipantDataFieldSerializer(),
+            keyset_chunks(query, ParticipantDataField.id))
+
+    def serialize_partners(self, participant_set_id):
+        query = ParticipantPartner.query.filter_by(
+            participant_set_id=participant_set_id
+        ).options(
+            joinedload(ParticipantPartner.participant_set).load_only(
+                ParticipantSet.uuid))
+
+        yield from serialize_chunks(
+            ParticipantPartnerSerializer(),
+            keyset_chunks(query, ParticipantPartner.id))
+
+    def serialize_roles(self, participant_set_id):
+        query = ParticipantRole.query.filter_by(
+            participant_set_id=participant_set_id
+        ).options(
+            joinedload(ParticipantRole.participant_set).load_only(
+                ParticipantSet.uuid))
+
+        yield from serialize_chunks(
+            ParticipantRoleSerializer(),
+            keyset_chunks(query, ParticipantRole.id))
+
+    def serialize_participants(self, participant_set_id):
+        query = Participant.query.filter_by(
+            participant_set_id=participant_set_id
+        ).options(
+            lazyload(Participant.phone_contacts),
+            joinedload(Participant.role).load_only(ParticipantRole.uuid),
+            joinedload(Participant.location).load_only(Location.uuid),
+            joinedload(Participant.partner).load_only(
+                ParticipantPartner.uuid))
+
+        yield from serialize_chunks(
+            ParticipantSerializer(), keyset_chunks(query, Participant.id))
+
+    def serialize_participant_phones(self, participant_set_id):
+        query = PhoneContact.query.join(Participant).filter(
+            Participant.participant_set_id == participant_set_id
+        ).with_entities(
+            PhoneContact.id,
+            cast(Participant.uuid, String), PhoneContact.number,
+            cast(func.extract('epoch', PhoneContact.created), Float),
+            cast(func.extract('epoch', PhoneContact.updated), Float),
+            PhoneContact.verified)
+
+        for chunk in keyset_chunks(query, PhoneContact.id):
+            yield [list(record[1:]) for record in chunk]
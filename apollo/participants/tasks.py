@@ -4,21 +4,38 @@ import numbers
 import os
 import random
 import string
+from datetime import timedelta
+from functools import partial
 
+import numpy as np
 import pandas as pd
+import sqlalchemy as sa
 from celery import shared_task
 from flask import render_template_string
 from flask_babel import gettext as _
-from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
+from sqlalchemy.dialects.postgresql import JSONB, insert
 
-from apollo import helpers, services
+from apollo import helpers, services, utils
 from apollo.core import db, uploads
+from apollo.locations.models import Location
+from apollo.messaging import lookups
 from apollo.messaging.tasks import send_email
-from apollo.participants.models import Participant, Sample
+from apollo.participants.models import (
+    Participant,
+    ParticipantPartner,
+    ParticipantRole,
+    PhoneContact,
+    Sample,
+    samples_participants,
+)
+from apollo.participants.services import number_regex
 
 APPLICABLE_GENDERS = [s[0] for s in Participant.GENDER]
 logger = logging.getLogger(__name__)
 
+# the participants are written in chunks of rows, each in its own transaction
+IMPORT_CHUNK_SIZE = 1000
+
 email_template = """
 Of {{ count }} records:
 - {{ successful_imports }} were successfully imported,
@@ -65,6 +82,262 @@ def generate_password(length):
     )
 
 
+def _translations(dataframe, header_map, prefix, locales):
+    """Returns the translations of a participant name for every row."""
+    columns = [(locale, header_map.get(f"{prefix}_{locale}")) for locale in locales]
+    names = [
+        (locale, helpers.valid_values(column), column.astype(str).str.strip().to_numpy())
+        for locale, column_name in columns
+        if column_name
+        for column in [helpers.source_column(dataframe, column_name)]
+    ]
+
+    return [{locale: values[row] for locale, valid, values in names if valid[row]} for row in range(dataframe.shape[0])]
+
+
+def _number_or_value(value):
+    if isinstance(value, numbers.Number):
+        return int(value)
+    return value
+
+
+def _valid_items(values):
+    """Returns the rows and the values of the valid cells of a column."""
+    rows = np.flatnonzero(helpers.valid_values(values))
+    return rows, values.to_numpy()[rows]
+
+
+def _validate_participants(dataframe, header_map, locales, sample_map, extra_field_names):
+    """Validates and normalizes the rows of a participant import file.
+
+    The columns are checked and converted as a whole, before any database
+    work. Returns a data frame of the valid rows, with the normalized
+    values of every participant, and the (participant ID, message) errors
+    of the invalid rows, in the order of the rows.
+    """
+    num_rows = dataframe.shape[0]
+    column = partial(helpers.source_column, dataframe)
+
+    source_participant_ids = column(header_map["id"])
+    participant_ids, valid_rows = helpers.parse_integers(source_participant_ids)
+    participant_ids = np.array([str(value) for value in participant_ids], dtype=object)
+    invalid_rows = {
+        row: (
+            source_participant_ids.iat[row],
+            _("Invalid (non-numeric) participant ID (%(p_id)s)", p_id=source_participant_ids.iat[row]),
+        )
+        for row in np.flatnonzero(~valid_rows)
+    }
+
+    participants = pd.DataFrame(
+        {
+            "row": np.arange(num_rows),
+            "participant_id": participant_ids,
+            "source_participant_id": source_participant_ids,
+            "full_name_translations": _translations(dataframe, header_map, "full_name", locales),
+            "first_name_translations": _translations(dataframe, header_map, "first_name", locales),
+            "other_names_translations": _translations(dataframe, header_map, "other_names", locales),
+            "last_name_translations": _translations(dataframe, header_map, "last_name", locales),
+        }
+    )
+
+    for key in ("role", "partner", "email"):
+        values = column(header_map.get(key))
+        participants[key] = values.where(helpers.valid_values(values), None)
+
+    location_ids = column(header_map.get("location"))
+    location_codes, valid_location_codes = helpers.parse_integers(location_ids)
+    participants["location_id"] = location_ids
+    participants["location_code"] = [str(code) for code in location_codes]
+    if header_map.get("location"):
+        for row in np.flatnonzero(valid_rows & ~valid_location_codes):
+            message = _("Invalid (non-numeric) location ID (%(loc_id)s)", loc_id=location_ids.iat[row])
+            invalid_rows[row] = (participant_ids[row], message)
+        valid_rows &= valid_location_codes
+
+    # ignore cases where participant is own supervisor
+    supervisor_ids = column(header_map.get("supervisor"))
+    participants["supervisor_id"] = [
+        (str(int(value)) if isinstance(value, numbers.Number) else value) if valid else None
+        for value, valid in zip(
+            supervisor_ids, helpers.valid_values(supervisor_ids) & (supervisor_ids.to_numpy() != participant_ids)
+        )
+    ]
+
+    genders = column(header_map.get("gender"))
+    initials = genders.astype(str).str[:1].str.upper()
+    participants["gender"] = initials.where(
+        helpers.valid_values(genders) & initials.isin(APPLICABLE_GENDERS), APPLICABLE_GENDERS[0]
+    )
+
+    passwords = column(header_map.get("password"))
+    participants["password"] = [
+        value if valid else generate_password(6) for value, valid in zip(passwords, helpers.valid_values(passwords))
+    ]
+
+    user_locales = column(header_map.get("locale"))
+    participants["locale"] = user_locales.where(
+        helpers.valid_values(user_locales) & user_locales.astype(str).str.lower().isin(locales), None
+    )
+
+    # import phone numbers in reverse order so the first is the latest
+    phones = [[] for _row in range(num_rows)]
+    for phone_column in reversed(header_map.get("phone", [])):
+        values = column(phone_column)
+        for row, value in zip(*_valid_items(values)):
+            phones[row].append(str(_number_or_value(value)))
+    participants["phones"] = phones
+
+    samples = [[] for _row in range(num_rows)]
+    for sample_column in header_map.get("sample", []):
+        if sample_column not in sample_map:
+            continue
+        values = column(sample_column)
+        counts, valid_counts = helpers.parse_integers(values)
+        for row in np.flatnonzero(helpers.valid_values(values) & valid_counts & (counts != 0)):
+            samples[row].append(sample_column)
+    participants["samples"] = samples
+
+    # sort out any extra fields
+    extra_data = [{} for _row in range(num_rows)]
+    for field_name in extra_field_names:
+        if not header_map.get(field_name):
+            continue
+        for row, value in zip(*_valid_items(column(header_map.get(field_name)))):
+            extra_data[row][field_name] = _number_or_value(value)
+    participants["extra_data"] = extra_data
+
+    return participants[valid_rows], [invalid_rows[row] for row in sorted(invalid_rows)]
+
+
+def _participant_map(participant_set, participant_ids=None):
+    """Maps the participant IDs of a participant set to the participants.
+
+    If the set has several participants with the same ID, the first one is
+    used.
+    """
+    query = db.session.query(Participant.participant_id, Participant.id).filter(
+        Participant.participant_set_id == participant_set.id
+    )
+    if participant_ids is not None:
+        query = query.filter(Participant.participant_id.in_(participant_ids))
+
+    return dict(query.order_by(Participant.id.desc()))
+
+
+def _name_map(model, participant_set):
+    """Maps the names of the roles or partners of a participant set."""
+    query = db.session.query(model.name, model.id).filter(model.participant_set_id == participant_set.id)
+    return dict(query.order_by(model.id.desc()))
+
+
+def _create_names(model, names, name_map, participant_set):
+    """Creates the roles or partners that are not in a name map."""
+    names = sorted({name for name in names if name is not None and name not in name_map})
+    if not names:
+        return
+
+    statement = sa.insert(model.__table__).returning(model.name, model.id, sort_by_parameter_order=True)
+    name_map.update(
+        db.session.execute(statement, [{"name": name, "participant_set_id": participant_set.id} for name in names])
+    )
+
+
+def _bind_value(column):
+    # missing JSON values are written as SQL nulls, not JSON nulls
+    column_type = JSONB(none_as_null=True) if isinstance(column.type, JSONB) else column.type
+    return sa.bindparam(f"new_{column.key}", type_=column_type)
+
+
+def _write_participants(records, participant_map, columns):
+    """Inserts or updates the participants of a chunk of rows.
+
+    `columns` are the columns set by the import, and the (coalesced) values
+    of the other columns in the records are only set if they are not null.
+    New participants are added to the participant map.
+    """
+    table = Participant.__table__
+    lookups.mark_changed(db.session, lookups.PARTICIPANTS)
+    keys = list(next(iter(records.values()), {}))
+    new_records = [
+        {f"new_{key}": value for key, value in record.items()}
+        for participant_id, record in records.items()
+        if participant_id not in participant_map
+    ]
+    existing_records = [
+        {"participant_pk": participant_map[participant_id], **{f"new_{key}": value for key, value in record.items()}}
+        for participant_id, record in records.items()
+        if participant_id in participant_map
+    ]
+
+    if new_records:
+        statement = (
+            table.insert()
+            .values({key: _bind_value(table.c[key]) for key in keys})
+            .returning(table.c.participant_id, table.c.id, sort_by_parameter_order=True)
+        )
+        participant_map.update(db.session.execute(statement, new_records))
+
+    if existing_records:
+        values = {
+            key: _bind_value(table.c[key])
+            if key in columns
+            else sa.func.coalesce(_bind_value(table.c[key]), table.c[key])
+            for key in keys
+            if key not in ("participant_id", "participant_set_id")
+        }
+        statement = table.update().where(table.c.id == sa.bindparam("participant_pk")).values(values)
+        db.session.execute(statement, existing_records)
+
+
+def _write_phones(phones, participant_map):
+    """Replaces the phone contacts of the participants of a chunk of rows.
+
+    The numbers of each participant are added in order, so that the last
+    number is the most recently updated one.
+    """
+    table = PhoneContact.__table__
+    lookups.mark_changed(db.session, lookups.PARTICIPANTS)
+    participant_pks = [participant_map[participant_id] for participant_id in phones]
+    db.session.execute(table.delete().where(table.c.participant_id.in_(participant_pks)))
+
+    timestamp = utils.current_timestamp()
+    rows = []
+    for participant_id, phone_numbers in phones.items():
+        added = set()
+        for number in phone_numbers:
+            # skip numbers that were already added
+            digits = number_regex.sub("", number)
+            if digits in added:
+                continue
+            added.add(digits)
+
+            updated = timestamp + timedelta(microseconds=len(rows))
+            rows.append(
+                {
+                    "participant_id": participant_map[participant_id],
+                    "number": number,
+                    "verified": True,
+                    "created": updated,
+                    "updated": updated,
+                }
+            )
+
+    if rows:
+        db.session.execute(table.insert(), rows)
+
+
+def _write_samples(samples, participant_map, sample_map):
+    """Adds the participants of a chunk of rows to their samples."""
+    rows = [
+        {"sample_id": sample_map[column].id, "participant_id": participant_map[participant_id]}
+        for participant_id, columns in samples.items()
+        for column in columns
+    ]
+    if rows:
+        db.session.execute(insert(samples_participants).on_conflict_do_nothing(), rows)
+
+
 def update_participants(dataframe, header_map, participant_set, task):
     """Upserts participant information.
 
@@ -86,10 +359,12 @@ def update_participants(dataframe, header_map, participant_set, task):
         password - the participant's password.
         phone - a prefix for columns starting with this string that contain
                 numbers
-    """
-    index = dataframe.index
 
-    unresolved_supervisors = set()
+    The participants, roles, partners and locations of the participant set
+    are loaded into maps first. The validated rows are then written in
+    chunks, each in its own transaction, with multi-row statements, and the
+    supervisors are resolved once all the participants are written.
+    """
     errors = set()
     warnings = set()
 
@@ -101,27 +376,14 @@ def update_participants(dataframe, header_map, participant_set, task):
 
     location_set = participant_set.location_set
     locales = location_set.deployment.locale_codes
-    full_name_column_keys = [f"full_name_{locale}" for locale in locales]
-    first_name_column_keys = [f"first_name_{locale}" for locale in locales]
-    other_names_column_keys = [f"other_names_{locale}" for locale in locales]
-    last_name_column_keys = [f"last_name_{locale}" for locale in locales]
 
     # set up mappings
-    PARTICIPANT_ID_COL = header_map["id"]
     ROLE_COL = header_map.get("role")
-    PARTNER_COL = header_map.get("partner")
     LOCATION_ID_COL = header_map.get("location")
-    SUPERVISOR_ID_COL = header_map.get("supervisor")
     GENDER_COL = header_map.get("gender")
     EMAIL_COL = header_map.get("email")
-    PASSWORD_COL = header_map.get("password")
-    LOCALE_COL = header_map.get("locale")
     phone_columns = header_map.get("phone", [])
     sample_columns = header_map.get("sample", [])
-    full_name_columns = [header_map.get(col) for col in full_name_column_keys]
-    first_name_columns = [header_map.get(col) for col in first_name_column_keys]
-    other_names_columns = [header_map.get(col) for col in other_names_column_keys]
-    last_name_columns = [header_map.get(col) for col in last_name_column_keys]
 
     extra_field_names = [f.name for f in participant_set.extra_fields] if participant_set.extra_fields else []
 
@@ -136,217 +398,7 @@ def update_participants(dataframe, header_map, participant_set, task):
         db.session.add_all(sample_map.values())
         db.session.commit()
 
-    for idx in index:
-        record = dataframe.iloc[idx]
-        participant_id = record[PARTICIPANT_ID_COL]
-        try:
-            participant_id = int(participant_id)
-        except (TypeError, ValueError):
-            message = _("Invalid (non-numeric) participant ID (%(p_id)s)", p_id=participant_id)
-            errors.add((participant_id, message))
-            error_records += 1
-            error_log.append({"label": "ERROR", "message": message})
-            continue
-        participant_id = str(participant_id)
-
-        participant = services.participants.find(participant_id=participant_id, participant_set=participant_set).first()
-
-        if participant is None:
-            participant = services.participants.new(
-                participant_id=participant_id, participant_set_id=participant_set.id
-            )
-
-        participant_full_names = [record.get(col) for col in full_name_columns]
-        if participant_full_names:
-            participant.full_name_translations = {
-                locale: str(name).strip() for locale, name in zip(locales, participant_full_names) if _is_valid(name)
-            }
-
-        participant_first_names = [record.get(col) for col in first_name_columns]
-        if participant_first_names:
-            participant.first_name_translations = {
-                locale: str(name).strip() for locale, name in zip(locales, participant_first_names) if _is_valid(name)
-            }
-
-        participant_other_names = [record.get(col) for col in other_names_columns]
-        if participant_other_names:
-            participant.other_names_translations = {
-                locale: str(name).strip() for locale, name in zip(locales, participant_other_names) if _is_valid(name)
-            }
-
-        participant_last_names = [record.get(col) for col in last_name_columns]
-        if participant_last_names:
-            participant.last_name_translations = {
-                locale: str(name).strip() for locale, name in zip(locales, participant_last_names) if _is_valid(name)
-            }
-
-        role = None
-        if ROLE_COL:
-            role_name = record[ROLE_COL]
-            if _is_valid(role_name):
-                role = services.participant_roles.find(name=role_name, participant_set=participant_set).first()
-                if role is None:
-                    role = create_role(role_name, participant_set)
-            participant.role = role
-
-        partner = None
-        if PARTNER_COL:
-            partner_name = record[PARTNER_COL]
-            if _is_valid(partner_name):
-                partner = services.participant_partners.find(name=partner_name, participant_set=participant_set).first()
-                if partner is None:
-                    partner = create_partner(partner_name, participant_set)
-                participant.partner = partner
-
-        location = None
-        try:
-            if LOCATION_ID_COL:
-                loc_code = record[LOCATION_ID_COL]
-                try:
-                    loc_code = int(loc_code)
-                except (TypeError, ValueError):
-                    message = _("Invalid (non-numeric) location ID (%(loc_id)s)", loc_id=loc_code)
-                    errors.add((participant_id, message))
-                    error_records += 1
-                    error_log.append({"label": "ERROR", "message": message})
-                    continue
-
-                location = services.locations.find(code=str(loc_code), location_set=location_set).one()
-        except MultipleResultsFound:
-            errors.add((participant_id, _("Invalid location id (%(loc_id)s)", loc_id=record[LOCATION_ID_COL])))
-            error_records += 1
-            error_log.append(
-                {
-                    "label": "ERROR",
-                    "message": _(
-                        "Location code %(loc_id)s for row %(row)d is not unique",
-                        loc_id=record[LOCATION_ID_COL],
-                        row=(idx + 1),
-                    ),
-                }
-            )
-            continue
-        except NoResultFound:
-            warnings.add((participant_id, _("Location with id %(loc_id)s not found", loc_id=record[LOCATION_ID_COL])))
-            warning_records += 1
-            error_log.append(
-                {
-                    "label": "WARNING",
-                    "message": _(
-                        "Location code %(loc_id)s for row %(row)d with " "participant ID %(part_id)s not found",
-                        loc_id=record[LOCATION_ID_COL],
-                        row=(idx + 1),
-                        part_id=record[PARTICIPANT_ID_COL],
-                    ),
-                }
-            )
-
-        if location:
-            participant.location = location
-
-        supervisor = None
-        if SUPERVISOR_ID_COL:
-            if _is_valid(record[SUPERVISOR_ID_COL]):
-                if record[SUPERVISOR_ID_COL] != participant_id:
-                    # ignore cases where participant is own supervisor
-                    supervisor_id = record[SUPERVISOR_ID_COL]
-                    if isinstance(supervisor_id, numbers.Number):
-                        supervisor_id = str(int(supervisor_id))
-                    supervisor = services.participants.find(
-                        participant_id=supervisor_id,
-                        participant_set=participant_set,
-                    ).first()
-                    if supervisor is None:
-                        # perhaps supervisor exists further along.
-                        # cache the refs
-                        unresolved_supervisors.add((participant_id, supervisor_id))
-                    else:
-                        participant.supervisor_id = supervisor.id
-
-        if GENDER_COL:
-            gender_spec = record[GENDER_COL]
-            if _is_valid(gender_spec) and gender_spec[:1].upper() in APPLICABLE_GENDERS:
-                participant.gender = gender_spec[:1].upper()
-            else:
-                participant.gender = APPLICABLE_GENDERS[0]
-
-        if EMAIL_COL:
-            participant.email = record[EMAIL_COL] if _is_valid(record[EMAIL_COL]) else None
-
-        if PASSWORD_COL:
-            participant.password = record[PASSWORD_COL] if _is_valid(record[PASSWORD_COL]) else generate_password(6)
-        else:
-            participant.password = generate_password(6)
-
-        if LOCALE_COL:
-            locale = record[LOCALE_COL]
-            if _is_valid(locale) and str(locale).lower() in locales:
-                participant.locale = locale
-
-        # save if this is a new participant - we need an id for lookup
-        if not participant.id:
-            participant.save()
-
-        if phone_columns:
-            # If this is an update for the participant, we should clear
-            # the current list of phone numbers and then recreate them
-            if participant.id:
-                participant.phone_contacts = []
-                db.session.commit()
-
-            # check if the phone number is on record
-            # import phone numbers in reverse order so the first is the latest
-            for column in reversed(phone_columns):
-                if not _is_valid(record[column]):
-                    continue
-
-                mobile = record[column]
-                if isinstance(mobile, numbers.Number):
-                    mobile = int(mobile)
-                mobile_num = str(mobile)
-
-                phone = services.phone_contacts.lookup(mobile_num, participant)
-                if not phone:
-                    phone = services.phone_contacts.create(
-                        number=mobile_num, participant_id=participant.id, verified=True
-                    )
-
-        if sample_columns:
-            for column in sample_columns:
-                if not _is_valid(record[column]):
-                    continue
-
-                sample = sample_map.get(column)
-                if sample is None:
-                    continue
-
-                try:
-                    value = int(record[column])
-                    if value == 0:
-                        continue
-                except ValueError:
-                    continue
-                participant.samples.append(sample)
-
-        # sort out any extra fields
-        extra_data = {}
-        for field_name in extra_field_names:
-            column = header_map.get(field_name)
-            if column:
-                value = record[column]
-                if _is_valid(value):
-                    if isinstance(value, numbers.Number):
-                        value = int(value)
-                    extra_data[field_name] = value
-
-        # finally done with first pass
-        participant.save()
-        processed_records += 1
-
-        # if we have extra data, update the participant
-        if extra_data:
-            services.participants.find(id=participant.id).update({"extra_data": extra_data}, synchronize_session=False)
-
+    def report_progress():
         task.update_state(
             state="PROGRESS",
             meta={
@@ -358,48 +410,163 @@ def update_participants(dataframe, header_map, participant_set, task):
             },
         )
 
+    participants, invalid_rows = _validate_participants(dataframe, header_map, locales, sample_map, extra_field_names)
+    for participant_id, message in invalid_rows:
+        errors.add((participant_id, message))
+        error_records += 1
+        error_log.append({"label": "ERROR", "message": message})
+
+    participant_map = _participant_map(participant_set)
+    role_map = _name_map(ParticipantRole, participant_set)
+    partner_map = _name_map(ParticipantPartner, participant_set)
+    location_map = dict(
+        db.session.query(Location.code, Location.id).filter(Location.location_set_id == location_set.id)
+    )
+
+    # the columns that are always set. the other ones are only set if the
+    # row has a value for them
+    columns = {
+        "full_name_translations",
+        "first_name_translations",
+        "other_names_translations",
+        "last_name_translations",
+        "password",
+    }
+    if ROLE_COL:
+        columns.add("role_id")
+    if GENDER_COL:
+        columns.add("gender")
+    if EMAIL_COL:
+        columns.add("email")
+
+    # the supervisor references, resolved after all the participants are
+    # written since the supervisors may be imported from later rows
+    supervisors = {}
+
+    for start in range(0, len(participants), IMPORT_CHUNK_SIZE):
+        chunk = participants.iloc[start : start + IMPORT_CHUNK_SIZE]
+        _create_names(ParticipantRole, chunk["role"], role_map, participant_set)
+        _create_names(ParticipantPartner, chunk["partner"], partner_map, participant_set)
+
+        # the rows of each participant in the chunk are merged, so that
+        # later rows update the values of earlier ones
+        records = {}
+        phones = {}
+        samples = {}
+        for record in chunk.itertuples(index=False):
+            participant_id = record.participant_id
+
+            location_id = None
+            if LOCATION_ID_COL:
+                location_id = location_map.get(record.location_code)
+                if location_id is None:
+                    warnings.add(
+                        (participant_id, _("Location with id %(loc_id)s not found", loc_id=record.location_id))
+                    )
+                    warning_records += 1
+                    error_log.append(
+                        {
+                            "label": "WARNING",
+                            "message": _(
+                                "Location code %(loc_id)s for row %(row)d with " "participant ID %(part_id)s not found",
+                                loc_id=record.location_id,
+                                row=(record.row + 1),
+                                part_id=record.source_participant_id,
+                            ),
+                        }
+                    )
+
+            values = {
+                "participant_id": participant_id,
+                "participant_set_id": participant_set.id,
+                "full_name_translations": record.full_name_translations,
+                "first_name_translations": record.first_name_translations,
+                "other_names_translations": record.other_names_translations,
+                "last_name_translations": record.last_name_translations,
+                "role_id": role_map.get(record.role),
+                "partner_id": partner_map.get(record.partner),
+                "location_id": location_id,
+                "gender": record.gender if GENDER_COL else None,
+                "email": record.email,
+                "password": record.password,
+                "locale": record.locale,
+                "extra_data": record.extra_data or None,
+            }
+            previous = records.get(participant_id)
+            if previous is not None:
+                values = {
+                    key: value if value is not None or key in columns else previous[key]
+                    for key, value in values.items()
+                }
+            records[participant_id] = values
+
+            if phone_columns:
+                phones[participant_id] = record.phones
+            samples.setdefault(participant_id, set()).update(record.samples)
+
+            if record.supervisor_id is not None:
+                supervisors[participant_id] = record.supervisor_id
+
+            processed_records += 1
+
+        _write_participants(records, participant_map, columns)
+        if phones:
+            _write_phones(phones, participant_map)
+        _write_samples(samples, participant_map, sample_map)
+        db.session.commit()
+
+        report_progress()
+
     # second pass - resolve missing supervisor references
-    for participant_id, supervisor_id in unresolved_supervisors:
+    references = {}
+    for participant_id, supervisor_id in supervisors.items():
         try:
-            participant_id = str(int(participant_id))
-            supervisor_id = str(int(supervisor_id))
+            references[participant_id] = str(int(supervisor_id))
         except (TypeError, ValueError):
             continue
 
-        participant = services.participants.find(participant_id=participant_id, participant_set=participant_set).first()
-        supervisor = services.participants.find(
-            participant_id=supervisor_id,
-            participant_set=participant_set,
-        ).first()
-
-        if supervisor is None:
-            participant.delete()
-            errors.add((participant_id, _("Supervisor with ID %(id)s not found", id=supervisor_id)))
-            processed_records -= 1
-            error_records += 1
-            error_log.append(
-                {
-                    "label": "ERROR",
-                    "message": _(
-                        "Supervisor ID %(sup_id)s specified for " "participant ID %(part_id)s not found",
-                        sup_id=supervisor_id,
-                        part_id=participant_id,
-                    ),
-                }
-            )
-            task.update_state(
-                state="PROGRESS",
-                meta={
-                    "total_records": total_records,
-                    "error_records": error_records,
-                    "processed_records": processed_records,
-                    "warning_records": warning_records,
-                    "error_log": error_log,
-                },
-            )
-        else:
-            participant.supervisor_id = supervisor.id
-            participant.save()
+    supervisor_map = _participant_map(participant_set, set(references.values())) if references else {}
+    unresolved = sorted(
+        (participant_id, supervisor_id)
+        for participant_id, supervisor_id in references.items()
+        if supervisor_id not in supervisor_map
+    )
+    for participant_id, supervisor_id in unresolved:
+        errors.add((participant_id, _("Supervisor with ID %(id)s not found", id=supervisor_id)))
+        processed_records -= 1
+        error_records += 1
+        error_log.append(
+            {
+                "label": "ERROR",
+                "message": _(
+                    "Supervisor ID %(sup_id)s specified for " "participant ID %(part_id)s not found",
+                    sup_id=supervisor_id,
+                    part_id=participant_id,
+                ),
+            }
+        )
+
+    table = Participant.__table__
+    resolved = [
+        (participant_map[participant_id], supervisor_map[supervisor_id])
+        for participant_id, supervisor_id in references.items()
+        if supervisor_id in supervisor_map
+    ]
+    if resolved:
+        pairs = sa.values(sa.column("id", sa.Integer), sa.column("supervisor_id", sa.Integer), name="pairs").data(
+            resolved
+        )
+        db.session.execute(table.update().where(table.c.id == pairs.c.id).values(supervisor_id=pairs.c.supervisor_id))
+
+    # participants whose supervisor is not found are not imported
+    if unresolved:
+        participant_pks = [participant_map[participant_id] for participant_id, _supervisor_id in unresolved]
+        db.session.execute(table.delete().where(table.c.id.in_(participant_pks)))
+
+    db.session.commit()
+
+    if unresolved:
+        report_progress()
 
     return dataframe.shape[0], errors, warnings
 
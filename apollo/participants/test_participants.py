@@ -0,0 +1,102 @@
+from unittest import mock
+
+import pandas as pd
+import pytest
+
+from apollo import models
+from apollo.core import db
+from apollo.participants import tasks
+
+
+def _create_participant_set(name):
+    """Creates a participant set with a location and a participant."""
+    deployment = models.Deployment(name=name, hostnames=[name])
+    location_set = models.LocationSet(name=name, deployment=deployment)
+    location_type = models.LocationType(name_translations={"en": "Station"}, location_set=location_set)
+    location = models.Location(
+        name_translations={"en": "Station 1"}, code="11", location_set=location_set, location_type=location_type
+    )
+    participant_set = models.ParticipantSet(name=name, deployment=deployment, location_set=location_set)
+    participant = models.Participant(
+        participant_id="1",
+        full_name_translations={"en": "Ann"},
+        email="ann@example.com",
+        gender="F",
+        location=location,
+        participant_set=participant_set,
+    )
+    participant.phone_contacts.append(models.PhoneContact(number="0800"))
+    db.session.add_all([location, participant])
+    db.session.commit()
+
+    return participant_set, participant, location
+
+
+def _participants(participant_set):
+    """Returns the participants of a participant set by their ID."""
+    return {
+        participant.participant_id: participant
+        for participant in models.Participant.query.filter_by(participant_set_id=participant_set.id)
+    }
+
+
+@pytest.mark.usefixtures("db")
+def test_participant_import():
+    """Tests that imported participants are updated or inserted."""
+    participant_set, participant, location = _create_participant_set("participants")
+    data_frame = pd.DataFrame(
+        {
+            "ID": ["1", "2", "3"],
+            "Name": ["Anne", "Bob", "Carl"],
+            "Role": ["Observer", "Observer", "Supervisor"],
+            "Location": ["11", "11", "11"],
+            "Phone 1": ["0801-234", "0802", "0803"],
+            "Phone 2": ["0801 234", "", ""],
+            "Supervisor": ["", "1", "9"],
+        }
+    )
+    header_map = {
+        "id": "ID",
+        "full_name_en": "Name",
+        "role": "Role",
+        "location": "Location",
+        "phone": ["Phone 1", "Phone 2"],
+        "supervisor": "Supervisor",
+    }
+    task = mock.Mock()
+
+    count, errors, warnings = tasks.update_participants(data_frame, header_map, participant_set, task)
+    db.session.expire_all()
+
+    assert count == 3
+    participants = _participants(participant_set)
+    assert sorted(participants) == ["1", "2"]
+
+    # the existing participant is updated in place, and keeps the values of
+    # the columns that are not mapped
+    updated = participants["1"]
+    assert updated.id == participant.id
+    assert updated.full_name_translations == {"en": "Anne"}
+    assert updated.role.name == "Observer"
+    assert updated.email == "ann@example.com"
+    assert updated.gender.code == "F"
+    assert updated.location_id == location.id
+
+    # the same number in another format is only added once
+    assert [phone.number for phone in updated.phone_contacts] == ["0801 234"]
+
+    inserted = participants["2"]
+    assert inserted.full_name_translations == {"en": "Bob"}
+    assert inserted.location_id == location.id
+    assert inserted.supervisor_id == participant.id
+    assert [phone.number for phone in inserted.phone_contacts] == ["0802"]
+
+    # participants whose supervisor is not found are not imported
+    assert errors == {("3", "Supervisor with ID 9 not found")}
+    assert warnings == set()
+    meta = task.update_state.call_args.kwargs["meta"]
+    assert meta["error_log"][-1] == {
+        "label": "ERROR",
+        "message": "Supervisor ID 9 specified for participant ID 3 not found",
+    }
+    assert (meta["processed_records"], meta["error_records"]) == (2, 1)
@@ -28,6 +28,7 @@ from sqlalchemy.orm import joinedload
 
 from apollo import models, services, utils
 from apollo.core import db, docs, uploads
+from apollo.dal.pagination import paginate
 from apollo.frontend import helpers, permissions, route
 from apollo.frontend.forms import generate_participant_edit_form
 from apollo.messaging.tasks import send_messages
@@ -298,6 +299,7 @@ def participant_list(participant_set_id=0, view=None):
     # using .copy() returns a mutable version of it.
     args = request.args.to_dict(flat=False)
     page = int(args.pop("page", [1])[0])
+    cursor = args.pop("cursor", [None])[0]
     if participant_set_id:
         args["participant_set_id"] = participant_set_id
 
@@ -332,7 +334,9 @@ def participant_list(participant_set_id=0, view=None):
         "participant_set": participant_set,
         "participant_set_id": participant_set.id,
         "location_types": helpers.displayable_location_types(is_administrative=True, location_set_id=location_set_id),
-        "participants": queryset_filterset.qs.paginate(page=page, per_page=current_app.config.get("PAGE_SIZE")),
+        "participants": paginate(
+            queryset_filterset.qs, page=page, per_page=current_app.config.get("PAGE_SIZE"), cursor=cursor
+        ),
     }
 
     if view:
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Benchmark for the process analysis statistics.
+
+Times the per-location statistics of a synthetic checklist with every
+analysis type over a large number of locations. Run it with:
+
+    python -m apollo.process_analysis.benchmark --fields 80 --locations 3000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from apollo.process_analysis.common import generate_field_stats
+
+ANALYSIS_TYPES = ("mean", "histogram", "count", "bucket", "multiselect")
+
+
+def make_fields(num_fields):
+    """Returns form field definitions cycling through the analysis types."""
+    fields = []
+    for index in range(num_fields):
+        analysis_type = ANALYSIS_TYPES[index % len(ANALYSIS_TYPES)]
+        field = {"tag": f"F{index}", "type": "integer", "analysis_type": analysis_type, "null_value": 99}
+        if analysis_type in ("histogram", "multiselect"):
+            field["options"] = {f"Option {option}": option for option in range(1, 6)}
+        if analysis_type == "multiselect":
+            field.update(type="multiselect", analysis_type="histogram", null_value=None)
+        if analysis_type == "bucket":
+            field["expected"] = 5
+        fields.append(field)
+
+    return fields
+
+
+def make_dataframe(fields, num_locations, rows_per_location, seed=0):
+    """Returns a submission data frame with some missing values."""
+    rng = np.random.default_rng(seed)
+    num_rows = num_locations * rows_per_location
+    data = {"LGA": np.repeat([f"LGA {index:05d}" for index in range(num_locations)], rows_per_location)}
+
+    for field in fields:
+        if field["type"] == "multiselect":
+            values = [list(rng.choice(5, size=rng.integers(0, 3), replace=False) + 1) for _ in range(num_rows)]
+            data[field["tag"]] = pd.Series(values, dtype=object)
+        else:
+            values = rng.integers(1, 10, size=num_rows).astype(float)
+            values[rng.random(num_rows) < 0.1] = np.nan
+            values[rng.random(num_rows) < 0.05] = 99
+            data[field["tag"]] = values
+
+    return pd.DataFrame(data)
+
+
+def run(num_fields, num_locations, rows_per_location, repeat):
+    """Returns the best time, in seconds, to compute all the statistics."""
+    fields = make_fields(num_fields)
+    data_frame = make_dataframe(fields, num_locations, rows_per_location)
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data_group = data_frame.groupby("LGA")
+        for field in fields:
+            generate_field_stats(field, data_frame)
+            generate_field_stats(field, data_group)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def main():
+    """Runs the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fields", type=int, default=80)
+    parser.add_argument("--locations", type=int, default=3000)
+    parser.add_argument("--rows-per-location", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    elapsed = run(args.fields, args.locations, args.rows_per_location, args.repeat)
+    print(f"{args.fields} fields over {args.locations} locations: {elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
-from collections import defaultdict
-from functools import partial
 from itertools import chain
 from operator import itemgetter
 import numpy as np
 import pandas as pd
 
+# The statistics below are computed for every group of a grouped data set
+# at once: each row is numbered with its group and the counts for all the
+# groups are taken with a single `np.bincount` pass per statistic, instead
+# of selecting and aggregating every group separately.
+
 
 def _replace_empty_lists(value):
     if isinstance(value, list) and len(value) == 0:
@@ -14,10 +17,6 @@ def _replace_empty_lists(value):
     return value
 
 
-def _fake_cmp(target, value):
-    return ((value > target) - (value < target))
-
-
 def percent_of(a, b):
     '''Returns the percentage of b that is a'''
     if np.isnan(a) or b == 0:
@@ -25,6 +24,112 @@ def percent_of(a, b):
     return float(100 * float(a) / b)
 
 
+def _percents(a, b):
+    '''Element-wise version of `percent_of` for arrays.'''
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(np.isnan(a) | (b == 0), 0.0, 100 * a / b)
+
+
+def _object_array(values):
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _grouped_column(dataset, tag):
+    '''Returns the values of a column, the group number of every value and
+    the group names. An ungrouped data set is treated as a single group
+    named None, and rows that do not belong to any group are left out.'''
+    if hasattr(dataset, 'groups'):
+        names = dataset.size().index.tolist()
+        codes = dataset.ngroup().to_numpy(dtype=float, na_value=np.nan)
+        selected = ~np.isnan(codes)
+        column = dataset.obj[tag].to_numpy()[selected]
+
+        return column, codes[selected].astype(np.intp), names
+
+    column = dataset[tag].to_numpy()
+    return column, np.zeros(len(column), dtype=np.intp), [None]
+
+
+def _count(codes, mask, size):
+    return np.bincount(codes[mask], minlength=size)
+
+
+def _availability_stats(column, codes, size, null_value):
+    '''Returns the reporting statistics of every group, along with the masks
+    of the reported and available values.'''
+    reported_mask = pd.notna(column)
+    if null_value is None:
+        available_mask = reported_mask
+    else:
+        available_mask = reported_mask & (column != null_value)
+
+    total = np.bincount(codes, minlength=size)
+    reported = _count(codes, reported_mask, size)
+    available = _count(codes, available_mask, size)
+    not_available = reported - available
+    missing = total - reported
+
+    stats = {
+        'total': total,
+        'reported': reported,
+        'missing': missing,
+        'available': available,
+        'not_available': not_available,
+        'percent_reported': _percents(reported, total),
+        'percent_missing': _percents(missing, total),
+        'percent_available': _percents(available, reported),
+        'percent_not_available': _percents(not_available, reported),
+    }
+
+    return stats, reported_mask, available_mask
+
+
+def _histograms(counts, denominators, options, positions):
+    '''Returns the histogram of every group from a matrix of the number of
+    occurrences of each option (in the columns) for each group (in the
+    rows).'''
+    percents = _percents(counts, np.asarray(denominators)[:, None]).tolist()
+    counts = counts.tolist()
+
+    return [
+        {
+            opt: (group_counts[positions[opt]], group_percents[positions[opt]])
+            for opt in options
+        }
+        for group_counts, group_percents in zip(counts, percents)
+    ]
+
+
+def _option_counts(codes, values, size, options):
+    '''Returns the number of occurrences of each option for each group.'''
+    counts = np.zeros((size, len(options)), dtype=np.int64)
+    for position, opt in enumerate(options):
+        counts[:, position] = _count(codes, values == opt, size)
+
+    return counts
+
+
+def _select(stats, keys, index):
+    return {key: stats[key][index].item() for key in keys}
+
+
+def _location_stats(names, stats, keys, **extra):
+    '''Returns the per-group statistics, keyed by the group names.'''
+    columns = {key: stats[key].tolist() for key in keys}
+    location_stats = {}
+    for index, group_name in enumerate(names):
+        location_stats[group_name] = {
+            key: columns[key][index] for key in keys}
+        for key, values in extra.items():
+            location_stats[group_name][key] = values[index]
+
+    return location_stats
+
+
 def generate_mean_stats(tag, dataset, null_value=None):
     '''Returns statistics (mean, standard deviation, number/percentage
     of actual reports, number/percentage of missing reports) for a
@@ -40,87 +145,30 @@ def generate_mean_stats(tag, dataset, null_value=None):
     group, the result will be a nested dictionary
     '''
     field_stats = {'type': 'mean'}
+    keys = [
+        'reported', 'missing', 'available', 'not_available',
+        'percent_reported', 'percent_missing', 'percent_available',
+        'percent_not_available'
+    ]
 
-    if hasattr(dataset, 'groups'):
-        # generate the per-group statistics
-        # the transpose and to_dict ensures that the output looks similar to
-        # ['item']['mean'] for every item in the group
-        # location_stats = dataset[tag].agg({
-        #     'mean': np.mean,
-        #     'std': lambda x: np.std(x)
-        # }).replace(np.nan, 0).transpose().to_dict()
-        location_stats = {}
-
-        for group_name in dataset.groups:
-            temp = dataset[tag].get_group(group_name)
-            total = temp.size
-            reported = temp.count()
-            if null_value is None:
-                available = reported
-                not_available = 0
-                mean = temp.mean()
-            else:
-                not_available = temp.where(temp == null_value).count()
-                available = reported - not_available
-                mean = temp[temp != null_value].mean()
-            missing = total - reported
-            percent_reported = percent_of(reported, total)
-            percent_available = percent_of(available, reported)
-            percent_not_available = percent_of(not_available, reported)
-            percent_missing = percent_of(missing, total)
-
-            location_stats[group_name] = {}
-            location_stats[group_name]['reported'] = reported
-            location_stats[group_name]['missing'] = missing
-            location_stats[group_name]['available'] = available
-            location_stats[group_name]['not_available'] = not_available
-            location_stats[group_name]['percent_reported'] = \
-                percent_reported
-            location_stats[group_name]['percent_missing'] = \
-                percent_missing
-            location_stats[group_name]['percent_available'] = \
-                percent_available
-            location_stats[group_name]['percent_not_available'] = \
-                percent_not_available
-            location_stats[group_name]['mean'] = \
-                mean if not pd.isnull(mean) else 0.0
-
-        field_stats['locations'] = location_stats
-    else:
-        # generate the statistics over the entire data set
-        # this means there will be one set of statistics for the entire
-        # data set, as opposed to above, where each group gets its stats
-        # generated separately
-        temp = dataset[tag]
-        reported = temp.count()
-        if null_value is None:
-            not_available = 0
-            mean = temp.mean()
-        else:
-            not_available = temp.where(temp == null_value).count()
-            mean = temp[temp != null_value].mean()
-        total = temp.size
-        available = reported - not_available
-        missing = total - reported
-        percent_reported = percent_of(reported, total)
-        percent_missing = percent_of(missing, total)
-        percent_available = percent_of(available, reported)
-        percent_not_available = percent_of(not_available, reported)
-
-        stats = {
-            'reported': reported, 'missing': missing,
-            'available': available, 'not_available': not_available,
-            'percent_reported': percent_reported,
-            'percent_missing': percent_missing,
-            'percent_available': percent_available,
-            'percent_not_available': percent_not_available,
-            'mean': mean
-        }
+    column, codes, names = _grouped_column(dataset, tag)
+    size = len(names)
+    stats, _, available_mask = _availability_stats(
+        column, codes, size, null_value)
 
-        if np.isnan(stats['mean']):
-            stats['mean'] = 0
+    sums = np.bincount(
+        codes[available_mask],
+        weights=column[available_mask].astype(float), minlength=size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / stats['available']
 
-        field_stats.update(stats)
+    if hasattr(dataset, 'groups'):
+        field_stats['locations'] = _location_stats(
+            names, stats, keys,
+            mean=np.nan_to_num(means, nan=0.0).tolist())
+    else:
+        field_stats.update(_select(stats, keys, 0))
+        field_stats['mean'] = 0 if np.isnan(means[0]) else means[0].item()
 
     return field_stats
 
@@ -141,19 +189,14 @@ def generate_histogram_stats(tag, dataset, options=[], labels=None,
     - a dictionary (or nested dictionary, if data set is grouped) with the
     above statistics, as well as the labels for each of the options. Both the
     histogram and the labels are generated as lists, so they are ordered.'''
+    column, codes, names = _grouped_column(dataset, tag)
+    size = len(names)
+    stats, reported_mask, available_mask = _availability_stats(
+        column, codes, size, null_value)
 
     options_generated = set(options)
-    if len(options_generated) == 0:
-        if hasattr(dataset, 'groups'):
-            dataset_slice = pd.concat([subset[tag] for _, subset in dataset])
-        else:
-            dataset_slice = dataset[tag]
-    else:
-        if hasattr(dataset, 'groups'):
-            dataset_slice = pd.concat([subset[tag] for _, subset in dataset])
-        else:
-            dataset_slice = dataset[tag]
-    options_generated.update(dataset_slice.dropna().unique().astype(int))
+    options_generated.update(
+        np.unique(column[reported_mask].astype(int)).tolist())
     option_labels = sorted(options_generated)
 
     field_stats = {'type': 'histogram', 'labels': labels}
@@ -164,97 +207,41 @@ def generate_histogram_stats(tag, dataset, options=[], labels=None,
     if null_value in options_generated:
         options_generated.remove(null_value)
 
+    # count every available value with the position of its option
+    sorted_options = np.array(sorted(options_generated), dtype=np.int64)
+    positions = {opt: position for position, opt in enumerate(
+        sorted(options_generated))}
+    values = column[available_mask].astype(int)
+    value_codes = codes[available_mask]
+    if len(sorted_options):
+        indexes = np.searchsorted(sorted_options, values)
+        indexes = np.minimum(indexes, len(sorted_options) - 1)
+        known = sorted_options[indexes] == values
+    else:
+        indexes = np.zeros(len(values), dtype=np.intp)
+        known = np.zeros(len(values), dtype=bool)
+    counts = np.bincount(
+        value_codes[known] * len(sorted_options) + indexes[known],
+        minlength=size * len(sorted_options),
+    ).reshape(size, len(sorted_options))
+
+    denominators = stats['reported'] if null_value is None \
+        else stats['available']
+    histograms = _histograms(
+        counts, denominators, options_generated, positions)
+
+    keys = [
+        'missing', 'reported', 'available', 'not_available', 'total',
+        'percent_reported', 'percent_missing', 'percent_available',
+        'percent_not_available'
+    ]
     if hasattr(dataset, 'groups'):
-        # the data is grouped, so per-group statistics will be generated
-        location_stats = {}
-
-        for group_name in dataset.groups:
-            temp = dataset.get_group(group_name).get(tag)
-
-            reported = temp.count()
-            if null_value is None:
-                not_available = 0
-            else:
-                not_available = temp.where(temp == null_value).count()
-            available = reported - not_available
-            total = temp.size
-            missing = total - reported
-            percent_reported = percent_of(reported, total)
-            percent_available = percent_of(available, reported)
-            percent_not_available = percent_of(not_available, reported)
-            percent_missing = percent_of(missing, total)
-
-            location_stats[group_name] = {}
-            location_stats[group_name]['missing'] = missing
-            location_stats[group_name]['reported'] = reported
-            location_stats[group_name]['available'] = available
-            location_stats[group_name]['not_available'] = not_available
-            location_stats[group_name]['total'] = reported + missing
-            location_stats[group_name]['percent_reported'] = percent_reported
-            location_stats[group_name]['percent_missing'] = percent_missing
-            location_stats[group_name]['percent_available'] = percent_available
-            location_stats[group_name]['percent_not_available'] = \
-                percent_not_available
-
-            subset = temp if null_value is None else temp[temp != null_value]
-            value_counts = subset.dropna().astype(int).value_counts().to_dict()
-
-            histogram = defaultdict(lambda: (0, 0.0))
-            denominator = reported if null_value is None else available
-            histogram = {
-                opt: (
-                    value_counts.get(opt, 0),
-                    percent_of(value_counts.get(opt, 0), denominator)
-                )
-                for opt in options_generated
-            }
-
-            location_stats[group_name]['histogram'] = histogram
-
-        field_stats['locations'] = location_stats
+        field_stats['locations'] = _location_stats(
+            names, stats, keys, histogram=histograms)
     else:
-        # ungrouped data, statistics for the entire data set will be generated
-        temp = dataset[tag]
-        subset = temp if null_value is None else temp[temp != null_value]
-        reported = temp.count()
-        if null_value is None:
-            not_available = 0
-        else:
-            not_available = temp.where(temp == null_value).count()
-
-        available = reported - not_available
-        total = temp.size
-        missing = total - reported
-        percent_reported = percent_of(reported, total)
-        percent_missing = percent_of(missing, total)
-        percent_available = percent_of(available, reported)
-        percent_not_available = percent_of(not_available, reported)
-
-        value_counts = subset.dropna().astype(
-            int).value_counts().to_dict()
-        histogram = defaultdict(lambda: (0, 0.0))
-        denominator = reported if null_value is None else available
-        histogram = {
-            opt: (
-                value_counts.get(opt, 0),
-                percent_of(value_counts.get(opt, 0), denominator)
-            )
-            for opt in options_generated
-        }
-
-        stats = {
-            'histogram': histogram, 'reported': reported,
-            'missing': missing, 'percent_reported': percent_reported,
-            'percent_missing': percent_missing,
-            'percent_available': percent_available,
-            'percent_not_available': percent_not_available,
-            'total': total, 'available': available,
-            'not_available': not_available,
-        }
-
-        field_stats.update(stats)
+        field_stats.update(_select(stats, keys, 0))
+        field_stats['histogram'] = histograms[0]
 
-    option_labels = sorted(options_generated)
     field_stats.update(meta=descriptors)
 
     return field_stats
@@ -276,65 +263,32 @@ def generate_multiselect_histogram_stats(tag, dataset, options, labels=None):
     of the relevant statistics.'''
     field_stats = {'type': 'histogram', 'labels': labels}
 
+    column, codes, names = _grouped_column(dataset, tag)
+    size = len(names)
+    column = _object_array(
+        [_replace_empty_lists(value) for value in column])
+    stats, reported_mask, _ = _availability_stats(
+        column, codes, size, None)
+
+    # every selected option is numbered with the group of its submission
+    reported_values = column[reported_mask]
+    values = _object_array(list(chain(*reported_values)))
+    value_codes = np.repeat(
+        codes[reported_mask],
+        [len(value) for value in reported_values]).astype(np.intp)
+
+    options = list(options)
+    counts = _option_counts(value_codes, values, size, options)
+    positions = {opt: position for position, opt in enumerate(options)}
+    histograms = _histograms(counts, stats['reported'], options, positions)
+
+    keys = ['missing', 'reported', 'percent_reported', 'percent_missing']
     if hasattr(dataset, 'groups'):
-        location_stats = {}
-
-        for group_name in dataset.groups:
-            temp = dataset.get_group(group_name).get(tag).apply(
-                _replace_empty_lists)
-            flattened_data = pd.Series(list(chain(*temp.dropna().values)))
-            reported = temp.count()
-            total = temp.size
-            missing = total - reported
-            percent_missing = percent_of(missing, total)
-            percent_reported = percent_of(reported, total)
-
-            location_stats[group_name] = {}
-            location_stats[group_name]['missing'] = missing
-            location_stats[group_name]['reported'] = reported
-            location_stats[group_name]['percent_reported'] = percent_reported
-            location_stats[group_name]['percent_missing'] = percent_missing
-
-            value_counts = flattened_data.value_counts()
-            histogram = defaultdict(lambda: (0, 0.0))
-            histogram = {
-                opt: (
-                    value_counts.get(opt, 0),
-                    percent_of(value_counts.get(opt, 0), reported)
-                )
-                for opt in options
-            }
-
-            location_stats[group_name]['histogram'] = histogram
-
-        field_stats['locations'] = location_stats
+        field_stats['locations'] = _location_stats(
+            names, stats, keys, histogram=histograms)
     else:
-        column_data = dataset[tag].apply(_replace_empty_lists)
-        flattened_column_data = pd.Series(
-            list(chain(*column_data.dropna().values)))
-        reported = column_data.count()
-        total = column_data.size
-        missing = total - reported
-        percent_reported = percent_of(reported, total)
-        percent_missing = percent_of(missing, total)
-
-        value_counts = flattened_column_data.value_counts()
-        histogram = defaultdict(lambda: (0, 0.0))
-        histogram = {
-            opt: (
-                value_counts.get(opt, 0),
-                percent_of(value_counts.get(opt, 0), reported)
-            )
-            for opt in options
-        }
-
-        stats = {
-            'histogram': histogram, 'reported': reported,
-            'missing': missing, 'percent_reported': percent_reported,
-            'percent_missing': percent_missing
-        }
-
-        field_stats.update(stats)
+        field_stats.update(_select(stats, keys, 0))
+        field_stats['histogram'] = histograms[0]
 
     field_stats.update(meta=list(zip(labels or [], options)))
 
@@ -357,161 +311,57 @@ def generate_count_stats(tag, dataset, null_value=None):
     histogram and the labels are generated as lists, so they are ordered.'''
 
     field_stats = {'type': 'count'}
+    keys = [
+        'missing', 'reported', 'available', 'not_available', 'total',
+        'percent_reported', 'percent_missing', 'percent_available',
+        'percent_not_available'
+    ]
+
+    column, codes, names = _grouped_column(dataset, tag)
+    stats, _, _ = _availability_stats(column, codes, len(names), null_value)
 
     if hasattr(dataset, 'groups'):
-        # the data is grouped, so per-group statistics will be generated
-        location_stats = {}
-
-        for group_name in dataset.groups:
-            subset = dataset.get_group(group_name).get(tag)
-            reported = subset.count()
-            if null_value is None:
-                not_available = 0
-            else:
-                not_available = subset.where(subset == null_value).count()
-            total = subset.size
-            missing = total - reported
-            available = reported - not_available
-
-            percent_reported = percent_of(reported, total)
-            percent_missing = percent_of(missing, total)
-            percent_available = percent_of(available, reported)
-            percent_not_available = percent_of(not_available, reported)
-
-            location_stats[group_name] = {}
-            location_stats[group_name]['missing'] = missing
-            location_stats[group_name]['reported'] = reported
-            location_stats[group_name]['available'] = available
-            location_stats[group_name]['not_available'] = not_available
-            location_stats[group_name]['total'] = total
-            location_stats[group_name]['percent_reported'] = percent_reported
-            location_stats[group_name]['percent_missing'] = percent_missing
-            location_stats[group_name]['percent_available'] = percent_available
-            location_stats[group_name]['percent_not_available'] = \
-                percent_not_available
-
-        field_stats['locations'] = location_stats
+        field_stats['locations'] = _location_stats(names, stats, keys)
     else:
-        # ungrouped data, statistics for the entire data set will be generated
-        subset = dataset[tag]
-        reported = subset.count()
-        if null_value is None:
-            not_available = 0
-        else:
-            not_available = subset.where(subset == null_value).count()
-        available = reported - not_available
-        total = subset.size
-        missing = total - reported
-
-        percent_reported = percent_of(reported, total)
-        percent_missing = percent_of(missing, total)
-        percent_available = percent_of(available, reported)
-        percent_not_available = percent_of(not_available, reported)
-
-        stats = {
-            'reported': reported,
-            'missing': missing,
-            'available': available,
-            'not_available': not_available,
-            'percent_reported': percent_reported,
-            'percent_missing': percent_missing,
-            'percent_available': percent_available,
-            'percent_not_available': percent_not_available,
-            'total': total,
-        }
-
-        field_stats.update(stats)
+        field_stats.update(_select(stats, keys, 0))
 
     return field_stats
 
 
 def generate_bucket_stats(tag, dataset, target, null_value=None):
-    _cmp = partial(_fake_cmp, target)
     field_stats = {'type': 'bucket', 'target': target}
     options = [-1, 0, 1]
 
+    column, codes, names = _grouped_column(dataset, tag)
+    size = len(names)
+    stats, _, available_mask = _availability_stats(
+        column, codes, size, null_value)
+
+    # the values are compared with the target as -1 (below), 0 (on target)
+    # or 1 (above)
+    comparisons = np.sign(
+        column[available_mask].astype(float) - target).astype(np.intp)
+    counts = np.bincount(
+        codes[available_mask] * 3 + comparisons + 1,
+        minlength=size * 3).reshape(size, 3)
+    positions = {opt: opt + 1 for opt in options}
+    histograms = _histograms(counts, stats['reported'], options, positions)
+
     if hasattr(dataset, 'groups'):
-        location_stats = {}
-
-        for group_name in dataset.groups:
-            column_data = dataset.get_group(group_name)[tag]
-            if null_value is None:
-                transformed_data = column_data.dropna().apply(_cmp)
-                not_available = 0
-            else:
-                transformed_data = column_data[
-                    column_data != null_value].dropna().apply(_cmp)
-                not_available = column_data.where(
-                    column_data == null_value).count()
-            value_counts = transformed_data.value_counts().to_dict()
-            reported = column_data.count()
-            total = column_data.size
-            missing = total - reported
-            available = reported - not_available
-            percent_reported = percent_of(reported, total)
-            percent_missing = percent_of(missing, total)
-            percent_available = percent_of(available, reported)
-            percent_not_available = percent_of(not_available, reported)
-            histogram = defaultdict(lambda: (0, 0.0))
-            histogram = {
-                opt: (
-                    value_counts.get(opt, 0),
-                    percent_of(value_counts.get(opt, 0), reported)
-                )
-                for opt in options
-            }
-
-            location_stats[group_name] = {}
-            location_stats[group_name]['missing'] = missing
-            location_stats[group_name]['reported'] = reported
-            location_stats[group_name]['available'] = available
-            location_stats[group_name]['not_available'] = not_available
-            location_stats[group_name]['total'] = total
-            location_stats[group_name]['percent_reported'] = percent_reported
-            location_stats[group_name]['percent_available'] = percent_available
-            location_stats[group_name]['percent_not_available'] = \
-                percent_not_available
-            location_stats[group_name]['percent_missing'] = percent_missing
-            location_stats[group_name]['histogram'] = histogram
-
-        field_stats['locations'] = location_stats
+        keys = [
+            'missing', 'reported', 'available', 'not_available', 'total',
+            'percent_reported', 'percent_available', 'percent_not_available',
+            'percent_missing'
+        ]
+        field_stats['locations'] = _location_stats(
+            names, stats, keys, histogram=histograms)
     else:
-        column_data = dataset[tag]
-        if null_value is None:
-            transformed_data = column_data.dropna().apply(_cmp)
-            not_available = 0
-        else:
-            transformed_data = column_data[
-                column_data != null_value].dropna().apply(_cmp)
-            not_available = column_data.where(
-                column_data == null_value).count()
-        value_counts = transformed_data.value_counts().to_dict()
-        reported = column_data.count()
-        available = reported - not_available
-        total = column_data.size
-        missing = total - reported
-        percent_reported = percent_of(reported, total)
-        percent_missing = percent_of(missing, total)
-        percent_available = percent_of(available, reported)
-        percent_not_available = percent_of(not_available, reported)
-        histogram = defaultdict(lambda: (0, 0.0))
-        histogram = {
-            opt: (
-                value_counts.get(opt, 0),
-                percent_of(value_counts.get(opt, 0), reported)
-            )
-            for opt in options
-        }
-
-        stats = {
-            'histogram': histogram, 'reported': reported,
-            'missing': missing, 'percent_reported': percent_reported,
-            'percent_missing': percent_missing,
-            'percent_available': percent_available,
-            'percent_not_available': percent_not_available,
-        }
-
-        field_stats.update(stats)
+        keys = [
+            'reported', 'missing', 'percent_reported', 'percent_missing',
+            'percent_available', 'percent_not_available'
+        ]
+        field_stats.update(_select(stats, keys, 0))
+        field_stats['histogram'] = histograms[0]
 
     return field_stats
 
@@ -8,6 +8,7 @@ from apollo.process_analysis.common import (
     generate_histogram_stats,
     generate_multiselect_histogram_stats,
     generate_count_stats,
+    generate_bucket_stats,
     generate_field_stats,
 )
 
@@ -635,3 +636,55 @@ class ProcessAnalysisTest(TestCase):
                 "total": 5,
             },
         )
+
+    def test_generate_bucket_stats(self):
+        self.assertDictEqual(
+            generate_bucket_stats("AA", self.df, 2, null_value=4),
+            {
+                "type": "bucket",
+                "target": 2,
+                "reported": 4,
+                "missing": 1,
+                "percent_reported": 80.0,
+                "percent_missing": 20.0,
+                "percent_available": 75.0,
+                "percent_not_available": 25.0,
+                "histogram": {-1: (1, 25.0), 0: (1, 25.0), 1: (1, 25.0)},
+            },
+        )
+        self.assertDictEqual(
+            generate_bucket_stats("AA", self.df.groupby("location"), 2)[
+                "locations"
+            ]["B"],
+            {
+                "missing": 0,
+                "reported": 2,
+                "available": 2,
+                "not_available": 0,
+                "total": 2,
+                "percent_reported": 100.0,
+                "percent_missing": 0.0,
+                "percent_available": 100.0,
+                "percent_not_available": 0.0,
+                "histogram": {-1: (0, 0.0), 0: (1, 50.0), 1: (1, 50.0)},
+            },
+        )
+
+    def test_grouped_stats_skip_ungrouped_rows(self):
+        df = self.df.assign(location=["A", None, "B", "B", None])
+        stats = generate_count_stats("AB", df.groupby("location"))
+
+        self.assertEqual(list(stats["locations"]), ["A", "B"])
+        self.assertEqual(stats["locations"]["B"]["total"], 2)
+
+    def test_multiselect_histogram_counts_unselected_options(self):
+        stats = generate_multiselect_histogram_stats(
+            "AC", self.df.groupby("location"), options=[1, 7]
+        )
+
+        self.assertEqual(
+            stats["locations"]["A"]["histogram"], {1: (1, 100.0), 7: (0, 0.0)}
+        )
+        self.assertEqual(
+            stats["locations"]["B"]["histogram"], {1: (0, 0.0), 7: (0, 0.0)}
+        )
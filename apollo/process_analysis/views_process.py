@@ -17,7 +17,7 @@ from apollo.frontend.helpers import analysis_breadcrumb_data, analysis_navigatio
 from apollo.process_analysis.common import generate_incidents_data, generate_process_data
 from apollo.services import forms, location_types, locations, submissions
 from apollo.submissions import filters
-from apollo.submissions.utils import make_submission_dataframe
+from apollo.submissions.dataframes import get_submission_dataframe
 
 
 def filter_option_value(tag: str, op: str, value: str) -> str:
@@ -90,6 +90,7 @@ def _process_analysis(event, form_id, location_id=None, tag=None):
     display_tag = None
     event = g.event
     filter_on_locations = False
+    submission_type = "O"
 
     location_ids = models.LocationPath.query.with_entities(models.LocationPath.descendant_id).filter_by(
         ancestor_id=location.id, location_set_id=event.location_set_id
@@ -110,10 +111,9 @@ def _process_analysis(event, form_id, location_id=None, tag=None):
 
         query_kwargs = {"event": event, "form": form}
         if not form.untrack_data_conflicts and form.form_type == "CHECKLIST":
-            query_kwargs["submission_type"] = "M"
+            submission_type = "M"
             filter_on_locations = True
-        else:
-            query_kwargs["submission_type"] = "O"
+        query_kwargs["submission_type"] = submission_type
         queryset = submissions.find(**query_kwargs).filter(
             models.Submission.location_id.in_(location_ids), models.Submission.quarantine_status != "A"
         )
@@ -170,7 +170,7 @@ def _process_analysis(event, form_id, location_id=None, tag=None):
 
     # set up template context
     context = {}
-    submission_dataframe = make_submission_dataframe(filter_set.qs, form)
+    submission_dataframe = get_submission_dataframe(filter_set.qs, form, event, submission_type)
     context["dataframe"] = submission_dataframe
     context["breadcrumbs"] = breadcrumbs
     context["display_tag"] = display_tag
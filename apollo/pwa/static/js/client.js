@@ -35,6 +35,17 @@ class APIClient {
     }).then(this._getResult);
   };
 
+  submitBatch = function (formData, csrf_token) {
+    return fetch(this.endpoints.submitBatch, {
+      body: formData,
+      credentials: 'same-origin',
+      headers: {
+        'X-CSRF-TOKEN': csrf_token
+      },
+      method: 'POST'
+    }).then(this._getResult);
+  };
+
   getForms = function () {
     return fetch(this.endpoints.list, {
       credentials: 'same-origin',
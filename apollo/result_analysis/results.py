@@ -11,9 +11,9 @@ from apollo import models
 from apollo.formsframework.models import Form
 from apollo.frontend.helpers import analysis_breadcrumb_data
 from apollo.services import forms, location_types, locations, submissions
+from apollo.submissions.dataframes import get_submission_dataframe
 from apollo.submissions.filters import make_submission_analysis_filter
 from apollo.submissions.models import FLAG_STATUSES
-from apollo.submissions.utils import make_submission_dataframe
 
 
 def _point_estimate(dataframe, numerator, denominator):
@@ -106,7 +106,7 @@ def voting_results(form_id, location_id=None):
         not_(models.Submission.quarantine_status.in_(["A", "R"])),
     )
     filter_set = filter_class(queryset, request.args)
-    dataset = make_submission_dataframe(filter_set.qs, form)
+    dataset = get_submission_dataframe(filter_set.qs, form, event, query_kwargs["submission_type"])
 
     for result_field in result_fields:
         null_value_orig = result_field.get("null_value")
@@ -10,9 +10,10 @@ from apollo import models
 from apollo.formsframework.models import Form
 from apollo.frontend.helpers import analysis_breadcrumb_data, analysis_navigation_data
 from apollo.services import forms, location_types, locations, submissions
+from apollo.submissions.dataframes import get_turnout_dataframe
 from apollo.submissions.filters import make_submission_analysis_filter
 from apollo.submissions.models import FLAG_STATUSES
-from apollo.submissions.utils import make_turnout_dataframe, valid_turnout_dataframe
+from apollo.submissions.utils import valid_turnout_dataframe
 
 
 def _point_estimate(dataframe, numerator, denominator):
@@ -107,7 +108,7 @@ def turnout_convergence(form_id, location_id=None):
         models.Submission.location_id.in_(location_ids),
     )
     filter_set = filter_class(queryset, request.args)
-    dataset = make_turnout_dataframe(filter_set.qs, form)
+    dataset = get_turnout_dataframe(filter_set.qs, form, event, query_kwargs["submission_type"])
 
     for turnout_field in turnout_fields:
         null_value_orig = turnout_field.get("null_value")
@@ -41,6 +41,10 @@ except KeyError:
 
 PAGE_SIZE = config("PAGE_SIZE", cast=int, default=25)
 API_PAGE_SIZE = config("API_PAGE_SIZE", cast=int, default=100)
+# list results are counted exactly up to this number, and estimated beyond
+PAGINATION_EXACT_COUNT_LIMIT = config("PAGINATION_EXACT_COUNT_LIMIT", cast=int, default=10000)
+# how long the estimated result counts are cached, in seconds
+PAGINATION_COUNT_CACHE_TIMEOUT = config("PAGINATION_COUNT_CACHE_TIMEOUT", cast=int, default=300)
 
 # default to UTC for prior deployments
 TIMEZONE = config("TIMEZONE", default="UTC")
@@ -138,8 +142,25 @@ elif _gateway_type == _gateway_types["telerivet"]:
     MESSAGING_OUTGOING_GATEWAY["route_id"] = config("MESSAGING_OUTGOING_GATEWAY_ROUTE_ID", default=None)
     MESSAGING_OUTGOING_GATEWAY["priority"] = config("MESSAGING_OUTGOING_GATEWAY_PRIORITY", default=None)
 
+# bulk outbound messages: recipients per gateway request, concurrent
+# requests and messages sent per second (0 for no limit)
+MESSAGING_SEND_BATCH_SIZE = config("MESSAGING_SEND_BATCH_SIZE", cast=int, default=100)
+MESSAGING_SEND_CONCURRENCY = config("MESSAGING_SEND_CONCURRENCY", cast=int, default=4)
+MESSAGING_SEND_RATE = config("MESSAGING_SEND_RATE", cast=float, default=0)
+
 MESSAGING_CC = config("MESSAGING_CC", cast=config.tuple, default=())
 MESSAGING_SECRET = config("MESSAGING_SECRET", default=None)
+# if enabled, the gateway webhooks queue the inbound messages and reply at
+# once, and the messages are processed by the workers
+MESSAGING_QUEUE_INBOUND = config("MESSAGING_QUEUE_INBOUND", cast=config.boolean, default=False)
+# retries of messages without a gateway id or timestamp are ignored within this window
+MESSAGING_DEDUPLICATION_WINDOW = config("MESSAGING_DEDUPLICATION_WINDOW", cast=int, default=300)  # in seconds
+# processing attempts of a queued message before it is marked as failed
+MESSAGING_MAX_ATTEMPTS = config("MESSAGING_MAX_ATTEMPTS", cast=int, default=5)
+# cache the form and participant lookups of the inbound messages in every
+# process, invalidated through Redis pub/sub
+MESSAGING_LOOKUP_CACHE = config("MESSAGING_LOOKUP_CACHE", cast=config.boolean, default=True)
+MESSAGING_LOOKUP_CACHE_TIMEOUT = config("MESSAGING_LOOKUP_CACHE_TIMEOUT", cast=int, default=3600)  # in seconds
 
 BIG_N = config("BIG_N", cast=int, default=0) or inf
 GOOGLE_ANALYTICS_KEY = config("GOOGLE_ANALYTICS_KEY", default=None)
@@ -177,6 +198,12 @@ FACEBOOK_CLIENT_ID = config("FACEBOOK_CLIENT_ID", default="")
 FACEBOOK_CLIENT_SECRET = config("FACEBOOK_CLIENT_SECRET", default="")
 
 MAPBOX_TOKEN = config("MAPBOX_TOKEN", default="")
+# submission map points are clustered below this zoom level
+MAP_CLUSTER_MAX_ZOOM = config("MAP_CLUSTER_MAX_ZOOM", cast=int, default=14)
+# size of the submission map clusters, in pixels
+MAP_CLUSTER_CELL_SIZE = config("MAP_CLUSTER_CELL_SIZE", cast=int, default=60)
+# lifetime of the cached vector tiles, in seconds
+TILE_CACHE_TIMEOUT = config("TILE_CACHE_TIMEOUT", cast=int, default=86400)
 
 API_KEY = config("API_KEY", default="")
 REDIS_URL = f"redis://{REDIS_HOSTNAME}/{REDIS_DATABASE}"
@@ -184,6 +211,19 @@ KEEPALIVE_INTERVAL = 15  # in seconds
 
 TASK_STATUS_TTL = config("TASK_STATUS_TTL", cast=int, default=300)  # in seconds
 
+# analysis data frame cache settings
+DATAFRAME_CACHE_TIMEOUT = config("DATAFRAME_CACHE_TIMEOUT", cast=int, default=86400)  # in seconds
+DATAFRAME_CACHE_SIZE = config("DATAFRAME_CACHE_SIZE", cast=int, default=8)  # data frames per process
+
+# largest number of submissions the PWA can send in a single request
+PWA_SYNC_BATCH_SIZE = config("PWA_SYNC_BATCH_SIZE", cast=int, default=50)
+
+# build the expression indexes of the form fields when forms are saved
+SUBMISSION_DATA_INDEXES = config("SUBMISSION_DATA_INDEXES", cast=config.boolean, default=False)
+
+# number of archive members built or loaded in parallel
+ARCHIVE_WORKERS = config("ARCHIVE_WORKERS", cast=int, default=4)
+
 # attachment settings
 BASE_UPLOAD_PATH = Path(config("DEFAULT_STORAGE_PATH", default=DEFAULT_UPLOAD_PATH))
 IMAGE_UPLOAD_PATH = Path(config("IMAGES_STORAGE_PATH", default=BASE_UPLOAD_PATH.joinpath("images")))
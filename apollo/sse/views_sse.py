@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
-from flask import Blueprint, request, Response, current_app
-from flask_security import login_required, roles_required
+from flask import Blueprint, abort, request, Response, current_app, session
+from flask_security import current_user, login_required
 from gevent import Timeout
 
 from apollo.core import red
@@ -37,11 +37,14 @@ bp = Blueprint('sse', __name__)
 
 @route(bp, '/stream', methods=['GET'])
 @login_required
-@roles_required('admin')
 def stream():
     config = current_app.config
     channel = request.args.get('channel', 'apollo')
 
+    # users other than admins can only follow the tasks they started
+    if channel != session.get('_id') and not current_user.has_role('admin'):
+        abort(403)
+
     def stream_events():
         while True:
             pubsub = red.pubsub()
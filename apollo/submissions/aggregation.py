@@ -11,6 +11,7 @@ import numpy as np
 import pandas as pd
 
 from apollo.submissions.qa.query_builder import get_logical_check_stats
+from apollo.submissions.qa.status import get_qa_status_counts, qa_status_available
 from apollo.submissions.utils import make_submission_dataframe
 
 
@@ -72,10 +73,19 @@ def aggregated_dataframe(queryset, form):
 def _qa_counts(query, form):
     data = []
     if form.quality_checks:
+        if qa_status_available(form):
+            # a single query counts the stored statuses of all the checks
+            counts = get_qa_status_counts(query, form)
+        else:
+            counts = None
+
         for check in form.quality_checks:
             d = {'name': check['name'], 'description': check['description']}
 
-            results = get_logical_check_stats(query, form, check)
+            if counts is not None:
+                results = counts.get(check['name'], {}).items()
+            else:
+                results = get_logical_check_stats(query, form, check)
             for label, count in results:
                 d[label] = count
 
@@ -109,7 +119,7 @@ def aggregate_dataset(query, form, stream=False):
     data_frame = make_submission_dataframe(query, form)
 
     if data_frame.empty:
-        raise StopIteration
+        return
 
     location_type_names = [
         a.location_type.name for a in query.first().location.ancestors()]
@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
 import json
+import logging
 from http import HTTPStatus
 from itertools import chain
 from pathlib import Path
 from uuid import uuid4
 
-from flask import g, jsonify, request
+from flask import current_app, g, jsonify, request
 from flask_apispec import MethodResource, marshal_with, use_kwargs
 from flask_babel import gettext
 from flask_jwt_extended import get_jwt_identity, jwt_required
@@ -32,6 +33,8 @@ from apollo.submissions.models import (
 from apollo.submissions.qa.query_builder import qa_status
 from apollo.utils import current_timestamp
 
+logger = logging.getLogger(__name__)
+
 
 def update_submission_version(submission):
     submission = Submission.query.get(submission.id)
@@ -172,80 +175,118 @@ def checklist_qa_status(uuid):
     return jsonify(response_body)
 
 
-@csrf.exempt
-@jwt_required()
-def submission():
-    try:
-        request_data = json.loads(request.form.get('submission'))
-    except Exception:
-        response_body = {
-            'message': gettext('Invalid data sent'),
-            'status': 'error'
-        }
+def _error(message, **kwargs):
+    response_body = {
+        'message': message,
+        'status': 'error'
+    }
+    response_body.update(kwargs)
 
-        response = jsonify(response_body)
-        response.status_code = HTTPStatus.BAD_REQUEST
-        return response
+    return response_body, HTTPStatus.BAD_REQUEST
 
-    form_id = request_data.get('form')
-    form_serial = request_data.get('serial')
-    payload = request_data.get('data')
-    participant_uuid = get_jwt_identity()
 
-    form = filter_form(form_id)
-    if form is None:
-        response_body = {
-            'message': gettext('Invalid form'),
-            'status': 'error'
-        }
+def _response(response_body, status_code):
+    response = jsonify(response_body)
+    response.status_code = status_code
+    return response
 
-        response = jsonify(response_body)
-        response.status_code = HTTPStatus.BAD_REQUEST
-        return response
+
+def _posting_participant():
+    participant_uuid = get_jwt_identity()
 
     try:
-        participant = Participant.query.filter_by(uuid=participant_uuid).one()
+        return Participant.query.filter_by(uuid=participant_uuid).one()
     except NoResultFound:
-        response_body = {
-            'message': gettext('Invalid participant'),
-            'status': 'error'
-        }
+        return None
 
-        response = jsonify(response_body)
-        response.status_code = HTTPStatus.BAD_REQUEST
-        return response
 
-    participant = filter_participants(form, participant.participant_id)
-    if participant is None:
-        response_body = {
-            'message': gettext('Invalid participant'),
-            'status': 'error'
-        }
+class SubmissionLookup(object):
+    """Lookups shared by the submissions a participant posts at once.
 
-        response = jsonify(response_body)
-        response.status_code = HTTPStatus.BAD_REQUEST
-        return response
+    The current events, and the forms, their schemas and the participant
+    for every form, are looked up once for all the submissions.
+    """
+
+    def __init__(self, participant):
+        """Looks up the current events."""
+        self.participant = participant
+        current_event = getattr(g, 'event', Event.default())
+        self.current_events = Event.overlapping_events(current_event)
+        self.event_ids = [
+            event_id for (event_id,)
+            in self.current_events.with_entities(Event.id)]
+        self._forms = {}
+        self._participants = {}
+        self._schemas = {}
+        self._events = {}
+
+    def form(self, form_id):
+        if not isinstance(form_id, (int, str)):
+            return None
+        if form_id not in self._forms:
+            self._forms[form_id] = filter_form(form_id)
+
+        return self._forms[form_id]
+
+    def form_participant(self, form):
+        if form.id not in self._participants:
+            self._participants[form.id] = filter_participants(
+                form, self.participant.participant_id)
+
+        return self._participants[form.id]
+
+    def schema(self, form):
+        if form.id not in self._schemas:
+            self._schemas[form.id] = form.create_schema()
+
+        return self._schemas[form.id]
+
+    def incident_event(self, form, participant):
+        # the submission event is determined by taking the intersection
+        # of form events, participant events and concurrent events
+        # and taking the last event ordered by descending end date
+        if form.id not in self._events:
+            self._events[form.id] = self.current_events.join(
+                Event.forms).filter(
+                    Event.forms.contains(form),
+                    Event.participant_set_id == participant.participant_set_id
+                ).order_by(Event.end.desc()).first()
+
+        return self._events[form.id]
+
+
+def save_submission(lookup, request_data, files):
+    """Saves a submission posted from the PWA.
+
+    :param lookup: the :class:`SubmissionLookup` of the request
+    :param request_data: the form, serial number and data of the submission
+    :param files: the image uploads of the submission, by tag
+    :returns: the response body and status code for the submission
+    """
+    form_id = request_data.get('form')
+    form_serial = request_data.get('serial')
+    payload = request_data.get('data')
+
+    form = lookup.form(form_id)
+    if form is None:
+        return _error(gettext('Invalid form'))
+
+    participant = lookup.form_participant(form)
+    if participant is None:
+        return _error(gettext('Invalid participant'))
 
     # validate payload
-    schema_class = form.create_schema()
+    schema_class = lookup.schema(form)
     try:
         data = schema_class().load(payload)
     except ValidationError as ex:
         error_fields = sorted(ex.messages.keys())
-        response_body = {
-            'message': gettext('Invalid value(s) for: %(fields)s',
-                               fields=','.join(error_fields)),
-            'status': 'error',
-            'errorFields': error_fields,
-        }
+        return _error(
+            gettext('Invalid value(s) for: %(fields)s',
+                    fields=','.join(error_fields)),
+            errorFields=error_fields)
 
-        response = jsonify(response_body)
-        response.status_code = HTTPStatus.BAD_REQUEST
-        return response
-
-    current_event = getattr(g, 'event', Event.default())
-    current_events = Event.overlapping_events(current_event)
-    event_ids = current_events.with_entities(Event.id)
+    event_ids = lookup.event_ids
 
     if form.form_type == 'CHECKLIST':
         # when searching for the submission, take into cognisance
@@ -267,13 +308,7 @@ def submission():
             Submission.event_id.in_(event_ids)
         ).first()
     else:
-        # the submission event is determined by taking the intersection
-        # of form events, participant events and concurrent events
-        # and taking the last event ordered by descending end date
-        event = current_events.join(Event.forms).filter(
-            Event.forms.contains(form),
-            Event.participant_set_id == participant.participant_set_id
-        ).order_by(Event.end.desc()).first()
+        event = lookup.incident_event(form, participant)
 
         if event is None:
             submission = None
@@ -290,13 +325,7 @@ def submission():
 
     # if submission is None, there's no submission
     if submission is None:
-        response_body = {
-            'message': gettext('Could not update data. Please check your ID'),
-            'status': 'error'
-        }
-        response = jsonify(response_body)
-        response.status_code = HTTPStatus.BAD_REQUEST
-        return response
+        return _error(gettext('Could not update data. Please check your ID'))
 
     data = submission.data.copy() if submission.data else {}
     payload2 = payload.copy()
@@ -322,7 +351,7 @@ def submission():
     attachments = []
     deleted_attachments = []
     collected_uploads = set()
-    for tag, wrapper in request.files.items():
+    for tag, wrapper in files.items():
         if tag not in form.tags:
             continue
         original_field_data = submission.data.get(tag)
@@ -352,7 +381,6 @@ def submission():
     for attachment in deleted_attachments:
         db.session.delete(attachment)
 
-
     if data != payload2:
         data.update(payload2)
         submission.participant_updated = current_timestamp()
@@ -423,7 +451,81 @@ def submission():
         '_id': submission.uuid,
     }
 
-    return jsonify(response_body)
+    return response_body, HTTPStatus.OK
+
+
+@csrf.exempt
+@jwt_required()
+def submission():
+    try:
+        request_data = json.loads(request.form.get('submission'))
+    except Exception:
+        return _response(*_error(gettext('Invalid data sent')))
+
+    participant = _posting_participant()
+    if participant is None:
+        return _response(*_error(gettext('Invalid participant')))
+
+    lookup = SubmissionLookup(participant)
+
+    return _response(*save_submission(lookup, request_data, request.files))
+
+
+@csrf.exempt
+@jwt_required()
+def submission_batch():
+    """Saves the submissions queued by the PWA while it was offline.
+
+    The submissions are posted as a JSON array in the `submissions` field,
+    and their image uploads as `<index>/<tag>` files, where `index` is the
+    position of the submission in the array. Each submission is saved on
+    its own, so one that cannot be saved does not prevent the others from
+    being saved. The response has the result of every submission, in the
+    order they were posted.
+    """
+    try:
+        batch = json.loads(request.form.get('submissions'))
+    except Exception:
+        batch = None
+
+    if not isinstance(batch, list) or not all(
+            isinstance(request_data, dict) for request_data in batch):
+        return _response(*_error(gettext('Invalid data sent')))
+
+    if len(batch) > current_app.config.get('PWA_SYNC_BATCH_SIZE'):
+        return _response(
+            *_error(gettext('Too many submissions sent')))
+
+    participant = _posting_participant()
+    if participant is None:
+        return _response(*_error(gettext('Invalid participant')))
+
+    lookup = SubmissionLookup(participant)
+    files = {}
+    for key, wrapper in request.files.items():
+        index, _, tag = key.partition('/')
+        files.setdefault(index, {})[tag] = wrapper
+
+    results = []
+    for index, request_data in enumerate(batch):
+        try:
+            response_body, status_code = save_submission(
+                lookup, request_data, files.get(str(index), {}))
+        except Exception:
+            logger.exception(
+                'Could not save the submission %d of participant %s',
+                index, participant.participant_id)
+            db.session.rollback()
+            response_body = {
+                'message': gettext('Could not save the data'),
+                'status': 'error'
+            }
+            status_code = HTTPStatus.INTERNAL_SERVER_ERROR
+
+        response_body['statusCode'] = int(status_code)
+        results.append(response_body)
+
+    return jsonify({'status': 'ok', 'results': results})
 
 
 @csrf.exempt
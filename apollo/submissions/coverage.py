@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""Incrementally maintained response rate counters.
+
+The response rate dashboard classifies every counted submission of a form
+into one of the coverage statuses below for each form group. Instead of
+recomputing this classification with several JSONB aggregate queries on
+every dashboard load, the status of each counted submission is stored in
+`Submission.coverage_status` and the number of submissions per status is
+materialized for each ancestor location in the `coverage_counter` table.
+
+The counters are adjusted whenever a submission's completion state changes
+and can be rebuilt from scratch for an event and form with the
+`rebuild_coverage` function (exposed as a CLI command and a Celery task).
+"""
+
+import hashlib
+import json
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB, array, insert
+from sqlalchemy.orm.attributes import set_committed_value
+
+from apollo.core import db
+from apollo.locations.models import Location, LocationPath, LocationType
+from apollo.submissions.models import CoverageCounter, Submission
+
+COMPLETE = "Complete"
+CONFLICT = "Conflict"
+MISSING = "Missing"
+PARTIAL = "Partial"
+OFFLINE = "Offline"
+
+COVERAGE_STATUSES = (COMPLETE, CONFLICT, MISSING, PARTIAL, OFFLINE)
+
+_STATUS_COLUMNS = {
+    COMPLETE: "complete",
+    CONFLICT: "conflict",
+    MISSING: "missing",
+    PARTIAL: "partial",
+    OFFLINE: "offline",
+}
+
+
+def coverage_submission_type(form):
+    """Returns the submission type counted on the dashboard for a form."""
+    if not form.untrack_data_conflicts and form.form_type == "CHECKLIST":
+        return "M"
+    return "O"
+
+
+def is_counted(submission):
+    """Checks if the submission contributes to the coverage counters."""
+    form = submission.form
+    if form.form_type not in ("CHECKLIST", "SURVEY"):
+        return False
+
+    return submission.submission_type == coverage_submission_type(form)
+
+
+def _group_specs(form):
+    form._populate_group_cache()
+    specs = []
+    for group_name in form._group_cache.keys():
+        group_tags = form.get_group_tags(group_name)
+        if form.untrack_data_conflicts:
+            conflict_tags = []
+        else:
+            conflict_tags = form.get_group_tags(group_name, form.CONFLICT_FIELD_TYPES)
+        specs.append((group_name, group_tags, conflict_tags))
+
+    return specs
+
+
+def coverage_signature(form):
+    """Fingerprint of the form attributes that the classification depends on.
+
+    Counters built for a different signature are stale and are neither read
+    nor incrementally updated until they are rebuilt.
+    """
+    payload = json.dumps([form.form_type, form.untrack_data_conflicts, _group_specs(form)])
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+def classify(data, conflicts, unreachable, group_tags, conflict_tags):
+    """Returns the coverage status of a submission for a single group.
+
+    The order of the checks mirrors the filters used by the dashboard queries,
+    so a submission that is both offline and in conflict with all the group
+    fields reported is not counted in any status.
+    """
+    if not group_tags:
+        return MISSING
+
+    data = data or {}
+    conflicts = conflicts or []
+
+    has_all = all(tag in data for tag in group_tags)
+    has_any = any(tag in data for tag in group_tags)
+    in_conflict = any(tag in conflicts for tag in conflict_tags)
+
+    if in_conflict and not unreachable:
+        return CONFLICT
+    if in_conflict and has_all:
+        return None
+    if has_all:
+        return COMPLETE
+    if unreachable:
+        return OFFLINE
+    if has_any:
+        return PARTIAL
+    return MISSING
+
+
+def compute_coverage(submission):
+    """Returns the coverage status of the submission for every form group."""
+    return {
+        group_name: classify(submission.data, submission.conflicts, submission.unreachable, group_tags, conflict_tags)
+        for group_name, group_tags, conflict_tags in _group_specs(submission.form)
+    }
+
+
+def _status_expression(group_tags, conflict_tags):
+    """SQL equivalent of `classify` for a single group."""
+    if not group_tags:
+        return sa.literal(MISSING)
+
+    data = sa.func.coalesce(Submission.data, sa.literal({}, JSONB), type_=JSONB)
+    conflicts = sa.func.coalesce(Submission.conflicts, sa.literal([], JSONB), type_=JSONB)
+
+    has_all = data.has_all(array(group_tags))
+    has_any = data.has_any(array(group_tags))
+    in_conflict = conflicts.has_any(array(conflict_tags)) if conflict_tags else sa.false()
+
+    return sa.case(
+        (sa.and_(in_conflict, Submission.unreachable.is_(False)), CONFLICT),
+        (sa.and_(in_conflict, has_all), sa.null()),
+        (has_all, COMPLETE),
+        (Submission.unreachable.is_(True), OFFLINE),
+        (has_any, PARTIAL),
+        else_=MISSING,
+    )
+
+
+def _counters_current(event_id, form_id, signature):
+    return (
+        sa.select(CoverageCounter.location_id)
+        .where(
+            CoverageCounter.event_id == event_id,
+            CoverageCounter.form_id == form_id,
+            CoverageCounter.signature == signature,
+        )
+        .exists()
+    )
+
+
+def counters_available(event, form):
+    """Checks that up to date counters exist for the event and form."""
+    signature = coverage_signature(form)
+    return db.session.query(_counters_current(event.id, form.id, signature)).scalar()
+
+
+def _swap_coverage_status(submission, coverage_status):
+    """Atomically stores the new statuses and returns the previous ones."""
+    statement = sa.text(
+        "UPDATE submission SET coverage_status = :coverage_status "
+        "FROM (SELECT id, coverage_status FROM submission WHERE id = :id FOR UPDATE) AS previous "
+        "WHERE submission.id = previous.id RETURNING previous.coverage_status"
+    ).bindparams(sa.bindparam("coverage_status", type_=JSONB))
+
+    previous = db.session.execute(statement, {"id": submission.id, "coverage_status": coverage_status}).scalar()
+    set_committed_value(submission, "coverage_status", coverage_status)
+
+    return previous or {}
+
+
+def update_coverage(submission):
+    """Adjusts the coverage counters after the state of a submission changed.
+
+    The new statuses are compared with the ones that were last counted for
+    the submission and only the difference is applied to the counters of the
+    submission location and its ancestors. The statements run in the current
+    transaction, so they are committed together with the submission.
+    """
+    if submission.id is None or not is_counted(submission):
+        return
+
+    form = submission.form
+    coverage_status = compute_coverage(submission)
+    previous_status = _swap_coverage_status(submission, coverage_status)
+
+    signature = coverage_signature(form)
+    columns = list(_STATUS_COLUMNS.values())
+
+    for group_name, status in coverage_status.items():
+        previous = previous_status.get(group_name)
+        if previous == status:
+            continue
+
+        deltas = dict.fromkeys(columns, 0)
+        if previous in _STATUS_COLUMNS:
+            deltas[_STATUS_COLUMNS[previous]] -= 1
+        if status in _STATUS_COLUMNS:
+            deltas[_STATUS_COLUMNS[status]] += 1
+
+        source = (
+            sa.select(
+                sa.literal(submission.event_id),
+                sa.literal(form.id),
+                sa.literal(group_name),
+                LocationPath.ancestor_id,
+                Location.location_type_id,
+                sa.literal(signature),
+                *[sa.literal(deltas[column]) for column in columns],
+            )
+            .join(Location, Location.id == LocationPath.ancestor_id)
+            .where(
+                LocationPath.descendant_id == submission.location_id,
+                _counters_current(submission.event_id, form.id, signature),
+            )
+        )
+
+        statement = insert(CoverageCounter).from_select(
+            ["event_id", "form_id", "group_name", "location_id", "location_type_id", "signature"] + columns, source
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=["event_id", "form_id", "group_name", "location_id"],
+            set_={column: getattr(CoverageCounter, column) + getattr(statement.excluded, column) for column in columns},
+        )
+        db.session.execute(statement)
+
+
+def rebuild_coverage(event, form):
+    """Recomputes the coverage statuses and counters for an event and form."""
+    filters = [
+        Submission.event_id == event.id,
+        Submission.form_id == form.id,
+        Submission.submission_type == coverage_submission_type(form),
+    ]
+    specs = _group_specs(form)
+    signature = coverage_signature(form)
+
+    db.session.query(CoverageCounter).filter(
+        CoverageCounter.event_id == event.id, CoverageCounter.form_id == form.id
+    ).delete(synchronize_session=False)
+
+    if not specs or form.form_type not in ("CHECKLIST", "SURVEY"):
+        db.session.commit()
+        return
+
+    status_object = sa.func.jsonb_build_object(
+        *[
+            argument
+            for group_name, group_tags, conflict_tags in specs
+            for argument in (sa.literal(group_name), _status_expression(group_tags, conflict_tags))
+        ]
+    )
+    # the 'updated' column is kept as is, since it is used as the
+    # submission timestamp by the analysis views
+    db.session.execute(
+        sa.update(Submission)
+        .where(*filters)
+        .values(coverage_status=status_object, updated=Submission.updated)
+        .execution_options(synchronize_session=False)
+    )
+
+    columns = list(_STATUS_COLUMNS.values())
+    for group_name, _group_tags, _conflict_tags in specs:
+        status = Submission.coverage_status[group_name].astext
+        source = (
+            sa.select(
+                sa.literal(event.id),
+                sa.literal(form.id),
+                sa.literal(group_name),
+                LocationPath.ancestor_id,
+                Location.location_type_id,
+                sa.literal(signature),
+                *[sa.func.count(Submission.id).filter(status == status_name) for status_name in _STATUS_COLUMNS.keys()],
+            )
+            .select_from(Submission)
+            .join(LocationPath, LocationPath.descendant_id == Submission.location_id)
+            .join(Location, Location.id == LocationPath.ancestor_id)
+            .where(*filters)
+            .group_by(LocationPath.ancestor_id, Location.location_type_id)
+        )
+        db.session.execute(
+            insert(CoverageCounter).from_select(
+                ["event_id", "form_id", "group_name", "location_id", "location_type_id", "signature"] + columns,
+                source,
+            )
+        )
+
+    db.session.commit()
+
+
+def _counter_row(location_id, name, counts):
+    row = {status: int(count or 0) for status, count in zip(COVERAGE_STATUSES, counts)}
+    row.update({"id": location_id, "name": name})
+    return row
+
+
+def _status_sums():
+    return [sa.func.sum(getattr(CoverageCounter, _STATUS_COLUMNS[status])) for status in COVERAGE_STATUSES]
+
+
+def get_group_coverage(event, form, group, location_type, location=None):
+    """Coverage per location of the given type, read from the counters."""
+    signature = coverage_signature(form)
+    query = (
+        db.session.query(CoverageCounter)
+        .join(Location, Location.id == CoverageCounter.location_id)
+        .filter(
+            CoverageCounter.event_id == event.id,
+            CoverageCounter.form_id == form.id,
+            CoverageCounter.group_name == group["name"],
+            CoverageCounter.location_type_id == location_type.id,
+            CoverageCounter.signature == signature,
+        )
+    )
+
+    if location is not None:
+        descendants = sa.select(LocationPath.descendant_id).where(LocationPath.ancestor_id == location.id)
+        query = query.filter(CoverageCounter.location_id.in_(descendants))
+
+    dataset = query.with_entities(Location.id, Location.name, *_status_sums()).group_by(Location.id).all()
+
+    return [
+        _counter_row(row[0], row[1], row[2:]) for row in sorted(dataset, key=lambda item: item[1] or "") if any(row[2:])
+    ]
+
+
+def get_global_coverage(event, form):
+    """Coverage per form group, read from the counters."""
+    root_type = LocationType.root(event.location_set_id)
+    if root_type is None:
+        return []
+
+    signature = coverage_signature(form)
+    query = (
+        db.session.query(CoverageCounter)
+        .filter(
+            CoverageCounter.event_id == event.id,
+            CoverageCounter.form_id == form.id,
+            CoverageCounter.location_type_id == root_type.id,
+            CoverageCounter.signature == signature,
+        )
+        .with_entities(CoverageCounter.group_name, *_status_sums())
+        .group_by(CoverageCounter.group_name)
+    )
+    dataset = {row[0]: row[1:] for row in query}
+
+    coverage_list = []
+    for group in form.data.get("groups") or []:
+        counts = dataset.get(group["name"], (0,) * len(COVERAGE_STATUSES))
+        data = {status: int(count or 0) for status, count in zip(COVERAGE_STATUSES, counts)}
+        data.update({"name": group["name"], "slug": group["slug"]})
+        coverage_list.append(data)
+
+    return coverage_list
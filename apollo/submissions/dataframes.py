@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""Cached submission data frames for the analysis views.
+
+Building the analysis data frame extracts every form field from the JSONB
+submission data and aggregates the location hierarchy of each submission,
+which is expensive for large events. The data frame of all the submissions
+of an event, form and submission type is therefore cached (in process and
+in Redis) together with a watermark: the latest `updated` timestamp of the
+submissions it was built from. The location names and location type
+columns of the data frame are in the current locale, so it is cached for
+every locale. On every request, only the submissions
+updated since the watermark are read from the database and merged into the
+cached data frame, and the rows matching the request filters are selected
+from it by submission id.
+
+In Redis, the full data frame is only stored when it is built; the rows
+that changed on a refresh are appended to a list of deltas which is merged
+into it when it is loaded, and the data frame is stored again (with the
+deltas cleared) once `MAX_DELTAS` of them have accumulated.
+"""
+
+import logging
+import pickle
+import threading
+from datetime import timedelta
+
+import cachetools
+import pandas as pd
+from flask_babel import get_locale
+from redis.exceptions import RedisError
+from sqlalchemy import func
+
+from apollo import settings
+from apollo.core import red
+from apollo.submissions.models import Submission
+from apollo.submissions.utils import make_submission_dataframe, make_turnout_dataframe
+
+logger = logging.getLogger(__name__)
+
+SUBMISSION_DATAFRAME = "submission"
+TURNOUT_DATAFRAME = "turnout"
+
+_BUILDERS = {
+    SUBMISSION_DATAFRAME: make_submission_dataframe,
+    TURNOUT_DATAFRAME: make_turnout_dataframe,
+}
+
+# submissions committed after the data frame was built could carry an
+# `updated` timestamp slightly older than the watermark, so the refresh
+# re-reads the submissions updated shortly before it as well
+WATERMARK_MARGIN = timedelta(minutes=5)
+# number of deltas stored before the full data frame is stored again
+MAX_DELTAS = 20
+
+_local_cache = cachetools.LRUCache(maxsize=settings.DATAFRAME_CACHE_SIZE)
+_local_cache_lock = threading.Lock()
+
+
+def _cache_key(kind, event_id, form_id, submission_type, locale):
+    return f"apollo:dataframe:{kind}:{event_id}:{form_id}:{submission_type}:{locale}"
+
+
+def _deltas_key(key):
+    return f"{key}:deltas"
+
+
+def _load_state(key):
+    with _local_cache_lock:
+        state = _local_cache.get(key)
+    if state is not None:
+        return state
+
+    try:
+        payload, deltas = red.pipeline().get(key).lrange(_deltas_key(key), 0, -1).execute()
+    except RedisError:
+        logger.exception("Could not read the cached data frame %s", key)
+        return None
+
+    if not payload:
+        return None
+
+    state = pickle.loads(payload)
+    state["deltas"] = 0
+    for delta_payload in deltas:
+        delta = pickle.loads(delta_payload)
+        # a delta built before the data frame was rebuilt for a new version
+        if delta["version"] != state["version"]:
+            continue
+
+        # the watermark of the last delta is kept even if it is older, since
+        # the rows updated since are read again then
+        state["dataframe"] = merge_dataframes(state["dataframe"], delta["dataframe"])
+        state["watermark"] = delta["watermark"]
+        state["deltas"] += 1
+
+    return state
+
+
+def _store_state(key, state, delta=None):
+    """Caches the state of a data frame.
+
+    If `delta` is given, only the rows it holds are added to the data frame
+    stored in Redis, and nothing is stored if it is empty.
+    """
+    with _local_cache_lock:
+        _local_cache[key] = state
+
+    if delta is not None and delta.empty:
+        return
+
+    timeout = settings.DATAFRAME_CACHE_TIMEOUT
+    deltas_key = _deltas_key(key)
+    pipeline = red.pipeline()
+    if delta is None:
+        payload = {"version": state["version"], "watermark": state["watermark"], "dataframe": state["dataframe"]}
+        pipeline.set(key, pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL), timeout)
+        pipeline.delete(deltas_key)
+    else:
+        payload = {"version": state["version"], "watermark": state["watermark"], "dataframe": delta}
+        pipeline.rpush(deltas_key, pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))
+        pipeline.expire(deltas_key, timeout)
+        pipeline.expire(key, timeout)
+
+    try:
+        pipeline.execute()
+    except RedisError:
+        logger.exception("Could not store the cached data frame %s", key)
+
+
+def merge_dataframes(cached, changed):
+    """Replaces the rows of the cached data frame with the changed ones.
+
+    Both data frames are indexed by the submission id.
+    """
+    if changed.empty:
+        return cached
+    if cached.empty:
+        return changed
+
+    return pd.concat([cached[~cached.index.isin(changed.index)], changed])
+
+
+def changed_rows(cached, updated):
+    """Returns the rows of the updated data frame that are not in the cached one.
+
+    The updated rows that are equal to the cached rows with the same id,
+    like the ones read again because of the watermark margin, are left out.
+    """
+    if updated.empty or cached.empty:
+        return updated
+
+    columns = cached.columns.union(updated.columns)
+    previous = cached.reindex(index=updated.index, columns=columns)
+    current = updated.reindex(columns=columns)
+    unchanged = ((previous == current) | (previous.isna() & current.isna())).all(axis=1)
+
+    return updated[~unchanged]
+
+
+def _refresh(kind, event, form, submission_type):
+    """Returns the up to date data frame of all the submissions."""
+    # the location type columns and the location names are in the current
+    # locale, so every locale has its own data frame
+    key = _cache_key(kind, event.id, form.id, submission_type, str(get_locale()))
+    # the location names are part of the data frame
+    version = (form.version_identifier, event.location_set.ancestry_version if event.location_set else None)
+    base_query = Submission.query.filter(
+        Submission.event_id == event.id,
+        Submission.form_id == form.id,
+        Submission.submission_type == submission_type,
+    )
+    builder = _BUILDERS[kind]
+
+    # the watermark is read first, so submissions updated while the data
+    # frame is built are read again on the next refresh
+    watermark = base_query.with_entities(func.max(Submission.updated)).scalar()
+    if watermark is None:
+        return pd.DataFrame()
+
+    state = _load_state(key)
+    if state is None or state["version"] != version:
+        dataframe = builder(base_query, form, index_by_id=True)
+        deltas, delta = 0, None
+    elif state["watermark"] == watermark:
+        return state["dataframe"]
+    else:
+        updated = builder(
+            base_query.filter(Submission.updated >= state["watermark"] - WATERMARK_MARGIN), form, index_by_id=True
+        )
+        delta = changed_rows(state["dataframe"], updated)
+        dataframe = merge_dataframes(state["dataframe"], delta)
+        deltas = state["deltas"] + (0 if delta.empty else 1)
+        if deltas > MAX_DELTAS:
+            deltas, delta = 0, None
+
+    _store_state(key, {"version": version, "watermark": watermark, "dataframe": dataframe, "deltas": deltas}, delta)
+
+    return dataframe
+
+
+def get_submission_dataframe(query, form, event, submission_type, kind=SUBMISSION_DATAFRAME):
+    """Returns the analysis data frame of the submissions in the query.
+
+    The query must be restricted to the submissions of the event, form and
+    submission type given; any other filters are applied to the cached data
+    frame by selecting the ids of the submissions in the query.
+    """
+    dataframe = _refresh(kind, event, form, submission_type)
+    if dataframe.empty:
+        return pd.DataFrame()
+
+    submission_ids = query.with_entities(Submission.id).distinct()
+    selected = dataframe[dataframe.index.isin([row[0] for row in submission_ids])]
+    if selected.empty:
+        return pd.DataFrame()
+
+    return selected.reset_index(drop=True)
+
+
+def get_turnout_dataframe(query, form, event, submission_type):
+    """Returns the turnout data frame of the submissions in the query."""
+    return get_submission_dataframe(query, form, event, submission_type, kind=TURNOUT_DATAFRAME)
@@ -20,6 +20,7 @@ from apollo.helpers import _make_choices
 from apollo.settings import TIMEZONE
 from apollo.submissions.models import FLAG_CHOICES
 from apollo.submissions.qa.query_builder import build_expression, generate_qa_query
+from apollo.submissions.qa.status import CONDITION_STATUSES, qa_status_available, qa_status_filter
 
 APP_TZ = gettz(TIMEZONE)
 
@@ -502,6 +503,9 @@ class QualityAssuranceFilter(ChoiceFilter):
             'criterion' in value and 'condition' in value and
             value['criterion'] and value['condition']
         ):
+            if qa_status_available(self.qa_form):
+                return self._stored_status_queryset(query, value)
+
             if value['criterion'] == 'A':
                 # find all records for which any match the
                 # following condition
@@ -618,6 +622,26 @@ class QualityAssuranceFilter(ChoiceFilter):
                     null_query == False, qa_subquery == False)  # noqa
         return query
 
+    def _stored_status_queryset(self, query, value):
+        # the stored QA statuses are looked up with the GIN index
+        if value['condition'] not in CONDITION_STATUSES:
+            return query.filter(false()) if value['criterion'] == 'A' \
+                else query
+
+        if value['criterion'] == 'A':
+            check_names = [
+                check['name'] for check in self.qa_form.quality_checks]
+        else:
+            try:
+                index = int(value['criterion'])
+                check = self.qa_form.quality_checks[index]
+            except (IndexError, ValueError):
+                return query
+            check_names = [check['name']]
+
+        return query.filter(
+            qa_status_filter(check_names, value['condition']))
+
 
 class SubmissionDateFilter(CharFilter):
     def queryset_(self, queryset, value):
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Expression indexes of the submission data fields.
+
+The submission data is a JSONB object with a generic GIN index, which
+serves the `has_any`, `has_all` and `contains` lookups of the coverage
+filters, but not the comparison of a single field cast to a number with a
+constant, like `CAST(data ->> 'AA' AS INTEGER) = 2` in the option filter of
+the incident list. That needs an index on the same expression. The results
+and turnout analysis only select the fields, and the quality checks are
+read from the stored QA statuses while they are current and otherwise
+compare fields with each other, so such an index does not help them.
+
+The advisor proposes one partial expression index per form and field used
+in such a condition, restricted to the submissions of the form, e.g.
+
+    CREATE INDEX ix_submission_data_12_... ON submission
+        ((CAST(data ->> 'AA' AS INTEGER))) WHERE form_id = 12
+
+and `sync_indexes` creates the missing indexes of a form and drops the
+ones it no longer needs, or all of them when the form is archived or
+deleted. The indexes are built concurrently, so the submission table is
+not locked while they are built. The usage of the indexes is reported
+from `pg_stat_user_indexes`.
+"""
+
+import hashlib
+from collections import namedtuple
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from apollo.core import db
+from apollo.formsframework.models import Form
+from apollo.submissions.models import Submission
+
+INDEX_PREFIX = "ix_submission_data_"
+_PATTERN = INDEX_PREFIX.replace("_", r"\_") + "%"
+
+INCIDENT_FILTER = "incident filter"
+
+IndexProposal = namedtuple("IndexProposal", ["name", "form_id", "tag", "expression", "reasons"])
+IndexUsage = namedtuple("IndexUsage", ["name", "form_id", "scans", "tuples_read", "size"])
+
+# the index expressions refer to the column without its table
+_data = sa.column("data", postgresql.JSONB)
+# a dialect that does not escape the percent signs of the literals, since
+# the statements are executed without parameters
+_dialect = postgresql.dialect(paramstyle="named")
+
+
+def _compile(expression):
+    return str(expression.compile(dialect=_dialect, compile_kwargs={"literal_binds": True}))
+
+
+def index_name(form_id, expression):
+    """Returns the name of the index of an expression for a form."""
+    digest = hashlib.md5(expression.encode("utf-8")).hexdigest()[:12]
+    return f"{INDEX_PREFIX}{form_id}_{digest}"
+
+
+def index_form_id(name):
+    """Returns the id of the form of an index, from its name."""
+    form_id, _, _digest = name[len(INDEX_PREFIX) :].partition("_")
+    return int(form_id) if form_id.isdigit() else None
+
+
+def _incident_filter_expressions(form):
+    if form.form_type != "INCIDENT":
+        return []
+
+    # the option filter of the incident list is on the first select field
+    fields = [field for field in form.response_fields if field["type"] == "select"]
+
+    return [(field["tag"], _data[field["tag"]].astext.cast(sa.Integer), INCIDENT_FILTER) for field in fields[:1]]
+
+
+def propose_indexes(form):
+    """Returns the expression indexes proposed for the fields of a form."""
+    candidates = _incident_filter_expressions(form)
+
+    proposals = {}
+    for tag, expression, reason in candidates:
+        field = form.get_field_by_tag(tag)
+        if not field:
+            continue
+
+        sql = _compile(expression)
+        name = index_name(form.id, sql)
+        if name in proposals:
+            proposals[name].reasons.append(reason)
+        else:
+            proposals[name] = IndexProposal(name, form.id, tag, sql, [reason])
+
+    return sorted(proposals.values(), key=lambda proposal: (proposal.tag, proposal.name))
+
+
+def create_statement(proposal):
+    """Returns the statement creating a proposed index."""
+    return (
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {proposal.name} ON {Submission.__tablename__} "
+        f"(({proposal.expression})) WHERE form_id = {int(proposal.form_id)}"
+    )
+
+
+def _execute_concurrently(statement):
+    # concurrent index builds cannot run in a transaction
+    with db.engine.connect() as connection:
+        connection.execution_options(isolation_level="AUTOCOMMIT").exec_driver_sql(statement)
+
+
+def create_index(proposal):
+    """Builds a proposed index, without locking the submission table.
+
+    An invalid index left by a failed build is dropped first.
+    """
+    _execute_concurrently(f"DROP INDEX CONCURRENTLY IF EXISTS {proposal.name}")
+    _execute_concurrently(create_statement(proposal))
+
+
+def drop_index(name):
+    """Drops an index created for a form."""
+    _execute_concurrently(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def existing_indexes(form_id=None):
+    """Returns the names of the valid indexes created for a form, or for all the forms."""
+    rows = db.session.execute(
+        sa.text(
+            "SELECT idx.relname FROM pg_index "
+            "JOIN pg_class AS idx ON idx.oid = pg_index.indexrelid "
+            "JOIN pg_class AS tbl ON tbl.oid = pg_index.indrelid "
+            "WHERE tbl.relname = :table AND pg_table_is_visible(tbl.oid) "
+            "AND pg_index.indisvalid AND idx.relname LIKE :pattern"
+        ),
+        {"table": Submission.__tablename__, "pattern": _PATTERN},
+    )
+
+    return sorted(name for (name,) in rows if form_id is None or index_form_id(name) == form_id)
+
+
+def sync_indexes(form_id, create=True):
+    """Creates the missing indexes of a form and drops the unused ones.
+
+    All the indexes of the form are dropped if it is archived or deleted.
+    The current transaction is committed first, since the concurrent index
+    builds wait for the open transactions to finish.
+
+    :param create: Whether to create the missing indexes, or only drop the
+                   indexes that are no longer needed
+    :returns: the names of the created and dropped indexes
+    """
+    form = db.session.get(Form, form_id)
+    if form is None or form.is_hidden:
+        proposals = {}
+    else:
+        proposals = {proposal.name: proposal for proposal in propose_indexes(form)}
+    existing = set(existing_indexes(form_id))
+    db.session.commit()
+
+    dropped = sorted(existing.difference(proposals))
+    for name in dropped:
+        drop_index(name)
+
+    created = sorted(set(proposals).difference(existing)) if create else []
+    for name in created:
+        create_index(proposals[name])
+
+    return created, dropped
+
+
+def index_usage():
+    """Returns the usage statistics of the indexes created for the forms."""
+    rows = db.session.execute(
+        sa.text(
+            "SELECT indexrelname, idx_scan, idx_tup_read, pg_relation_size(indexrelid) "
+            "FROM pg_stat_user_indexes WHERE relname = :table AND indexrelname LIKE :pattern "
+            "ORDER BY indexrelname"
+        ),
+        {"table": Submission.__tablename__, "pattern": _PATTERN},
+    )
+
+    return [IndexUsage(name, index_form_id(name), scans, tuples_read, size) for name, scans, tuples_read, size in rows]
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""GeoJSON map data of the submission list.
+
+The features are streamed from a server-side cursor over a SQL projection
+of the submissions (the coordinates of their points with the names and
+phone numbers of their participants and locations), so neither the
+submissions nor the feature collection are held in memory, and only the
+points within the bounding box of the map view are read.
+
+When the map is zoomed out below `MAP_CLUSTER_MAX_ZOOM`, the points are
+clustered in the database on a grid of cells of `MAP_CLUSTER_CELL_SIZE`
+pixels at the zoom level of the map, and every cluster is returned as a
+single feature with the number of its points. The points alone in their
+cell are returned as such.
+"""
+
+import calendar
+import json
+
+import sqlalchemy as sa
+
+from apollo import settings
+from apollo.core import db
+from apollo.locations.models import Location
+from apollo.participants.models import Participant, PhoneContact
+from apollo.submissions.models import Submission
+
+# number of features fetched from the server-side cursor at a time
+MAP_CHUNK_SIZE = 1000
+# size of the map tiles, in pixels
+TILE_SIZE = 256
+
+
+def parse_bbox(value):
+    """Parses a `west,south,east,north` bounding box, or returns None.
+
+    The coordinates are clamped to the valid longitudes and latitudes,
+    since the map view can extend beyond them.
+    """
+    try:
+        west, south, east, north = (float(coordinate) for coordinate in value.split(","))
+    except (AttributeError, ValueError):
+        return None
+
+    if south > north:
+        return None
+
+    return max(west, -180.0), max(south, -90.0), min(east, 180.0), min(north, 90.0)
+
+
+def parse_zoom(value):
+    """Parses the zoom level of the map, or returns None."""
+    try:
+        zoom = int(value)
+    except (TypeError, ValueError):
+        return None
+
+    return zoom if 0 <= zoom <= 24 else None
+
+
+def _bbox_condition(bbox):
+    west, south, east, north = bbox
+    envelope = sa.func.ST_MakeEnvelope(west, south, east, north, 4326)
+    if west <= east:
+        return Submission.geom.op("&&")(envelope)
+
+    # the bounding box crosses the antimeridian
+    return sa.or_(
+        Submission.geom.op("&&")(sa.func.ST_MakeEnvelope(west, south, 180, north, 4326)),
+        Submission.geom.op("&&")(sa.func.ST_MakeEnvelope(-180, south, east, north, 4326)),
+    )
+
+
+def submission_filter(query, bbox=None):
+    """Filter for the submissions of a query with points in a bounding box.
+
+    The submissions are selected by id, so that the joins, grouping and
+    ordering of the list query do not apply to the map data.
+    """
+    conditions = [
+        Submission.id.in_(query.order_by(None).with_entities(Submission.id)),
+        Submission.geom.isnot(None),
+    ]
+    if bbox is not None:
+        conditions.append(_bbox_condition(bbox))
+
+    return conditions
+
+
+def participant_name():
+    """Returns the expression of the name of the participants."""
+    names = [
+        sa.func.nullif(name, "") for name in (Participant.first_name, Participant.other_names, Participant.last_name)
+    ]
+    return sa.func.coalesce(sa.func.nullif(Participant.full_name, ""), sa.func.concat_ws(" ", *names))
+
+
+def _primary_phone():
+    return (
+        sa.select(PhoneContact.number)
+        .where(PhoneContact.participant_id == Participant.id, PhoneContact.verified == True)  # noqa
+        .order_by(PhoneContact.updated.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def point_query(conditions):
+    """Returns the statement of the point features of the submissions."""
+    return (
+        sa.select(
+            sa.func.ST_X(Submission.geom).label("x"),
+            sa.func.ST_Y(Submission.geom).label("y"),
+            Location.name.label("location"),
+            participant_name().label("participant"),
+            Participant.participant_id,
+            _primary_phone().label("phone"),
+            Submission.participant_updated,
+        )
+        .select_from(Submission)
+        .outerjoin(Location, Location.id == Submission.location_id)
+        .outerjoin(Participant, Participant.id == Submission.participant_id)
+        .where(*conditions)
+    )
+
+
+def cell_size(zoom):
+    """Returns the size of the clustering grid cells at a zoom level, in degrees."""
+    return 360.0 / (2**zoom) * settings.MAP_CLUSTER_CELL_SIZE / TILE_SIZE
+
+
+def cluster_query(conditions, zoom):
+    """Returns the statement of the clusters of the submission points."""
+    cell = sa.func.ST_SnapToGrid(Submission.geom, cell_size(zoom))
+    centroid = sa.func.ST_Centroid(sa.func.ST_Collect(Submission.geom))
+
+    return (
+        sa.select(
+            sa.func.ST_X(centroid).label("x"),
+            sa.func.ST_Y(centroid).label("y"),
+            sa.func.count().label("count"),
+            sa.func.min(Submission.id).label("submission_id"),
+        )
+        .where(*conditions)
+        .group_by(cell)
+    )
+
+
+def _feature(x, y, properties):
+    return json.dumps(
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": [x, y]}, "properties": properties},
+        separators=(",", ":"),
+    )
+
+
+def _point_properties(row):
+    properties = {
+        "location": row.location,
+        "participant": row.participant,
+        "participant_id": row.participant_id,
+        "phone": row.phone,
+        "last_updated": None,
+        "last_updated_timestamp": None,
+    }
+    if row.participant_updated:
+        properties["last_updated"] = row.participant_updated.strftime("%b %d, %Y %l:%M %p")
+        properties["last_updated_timestamp"] = str(calendar.timegm(row.participant_updated.utctimetuple()))
+
+    return properties
+
+
+def _stream(statement):
+    result = db.session.execute(statement.execution_options(yield_per=MAP_CHUNK_SIZE))
+    try:
+        yield from result
+    finally:
+        result.close()
+
+
+def generate_features(query, bbox=None, zoom=None):
+    """Yields the GeoJSON features of the submissions of a query.
+
+    The points are clustered if a zoom level below `MAP_CLUSTER_MAX_ZOOM`
+    is given.
+    """
+    conditions = submission_filter(query, bbox)
+
+    if zoom is None or zoom >= settings.MAP_CLUSTER_MAX_ZOOM:
+        for row in _stream(point_query(conditions)):
+            yield _feature(row.x, row.y, _point_properties(row))
+        return
+
+    single_ids = []
+    for row in _stream(cluster_query(conditions, zoom)):
+        if row.count == 1:
+            single_ids.append(row.submission_id)
+        else:
+            yield _feature(row.x, row.y, {"cluster": True, "count": row.count})
+
+    for start in range(0, len(single_ids), MAP_CHUNK_SIZE):
+        ids = single_ids[start : start + MAP_CHUNK_SIZE]
+        for row in db.session.execute(point_query([Submission.id.in_(ids)])):
+            yield _feature(row.x, row.y, _point_properties(row))
+
+
+def generate_feature_collection(query, bbox=None, zoom=None):
+    """Yields the GeoJSON feature collection of a query in chunks."""
+    yield '{"type":"FeatureCollection","features":['
+
+    chunk = []
+    separator = ""
+    for feature in generate_features(query, bbox, zoom):
+        chunk.append(feature)
+        if len(chunk) == MAP_CHUNK_SIZE:
+            yield separator + ",".join(chunk)
+            chunk = []
+            separator = ","
+
+    if chunk:
+        yield separator + ",".join(chunk)
+    yield "]}"
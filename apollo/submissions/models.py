@@ -6,6 +6,7 @@ from flask_babel import gettext
 from flask_babel import lazy_gettext as _
 from geoalchemy2 import Geometry
 from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy_utils import ChoiceType
 
 from apollo.core import db
@@ -28,6 +29,9 @@ FLAG_CHOICES = (
     ("4", _("VERIFIED")),
 )
 
+# the checklists are created for batches of this many participants
+INIT_BATCH_SIZE = 1000
+
 STATUS_CHOICES = (
     ("", _("Status")),
     ("0", _("Status — No Problem")),
@@ -60,7 +64,10 @@ class Submission(BaseModel):
 
     VERIFICATION_OPTIONS = {"VERIFIED": "4", "REJECTED": "5"}
 
-    __table_args__ = (db.Index("submission_data_idx", "data", postgresql_using="gin"),)
+    __table_args__ = (
+        db.Index("submission_data_idx", "data", postgresql_using="gin"),
+        db.Index("submission_qa_status_idx", "qa_status", postgresql_using="gin"),
+    )
     __tablename__ = "submission"
 
     id = db.Column(db.Integer, primary_key=True)
@@ -117,8 +124,35 @@ class Submission(BaseModel):
     geom = db.Column(Geometry("POINT", srid=4326))
     verified_fields = db.Column(JSONB, default=[])
 
+    """
+    The coverage_status field maps each form group name to the response
+    rate status (Complete, Conflict, Missing, Partial or Offline) that was
+    last counted for this submission in the coverage counters. It is
+    maintained by `apollo.submissions.coverage` and should not be set
+    directly.
+    """
+    coverage_status = db.Column(JSONB)
+
+    """
+    The qa_status field maps each quality check name of the form to the
+    status (Flagged, Verified, OK or Missing) of the check for an observer
+    submission. It is maintained by `apollo.submissions.qa.status` and
+    should not be set directly.
+    """
+    qa_status = db.Column(JSONB)
+
     @classmethod
     def init_submissions(cls, event, form, role, location_type, task=None):
+        """Creates the checklists of a form for the participants of a role.
+
+        Every participant gets an observer checklist for the location of the
+        given type that contains its location, which is found with a join on
+        the location closure table, and each of those locations gets a
+        master checklist. The missing checklists are inserted with set-based
+        statements, a batch of participants at a time.
+        """
+        from apollo.dal.serializers import random_uuid
+        from apollo.locations.models import Location, LocationPath
         from apollo.participants.models import Participant
 
         if form.form_type != "CHECKLIST":
@@ -142,109 +176,133 @@ class Submission(BaseModel):
         warning_records = 0
         error_log = []
 
-        for participant in participants:
-            if not participant.location_id:
+        def report_progress():
+            if task:
+                task.update_state(
+                    state="PROGRESS",
+                    meta={
+                        "total_records": total_records,
+                        "processed_records": processed_records,
+                        "error_records": error_records,
+                        "warning_records": warning_records,
+                        "error_log": error_log,
+                    },
+                )
+
+        for (participant_id,) in (
+            participants.filter(Participant.location_id.is_(None))
+            .order_by(Participant.id)
+            .with_entities(Participant.participant_id)
+        ):
+            error_records += 1
+            error_log.append(
+                {
+                    "label": "ERROR",
+                    "message": gettext("Participant ID %(part_id)s has no location", part_id=participant_id),
+                }
+            )
+
+        located_participants = (
+            participants.filter(Participant.location_id.isnot(None))
+            .order_by(Participant.id)
+            .with_entities(Participant.id, Participant.participant_id)
+            .all()
+        )
+
+        table = cls.__table__
+        columns = [
+            "form_id",
+            "participant_id",
+            "location_id",
+            "deployment_id",
+            "event_id",
+            "submission_type",
+            "data",
+            "uuid",
+        ]
+
+        for start in range(0, len(located_participants), INIT_BATCH_SIZE):
+            batch = dict(located_participants[start : start + INIT_BATCH_SIZE])
+
+            # the location of the given type of each participant, which is
+            # either its own location or the closest such ancestor
+            targets = (
+                db.session.query(Participant.id, LocationPath.ancestor_id)
+                .join(LocationPath, LocationPath.descendant_id == Participant.location_id)
+                .join(Location, Location.id == LocationPath.ancestor_id)
+                .filter(Participant.id.in_(list(batch)), Location.location_type_id == location_type.id)
+                .distinct(Participant.id)
+                .order_by(Participant.id, LocationPath.depth)
+                .all()
+            )
+
+            for pk in sorted(set(batch).difference(pk for pk, _location_id in targets)):
                 error_records += 1
                 error_log.append(
                     {
                         "label": "ERROR",
                         "message": gettext(
-                            "Participant ID %(part_id)s has no location", part_id=participant.participant_id
+                            "Participant ID %(part_id)s has no location of type %(location_type)s",
+                            part_id=batch[pk],
+                            location_type=location_type.name,
                         ),
                     }
                 )
-                continue
 
-            if location_type.id == participant.location.location_type.id:
-                location = participant.location
-            else:
-                try:
-                    location = next(
-                        a for a in participant.location.ancestors() if a.location_type.id == location_type.id
+            if targets:
+                target_values = sa.values(
+                    sa.column("participant_id", sa.Integer), sa.column("location_id", sa.Integer), name="targets"
+                ).data(targets)
+                submission_filters = [
+                    table.c.form_id == form.id,
+                    table.c.location_id == target_values.c.location_id,
+                    table.c.deployment_id == deployment_id,
+                    table.c.event_id == event.id,
+                ]
+
+                observer_submissions = sa.select(
+                    sa.literal(form.id),
+                    target_values.c.participant_id,
+                    target_values.c.location_id,
+                    sa.literal(deployment_id),
+                    sa.literal(event.id),
+                    sa.literal("O"),
+                    sa.literal({}, JSONB),
+                    random_uuid(),
+                ).where(
+                    ~sa.exists().where(
+                        *submission_filters,
+                        table.c.participant_id == target_values.c.participant_id,
+                        table.c.submission_type == "O",
                     )
-                    if not location:
-                        error_records = total_records - processed_records
-                        if task:
-                            task.update_state(
-                                state="PROGRESS",
-                                meta={
-                                    "total_records": total_records,
-                                    "processed_records": processed_records,
-                                    "error_records": error_records,
-                                    "warning_records": warning_records,
-                                    "error_log": error_log,
-                                },
-                            )
-                        return
-                except StopIteration:
-                    error_records = total_records - processed_records
-                    if task:
-                        task.update_state(
-                            state="PROGRESS",
-                            meta={
-                                "total_records": total_records,
-                                "processed_records": processed_records,
-                                "error_records": error_records,
-                                "warning_records": warning_records,
-                                "error_log": error_log,
-                            },
+                )
+                master_submissions = (
+                    sa.select(
+                        sa.literal(form.id),
+                        sa.null(),
+                        target_values.c.location_id,
+                        sa.literal(deployment_id),
+                        sa.literal(event.id),
+                        sa.literal("M"),
+                        sa.literal({}, JSONB),
+                        random_uuid(),
+                    )
+                    .where(
+                        ~sa.exists().where(
+                            *submission_filters, table.c.participant_id.is_(None), table.c.submission_type == "M"
                         )
-                    return
-
-            obs_submission = cls.query.filter_by(
-                form_id=form.id,
-                participant_id=participant.id,
-                location_id=location.id,
-                deployment_id=deployment_id,
-                event_id=event.id,
-                submission_type="O",
-            ).first()
-
-            if not obs_submission:
-                obs_submission = cls(
-                    form_id=form.id,
-                    participant_id=participant.id,
-                    location_id=location.id,
-                    deployment_id=deployment_id,
-                    event_id=event.id,
-                    submission_type="O",
-                    data={},
+                    )
+                    .group_by(target_values.c.location_id)
                 )
-                obs_submission.save()
-
-            master_submission = cls.query.filter_by(
-                form_id=form.id,
-                participant_id=None,
-                location_id=location.id,
-                deployment_id=deployment_id,
-                event_id=event.id,
-                submission_type="M",
-            ).first()
 
-            if not master_submission:
-                master_submission = cls(
-                    form_id=form.id,
-                    participant_id=None,
-                    location_id=location.id,
-                    deployment_id=deployment_id,
-                    event_id=event.id,
-                    submission_type="M",
-                    data={},
-                )
-                master_submission.save()
+                db.session.execute(table.insert().from_select(columns, observer_submissions))
+                db.session.execute(table.insert().from_select(columns, master_submissions))
+                db.session.commit()
 
-            processed_records += 1
-            if task:
-                task.update_state(
-                    state="PROGRESS",
-                    meta={
-                        "total_records": total_records,
-                        "processed_records": processed_records,
-                        "error_records": error_records,
-                        "warning_records": warning_records,
-                        "error_log": error_log,
-                    },
-                )
+            processed_records += len(targets)
+            report_progress()
+
+        report_progress()
 
     def update_group_timestamps(self, data: dict) -> None:
         # local to avoid circular import
@@ -276,23 +334,35 @@ class Submission(BaseModel):
         and update all related submissions with the
         conflict data
         """
+        # local to avoid circular import
+        from apollo.submissions.coverage import update_coverage
+        from apollo.submissions.qa.status import update_qa_status
+
         if self.form.form_type == "INCIDENT":
             return
 
         if self.form.untrack_data_conflicts:
+            update_coverage(self)
+            update_qa_status(self)
             return
 
         combined_data = self.data
         combined_data.update(data)
 
+        # the observer submissions at the location and the master are loaded
+        # once and the conflicts of every submission are computed from them
+        observers = self._load_related()
+
         if self.quarantine_status == "A":
             conflict_tags = []
             subset = {}
         elif self.quarantine_status == "R":
-            conflict_tags = self.compute_conflict_tags(set(combined_data.keys()).difference(set(self.form.vote_tags)))
+            conflict_tags = self.compute_conflict_tags(
+                set(combined_data.keys()).difference(set(self.form.vote_tags)), observers
+            )
             subset = {k: v for k, v in combined_data.items() if k not in conflict_tags and k not in self.form.vote_tags}
         else:
-            conflict_tags = self.compute_conflict_tags(combined_data.keys())
+            conflict_tags = self.compute_conflict_tags(combined_data.keys(), observers)
             subset = {k: v for k, v in combined_data.items() if k not in conflict_tags}
 
         subset_keys = set(subset.keys())
@@ -300,6 +370,8 @@ class Submission(BaseModel):
         master = self.master
 
         siblings = self.siblings
+        previous_conflicts = {submission.id: submission.conflicts for submission in siblings}
+        previous_conflicts[self.id] = self.conflicts
         self.conflicts = trim_conflicts(self, conflict_tags, combined_data.keys())
         master.conflicts = trim_conflicts(master, conflict_tags, combined_data.keys())
         for sibling in siblings:
@@ -309,7 +381,7 @@ class Submission(BaseModel):
                 conflict_tags = []
             elif sibling.quarantine_status == "R":
                 conflict_tags = sibling.compute_conflict_tags(
-                    set(combined_data.keys()).difference(set(self.form.vote_tags))
+                    set(combined_data.keys()).difference(set(self.form.vote_tags)), observers
                 )
                 subset.update(
                     {
@@ -321,10 +393,10 @@ class Submission(BaseModel):
             else:
                 if self.quarantine_status == "R":
                     conflict_tags = sibling.compute_conflict_tags(
-                        set(combined_data.keys()).difference(set(self.form.vote_tags))
+                        set(combined_data.keys()).difference(set(self.form.vote_tags)), observers
                     )
                 else:
-                    conflict_tags = sibling.compute_conflict_tags(combined_data.keys())
+                    conflict_tags = sibling.compute_conflict_tags(combined_data.keys(), observers)
 
                 subset.update(
                     {k: sibling.data[k] for k in sibling_data_keys.difference(subset_keys) if k not in conflict_tags}
@@ -351,11 +423,99 @@ class Submission(BaseModel):
             master.extra_data = extra_data
 
         db.session.begin(nested=True)
-        db.session.add_all([self, master])
-        db.session.add_all(siblings)
+        self._save_related(master, [self, *siblings], previous_conflicts)
+        for submission in [self, master, *siblings]:
+            update_coverage(submission)
+        update_qa_status(self)
         db.session.commit()
 
+    def _load_related(self):
+        """Loads the observer submissions at the location and the master.
+
+        A single query returns every observer submission sharing the
+        location (and serial number) of this submission along with the
+        master submission, which are then cached as the `siblings` and
+        `master` of this submission. Returns the observer submissions,
+        including this one.
+        """
+        submissions = (
+            Submission.query.filter(
+                Submission.deployment_id == self.deployment_id,
+                Submission.event_id == self.event_id,
+                Submission.form_id == self.form_id,
+                Submission.location_id == self.location_id,
+                sa.or_(
+                    sa.and_(Submission.submission_type == "O", Submission.serial_no == self.serial_no),
+                    Submission.submission_type == "M",
+                ),
+            )
+            .order_by(Submission.id)
+            .all()
+        )
+
+        masters = [submission for submission in submissions if submission.submission_type == "M"]
+        self._siblings = [
+            submission for submission in submissions if submission.submission_type == "O" and submission.id != self.id
+        ]
+        self._master = next(
+            (submission for submission in masters if submission.serial_no == self.serial_no),
+            masters[0] if masters else None,
+        )
+
+        return [self, *self._siblings]
+
+    def _save_related(self, master, observers, previous_conflicts):
+        """Writes the master and the observer submissions in one statement.
+
+        Only the observer submissions whose conflicts changed are written
+        and the in-memory objects are marked as persisted afterwards.
+        """
+        timestamp = current_timestamp()
+        columns = ("conflicts", "data", "extra_data", "participant_updated")
+        rows = [(master.id, master.conflicts, master.data, master.extra_data, master.participant_updated)]
+        for submission in observers:
+            if submission is master or submission.conflicts == previous_conflicts.get(submission.id):
+                continue
+            rows.append((submission.id, submission.conflicts, None, None, None))
+
+        values = sa.values(
+            sa.column("id", sa.Integer),
+            sa.column("conflicts", JSONB(none_as_null=True)),
+            sa.column("data", JSONB(none_as_null=True)),
+            sa.column("extra_data", JSONB(none_as_null=True)),
+            sa.column("participant_updated", sa.DateTime),
+            name="related",
+        ).data(rows)
+
+        # the data columns are NULL in the observer rows and kept as is
+        statement = (
+            sa.update(Submission)
+            .where(Submission.id == values.c.id)
+            .values(
+                conflicts=sa.cast(values.c.conflicts, JSONB),
+                data=sa.func.coalesce(sa.cast(values.c.data, JSONB), Submission.data),
+                extra_data=sa.func.coalesce(sa.cast(values.c.extra_data, JSONB), Submission.extra_data),
+                participant_updated=sa.func.coalesce(
+                    sa.cast(values.c.participant_updated, sa.DateTime), Submission.participant_updated
+                ),
+                updated=timestamp,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(statement)
+
+        written = {submission.id: submission for submission in observers}
+        written[master.id] = master
+        for row in rows:
+            submission = written[row[0]]
+            for name in columns if submission is master else ("conflicts",):
+                set_committed_value(submission, name, getattr(submission, name))
+            set_committed_value(submission, "updated", timestamp)
+
     def update_master_offline_status(self):
+        # local to avoid circular import
+        from apollo.submissions.coverage import update_coverage
+
         if self.master is None:
             return
 
@@ -374,7 +534,17 @@ class Submission(BaseModel):
         if master_offline_status != self.master.unreachable:
             db.session.add(self.master)
 
-    def compute_conflict_tags(self, tags=None):
+        update_coverage(self)
+        update_coverage(self.master)
+
+    def compute_conflict_tags(self, tags=None, observers=None):
+        """Returns the tags whose values conflict with other observers.
+
+        A tag is in conflict when another observer submission at the same
+        location reported a value that does not contain the value of this
+        submission. `observers` are the observer submissions at the location,
+        as returned by `_load_related`; they are loaded if not provided.
+        """
         # don't compute if the 'track conflicts' flag is not set
         # on the form
         if self.form.untrack_data_conflicts:
@@ -388,43 +558,38 @@ class Submission(BaseModel):
         tags_to_check = set(self.form.tags) - set(self.overridden_fields)
         if tags:
             tags_to_check = tags_to_check.intersection(set(tags))
+        tags_to_check = {tag for tag in tags_to_check if tag in self.data}
 
         tags_to_check_non_votes = tags_to_check.difference(set(self.form.vote_tags))
 
-        # conflict query
-        any_conflict_query = [
-            sa.func.bool_or(
-                sa.and_(
-                    Submission.data.has_key(tag),
-                    sa.not_(Submission.data.contains({tag: self.data[tag]})),
-                )
-            ).label(tag)
-            for tag in tags_to_check
-            if tag in self.data
-        ]
-        non_vote_conflict_query = [
-            sa.func.bool_or(
-                sa.and_(
-                    Submission.data.has_key(tag),
-                    sa.not_(Submission.data.contains({tag: self.data[tag]})),
-                )
-            ).label(tag)
-            for tag in tags_to_check_non_votes
-            if tag in self.data
-        ]
-
-        if not any_conflict_query:
+        if not tags_to_check:
             return []
-        siblings_no_quarantine = self.__siblings().filter(Submission.quarantine_status == "")
-        siblings_with_results_quarantine = self.__siblings().filter(Submission.quarantine_status == "R")
 
-        results_conflict = siblings_no_quarantine.with_entities(*any_conflict_query)
-        results_vote_conflict = siblings_with_results_quarantine.with_entities(*non_vote_conflict_query)
+        if observers is None:
+            observers = self.siblings
+
+        conflicts = set()
+        for tag in tags_to_check:
+            value = self.data[tag]
+            for observer in observers:
+                if observer is self or observer.id == self.id:
+                    continue
+
+                # observers with quarantined results are only compared
+                # on the non-vote tags and fully quarantined ones not at all
+                if observer.quarantine_status == "":
+                    checked = tags_to_check
+                elif observer.quarantine_status == "R":
+                    checked = tags_to_check_non_votes
+                else:
+                    continue
 
-        any_conflict = {k for result in results_conflict for k, v in result._asdict().items() if v}
-        vote_conflict = {k for result in results_vote_conflict for k, v in result._asdict().items() if v}
+                observer_data = observer.data or {}
+                if tag in checked and tag in observer_data and not jsonb_contains(observer_data[tag], value):
+                    conflicts.add(tag)
+                    break
 
-        return any_conflict.union(vote_conflict)
+        return conflicts
 
     def get_incident_status_display(self):
         d = dict(self.INCIDENT_STATUSES)
@@ -559,6 +724,31 @@ class Submission(BaseModel):
         return True
 
 
+class CoverageCounter(db.Model):
+    """Materialized response rate counters for the dashboard.
+
+    Each row holds the number of counted submissions per coverage status for
+    a form group, aggregated at one ancestor location of the submissions.
+    """
+
+    __tablename__ = "coverage_counter"
+    __table_args__ = (
+        db.Index("coverage_counter_location_type_idx", "event_id", "form_id", "group_name", "location_type_id"),
+    )
+
+    event_id = db.Column(db.Integer, db.ForeignKey("event.id", ondelete="CASCADE"), primary_key=True)
+    form_id = db.Column(db.Integer, db.ForeignKey("form.id", ondelete="CASCADE"), primary_key=True)
+    group_name = db.Column(db.String, primary_key=True)
+    location_id = db.Column(db.Integer, db.ForeignKey("location.id", ondelete="CASCADE"), primary_key=True)
+    location_type_id = db.Column(db.Integer, db.ForeignKey("location_type.id", ondelete="CASCADE"), nullable=False)
+    signature = db.Column(db.String, nullable=False)
+    complete = db.Column(db.Integer, default=0, nullable=False)
+    conflict = db.Column(db.Integer, default=0, nullable=False)
+    missing = db.Column(db.Integer, default=0, nullable=False)
+    partial = db.Column(db.Integer, default=0, nullable=False)
+    offline = db.Column(db.Integer, default=0, nullable=False)
+
+
 class SubmissionComment(BaseModel):
     __tablename__ = "submission_comment"
 
@@ -647,6 +837,33 @@ class SubmissionImageAttachment(BaseModel):
     )
 
 
+def jsonb_contains(container, value):
+    """Python equivalent of the Postgres JSONB containment operator (@>).
+
+    Scalars are contained if they are equal and of the same JSON type,
+    arrays if every element of `value` is contained in an element of
+    `container` and objects if every key of `value` is contained in the
+    value of the same key in `container`.
+    """
+    if isinstance(container, list) and isinstance(value, list):
+        return all(any(jsonb_contains(item, element) for item in container) for element in value)
+
+    if isinstance(container, dict) and isinstance(value, dict):
+        return all(key in container and jsonb_contains(container[key], element) for key, element in value.items())
+
+    if isinstance(container, (list, dict)) or isinstance(value, (list, dict)):
+        return False
+
+    # JSON booleans and numbers are different types
+    if isinstance(container, bool) or isinstance(value, bool):
+        return type(container) is type(value) and container == value
+
+    if isinstance(container, (int, float)) and isinstance(value, (int, float)):
+        return container == value
+
+    return type(container) is type(value) and container == value
+
+
 def trim_conflicts(submission, conflict_tags, data_keys):
     """Trim resolved conflicts.
 
@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
-"""Query builder module for checklist QA."""
+"""Query builder module for checklist QA.
+
+Building the QA parser and parsing the QA expressions is slow, so the parser
+is built once per thread and the parse trees, SQL expressions and compiled
+inline checks are cached. The SQL expressions and compiled checks depend on
+the form fields, so they are cached by form id and version identifier.
+"""
 
 import operator as op
+import threading
 
-from arpeggio import PTNodeVisitor, visit_parse_tree
+import cachetools
+from arpeggio import PTNodeVisitor, Terminal, visit_parse_tree
 from arpeggio.cleanpeg import ParserPEG
 from sqlalchemy import BigInteger, Integer, String, and_, case, cast, false, func, null, or_
 from sqlalchemy.dialects.postgresql import array
@@ -57,6 +65,15 @@ OPERATIONS = {
     "||": op.or_,
 }
 
+QA_CACHE_SIZE = 1024
+
+_parser_local = threading.local()
+_parse_cache = cachetools.LRUCache(maxsize=QA_CACHE_SIZE)
+_query_cache = cachetools.LRUCache(maxsize=QA_CACHE_SIZE)
+_case_query_cache = cachetools.LRUCache(maxsize=QA_CACHE_SIZE)
+_inline_check_cache = cachetools.LRUCache(maxsize=QA_CACHE_SIZE)
+_cache_lock = threading.Lock()
+
 FIELD_TYPE_CASTS = {
     "select": Integer,
     "string": String,
@@ -76,6 +93,42 @@ def _get_cast_type(field):
     return null()
 
 
+def _get_parser():
+    # parsers keep the state of the parse, so each thread has its own
+    parser = getattr(_parser_local, "parser", None)
+    if parser is None:
+        parser = _parser_local.parser = ParserPEG(GRAMMAR, "qa")
+
+    return parser
+
+
+def parse_expression(expression):
+    """Returns the (cached) parse tree of a QA expression."""
+    with _cache_lock:
+        tree = _parse_cache.get(expression)
+    if tree is None:
+        tree = _get_parser().parse(expression)
+        with _cache_lock:
+            _parse_cache[expression] = tree
+
+    return tree
+
+
+def _cached(cache, key, build, *args):
+    # forms that are not saved yet have no stable id and version
+    if key[0] is None or key[1] is None:
+        return build(*args)
+
+    with _cache_lock:
+        value = cache.get(key)
+    if value is None:
+        value = build(*args)
+        with _cache_lock:
+            cache[key] = value
+
+    return value
+
+
 class BaseVisitor(PTNodeVisitor):
     def __init__(self, defaults=True, **kwargs):
         """Constructor for BaseVisitor."""
@@ -157,11 +210,8 @@ class InlineQATreeVisitor(BaseVisitor):
 
     def visit_variable(self, node, children):
         var_name = node.value
-        if var_name not in self.form.tags:
-            return "NULL"
-
         field = self.form.get_field_by_tag(var_name)
-        if field["type"] == "multiselect":
+        if field is None or field["type"] == "multiselect":
             return "NULL"
 
         return self.submission.data.get(var_name, "NULL")
@@ -280,12 +330,13 @@ def generate_qa_query(expression, form):
     if expression == "" or expression == "=":
         return null(), set()
 
-    parser = ParserPEG(GRAMMAR, "qa")
-    tree = parser.parse(expression)
+    def build():
+        visitor = QATreeVisitor(form=form)
+        return visit_parse_tree(parse_expression(expression), visitor), frozenset(visitor.variables)
 
-    visitor = QATreeVisitor(form=form)
+    query, variables = _cached(_query_cache, (form.id, form.version_identifier, expression), build)
 
-    return visit_parse_tree(tree, visitor), visitor.variables
+    return query, set(variables)
 
 
 def generate_qa_queries(form):
@@ -294,43 +345,54 @@ def generate_qa_queries(form):
     tag_groups = []
     if form.quality_checks:
         for check in form.quality_checks:
-            expression = build_expression(check)
-            uses_null = "null" in expression.lower()
-
-            # evaluate every expression, including empty ones
-            subquery, used_tags = generate_qa_query(expression, form)
-
-            tags = array(used_tags)
-
-            if used_tags:
-                null_query = (
-                    or_(
-                        *[
-                            Submission.data[tag] == None  # noqa
-                            for tag in used_tags
-                        ]
-                    )
-                    if not uses_null
-                    else false()
-                )
-                case_query = case(
-                    (and_(null_query == False, subquery == True, ~Submission.verified_fields.has_all(tags)), "Flagged"),  # noqa
-                    (and_(null_query == False, subquery == True, Submission.verified_fields.has_all(tags)), "Verified"),  # noqa
-                    (and_(null_query == False, subquery == False), "OK"),  # noqa
-                    (or_(null_query == True, subquery == None), "Missing"),  # noqa
-                ).label(check["name"])
-            else:
-                case_query = case(
-                    (subquery == True, "Flagged"),  # noqa
-                    (subquery == False, "OK"),  # noqa
-                ).label(check["name"])
-
+            case_query, used_tags = _cached(
+                _case_query_cache,
+                (form.id, form.version_identifier, check["name"], build_expression(check)),
+                _generate_check_case_query,
+                check,
+                form,
+            )
             subqueries.append(case_query)
-            tag_groups.append(sorted(used_tags))
+            tag_groups.append(list(used_tags))
 
     return subqueries, tag_groups
 
 
+def _generate_check_case_query(check, form):
+    expression = build_expression(check)
+    uses_null = "null" in expression.lower()
+
+    # evaluate every expression, including empty ones
+    subquery, used_tags = generate_qa_query(expression, form)
+
+    tags = array(used_tags)
+
+    if used_tags:
+        null_query = (
+            or_(
+                *[
+                    Submission.data[tag] == None  # noqa
+                    for tag in used_tags
+                ]
+            )
+            if not uses_null
+            else false()
+        )
+        case_query = case(
+            (and_(null_query == False, subquery == True, ~Submission.verified_fields.has_all(tags)), "Flagged"),  # noqa
+            (and_(null_query == False, subquery == True, Submission.verified_fields.has_all(tags)), "Verified"),  # noqa
+            (and_(null_query == False, subquery == False), "OK"),  # noqa
+            (or_(null_query == True, subquery == None), "Missing"),  # noqa
+        ).label(check["name"])
+    else:
+        case_query = case(
+            (subquery == True, "Flagged"),  # noqa
+            (subquery == False, "OK"),  # noqa
+        ).label(check["name"])
+
+    return case_query, sorted(used_tags)
+
+
 def get_logical_check_stats(query, form, condition):
     """Compute QA metrics."""
     complete_expression = build_expression(condition)
@@ -393,32 +455,86 @@ class TagVisitor(PTNodeVisitor):
         self.variables.add(node.value)
 
 
-def get_inline_qa_status(submission, condition):
-    """QA status for inline rendering."""
-    control_expression = build_expression(condition)
+def _compile_node(node, visitor_class):
+    """Returns a function applying a visitor to a parse tree node.
 
-    # short-circuit for empty expression
-    if control_expression == "":
-        return None, set()
+    The function visits the node exactly like `visit_parse_tree` would: the
+    children are visited first, the ones that return None are dropped and
+    the results of the others are passed to the visit method of the node,
+    or to the default visit method if the visitor has none.
+    """
+    method = getattr(visitor_class, f"visit_{node.rule_name}", None)
+
+    if isinstance(node, Terminal):
+        if method is None:
+            value = str(node) if not node.suppress else None
+            return lambda visitor: value
+
+        return lambda visitor: method(visitor, node, [])
+
+    if method is None:
+        method = visitor_class.visit__default__
+    child_functions = [_compile_node(child, visitor_class) for child in node]
+
+    def visit(visitor):
+        children = []
+        for function in child_functions:
+            result = function(visitor)
+            if result is not None:
+                children.append(result)
 
-    parser = ParserPEG(GRAMMAR, "qa")
-    tree = parser.parse(control_expression)
+        return method(visitor, node, children)
 
-    var_visitor = TagVisitor()
-    visit_parse_tree(tree, var_visitor)
+    return visit
 
-    used_tags = var_visitor.variables.intersection(submission.form.tags)
 
-    visitor = InlineQATreeVisitor(form=submission.form, submission=submission)
+class InlineQACheck(object):
+    """A QA expression compiled for evaluating submissions of a form."""
 
-    try:
-        result = visit_parse_tree(tree, visitor)
-    except TypeError:
-        # tried to perform a math operation combining None and a number,
-        # most likely
+    def __init__(self, expression, form):
+        """Constructor for InlineQACheck."""
+        tree = parse_expression(expression)
+
+        tag_visitor = TagVisitor()
+        visit_parse_tree(tree, tag_visitor)
+
+        self.tags = tag_visitor.variables.intersection(form.tags)
+        self.visit = _compile_node(tree, InlineQATreeVisitor)
+
+    def __call__(self, submission):
+        """Returns the result of the check and the tags it uses."""
+        visitor = InlineQATreeVisitor(form=submission.form, submission=submission)
+
+        try:
+            result = self.visit(visitor)
+        except TypeError:
+            # tried to perform a math operation combining None and a number,
+            # most likely
+            return None, set()
+
+        return result, set(self.tags)
+
+
+def compile_inline_check(expression, form):
+    """Returns the (cached) compiled inline check of a QA expression."""
+    return _cached(
+        _inline_check_cache,
+        (form.id, form.version_identifier, expression),
+        InlineQACheck,
+        expression,
+        form,
+    )
+
+
+def get_inline_qa_status(submission, condition):
+    """QA status for inline rendering."""
+    control_expression = build_expression(condition)
+
+    # short-circuit for empty expression
+    if control_expression == "":
         return None, set()
 
-    return result, used_tags
+    return compile_inline_check(control_expression, submission.form)(submission)
 
 
 def build_expression(logical_check):
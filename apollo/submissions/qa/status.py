@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Persisted quality assurance statuses.
+
+Evaluating every quality check of a form with the SQL expressions built by
+the query builder is expensive, and the QA list, its filters and the QA
+dashboard used to do it for every submission on every request. Instead, the
+status of each check (Flagged, Verified, OK or Missing) is stored for every
+observer submission in `Submission.qa_status`, a JSONB object indexed with
+GIN, so that the readers become indexed lookups.
+
+The statuses are evaluated in the database whenever a submission is written
+and are rebuilt for all the submissions of a form, with `rebuild_qa_status`
+(exposed as a CLI command and a Celery task), when its quality checks or
+fields change. Like the coverage counters, the statuses are only read while
+the signature recorded on the form matches the current one; otherwise the
+readers evaluate the checks as before.
+"""
+
+import hashlib
+import json
+
+import sqlalchemy as sa
+from sqlalchemy.orm.attributes import set_committed_value
+
+from apollo.core import db
+from apollo.formsframework.models import Form
+from apollo.locations.models import Location
+from apollo.participants.models import Participant
+from apollo.submissions.models import FLAG_CHOICES, Submission
+from apollo.submissions.qa.query_builder import build_expression, generate_qa_queries
+
+FLAGGED = "Flagged"
+MISSING = "Missing"
+OK = "OK"
+VERIFIED = "Verified"
+
+# maps the conditions of the QA filter to the statuses they select
+CONDITION_STATUSES = {
+    FLAG_CHOICES[0][0]: (FLAGGED,),
+    FLAG_CHOICES[1][0]: (MISSING, None),
+    FLAG_CHOICES[2][0]: (OK,),
+    FLAG_CHOICES[3][0]: (VERIFIED,),
+}
+
+
+def qa_signature(form):
+    """Fingerprint of the form attributes that the QA statuses depend on."""
+    checks = sorted((check["name"], build_expression(check)) for check in form.quality_checks or [])
+    fields = [
+        (tag, field.get("type"), field.get("min"), field.get("max"))
+        for tag in form.tags
+        for field in [form.get_field_by_tag(tag)]
+    ]
+    payload = json.dumps([checks, fields], default=str)
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+def qa_status_available(form):
+    """Checks that the stored QA statuses of the form are up to date."""
+    if not form.quality_checks:
+        return False
+
+    return form.qa_status_signature == qa_signature(form)
+
+
+def _joins(form):
+    """Join conditions for the lookups used by the quality checks."""
+    expressions = [build_expression(check) for check in form.quality_checks]
+    joins = []
+    if any("$location" in expression for expression in expressions):
+        joins.append(Location.id == Submission.location_id)
+    if any("$participant" in expression for expression in expressions):
+        joins.append(Participant.id == Submission.participant_id)
+
+    return joins
+
+
+def _status_object(form):
+    case_queries, _tag_groups = generate_qa_queries(form)
+    return sa.func.jsonb_build_object(
+        *[
+            argument
+            for check, case_query in zip(form.quality_checks, case_queries)
+            for argument in (sa.literal(check["name"]), case_query.element)
+        ]
+    )
+
+
+def update_qa_status(*submissions):
+    """Evaluates and stores the QA statuses of the submissions.
+
+    The statements run in the current transaction, so the statuses are
+    committed together with the submissions.
+    """
+    submissions = [
+        submission
+        for submission in submissions
+        if submission is not None and submission.id is not None and submission.submission_type == "O"
+    ]
+    if not submissions:
+        return
+
+    form = submissions[0].form
+    if not form.quality_checks:
+        return
+
+    by_id = {submission.id: submission for submission in submissions}
+    # the 'updated' column is kept as is, since it is used as the
+    # submission timestamp by the analysis views
+    statement = (
+        sa.update(Submission)
+        .where(Submission.id.in_(list(by_id)), *_joins(form))
+        .values(qa_status=_status_object(form), updated=Submission.updated)
+        .returning(Submission.id, Submission.qa_status)
+        .execution_options(synchronize_session=False)
+    )
+    for submission_id, qa_status in db.session.execute(statement):
+        set_committed_value(by_id[submission_id], "qa_status", qa_status)
+
+
+def rebuild_qa_status(form, event=None):
+    """Recomputes the QA statuses of the submissions of a form.
+
+    If an event is given and the stored statuses are up to date, only the
+    submissions of that event are recomputed.
+    """
+    filters = [Submission.form_id == form.id, Submission.submission_type == "O"]
+    signature = qa_signature(form) if form.quality_checks else None
+    if event is not None and signature is not None and form.qa_status_signature == signature:
+        filters.append(Submission.event_id == event.id)
+
+    if signature is None:
+        status_object = sa.null()
+        joins = []
+    else:
+        status_object = _status_object(form)
+        joins = _joins(form)
+
+    db.session.execute(
+        sa.update(Submission)
+        .where(*filters, *joins)
+        .values(qa_status=status_object, updated=Submission.updated)
+        .execution_options(synchronize_session=False)
+    )
+    # the form version is kept as is, since it identifies the form schema
+    db.session.execute(
+        sa.update(Form)
+        .where(Form.id == form.id)
+        .values(qa_status_signature=signature, version_identifier=Form.version_identifier)
+        .execution_options(synchronize_session=False)
+    )
+    set_committed_value(form, "qa_status_signature", signature)
+
+    db.session.commit()
+
+
+def qa_status_columns(form):
+    """Returns the status columns of the quality checks of a form.
+
+    The columns are labelled with the names of the checks.
+    """
+    if qa_status_available(form):
+        return [Submission.qa_status[check["name"]].astext.label(check["name"]) for check in form.quality_checks]
+
+    return generate_qa_queries(form)[0]
+
+
+def qa_status_filter(check_names, condition):
+    """Filter for the submissions with any of the checks in a condition."""
+    clauses = [
+        Submission.qa_status.contains({name: status})
+        for name in check_names
+        for status in CONDITION_STATUSES.get(condition, ())
+    ]
+
+    return sa.or_(*clauses) if clauses else sa.false()
+
+
+def get_qa_status_counts(query, form):
+    """Returns the number of submissions per status for every check.
+
+    The counts are read from the stored statuses with a single query and
+    returned as a dictionary mapping the check names to the counts of each
+    status.
+    """
+    statuses = sa.func.jsonb_each_text(Submission.qa_status).table_valued("key", "value").render_derived()
+    rows = (
+        query.join(statuses, sa.true())
+        .with_entities(statuses.c.key, statuses.c.value, sa.func.count())
+        .group_by(statuses.c.key, statuses.c.value)
+        .order_by(None)
+    )
+
+    counts = {}
+    for name, status, count in rows:
+        counts.setdefault(name, {})[status] = count
+
+    return counts
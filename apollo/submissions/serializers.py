@@ -1,8 +1,20 @@
 # -*- coding: utf-8 -*-
 import calendar
-import json
 
-from apollo.dal.serializers import ArchiveSerializer
+import sqlalchemy as sa
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy.orm import joinedload
+
+from apollo.core import db
+from apollo.dal.serializers import (
+    ArchiveSerializer,
+    keyset_chunks,
+    serialize_chunks,
+    staged_json,
+    staged_timestamp,
+    staged_uuid,
+)
 from apollo.formsframework.models import Form
 from apollo.locations.models import Location
 from apollo.participants.models import Participant
@@ -28,6 +40,7 @@ class SubmissionSerializer(object):
             'data': obj.data,
             'extra_data': obj.extra_data,
             'submission_type': obj.submission_type.code,
+            'serial_no': obj.serial_no,
             'created': calendar.timegm(obj.created.utctimetuple()),
             'updated': calendar.timegm(obj.updated.timetuple())
             if obj.updated else None,
@@ -44,16 +57,66 @@ class SubmissionSerializer(object):
 
 
 class SubmissionArchiveSerializer(ArchiveSerializer):
-    def deserialize(self, zip_file):
-        return super().deserialize(zip_file)
-
-    def serialize(self, event, zip_file):
-        query = Submission.query.filter_by(
-            event_id=event.id).join(Form).join(Location).join(Participant)
-        serializer = SubmissionSerializer()
-
-        with zip_file.open('submissions.ndjson', 'w') as f:
-            for sub in query:
-                data = serializer.serialize_one(sub)
-                line = f'{json.dumps(data)}\n'
-                f.write(line.encode('utf-8'))
+    def deserialize(self, archive, event):
+        table = archive.table('submissions.ndjson')
+        if table is None:
+            return
+
+        record = table.c.record
+        overridden_fields = func.jsonb_array_elements_text(
+            staged_json(record['overridden_fields'])).table_valued('value')
+        query = sa.select(
+            staged_uuid(record['uuid']),
+            sa.literal(event.deployment_id),
+            sa.literal(event.id),
+            Form.id,
+            Participant.id,
+            Location.id,
+            staged_json(record['data']),
+            staged_json(record['extra_data']),
+            record['submission_type'].astext,
+            record['serial_no'].astext,
+            staged_timestamp(record['created']),
+            staged_timestamp(record['updated']),
+            sa.cast(record['sender_verified'].astext, sa.Boolean),
+            record['quarantine_status'].astext,
+            record['verification_status'].astext,
+            record['incident_description'].astext,
+            record['incident_status'].astext,
+            func.coalesce(
+                sa.select(
+                    func.array_agg(overridden_fields.c.value)
+                ).scalar_subquery(),
+                sa.literal([], ARRAY(sa.String))),
+            sa.false(),
+            sa.literal([], JSONB)
+        ).select_from(table).join(Form, sa.and_(
+            Form.id.in_([form.id for form in event.forms]),
+            Form.uuid == staged_uuid(record['form']))
+        ).join(Location, sa.and_(
+            Location.location_set_id == event.location_set_id,
+            Location.uuid == staged_uuid(record['location']))
+        ).outerjoin(Participant, sa.and_(
+            Participant.participant_set_id == event.participant_set_id,
+            Participant.uuid == staged_uuid(record['participant'])))
+        db.session.execute(sa.insert(Submission).from_select(
+            ['uuid', 'deployment_id', 'event_id', 'form_id', 'participant_id',
+             'location_id', 'data', 'extra_data', 'submission_type',
+             'serial_no', 'created', 'updated', 'sender_verified',
+             'quarantine_status', 'verification_status',
+             'incident_description', 'incident_status', 'overridden_fields',
+             'unreachable', 'verified_fields'], query))
+
+    def serialize(self, event, archive):
+        archive.add(
+            'submissions.ndjson', self.serialize_submissions, event.id)
+
+    def serialize_submissions(self, event_id):
+        # master submissions have no participant
+        query = Submission.query.filter_by(event_id=event_id).options(
+            joinedload(Submission.form).load_only(Form.uuid),
+            joinedload(Submission.participant).load_only(Participant.uuid),
+            joinedload(Submission.location).load_only(Location.uuid))
+
+        yield from serialize_chunks(
+            SubmissionSerializer(), keyset_chunks(query, Submission.id))
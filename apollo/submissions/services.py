@@ -1,19 +1,28 @@
 # -*- coding: utf-8 -*-
 import csv
+from collections import defaultdict
 from io import StringIO
+from itertools import islice
 
 import sqlalchemy as sa
 from dateutil.parser import isoparse
 from flask_babel import gettext as _
 from geoalchemy2.shape import to_shape
+from sqlalchemy.orm import selectinload
 
 from apollo import constants
+from apollo.core import db
 from apollo.dal.service import Service
-from apollo.locations.models import LocationType, LocationTypePath
-from apollo.participants.models import Sample
+from apollo.locations.models import (
+    Location, LocationPath, LocationType, LocationTypePath)
+from apollo.participants.models import (
+    Participant, Sample, samples_participants)
 from apollo.submissions.models import (
     Submission, SubmissionComment, SubmissionVersion)
-from apollo.submissions.qa.query_builder import generate_qa_queries
+from apollo.submissions.qa.status import qa_status_columns
+
+# number of submissions fetched from the server-side cursor at a time
+EXPORT_CHUNK_SIZE = 1000
 
 
 def export_field_value(form, submission, tag):
@@ -41,16 +50,97 @@ def export_timestamp(ts_string: str) -> str:
     return dt.strftime('%Y-%m-%d %H:%M:%S')
 
 
+def chunked(iterable, size):
+    """Splits an iterable into lists of at most `size` items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def prefetch_export_data(submissions):
+    """Loads the data related to a chunk of exported submissions in bulk.
+
+    Loads the locations (with their paths), the participants (with their
+    phone contacts), the sample memberships, the first comment of each
+    observer submission and the first observer submission of each master
+    submission, so that exporting the chunk does not issue a query per
+    submission. The returned dictionary also holds on to the loaded objects
+    so that they are not evicted from the session identity map.
+    """
+    location_ids = {s.location_id for s in submissions}
+    observer_ids = [s.id for s in submissions if s.submission_type == 'O']
+    masters = [s for s in submissions if s.submission_type == 'M']
+
+    siblings = {}
+    if masters:
+        observers = Submission.query.filter(
+            Submission.deployment_id == masters[0].deployment_id,
+            Submission.event_id == masters[0].event_id,
+            Submission.form_id == masters[0].form_id,
+            Submission.submission_type == 'O',
+            Submission.location_id.in_({s.location_id for s in masters}),
+        ).order_by(Submission.id)
+        for observer in observers:
+            siblings.setdefault(
+                (observer.location_id, observer.serial_no), observer)
+
+    participant_ids = {
+        s.participant_id
+        for s in [*submissions, *siblings.values()] if s.participant_id}
+    participants = Participant.query.options(
+        selectinload(Participant.phone_contacts)
+    ).filter(Participant.id.in_(participant_ids)).all()
+
+    samples = defaultdict(set)
+    memberships = db.session.execute(
+        sa.select(
+            samples_participants.c.participant_id,
+            samples_participants.c.sample_id
+        ).where(samples_participants.c.participant_id.in_(participant_ids)))
+    for participant_id, sample_id in memberships:
+        samples[participant_id].add(sample_id)
+
+    comments = SubmissionComment.query.filter(
+        SubmissionComment.submission_id.in_(observer_ids)
+    ).distinct(SubmissionComment.submission_id).order_by(
+        SubmissionComment.submission_id, SubmissionComment.id)
+
+    locations = Location.query.filter(Location.id.in_(location_ids)).all()
+    ancestors = db.session.query(LocationPath.descendant_id, Location).join(
+        Location, Location.id == LocationPath.ancestor_id
+    ).filter(LocationPath.descendant_id.in_(location_ids)).all()
+    paths = defaultdict(dict)
+    for descendant_id, ancestor in ancestors:
+        paths[descendant_id][ancestor.location_type.name] = ancestor.name
+    for location in locations:
+        location._cached_path = paths[location.id]
+
+    return {
+        'locations': locations,
+        'ancestors': ancestors,
+        'participants': participants,
+        'samples': samples,
+        'comments': {c.submission_id: c for c in comments},
+        'siblings': siblings,
+    }
+
+
 class SubmissionService(Service):
     __model__ = Submission
 
     def export_list(
-            self, query, include_qa=False, include_group_timestamps=False
+            self, query, include_qa=False, include_group_timestamps=False,
+            progress=None
         ):
-        if query.count() == 0:
-            raise StopIteration
-
+        # `progress`, if given, is called with the number of submissions
+        # exported after every chunk
         submission = query.first()
+        if submission is None:
+            return
+
         event = submission.event
         form = submission.form
         extra_fields = event.location_set.extra_fields
@@ -90,7 +180,7 @@ class SubmissionService(Service):
         if export_qa:
             query = query.with_entities(
                 Submission,
-                *generate_qa_queries(form)[0],
+                *qa_status_columns(form),
             )
         quality_checks = form.quality_checks if export_qa else []
 
@@ -124,134 +214,151 @@ class SubmissionService(Service):
                     dataset_headers.extend(
                         [qc['description'] for qc in quality_checks])
 
+        # a single buffer and writer are reused for the whole export and
+        # the rows are streamed from a server-side cursor a chunk at a time
         output = StringIO()
         output.write(constants.BOM_UTF8_STR)
         writer = csv.writer(output)
         writer.writerow(dataset_headers)
         yield output.getvalue()
-        output.close()
 
-        for item in query:
-            if export_qa:
-                row_dict = item._asdict()
-                submission = row_dict['Submission']
-            else:
-                submission = item
-                row_dict = {}
-            location_path = submission.location.make_path()
-            group_timestamps = (submission.extra_data or {}).get(
-                'group_timestamps', {})
-            if submission.submission_type == 'O':
-                if submission.location.extra_data:
-                    extra_data_columns = [
-                        submission.location.extra_data.get(ef.name)
-                        for ef in extra_fields
-                    ]
+        processed = 0
+        for chunk in chunked(query.yield_per(EXPORT_CHUNK_SIZE),
+                             EXPORT_CHUNK_SIZE):
+            output.seek(0)
+            output.truncate()
+            related = prefetch_export_data(
+                [item[0] if export_qa else item for item in chunk])
+
+            for item in chunk:
+                if export_qa:
+                    row_dict = item._asdict()
+                    submission = row_dict['Submission']
                 else:
-                    extra_data_columns = [''] * len(extra_fields)
-
-                record = [submission.serial_no] if form.form_type == 'SURVEY' else []   # noqa
-
-                record.extend([
-                    submission.participant.participant_id
-                    if submission.participant else '',
-                    submission.participant.name
-                    if submission.participant else '',
-                    submission.participant.primary_phone
-                    if submission.participant else '',
-                    submission.last_phone_number if submission.last_phone_number else '',   # noqa
-                ] + [
-                    location_path.get(loc_type.name, '')
-                    for loc_type in location_types
-                ] + [
-                    submission.location.name,
-                    submission.location.code,
-                    to_shape(submission.geom).y if hasattr(submission.geom, 'desc') else '',  # noqa
-                    to_shape(submission.geom).x if hasattr(submission.geom, 'desc') else ''  # noqa
-                ] + extra_data_columns + [
-                    submission.location.registered_voters
-                ])
-
-                for group_name in form_groups:
-                    if include_group_timestamps:
-                        record.append(
-                            export_timestamp(group_timestamps.get(group_name, '')))
+                    submission = item
+                    row_dict = {}
+                location_path = submission.location.make_path()
+                group_timestamps = (submission.extra_data or {}).get(
+                    'group_timestamps', {})
+                if submission.submission_type == 'O':
+                    sample_ids = related['samples'][submission.participant_id]
+                    comment = related['comments'].get(submission.id)
+                    if submission.location.extra_data:
+                        extra_data_columns = [
+                            submission.location.extra_data.get(ef.name)
+                            for ef in extra_fields
+                        ]
+                    else:
+                        extra_data_columns = [''] * len(extra_fields)
+
+                    record = [submission.serial_no] if form.form_type == 'SURVEY' else []   # noqa
+
                     record.extend([
-                        export_field_value(form, submission, tag)
-                        for tag in group_tags.get(group_name)
+                        submission.participant.participant_id
+                        if submission.participant else '',
+                        submission.participant.name
+                        if submission.participant else '',
+                        submission.participant.primary_phone
+                        if submission.participant else '',
+                        submission.last_phone_number if submission.last_phone_number else '',   # noqa
+                    ] + [
+                        location_path.get(loc_type.name, '')
+                        for loc_type in location_types
+                    ] + [
+                        submission.location.name,
+                        submission.location.code,
+                        to_shape(submission.geom).y if hasattr(submission.geom, 'desc') else '',  # noqa
+                        to_shape(submission.geom).x if hasattr(submission.geom, 'desc') else ''  # noqa
+                    ] + extra_data_columns + [
+                        submission.location.registered_voters
                     ])
 
-                record += [
-                    submission.updated.strftime('%Y-%m-%d %H:%M:%S')
-                    if submission.updated else '',
-                    submission.incident_status.value
-                    if submission.incident_status else '',
-                    submission.incident_description
-                ] if form.form_type == 'INCIDENT' else ([
-                    submission.updated.strftime('%Y-%m-%d %H:%M:%S')
-                    if submission.updated else ''] + [
-                        1 if sample in submission.participant.samples else 0
-                        for sample in samples] + [
-                                submission.comments[0].comment.replace('\n', '') # noqa
-                                if submission.comments else '',
-                                submission.quarantine_status.value
-                                if submission.quarantine_status else '',
-                            ])
-
-                if export_qa:
-                    record.extend(
-                        [row_dict[qc['name']] for qc in quality_checks])
-            else:
-                sib = submission.siblings[0]
-                if submission.location.extra_data:
-                    extra_data_columns = [
-                        submission.location.extra_data.get(ef.name)
-                        for ef in extra_fields
-                    ]
+                    for group_name in form_groups:
+                        if include_group_timestamps:
+                            record.append(
+                                export_timestamp(group_timestamps.get(group_name, '')))
+                        record.extend([
+                            export_field_value(form, submission, tag)
+                            for tag in group_tags.get(group_name)
+                        ])
+
+                    record += [
+                        submission.updated.strftime('%Y-%m-%d %H:%M:%S')
+                        if submission.updated else '',
+                        submission.incident_status.value
+                        if submission.incident_status else '',
+                        submission.incident_description
+                    ] if form.form_type == 'INCIDENT' else ([
+                        submission.updated.strftime('%Y-%m-%d %H:%M:%S')
+                        if submission.updated else ''] + [
+                            1 if sample.id in sample_ids else 0
+                            for sample in samples] + [
+                                    comment.comment.replace('\n', '')
+                                    if comment else '',
+                                    submission.quarantine_status.value
+                                    if submission.quarantine_status else '',
+                                ])
+
+                    if export_qa:
+                        record.extend(
+                            [row_dict[qc['name']] for qc in quality_checks])
                 else:
-                    extra_data_columns = [''] * len(extra_fields)
-
-                record = [sib.serial_no] if form.form_type == 'SURVEY' else []
-
-                record.extend([
-                    sib.participant.participant_id
-                    if sib.participant else '',
-                    sib.participant.name
-                    if sib.participant else '',
-                    sib.participant.primary_phone
-                    if sib.participant else '',
-                    sib.last_phone_number if sib.last_phone_number else '',
-                ] + [
-                    location_path.get(loc_type.name, '')
-                    for loc_type in location_types
-                ] + [
-                    submission.location.name,
-                    submission.location.code,
-                    to_shape(sib.geom).y if hasattr(sib.geom, 'desc') else '', # noqa
-                    to_shape(sib.geom).x if hasattr(sib.geom, 'desc') else '', # noqa
-                ] + extra_data_columns + [
-                    submission.location.registered_voters
-                ])
-
-                for group_name in form_groups:
-                    record.append(
-                        export_timestamp(group_timestamps.get(group_name, '')))
+                    sib = related['siblings'].get(
+                        (submission.location_id, submission.serial_no)
+                    ) or submission.siblings[0]
+                    if submission.location.extra_data:
+                        extra_data_columns = [
+                            submission.location.extra_data.get(ef.name)
+                            for ef in extra_fields
+                        ]
+                    else:
+                        extra_data_columns = [''] * len(extra_fields)
+
+                    record = [sib.serial_no] if form.form_type == 'SURVEY' else []
+
                     record.extend([
-                        export_field_value(form, submission, tag)
-                        for tag in group_tags.get(group_name)
+                        sib.participant.participant_id
+                        if sib.participant else '',
+                        sib.participant.name
+                        if sib.participant else '',
+                        sib.participant.primary_phone
+                        if sib.participant else '',
+                        sib.last_phone_number if sib.last_phone_number else '',
+                    ] + [
+                        location_path.get(loc_type.name, '')
+                        for loc_type in location_types
+                    ] + [
+                        submission.location.name,
+                        submission.location.code,
+                        to_shape(sib.geom).y if hasattr(sib.geom, 'desc') else '', # noqa
+                        to_shape(sib.geom).x if hasattr(sib.geom, 'desc') else '', # noqa
+                    ] + extra_data_columns + [
+                        submission.location.registered_voters
                     ])
 
-                record += [
-                    submission.updated.strftime('%Y-%m-%d %H:%M:%S')
-                    if submission.updated else ''] + [
-                        1 if sample in sib.participant.samples else 0
-                        for sample in samples]
+                    for group_name in form_groups:
+                        record.append(
+                            export_timestamp(group_timestamps.get(group_name, '')))
+                        record.extend([
+                            export_field_value(form, submission, tag)
+                            for tag in group_tags.get(group_name)
+                        ])
+
+                    record += [
+                        submission.updated.strftime('%Y-%m-%d %H:%M:%S')
+                        if submission.updated else ''] + [
+                            1 if sample.id in related['samples'][sib.participant_id]
+                            else 0 for sample in samples]
+
+                writer.writerow(record)
 
-            output = StringIO()
-            writer = csv.writer(output)
-            writer.writerow(record)
             yield output.getvalue()
-            output.close()
+
+            processed += len(chunk)
+            if progress is not None:
+                progress(processed)
+
+        output.close()
 
 
 class SubmissionCommentService(Service):
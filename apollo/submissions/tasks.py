@@ -4,13 +4,23 @@ import os
 
 from celery import shared_task
 from flask_babel import gettext
+from sqlalchemy.orm import joinedload
+from sqlalchemy.sql import false
+from werkzeug.datastructures import MultiDict
 
-from apollo import helpers, models
+from apollo import helpers, models, services
 from apollo.core import uploads
+from apollo.dal import utils
 from apollo.participants.models import Participant
 
 from ..models import Submission
+from ..users.exports import run_export, write_chunks
 from ..users.models import UserUpload
+from . import filters
+from .aggregation import aggregate_dataset
+from .coverage import rebuild_coverage as _rebuild_coverage
+from .indexes import sync_indexes
+from .qa.status import rebuild_qa_status as _rebuild_qa_status
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +38,10 @@ def init_submissions(self, event_id, form_id, role_id, location_type_id, channel
 
     models.Submission.init_submissions(event, form, role, location_type, self)
 
+    # the new checklists are counted as missing on the dashboard
+    _rebuild_coverage(event, form)
+    _rebuild_qa_status(form, event)
+
 
 @shared_task(bind=True)
 def init_survey_submissions(self, event_id, form_id, upload_id):
@@ -164,3 +178,150 @@ def init_survey_submissions(self, event_id, form_id, upload_id):
                     "error_log": error_log,
                 },
             )
+
+    _rebuild_coverage(event, form)
+    _rebuild_qa_status(form, event)
+
+
+@shared_task
+def rebuild_coverage(event_id, form_id):
+    """Rebuild the response rate counters for an event and form."""
+    event = models.Event.query.filter_by(id=event_id).first()
+    form = models.Form.query.filter_by(id=form_id).first()
+
+    if not (event and form):
+        return
+
+    _rebuild_coverage(event, form)
+
+
+@shared_task
+def rebuild_qa_status(form_id):
+    """Rebuild the stored QA statuses of the submissions of a form."""
+    form = models.Form.query.filter_by(id=form_id).first()
+
+    if not form:
+        return
+
+    _rebuild_qa_status(form)
+
+
+@shared_task
+def sync_submission_indexes(form_id):
+    """Build the missing expression indexes of a form and drop the unused ones."""
+    created, dropped = sync_indexes(form_id)
+    if created or dropped:
+        logger.info("Form %s: created indexes %s, dropped indexes %s", form_id, created, dropped)
+
+
+def _submission_export_query(event, form, mode, args, participant_id=None):
+    """Builds the query for a submission export from the request arguments."""
+    query = models.Submission.query.options(joinedload(models.Submission.form))
+
+    # exports are not normally available to field coordinators, but the
+    # export is limited to their locations in case they are given access
+    participant = models.Participant.query.get(participant_id) if participant_id else None
+    if participant:
+        _location_query = (
+            models.Location.query.with_entities(models.Location.id)
+            .join(models.LocationPath, models.Location.id == models.LocationPath.descendant_id)
+            .filter(models.LocationPath.ancestor_id == participant.location_id)
+        )
+        query = query.filter(models.Submission.location_id.in_(_location_query))
+
+    filter_class = filters.make_submission_list_filter(event, form)
+    query = filter_class(query, args).qs
+
+    if mode in ["master", "aggregated"]:
+        submission_type = "M"
+
+        # only change the submission type if we are aggregating data
+        # and are not tracking conflicts
+        if mode == "aggregated" and form.untrack_data_conflicts == True:  # noqa
+            submission_type = "O"
+
+        queryset = query.filter(
+            models.Submission.submission_type == submission_type,
+            models.Submission.form == form,
+            models.Submission.event == event,
+        )
+        if utils.has_model(queryset, models.Location):
+            queryset = queryset.order_by(models.Location.code)
+        else:
+            queryset = queryset.join(models.Submission.location).order_by(models.Location.code)
+    else:
+        queryset = query.filter(
+            models.Submission.submission_type == "O",
+            models.Submission.form == form,
+            models.Submission.event == event,
+        )
+        if not utils.has_model(queryset, models.Location):
+            queryset = queryset.join(models.Submission.location)
+        queryset = queryset.join(
+            models.Participant,
+            models.Submission.participant_id == models.Participant.id,
+        ).order_by(models.Location.code, models.Participant.participant_id)
+
+    return queryset
+
+
+@shared_task(bind=True)
+def export_submissions(self, export_id, event_id, form_id, mode, args, participant_id=None, locale=None, channel=None):
+    """Export the submissions of a form to a CSV file."""
+    event = models.Event.query.filter_by(id=event_id).first()
+    form = models.Form.query.filter_by(id=form_id).first()
+
+    def write(fileobj, report_progress):
+        queryset = _submission_export_query(event, form, mode, MultiDict(args), participant_id)
+        if mode == "aggregated":
+            # TODO: you want to change the float format or even remove it
+            # if you have columns that have float values
+            write_chunks(fileobj, aggregate_dataset(queryset.order_by(None), form, True))
+            return
+
+        total_records = queryset.order_by(None).count()
+        report_progress(0, total_records)
+        dataset = services.submissions.export_list(
+            queryset,
+            include_group_timestamps=mode == "observer-ts",
+            progress=lambda processed_records: report_progress(processed_records, total_records),
+        )
+        write_chunks(fileobj, dataset)
+
+    run_export(self, export_id, write, locale)
+
+
+@shared_task(bind=True)
+def export_quality_assurance(self, export_id, event_id, form_id, args, locale=None, channel=None):
+    """Export the quality assurance results of a form to a CSV file."""
+    event = models.Event.query.filter_by(id=event_id).first()
+    form = models.Form.query.filter_by(id=form_id).first()
+
+    def write(fileobj, report_progress):
+        if form.quality_checks:
+            queryset = (
+                models.Submission.query.filter(
+                    models.Submission.submission_type == "O",
+                    models.Submission.form == form,
+                    models.Submission.event == event,
+                )
+                .join(models.Submission.location)
+                .join(models.Submission.participant)
+                .order_by(models.Submission.location_id, models.Submission.participant_id)
+            )
+        else:
+            queryset = models.Submission.query.filter(false())
+
+        filter_class = filters.generate_quality_assurance_filter(event, form)
+        queryset = filter_class(queryset, MultiDict(args)).qs
+
+        total_records = queryset.order_by(None).count()
+        report_progress(0, total_records)
+        dataset = services.submissions.export_list(
+            queryset,
+            include_qa=True,
+            progress=lambda processed_records: report_progress(processed_records, total_records),
+        )
+        write_chunks(fileobj, dataset)
+
+    run_export(self, export_id, write, locale)
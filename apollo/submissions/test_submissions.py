@@ -1,15 +1,111 @@
-from unittest import TestCase
+import io
+import json
+import pickle
+from types import SimpleNamespace
+from unittest import TestCase, mock
 
 import numpy as np
 import pandas as pd
+import pytest
+from arpeggio import visit_parse_tree
+from flask import current_app
+from flask_babel import force_locale, get_locale
 
+from apollo import models
+from apollo.core import db
+from apollo.formsframework.models import Form
+from apollo.locations.ancestry import update_location_ancestry
+from apollo.submissions import dataframes, indexes, maps
 from apollo.submissions.aggregation import (
     _multiselect_field_processor,
     _numeric_field_processor,
     _select_field_processor,
 )
+from apollo.submissions.api import views as api_views
+from apollo.submissions.coverage import (
+    COMPLETE,
+    CONFLICT,
+    MISSING,
+    OFFLINE,
+    PARTIAL,
+    classify,
+    rebuild_coverage,
+)
+from apollo.submissions.dataframes import changed_rows, merge_dataframes
 from apollo.submissions.incidents import incidents_csv
-from apollo.submissions.qa.query_builder import build_expression
+from apollo.submissions.models import Submission, jsonb_contains
+from apollo.submissions.qa.query_builder import (
+    InlineQATreeVisitor,
+    build_expression,
+    compile_inline_check,
+    get_inline_qa_status,
+    parse_expression,
+)
+from apollo.submissions.qa.status import qa_signature, qa_status_available
+from apollo.submissions.services import chunked
+from apollo.submissions.utils import make_submission_dataframe, make_turnout_dataframe
+from apollo.submissions.views_submissions import update_master_submission
+
+
+def _create_checklist_event(name):
+    """Creates an event with a checklist, a region and two stations."""
+    deployment = models.Deployment(name=name, hostnames=[name])
+    location_set = models.LocationSet(name=name, deployment=deployment)
+    region_type = models.LocationType(
+        name_translations={'en': 'Region'}, location_set=location_set)
+    station_type = models.LocationType(
+        name_translations={'en': 'Station'}, location_set=location_set)
+    region = models.Location(
+        name_translations={'en': 'North'}, code=f'{name}-1',
+        location_set=location_set, location_type=region_type)
+    stations = [
+        models.Location(
+            name_translations={'en': f'Station {index}'},
+            code=f'{name}-1{index}', location_set=location_set,
+            location_type=station_type)
+        for index in (1, 2)
+    ]
+    participant_set = models.ParticipantSet(
+        name=name, deployment=deployment, location_set=location_set)
+    role = models.ParticipantRole(
+        name='Observer', participant_set=participant_set)
+    event = models.Event(
+        name=name, deployment=deployment, location_set=location_set,
+        participant_set=participant_set)
+    fields = [
+        {'tag': tag, 'type': 'integer', 'analysis_type': 'N/A'}
+        for tag in ('AA', 'AB')
+    ]
+    form = models.Form(
+        name=name, prefix='TC', form_type='CHECKLIST', deployment=deployment,
+        events=[event], data={'groups': [
+            {'name': 'Opening', 'slug': 'opening', 'fields': fields}]})
+    db.session.add_all(
+        [region_type, station_type, region, *stations, role, event, form])
+    db.session.flush()
+
+    db.session.add_all([
+        models.LocationTypePath(
+            location_set=location_set, ancestor_id=ancestor.id,
+            descendant_id=descendant.id, depth=depth)
+        for ancestor, descendant, depth in (
+            (region_type, region_type, 0), (station_type, station_type, 0),
+            (region_type, station_type, 1))
+    ])
+    db.session.add_all([
+        models.LocationPath(
+            location_set=location_set, ancestor_id=ancestor.id,
+            descendant_id=descendant.id, depth=depth)
+        for ancestor, descendant, depth in [(region, region, 0)] + [
+            path for station in stations
+            for path in ((station, station, 0), (region, station, 1))]
+    ])
+    db.session.commit()
+
+    return SimpleNamespace(
+        deployment=deployment, location_set=location_set,
+        participant_set=participant_set, role=role, event=event, form=form,
+        region=region, stations=stations, station_type=station_type)
 
 
 class IncidentsTest(TestCase):
@@ -92,3 +188,607 @@ class ExpressionBuilderTestCase(TestCase):
 
         expression = build_expression(valid_controls)
         self.assertEqual(expression, 'AA = 1 && BA = 1 || BH = EJ')
+
+
+def _uncompiled_qa_status(expression, visitor, tags):
+    try:
+        return visit_parse_tree(parse_expression(expression), visitor), tags
+    except TypeError:
+        return None, set()
+
+
+class InlineQACheckTest(TestCase):
+    def setUp(self):
+        self.form = Form(
+            id=1,
+            version_identifier='v1',
+            data={'groups': [{'name': 'A', 'fields': [
+                {'tag': 'AA', 'type': 'integer'},
+                {'tag': 'AB', 'type': 'integer'},
+                {'tag': 'AC', 'type': 'multiselect'},
+                {'tag': 'AD', 'type': 'string'},
+            ]}]})
+
+    def _submission(self, data):
+        return SimpleNamespace(
+            form=self.form, data=data, serial_no=None,
+            location=SimpleNamespace(registered_voters=100, extra_data={'X': 5}),
+            participant=SimpleNamespace(extra_data=None))
+
+    def test_compiled_checks_match_the_visitor(self):
+        expressions = [
+            'AA > 2', 'AA + AB = 5', '-AA < 0', 'AA ^ 2 >= AB * 3',
+            '(AA - 1) / 2 = 1', 'AA > 1 && AB < 3 || AA = 0', 'AA = NULL',
+            'AC = 1', 'AZ > 1', 'AA | AB = 12', 'AD = AD',
+            '$location.registered_voters > AA', '$location@X = AA',
+            '$participant@X = AA', '$submission.serial_no = AA',
+        ]
+        submissions = [
+            self._submission({'AA': 3, 'AB': 2, 'AC': [1], 'AD': 'a'}),
+            self._submission({'AA': 1}),
+            self._submission({'AA': None, 'AB': 4}),
+            self._submission({}),
+        ]
+
+        def outcome(function, *args):
+            try:
+                result, tags = function(*args)
+            except Exception as exc:
+                return type(exc)
+            return str(result), tags
+
+        for expression in expressions:
+            check = compile_inline_check(expression, self.form)
+            for submission in submissions:
+                visitor = InlineQATreeVisitor(
+                    form=self.form, submission=submission)
+                self.assertEqual(
+                    outcome(check, submission),
+                    outcome(
+                        _uncompiled_qa_status, expression, visitor,
+                        check.tags),
+                    expression)
+
+    def test_compiled_checks_are_cached(self):
+        check = compile_inline_check('AA > 2', self.form)
+        self.assertIs(compile_inline_check('AA > 2', self.form), check)
+
+        self.form.version_identifier = 'v2'
+        self.assertIsNot(compile_inline_check('AA > 2', self.form), check)
+
+        status = get_inline_qa_status(
+            self._submission({'AA': 3}),
+            {'lvalue': 'AA', 'comparator': '>', 'rvalue': '2'})
+        self.assertEqual(status, (True, {'AA'}))
+
+
+class QAStatusSignatureTest(TestCase):
+    def setUp(self):
+        self.form = Form(
+            data={'groups': [{'name': 'A', 'fields': [
+                {'tag': 'AA', 'type': 'integer'},
+                {'tag': 'AB', 'type': 'integer'},
+            ]}]},
+            quality_checks=[
+                {'name': 'qa1', 'criteria': [
+                    {'lvalue': 'AA', 'comparator': '>', 'rvalue': '2'}]},
+                {'name': 'qa2', 'criteria': [
+                    {'lvalue': 'AB', 'comparator': '=', 'rvalue': 'AA'}]},
+            ])
+
+    def test_signature_ignores_the_order_of_the_checks(self):
+        signature = qa_signature(self.form)
+        self.form.quality_checks = list(reversed(self.form.quality_checks))
+        self.assertEqual(qa_signature(self.form), signature)
+
+    def test_signature_changes_with_the_checks_and_fields(self):
+        signature = qa_signature(self.form)
+        self.form.quality_checks[0]['criteria'][0]['rvalue'] = '3'
+        self.assertNotEqual(qa_signature(self.form), signature)
+
+        signature = qa_signature(self.form)
+        self.form.data['groups'][0]['fields'][1]['type'] = 'string'
+        self.form._populate_field_cache()
+        self.assertNotEqual(qa_signature(self.form), signature)
+
+    def test_statuses_are_only_available_when_current(self):
+        self.assertFalse(qa_status_available(self.form))
+
+        self.form.qa_status_signature = qa_signature(self.form)
+        self.assertTrue(qa_status_available(self.form))
+
+        self.form.quality_checks = []
+        self.assertFalse(qa_status_available(self.form))
+
+
+class SubmissionDataIndexTest(TestCase):
+    def setUp(self):
+        self.form = Form(
+            id=12, form_type='INCIDENT', data={'groups': [{
+                'name': 'A', 'fields': [
+                    {'tag': 'AA', 'type': 'select', 'options': {'Yes': 1}},
+                    {'tag': 'AB', 'type': 'select', 'options': {'No': 2}},
+                ]}]})
+
+    def test_proposals(self):
+        # the option filter of the incident list is on the first select
+        # field
+        proposals = indexes.propose_indexes(self.form)
+        self.assertEqual(
+            [(proposal.tag, proposal.expression, proposal.reasons)
+             for proposal in proposals],
+            [('AA', "CAST(data ->> 'AA' AS INTEGER)",
+              [indexes.INCIDENT_FILTER])])
+        self.assertEqual(indexes.index_form_id(proposals[0].name), 12)
+        self.assertEqual(
+            indexes.create_statement(proposals[0]),
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON submission '
+            "((CAST(data ->> 'AA' AS INTEGER))) "
+            'WHERE form_id = 12'.format(proposals[0].name))
+
+        # the results and turnout fields are only selected, and the fields
+        # of the quality checks are compared with each other
+        checklist_form = Form(
+            id=13, form_type='CHECKLIST', turnout_fields=['AB'],
+            registered_voters_tag='AC',
+            data={'groups': [{'name': 'A', 'fields': [
+                {'tag': 'AA', 'type': 'integer', 'min': 0, 'max': 999,
+                 'analysis_type': 'RESULT'},
+                {'tag': 'AB', 'type': 'integer', 'min': 0, 'max': 999,
+                 'analysis_type': 'N/A'},
+                {'tag': 'AC', 'type': 'integer', 'min': 0, 'max': 9999,
+                 'analysis_type': 'N/A'},
+            ]}]},
+            quality_checks=[
+                {'name': 'qa1', 'criteria': [
+                    {'lvalue': 'AB', 'comparator': '<', 'rvalue': 'AA'}]},
+            ])
+        self.assertEqual(indexes.propose_indexes(checklist_form), [])
+
+    def test_sync(self):
+        wanted = [proposal.name for proposal in indexes.propose_indexes(self.form)]
+        unused = indexes.index_name(12, 'data')
+
+        with mock.patch.object(indexes, 'db') as db, \
+                mock.patch.object(
+                    indexes, 'existing_indexes',
+                    return_value=[wanted[0], unused]), \
+                mock.patch.object(indexes, 'create_index') as create_index, \
+                mock.patch.object(indexes, 'drop_index') as drop_index:
+            db.session.get.return_value = self.form
+            self.assertEqual(
+                indexes.sync_indexes(12), (sorted(wanted[1:]), [unused]))
+            self.assertEqual(create_index.call_count, len(wanted) - 1)
+            drop_index.assert_called_once_with(unused)
+
+            # all the indexes of archived forms are dropped
+            self.form.is_hidden = True
+            self.assertEqual(
+                indexes.sync_indexes(12), ([], sorted([wanted[0], unused])))
+
+
+class CoverageClassificationTest(TestCase):
+    def setUp(self):
+        self.group_tags = ['AA', 'AB', 'AC']
+        self.conflict_tags = ['AA', 'AB']
+
+    def _classify(self, data, conflicts=None, unreachable=False):
+        return classify(
+            data, conflicts, unreachable, self.group_tags, self.conflict_tags)
+
+    def test_completion_statuses(self):
+        self.assertEqual(self._classify({}), MISSING)
+        self.assertEqual(self._classify(None), MISSING)
+        self.assertEqual(self._classify({'AA': 1, 'ZZ': 3}), PARTIAL)
+        self.assertEqual(
+            self._classify({'AA': 1, 'AB': 2, 'AC': 3}), COMPLETE)
+
+    def test_conflict_status(self):
+        self.assertEqual(self._classify({'AA': 1}, ['AA']), CONFLICT)
+        self.assertEqual(
+            self._classify({'AA': 1, 'AB': 2, 'AC': 3}, ['AB']), CONFLICT)
+        # conflicts on fields outside the group are ignored
+        self.assertEqual(self._classify({'AA': 1}, ['BA']), PARTIAL)
+
+    def test_offline_status(self):
+        self.assertEqual(self._classify({}, unreachable=True), OFFLINE)
+        self.assertEqual(
+            self._classify({'AA': 1}, ['AA'], unreachable=True), OFFLINE)
+        self.assertEqual(
+            self._classify({'AA': 1, 'AB': 2, 'AC': 3}, unreachable=True),
+            COMPLETE)
+        self.assertIsNone(
+            self._classify(
+                {'AA': 1, 'AB': 2, 'AC': 3}, ['AA'], unreachable=True))
+
+    def test_group_without_fields(self):
+        self.assertEqual(classify({'AA': 1}, None, False, [], []), MISSING)
+
+
+@pytest.mark.usefixtures('db')
+class CoverageCounterTest(TestCase):
+    def _counts(self, setup, location):
+        counter = models.CoverageCounter.query.filter_by(
+            event_id=setup.event.id, form_id=setup.form.id,
+            group_name='Opening', location_id=location.id).one()
+
+        return counter.complete, counter.partial, counter.missing
+
+    def test_master_edits_update_the_counters(self):
+        setup = _create_checklist_event('coverage')
+        station = setup.stations[0]
+        master = Submission(
+            form=setup.form, event=setup.event, deployment=setup.deployment,
+            location=station, submission_type='M', data={})
+        db.session.add(master)
+        db.session.commit()
+        rebuild_coverage(setup.event, setup.form)
+        self.assertEqual(self._counts(setup, setup.region), (0, 0, 1))
+
+        update_master_submission(master, {'data': {'AA': 1}})
+        self.assertEqual(self._counts(setup, station), (0, 1, 0))
+        self.assertEqual(self._counts(setup, setup.region), (0, 1, 0))
+
+        update_master_submission(master, {'data': {'AA': 1, 'AB': 2}})
+        self.assertEqual(self._counts(setup, station), (1, 0, 0))
+        self.assertEqual(self._counts(setup, setup.region), (1, 0, 0))
+        self.assertEqual(master.coverage_status, {'Opening': COMPLETE})
+
+
+@pytest.mark.usefixtures('db')
+class InitSubmissionsTest(TestCase):
+    def test_init_submissions(self):
+        setup = _create_checklist_event('init')
+        locations = [*setup.stations, setup.stations[0], setup.region, None]
+        participants = [
+            models.Participant(
+                participant_id=str(index), role=setup.role,
+                participant_set=setup.participant_set, location=location)
+            for index, location in enumerate(locations, 1)
+        ]
+        db.session.add_all(participants)
+        db.session.commit()
+        task = mock.Mock()
+
+        for _run in range(2):
+            Submission.init_submissions(
+                setup.event, setup.form, setup.role, setup.station_type,
+                task)
+
+            # the checklists are only created once
+            submissions = Submission.query.filter_by(form_id=setup.form.id)
+            self.assertEqual(
+                sorted(
+                    (submission.participant_id, submission.location_id)
+                    for submission in submissions.filter_by(
+                        submission_type='O')),
+                sorted(
+                    (participant.id, participant.location_id)
+                    for participant in participants[:3]))
+            self.assertEqual(
+                sorted(
+                    submission.location_id
+                    for submission in submissions.filter_by(
+                        submission_type='M')),
+                sorted(station.id for station in setup.stations))
+
+            # the participants without a location of the type are skipped
+            meta = task.update_state.call_args.kwargs['meta']
+            self.assertEqual(meta['error_log'], [
+                {'label': 'ERROR',
+                 'message': 'Participant ID 5 has no location'},
+                {'label': 'ERROR',
+                 'message': 'Participant ID 4 has no location of type '
+                            'Station'},
+            ])
+            self.assertEqual(
+                (meta['processed_records'], meta['error_records']), (3, 2))
+
+
+@pytest.mark.usefixtures('db')
+class AncestryDataFrameTest(TestCase):
+    def _closure_table_names(self, submissions):
+        # the ancestor names of the location of each submission, as read
+        # from the location closure table
+        return {
+            submission.id: {
+                path.ancestor_location.location_type.name:
+                    path.ancestor_location.name
+                for path in submission.location.ancestor_paths
+            }
+            for submission in submissions
+        }
+
+    def test_ancestry_columns(self):
+        setup = _create_checklist_event('ancestry')
+        setup.region.name_translations = {'en': 'North', 'fr': 'Nord'}
+        setup.form.turnout_fields = ['AA']
+        submissions = [
+            Submission(
+                form=setup.form, event=setup.event,
+                deployment=setup.deployment, location=location,
+                submission_type='M', data={'AA': index})
+            for index, location in enumerate(
+                [*setup.stations, setup.region])
+        ]
+        db.session.add_all(submissions)
+        db.session.commit()
+        update_location_ancestry(setup.location_set.id)
+        db.session.commit()
+        query = Submission.query.filter_by(form_id=setup.form.id)
+
+        for locale in ('en', 'fr'):
+            with force_locale(locale):
+                expected = self._closure_table_names(submissions)
+                for builder in (
+                        make_submission_dataframe, make_turnout_dataframe):
+                    dataframe = builder(query, setup.form, index_by_id=True)
+                    names = dataframe[['Region', 'Station']].to_dict(
+                        orient='index')
+                    self.assertEqual(
+                        {
+                            submission_id: {
+                                location_type: name
+                                for location_type, name in row.items()
+                                if isinstance(name, str)}
+                            for submission_id, row in names.items()},
+                        expected)
+            self.assertEqual(
+                expected[submissions[0].id]['Region'],
+                'North' if locale == 'en' else 'Nord')
+
+
+class ConflictComputationTest(TestCase):
+    def setUp(self):
+        self.form = Form(
+            form_type='CHECKLIST', untrack_data_conflicts=False,
+            data={'groups': [{'name': 'Group', 'fields': [
+                {'tag': 'AA', 'type': 'integer', 'analysis_type': 'N/A'},
+                {'tag': 'AB', 'type': 'multiselect', 'analysis_type': 'N/A'},
+                {'tag': 'AC', 'type': 'integer', 'analysis_type': 'RESULT'},
+            ]}]})
+
+    def _submission(self, pk, data, quarantine_status=''):
+        return Submission(
+            id=pk, form=self.form, data=data, overridden_fields=[],
+            quarantine_status=quarantine_status, submission_type='O')
+
+    def test_jsonb_containment(self):
+        self.assertTrue(jsonb_contains(1, 1))
+        self.assertTrue(jsonb_contains(1, 1.0))
+        self.assertFalse(jsonb_contains(1, '1'))
+        self.assertFalse(jsonb_contains(1, True))
+        self.assertTrue(jsonb_contains([1, 2, 3], [3, 1]))
+        self.assertFalse(jsonb_contains([1, 2], [1, 4]))
+        self.assertFalse(jsonb_contains([1], 1))
+
+    def test_conflicts_between_observers(self):
+        submission = self._submission(1, {'AA': 1, 'AB': [1, 2], 'AC': 5})
+        observers = [
+            submission,
+            self._submission(2, {'AA': 1, 'AB': [1, 2, 3], 'AC': 6}),
+            self._submission(3, {'AA': 2}, 'A'),
+        ]
+
+        self.assertEqual(
+            submission.compute_conflict_tags(observers=observers), {'AC'})
+        self.assertFalse(
+            submission.compute_conflict_tags(['AA', 'AB'], observers))
+
+    def test_results_quarantine(self):
+        submission = self._submission(1, {'AA': 1, 'AC': 5})
+        observers = [
+            submission,
+            self._submission(2, {'AA': 2, 'AC': 6}, 'R'),
+        ]
+
+        self.assertEqual(
+            submission.compute_conflict_tags(observers=observers), {'AA'})
+
+
+class DataFrameCacheTest(TestCase):
+    def test_merge_changed_rows(self):
+        cached = pd.DataFrame(
+            {'AA': [1.0, 2.0, 3.0]}, index=pd.Index([1, 2, 3]))
+        changed = pd.DataFrame(
+            {'AA': [5.0, 4.0], 'AB': [1.0, 1.0]}, index=pd.Index([2, 4]))
+
+        merged = merge_dataframes(cached, changed).sort_index()
+
+        self.assertEqual(list(merged.index), [1, 2, 3, 4])
+        self.assertEqual(list(merged['AA']), [1.0, 5.0, 3.0, 4.0])
+        self.assertTrue(np.isnan(merged.loc[1, 'AB']))
+
+    def test_merge_without_changes(self):
+        cached = pd.DataFrame({'AA': [1.0]}, index=pd.Index([1]))
+
+        self.assertIs(merge_dataframes(cached, pd.DataFrame()), cached)
+        self.assertIs(merge_dataframes(pd.DataFrame(), cached), cached)
+
+    def test_changed_rows(self):
+        cached = pd.DataFrame(
+            {'AA': [1.0, np.nan], 'AB': [['a'], None]},
+            index=pd.Index([1, 2]))
+        updated = pd.DataFrame(
+            {'AA': [1.0, np.nan, 3.0], 'AB': [['a'], ['b'], None]},
+            index=pd.Index([1, 2, 3]))
+
+        self.assertEqual(list(changed_rows(cached, updated).index), [2, 3])
+        self.assertTrue(changed_rows(cached, cached.copy()).empty)
+
+    def test_only_deltas_are_stored(self):
+        key = 'apollo:dataframe:submission:1:2:O:en'
+        cached = pd.DataFrame({'AA': [1.0, 2.0]}, index=pd.Index([1, 2]))
+        delta = pd.DataFrame({'AA': [5.0]}, index=pd.Index([2]))
+        state = {
+            'version': ('v1', 0), 'watermark': 1, 'dataframe': cached,
+            'deltas': 0}
+
+        with mock.patch.object(dataframes, 'red') as red, \
+                mock.patch.dict(dataframes._local_cache, clear=True):
+            pipeline = red.pipeline.return_value
+            dataframes._store_state(key, state, pd.DataFrame())
+            red.pipeline.assert_not_called()
+
+            dataframes._store_state(key, state, delta)
+            pipeline.set.assert_not_called()
+            stored_delta = pickle.loads(pipeline.rpush.call_args.args[1])
+            self.assertEqual(stored_delta['dataframe'].to_dict(), delta.to_dict())
+
+            dataframes._store_state(key, state)
+            stored = pickle.loads(pipeline.set.call_args.args[1])
+            self.assertEqual(stored['dataframe'].to_dict(), cached.to_dict())
+            pipeline.delete.assert_called_once_with(f'{key}:deltas')
+
+            # the deltas are merged into the stored data frame
+            dataframes._local_cache.clear()
+            pipeline.get.return_value.lrange.return_value.execute.return_value = [
+                pickle.dumps(stored), [pickle.dumps(stored_delta)]]
+            loaded = dataframes._load_state(key)
+            self.assertEqual(list(loaded['dataframe'].sort_index()['AA']), [1.0, 5.0])
+            self.assertEqual(loaded['deltas'], 1)
+
+
+class DataFrameLocaleTest(TestCase):
+    def test_data_frames_of_every_locale(self):
+        event = SimpleNamespace(
+            id=1, location_set=SimpleNamespace(ancestry_version=1))
+        form = SimpleNamespace(id=2, version_identifier='v1')
+        builder = mock.Mock(side_effect=lambda query, form, index_by_id: (
+            pd.DataFrame({str(get_locale()): [1]}, index=pd.Index([1]))))
+
+        with mock.patch.object(Submission, 'query') as query, \
+                mock.patch.object(dataframes, 'red') as red, \
+                mock.patch.dict(dataframes._local_cache, clear=True), \
+                mock.patch.dict(
+                    dataframes._BUILDERS,
+                    {dataframes.SUBMISSION_DATAFRAME: builder}):
+            base_query = query.filter.return_value
+            base_query.with_entities.return_value.scalar.return_value = 1
+            pipeline = red.pipeline.return_value
+            pipeline.get.return_value.lrange.return_value.execute \
+                .return_value = [None, []]
+
+            # the location type columns are labelled in the current locale
+            frames = []
+            for locale in ('en', 'fr', 'en'):
+                with force_locale(locale):
+                    frames.append(dataframes._refresh(
+                        dataframes.SUBMISSION_DATAFRAME, event, form, 'O'))
+
+            self.assertEqual(
+                [list(frame.columns) for frame in frames],
+                [['en'], ['fr'], ['en']])
+            self.assertEqual(builder.call_count, 2)
+            self.assertEqual(
+                [c.args[0] for c in pipeline.set.call_args_list],
+                ['apollo:dataframe:submission:1:2:O:en',
+                 'apollo:dataframe:submission:1:2:O:fr'])
+
+
+class ExportChunkingTest(TestCase):
+    def test_chunked(self):
+        self.assertEqual(
+            list(chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(chunked([], 2)), [])
+
+
+class MapDataTest(TestCase):
+    def test_parameters(self):
+        self.assertEqual(
+            maps.parse_bbox('-200,-10.5,30,95'), (-180.0, -10.5, 30.0, 90.0))
+        self.assertIsNone(maps.parse_bbox('1,2,3'))
+        self.assertIsNone(maps.parse_bbox('0,10,1,5'))
+        self.assertIsNone(maps.parse_bbox(None))
+        self.assertEqual(maps.parse_zoom('7'), 7)
+        self.assertIsNone(maps.parse_zoom('x'))
+        self.assertEqual(maps.cell_size(1), maps.cell_size(0) / 2)
+
+    def test_feature_collection(self):
+        features = [
+            maps._feature(i, i, {'cluster': True, 'count': i})
+            for i in range(5)]
+
+        for count in (0, 2, 5):
+            with mock.patch.object(maps, 'MAP_CHUNK_SIZE', 2), \
+                    mock.patch.object(
+                        maps, 'generate_features',
+                        return_value=iter(features[:count])):
+                data = json.loads(
+                    ''.join(maps.generate_feature_collection(None)))
+
+            self.assertEqual(data['type'], 'FeatureCollection')
+            self.assertEqual(
+                [f['properties']['count'] for f in data['features']],
+                list(range(count)))
+
+    def test_single_points_are_not_clustered(self):
+        clusters = [
+            SimpleNamespace(x=1.0, y=2.0, count=3, submission_id=1),
+            SimpleNamespace(x=5.0, y=6.0, count=1, submission_id=4),
+        ]
+        point = SimpleNamespace(
+            x=5.0, y=6.0, location='Ward 1', participant='Jane Doe',
+            participant_id='1234', phone='0800', participant_updated=None)
+
+        with mock.patch.object(maps, 'submission_filter', return_value=[]), \
+                mock.patch.object(maps, '_stream', return_value=clusters), \
+                mock.patch.object(maps, 'point_query'), \
+                mock.patch.object(maps.db, 'session') as session:
+            session.execute.return_value = [point]
+            features = [
+                json.loads(f) for f in maps.generate_features(None, zoom=3)]
+
+        self.assertEqual(features[0]['properties'], {'cluster': True, 'count': 3})
+        self.assertEqual(features[1]['geometry']['coordinates'], [5.0, 6.0])
+        self.assertEqual(features[1]['properties']['participant_id'], '1234')
+
+
+class SubmissionBatchTest(TestCase):
+    def _post(self, batch, files=None):
+        data = {'submissions': json.dumps(batch)}
+        data.update(files or {})
+        with current_app.test_request_context(
+                '/api/submissions/batch', method='POST', data=data):
+            return api_views.submission_batch.__wrapped__()
+
+    def test_results_are_returned_for_every_submission(self):
+        participant = SimpleNamespace(participant_id='1234')
+        results = [
+            ({'status': 'ok', 'submission': 1}, 200),
+            ({'status': 'error', 'message': 'Invalid form'}, 400),
+            RuntimeError('database error'),
+        ]
+        image = (io.BytesIO(b'image'), 'photo.jpg', 'image/jpeg')
+
+        with mock.patch.object(
+                api_views, '_posting_participant',
+                return_value=participant), \
+                mock.patch.object(api_views, 'SubmissionLookup') as lookup, \
+                mock.patch.object(
+                    api_views, 'save_submission',
+                    side_effect=results) as save_submission, \
+                mock.patch.object(api_views, 'db'):
+            response = self._post(
+                [{'form': 1}, {'form': 2}, {'form': 1}], {'0/AA': image})
+
+        # the lookups are shared by all the submissions
+        lookup.assert_called_once_with(participant)
+        self.assertEqual(save_submission.call_count, 3)
+        self.assertEqual(
+            list(save_submission.call_args_list[0][0][2]), ['AA'])
+        self.assertEqual(save_submission.call_args_list[1][0][2], {})
+
+        self.assertEqual(
+            [result['statusCode'] for result in response.json['results']],
+            [200, 400, 500])
+
+    def test_invalid_batches(self):
+        with mock.patch.object(api_views, 'save_submission') as save_submission:
+            self.assertEqual(self._post({'form': 1}).status_code, 400)
+            self.assertEqual(self._post(['form']).status_code, 400)
+            self.assertEqual(
+                self._post([{}] * (current_app.config['PWA_SYNC_BATCH_SIZE'] + 1)).status_code,
+                400)
+
+        save_submission.assert_not_called()
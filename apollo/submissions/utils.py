@@ -1,17 +1,20 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 import pandas as pd
-from sqlalchemy import TIMESTAMP, BigInteger, String, cast, func
-from sqlalchemy.dialects.postgresql import array_agg
+from sqlalchemy import TIMESTAMP, BigInteger, cast, func
 from sqlalchemy.orm import aliased
 
 from apollo.core import db
-from apollo.locations.models import Location, LocationPath, LocationType
+from apollo.locations.ancestry import ancestry_columns
+from apollo.locations.models import Location, LocationAncestry
 from apollo.submissions.models import Submission
 
 
-def make_submission_dataframe(query, form, selected_tags=None, excluded_tags=None):
-    """Create a pandas data frame from the given query."""
+def make_submission_dataframe(query, form, selected_tags=None, excluded_tags=None, index_by_id=False):
+    """Create a pandas data frame from the given query.
+
+    If `index_by_id` is set, the data frame is indexed by the submission id.
+    """
     if not db.session.query(query.exists()).scalar():
         return pd.DataFrame()
 
@@ -42,34 +45,16 @@ def make_submission_dataframe(query, form, selected_tags=None, excluded_tags=Non
             ).label("updated")
         ]
     )
+    if index_by_id:
+        columns.append(Submission.id.label("submission_id"))
 
     # alias just in case the query is already joined to the tables below
-    ancestor_loc = aliased(Location, name="ancestor")
-    ancestor_loc_type = aliased(LocationType, name="ancestor_type")
-    ancestor_loc_path = aliased(LocationPath, name="ancestor_path")
     own_loc = aliased(Location, name="own_location")
 
-    sub_query = (
-        Submission.query.join(own_loc, Submission.location_id == own_loc.id)
-        .join(ancestor_loc_path, Submission.location_id == ancestor_loc_path.descendant_id)
-        .join(ancestor_loc, ancestor_loc.id == ancestor_loc_path.ancestor_id)
-        .join(ancestor_loc_type, ancestor_loc.location_type_id == ancestor_loc_type.id)
-        .with_entities(
-            cast(ancestor_loc.name, String).label("ancestor_name"),
-            cast(ancestor_loc_type.name, String).label("ancestor_type"),
-            Submission.id.label("submission_id"),
-        )
-        .subquery()
-    )
-
     # add registered voters and path extraction to the columns
     columns.append(own_loc.registered_voters.label("registered_voters"))
-    columns.append(
-        func.jsonb_object(
-            array_agg(sub_query.c.ancestor_type),
-            array_agg(sub_query.c.ancestor_name),
-        ).label("location_data")
-    )
+    location_columns = ancestry_columns([event.location_set_id for event in form.events])
+    columns.extend(location_columns)
 
     # type coercion is necessary for numeric columns
     # if we allow Pandas to infer the column type for these,
@@ -84,8 +69,8 @@ def make_submission_dataframe(query, form, selected_tags=None, excluded_tags=Non
 
     dataframe_query = (
         query.filter(Submission.location_id == own_loc.id)
-        .join(sub_query, Submission.id == sub_query.c.submission_id)
-        .group_by(Submission.id, own_loc.registered_voters)
+        .join(LocationAncestry, Submission.location_id == LocationAncestry.location_id)
+        .group_by(Submission.id, own_loc.registered_voters, LocationAncestry.ancestors)
         .with_entities(*columns)
     )
 
@@ -94,15 +79,16 @@ def make_submission_dataframe(query, form, selected_tags=None, excluded_tags=Non
         dataframe_query.session.get_bind(),
     ).astype(type_coercions)
 
-    loc_data_df = pd.json_normalize(df["location_data"]).replace('(^"|"$)', "", regex=True)
-    loc_data_df.columns = loc_data_df.columns.str.strip('"')
+    # only keep the location types present in the hierarchy of the submissions
+    df_summary = df.drop(columns=[column.name for column in location_columns if df[column.name].isna().all()])
 
-    df_summary = pd.concat([df.drop("location_data", axis=1), loc_data_df], axis=1).reindex(df.index)
+    if index_by_id:
+        df_summary = df_summary.set_index("submission_id")
 
     return df_summary
 
 
-def make_turnout_dataframe(query, form):  # noqa
+def make_turnout_dataframe(query, form, index_by_id=False):  # noqa
     if not db.session.query(query.exists()).scalar():
         return pd.DataFrame()
 
@@ -128,38 +114,20 @@ def make_turnout_dataframe(query, form):  # noqa
             ).label("updated")
         ]
     )
+    if index_by_id:
+        columns.append(Submission.id.label("submission_id"))
 
     # alias just in case the query is already joined to the tables below
-    ancestor_loc = aliased(Location, name="ancestor")
-    ancestor_loc_type = aliased(LocationType, name="ancestor_type")
-    ancestor_loc_path = aliased(LocationPath, name="ancestor_path")
     own_loc = aliased(Location, name="own_location")
 
-    sub_query = (
-        Submission.query.join(own_loc, Submission.location_id == own_loc.id)
-        .join(ancestor_loc_path, Submission.location_id == ancestor_loc_path.descendant_id)
-        .join(ancestor_loc, ancestor_loc.id == ancestor_loc_path.ancestor_id)
-        .join(ancestor_loc_type, ancestor_loc.location_type_id == ancestor_loc_type.id)
-        .with_entities(
-            cast(ancestor_loc.name, String).label("ancestor_name"),
-            cast(ancestor_loc_type.name, String).label("ancestor_type"),
-            Submission.id.label("submission_id"),
-        )
-        .subquery()
-    )
-
     # add registered voters and path extraction to the columns
     columns.append(
         own_loc.registered_voters.label("registered_voters")
         if not form.turnout_registered_voters_tag
         else Submission.data[form.turnout_registered_voters_tag].label("registered_voters")
     )
-    columns.append(
-        func.jsonb_object(
-            array_agg(sub_query.c.ancestor_type),
-            array_agg(sub_query.c.ancestor_name),
-        ).label("location_data")
-    )
+    location_columns = ancestry_columns([event.location_set_id for event in form.events])
+    columns.extend(location_columns)
 
     # type coercion is necessary for numeric columns
     # if we allow Pandas to infer the column type for these,
@@ -174,8 +142,8 @@ def make_turnout_dataframe(query, form):  # noqa
 
     dataframe_query = (
         query.filter(Submission.location_id == own_loc.id)
-        .join(sub_query, Submission.id == sub_query.c.submission_id)
-        .group_by(Submission.id, own_loc.registered_voters)
+        .join(LocationAncestry, Submission.location_id == LocationAncestry.location_id)
+        .group_by(Submission.id, own_loc.registered_voters, LocationAncestry.ancestors)
         .with_entities(*columns)
     )
 
@@ -184,10 +152,11 @@ def make_turnout_dataframe(query, form):  # noqa
         dataframe_query.session.get_bind(),
     ).astype(type_coercions)
 
-    loc_data_df = pd.json_normalize(df["location_data"]).replace('(^"|"$)', "", regex=True)
-    loc_data_df.columns = loc_data_df.columns.str.strip('"')
+    # only keep the location types present in the hierarchy of the submissions
+    df_summary = df.drop(columns=[column.name for column in location_columns if df[column.name].isna().all()])
 
-    df_summary = pd.concat([df.drop("location_data", axis=1), loc_data_df], axis=1).reindex(df.index)
+    if index_by_id:
+        df_summary = df_summary.set_index("submission_id")
 
     return df_summary
 
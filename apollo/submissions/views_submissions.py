@@ -5,7 +5,6 @@ from functools import partial
 from http import HTTPStatus
 from uuid import uuid4
 
-import geojson
 import sqlalchemy as sa
 from flask import (
     Blueprint,
@@ -28,7 +27,6 @@ from flask_httpauth import HTTPBasicAuth
 from flask_menu import register_menu
 from flask_security import current_user, login_required
 from flask_security.utils import verify_and_update_password
-from geoalchemy2.shape import to_shape
 from slugify import slugify
 from sqlalchemy import BigInteger, case, desc, func, nullslast, text
 from sqlalchemy.dialects.postgresql import array
@@ -40,7 +38,7 @@ from werkzeug.datastructures import MultiDict
 from apollo import models, services
 from apollo import utils as autils
 from apollo.core import db, docs
-from apollo.dal import utils
+from apollo.dal.pagination import paginate
 from apollo.frontend import permissions, route
 from apollo.frontend.helpers import (
     DictDiffer,
@@ -52,13 +50,16 @@ from apollo.frontend.helpers import (
 )
 from apollo.frontend.template_filters import mkunixtimestamp
 from apollo.messaging.tasks import send_messages
-from apollo.submissions import filters, forms
-from apollo.submissions.aggregation import _qa_counts, aggregate_dataset, aggregated_dataframe
+from apollo.submissions import filters, forms, maps, tasks
+from apollo.submissions.aggregation import _qa_counts, aggregated_dataframe
 from apollo.submissions.api import views as api_views
+from apollo.submissions.coverage import update_coverage
 from apollo.submissions.incidents import incidents_csv
 from apollo.submissions.models import QUALITY_STATUSES, Submission
 from apollo.submissions.qa.query_builder import generate_qa_queries
+from apollo.submissions.qa.status import qa_status_available, qa_status_columns
 from apollo.submissions.utils import make_submission_dataframe
+from apollo.users.exports import start_export
 
 auth = HTTPBasicAuth()
 bp = Blueprint("submissions", __name__, template_folder="templates", static_folder="static")
@@ -67,6 +68,7 @@ bp.add_url_rule(
     "/api/submissions", view_func=api_views.SubmissionListResource.as_view("api_submission_list"), methods=["GET"]
 )
 bp.add_url_rule("/api/submissions", view_func=api_views.submission, methods=["POST", "PUT"])
+bp.add_url_rule("/api/submissions/batch", view_func=api_views.submission_batch, methods=["POST"])
 bp.add_url_rule("/api/qastatus/<uuid>", view_func=api_views.checklist_qa_status, methods=["GET"])
 bp.add_url_rule(
     "/api/submissions/<int:submission_id>",
@@ -156,6 +158,7 @@ def submission_list(form_id):
     data = request.args.to_dict(flat=False)
     data["form_id"] = str(form.id)
     page = int(data.pop("page", [1])[0])
+    cursor = data.pop("cursor", [None])[0]
     loc_types = displayable_location_types(is_administrative=True, location_set_id=event.location_set_id)
     query = models.Submission.query.options(joinedload(models.Submission.form))
     _location_query = None
@@ -205,59 +208,25 @@ def submission_list(form_id):
         ).first()
 
     if request.args.get("export") and permissions.export_submissions.can():
-        query = filter_class(query, request.args).qs
-        include_group_timestamps = False
-
         mode = request.args.get("export")
-        if mode in ["master", "aggregated"]:
-            submission_type = "M"
-
-            # only change the submission type if we are aggregating data
-            # and are not tracking conflicts
-            if mode == "aggregated" and form.untrack_data_conflicts == True:  # noqa
-                submission_type = "O"
-
-            queryset = query.filter(
-                models.Submission.submission_type == submission_type,
-                models.Submission.form == form,
-                models.Submission.event == event,
-            )
-            if utils.has_model(queryset, models.Location):
-                queryset = queryset.order_by(models.Location.code)
-            else:
-                queryset = queryset.join(models.Submission.location).order_by(models.Location.code)
-        else:
-            include_group_timestamps = True if mode == "observer-ts" else False
-            queryset = query.filter(
-                models.Submission.submission_type == "O",
-                models.Submission.form == form,
-                models.Submission.event == event,
-            )
-            if not utils.has_model(queryset, models.Location):
-                queryset = queryset.join(models.Submission.location)
-            queryset = queryset.join(
-                models.Participant,
-                models.Submission.participant_id == models.Participant.id,
-            ).order_by(models.Location.code, models.Participant.participant_id)
-
-        # TODO: fix this. no exports yet. nor aggregation
-        # query_filterset = filter_class(queryset, request.args)
         basename = slugify(
             "%s %s %s %s"
             % (g.event.name.lower(), form.name.lower(), datetime.utcnow().strftime("%Y %m %d %H%M%S"), mode)
         )
-        content_disposition = "attachment; filename=%s.csv" % basename
-        if mode == "aggregated":
-            # TODO: you want to change the float format or even remove it
-            # if you have columns that have float values
-            dataset = aggregate_dataset(queryset.order_by(None), form, True)
-        else:
-            dataset = services.submissions.export_list(queryset, include_group_timestamps=include_group_timestamps)
-
-        return Response(
-            stream_with_context(dataset), headers={"Content-Disposition": content_disposition}, mimetype="text/csv"
+        start_export(
+            tasks.export_submissions,
+            _("Export Submissions"),
+            "%s.csv" % basename,
+            "text/csv",
+            event_id=event.id,
+            form_id=form.id,
+            mode=mode,
+            args=request.args.to_dict(flat=False),
+            participant_id=session.get("participant"),
         )
 
+        return redirect(url_for("users.export_list"))
+
     # the following section defines the queryset for the submissions
     # to be retrieved. due to the fact that we do specialized sorting
     # the queryset will depend heavily on what is being sorted.
@@ -401,28 +370,13 @@ def submission_list(form_id):
     filter_form = query_filterset.form
 
     if request.args.get("geojson"):
-        features = []
-        for s in query_filterset.qs.filter(models.Submission.geom != None):  # noqa
-            features.append(
-                geojson.Feature(
-                    geometry=geojson.Point((to_shape(s.geom).x, to_shape(s.geom).y)),
-                    properties={
-                        "location": s.location.name,
-                        "participant": s.participant.name,
-                        "participant_id": s.participant.participant_id,
-                        "phone": s.participant.primary_phone,
-                        "last_updated": s.participant_updated.strftime("%b %d, %Y %l:%M %p")
-                        if s.participant_updated
-                        else None,  # noqa
-                        "last_updated_timestamp": s.participant_updated.strftime("%s")
-                        if s.participant_updated
-                        else None,  # noqa
-                    },
-                )
-            )
-        feature_collection = geojson.FeatureCollection(features)
+        features = maps.generate_feature_collection(
+            query_filterset.qs,
+            bbox=maps.parse_bbox(request.args.get("bbox")),
+            zoom=maps.parse_zoom(request.args.get("zoom")),
+        )
 
-        return Response(geojson.dumps(feature_collection), mimetype="application/geo+json")
+        return Response(stream_with_context(features), mimetype="application/geo+json")
 
     # TODO: rewrite this. verify what select_related does
     if request.form.get("action") == "send_message":
@@ -466,7 +420,7 @@ def submission_list(form_id):
         location_types=loc_types,
         location=location,
         breadcrumbs=breadcrumbs,
-        pager=query_filterset.qs.paginate(page=page, per_page=current_app.config.get("PAGE_SIZE")),
+        pager=paginate(query_filterset.qs, page=page, per_page=current_app.config.get("PAGE_SIZE"), cursor=cursor),
         submissions=query_filterset.qs,
     )
 
@@ -639,25 +593,29 @@ def submission_edit(submission_id):
                 initial_data.update(status=submission.incident_status.code)
         else:
             if questionnaire_form.quality_checks_enabled and questionnaire_form.quality_checks:
-                # use the QA query on this submission for the results
-                # of the individual checks.
-                # the joins are necessary to limit the number of results
-                sub_query = (
-                    models.Submission.query.filter_by(id=submission.id)
-                    .join(models.Submission.location)
-                    .join(models.Submission.participant)
-                )
                 qa_queries, tag_groups = generate_qa_queries(submission.form)
-                result = sub_query.with_entities(*qa_queries).one()._asdict()
+                if submission.submission_type == "O" and qa_status_available(submission.form):
+                    # the results of the individual checks are stored
+                    result = submission.qa_status or {}
+                else:
+                    # use the QA query on this submission for the results
+                    # of the individual checks.
+                    # the joins are necessary to limit the number of results
+                    sub_query = (
+                        models.Submission.query.filter_by(id=submission.id)
+                        .join(models.Submission.location)
+                        .join(models.Submission.participant)
+                    )
+                    result = sub_query.with_entities(*qa_queries).one()._asdict()
 
                 # for checks that failed, add the description to the list
                 # of failed check descriptions
                 # for checks that failed or were verified, add the question
                 # tags to the list of failed question tags
                 for idx, check in enumerate(questionnaire_form.quality_checks):
-                    if result[check["name"]] == "Flagged":
+                    if result.get(check["name"]) == "Flagged":
                         failed_checks.append(check["description"])
-                    if result[check["name"]] in ("Flagged", "Verified"):
+                    if result.get(check["name"]) in ("Flagged", "Verified"):
                         failed_check_tags.update(tag_groups[idx])
 
         submission_form = edit_form_class(data=initial_data, prefix=str(submission.id))
@@ -924,10 +882,7 @@ def submission_edit(submission_id):
                         if extra_data:
                             update_params["extra_data"] = extra_data
 
-                        services.submissions.find(id=master_submission.id).update(
-                            update_params, synchronize_session=False
-                        )
-                        db.session.commit()
+                        update_master_submission(master_submission, update_params)
 
                 else:
                     no_error = False
@@ -1301,7 +1256,8 @@ def quality_assurance_list(form_id):
 
     data = request.args.to_dict()
     data["form_id"] = str(form.id)
-    page = int(data.pop("page", [1])[0])
+    page = int(data.pop("page", 1))
+    cursor = data.pop("cursor", None)
     loc_types = displayable_location_types(is_administrative=True, location_set_id=g.event.location_set_id)
 
     user_locale = get_locale().language
@@ -1330,32 +1286,22 @@ def quality_assurance_list(form_id):
 
     if request.args.get("export") and permissions.export_submissions.can():
         mode = request.args.get("export")
-        if form.quality_checks:
-            queryset = (
-                models.Submission.query.filter(
-                    models.Submission.submission_type == "O",
-                    models.Submission.form == form,
-                    models.Submission.event == event,
-                )
-                .join(models.Submission.location)
-                .join(models.Submission.participant)
-                .order_by(models.Submission.location_id, models.Submission.participant_id)
-            )
-        else:
-            queryset = models.Submission.query.filter(false())
-
-        query_filterset = filter_class(queryset, request.args)
-        dataset = services.submissions.export_list(query_filterset.qs, include_qa=True)
         basename = slugify(
             "%s %s %s %s"
             % (g.event.name.lower(), form.name.lower(), datetime.utcnow().strftime("%Y %m %d %H%M%S"), mode)
         )
-        content_disposition = "attachment; filename=%s.csv" % basename
-
-        return Response(
-            stream_with_context(dataset), headers={"Content-Disposition": content_disposition}, mimetype="text/csv"
+        start_export(
+            tasks.export_quality_assurance,
+            _("Export Quality Assurance"),
+            "%s.csv" % basename,
+            "text/csv",
+            event_id=event.id,
+            form_id=form.id,
+            args=request.args.to_dict(flat=False),
         )
 
+        return redirect(url_for("users.export_list"))
+
     # the following section defines the queryset for the submissions
     # to be retrieved. due to the fact that we do specialized sorting
     # the queryset will depend heavily on what is being sorted.
@@ -1501,7 +1447,7 @@ def quality_assurance_list(form_id):
     if not form.quality_checks:
         queryset = models.Submission.query.filter(false())
     else:
-        queryset = queryset.with_entities(models.Submission, *generate_qa_queries(form)[0])
+        queryset = queryset.with_entities(models.Submission, *qa_status_columns(form))
 
     query_filterset = filter_class(queryset, request.args)
     filter_form = query_filterset.form
@@ -1532,7 +1478,7 @@ def quality_assurance_list(form_id):
         "breadcrumbs": breadcrumbs,
         "location_types": loc_types,
         "location": location,
-        "pager": query_filterset.qs.paginate(page=page, per_page=current_app.config.get("PAGE_SIZE")),
+        "pager": paginate(query_filterset.qs, page=page, per_page=current_app.config.get("PAGE_SIZE"), cursor=cursor),
         "submissions": queryset,
         "quality_statuses": QUALITY_STATUSES,
         "verification_statuses": VERIFICATION_OPTIONS,
@@ -1543,6 +1489,16 @@ def quality_assurance_list(form_id):
     return render_template(template_name, **context)
 
 
+def update_master_submission(master_submission, update_params):
+    """Saves the edits of a master submission and adjusts its coverage."""
+    services.submissions.find(id=master_submission.id).update(update_params, synchronize_session=False)
+
+    # the coverage statuses are computed from the saved values
+    db.session.refresh(master_submission)
+    update_coverage(master_submission)
+    db.session.commit()
+
+
 def update_submission_version(submission):
     """Submission version creation."""
     # reload the submission to get rid of the loading problem
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+from apollo import helpers
+
+
+def test_parse_integers():
+    """Tests the conversion of the integer columns of import files."""
+    column = pd.Series(["0", "007", " 12 ", 7, 7.0, "1.0", "", None, np.nan, "1e3", "abc", "1_000"], dtype=object)
+    values, valid = helpers.parse_integers(column)
+
+    assert list(valid) == [True, True, True, True, True, False, False, False, False, False, False, True]
+    assert list(values[valid]) == [0, 7, 12, 7, 7, 1000]
+    assert all(value is None for value in values[~valid])
+    # the codes are stored as the strings of the integers
+    assert [str(value) for value in values[:2]] == ["0", "7"]
+
+
+def test_parse_floats():
+    """Tests the conversion of the decimal columns of import files."""
+    column = pd.Series(["1.5", "-.5", "1e3", " 2 ", 3, "", None, "abc", "1.2.3"], dtype=object)
+    values, valid = helpers.parse_floats(column)
+
+    assert list(valid) == [True, True, True, True, True, False, False, False, False]
+    assert list(values[valid]) == [1.5, -0.5, 1000.0, 2.0, 3.0]
+
+    # columns without any strings are converted too
+    values, valid = helpers.parse_floats(pd.Series([1.0, 2.5], dtype=object))
+    assert list(valid) == [True, True]
+    assert list(values) == [1.0, 2.5]
+
+
+def test_column_values():
+    """Tests the selection of the columns and of the values that are set."""
+    data_frame = pd.DataFrame({"A": ["x", "", None], "B": [0, 1, np.nan]}, index=[5, 6, 7])
+
+    assert list(helpers.valid_values(helpers.source_column(data_frame, "A"))) == [True, False, False]
+    assert list(helpers.valid_values(helpers.source_column(data_frame, "B"))) == [False, True, False]
+    assert list(helpers.source_column(data_frame, "A").index) == [0, 1, 2]
+
+    # unmapped columns are blank
+    for column_name in (None, "C"):
+        column = helpers.source_column(data_frame, column_name)
+        assert column.tolist() == [None, None, None]
+        assert not helpers.valid_values(column).any()
+        assert not helpers.parse_integers(column)[1].any()
@@ -6,6 +6,7 @@ import warnings
 from sqlalchemy.sql import text
 
 from apollo.core import db
+from apollo.messaging import lookups
 
 logger = logging.getLogger(__name__)
 
@@ -21,5 +22,8 @@ def load_sql_fixture(fixture):
                 conn.execute(query_text)
         except Exception:
             logger.exception("Error occurred executing fixture statement(s)")
+
+        # the fixtures are not loaded through the ORM
+        lookups.invalidate(lookups.FORMS, lookups.PARTICIPANTS)
     else:
         warnings.warn(f"Invalid fixture specified: {source_file}", stacklevel=2)
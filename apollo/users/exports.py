@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Background export jobs.
+
+Large exports take longer than the web server allows a request to run, so
+they are written by Celery tasks instead. The view that requests an export
+records a `UserExport` and starts the task, which writes the export to a
+temporary file, reports its progress through the task status channel of
+the user's session and finally stores the file in the depot storage, from
+where it is served with support for range requests so that interrupted
+downloads can be resumed.
+"""
+
+import logging
+from tempfile import SpooledTemporaryFile
+from uuid import uuid4
+
+from depot.io.utils import FileIntent
+from flask import Response, current_app, request, session
+from flask_babel import force_locale, get_locale
+from flask_security import current_user
+from werkzeug.wsgi import wrap_file
+
+from apollo.core import db
+from apollo.users.models import UserExport
+
+logger = logging.getLogger(__name__)
+
+# exports larger than this are spooled to disk while they are written
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+
+def start_export(task, description, filename, content_type, **kwargs):
+    """Records an export for the current user and starts the export task.
+
+    The task is called with the id of the export, the current locale and
+    the session channel, in addition to the given keyword arguments.
+    """
+    user = current_user._get_current_object()
+    export = UserExport(
+        deployment_id=user.deployment_id,
+        user_id=user.id,
+        task_id=str(uuid4()),
+        description=str(description),
+        filename=filename,
+        content_type=content_type,
+    )
+    export.save()
+
+    kwargs.update({"export_id": export.id, "locale": str(get_locale()), "channel": session.get("_id")})
+    task.apply_async(kwargs=kwargs, task_id=export.task_id)
+
+    return export
+
+
+def run_export(task, export_id, writer, locale=None):
+    """Writes an export and stores it in the depot storage.
+
+    `writer` is called with the file object to write the export to and a
+    callable to report the progress of the export with the number of
+    processed and total records.
+    """
+    export = UserExport.query.filter(UserExport.id == export_id).first()
+    if export is None:
+        logger.error("Export %s does not exist, aborting", export_id)
+        return
+
+    export.status = "RUNNING"
+    export.save()
+
+    def report_progress(processed_records, total_records):
+        task.update_state(
+            state="PROGRESS",
+            meta={
+                "total_records": total_records,
+                "processed_records": processed_records,
+                "error_records": 0,
+                "warning_records": 0,
+                "error_log": [],
+            },
+        )
+
+    try:
+        with force_locale(locale or current_app.config["BABEL_DEFAULT_LOCALE"]):
+            with SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as fileobj:
+                writer(fileobj, report_progress)
+                fileobj.seek(0)
+
+                export.file = FileIntent(fileobj, export.filename, export.content_type)
+                export.status = "COMPLETED"
+                export.save()
+    except Exception:
+        db.session.rollback()
+        export.status = "FAILED"
+        export.save()
+        raise
+
+
+def write_chunks(fileobj, chunks):
+    """Writes the text chunks generated by an export to a binary file."""
+    for chunk in chunks:
+        fileobj.write(chunk.encode("utf-8"))
+
+
+def send_export(export):
+    """Returns a response serving the stored export file.
+
+    Range requests are supported, so that interrupted downloads of large
+    exports can be resumed.
+    """
+    stored_file = export.file.file
+
+    response = Response(
+        wrap_file(request.environ, stored_file),
+        mimetype=export.content_type,
+        headers={"Content-Disposition": "attachment; filename=%s" % export.filename},
+        direct_passthrough=True,
+    )
+    response.accept_ranges = "bytes"
+    response.content_length = stored_file.content_length
+    response.last_modified = stored_file.last_modified
+    response.set_etag(stored_file.file_id)
+
+    return response.make_conditional(request, accept_ranges=True, complete_length=stored_file.content_length)
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
+from depot.fields.sqlalchemy import UploadedFileField
+from flask_babel import lazy_gettext as _
 from flask_security import RoleMixin, UserMixin
 from flask_security.utils import hash_password
 from sqlalchemy import func
+from sqlalchemy_utils import ChoiceType
 
 from apollo.core import db
 from apollo.dal.models import BaseModel
@@ -106,3 +109,29 @@ class UserUpload(BaseModel):
         "Deployment", backref=db.backref("user_uploads", cascade="all, delete", passive_deletes=True)
     )
     user = db.relationship("User", backref=db.backref("uploads", cascade="all, delete", passive_deletes=True))
+
+
+class UserExport(BaseModel):
+    STATUSES = (
+        ("PENDING", _("Pending")),
+        ("RUNNING", _("Running")),
+        ("COMPLETED", _("Completed")),
+        ("FAILED", _("Failed")),
+    )
+
+    __tablename__ = "user_export"
+
+    id = db.Column(db.Integer, primary_key=True)
+    deployment_id = db.Column(db.Integer, db.ForeignKey("deployment.id", ondelete="CASCADE"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    created = db.Column(db.DateTime, default=current_timestamp)
+    task_id = db.Column(db.String)
+    description = db.Column(db.String)
+    filename = db.Column(db.String, nullable=False)
+    content_type = db.Column(db.String, nullable=False)
+    status = db.Column(ChoiceType(STATUSES), default="PENDING", nullable=False)
+    file = db.Column(UploadedFileField())
+    deployment = db.relationship(
+        "Deployment", backref=db.backref("user_exports", cascade="all, delete", passive_deletes=True)
+    )
+    user = db.relationship("User", backref=db.backref("exports", cascade="all, delete", passive_deletes=True))
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from io import BytesIO
+from types import SimpleNamespace
+
+from flask import current_app
+
+from apollo.users.exports import send_export
+
+
+class StoredFile(BytesIO):
+    file_id = "f5a2c0c6-8c6f-11ee-b9d1-0242ac120002"
+    last_modified = datetime(2024, 1, 1)
+
+    @property
+    def content_length(self):
+        return len(self.getvalue())
+
+
+def _export():
+    return SimpleNamespace(
+        filename="export.csv", content_type="text/csv", file=SimpleNamespace(file=StoredFile(b"0123456789"))
+    )
+
+
+def test_export_download(app):
+    """Tests that the complete export file is served."""
+    with current_app.test_request_context("/"):
+        response = send_export(_export())
+        response.direct_passthrough = False
+
+        assert response.status_code == 200
+        assert response.headers["Accept-Ranges"] == "bytes"
+        assert response.headers["Content-Length"] == "10"
+        assert response.get_data() == b"0123456789"
+
+
+def test_export_download_range(app):
+    """Tests that a range of the export file can be requested."""
+    with current_app.test_request_context("/", headers={"Range": "bytes=4-"}):
+        response = send_export(_export())
+        response.direct_passthrough = False
+
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == "bytes 4-9/10"
+        assert response.get_data() == b"456789"
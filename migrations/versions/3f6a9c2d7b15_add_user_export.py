@@ -0,0 +1,45 @@
+"""Add the background export jobs table.
+
+Revision ID: 3f6a9c2d7b15
+Revises: 5d2b8c4e1a93
+Create Date: 2026-10-18 13:24:05.811392
+
+"""
+
+import depot
+import sqlalchemy as sa
+import sqlalchemy_utils
+from alembic import op
+
+from apollo.users.models import UserExport
+
+# revision identifiers, used by Alembic.
+revision = "3f6a9c2d7b15"
+down_revision = "5d2b8c4e1a93"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Database upgrade migration."""
+    op.create_table(
+        "user_export",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("deployment_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("created", sa.DateTime(), nullable=True),
+        sa.Column("task_id", sa.String(), nullable=True),
+        sa.Column("description", sa.String(), nullable=True),
+        sa.Column("filename", sa.String(), nullable=False),
+        sa.Column("content_type", sa.String(), nullable=False),
+        sa.Column("status", sqlalchemy_utils.types.choice.ChoiceType(UserExport.STATUSES), nullable=False),
+        sa.Column("file", depot.fields.sqlalchemy.UploadedFileField(), nullable=True),
+        sa.ForeignKeyConstraint(["deployment_id"], ["deployment.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade():
+    """Database downgrade migration."""
+    op.drop_table("user_export")
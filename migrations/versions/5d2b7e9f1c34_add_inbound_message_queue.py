@@ -0,0 +1,52 @@
+"""Add the inbound message queue.
+
+Revision ID: 5d2b7e9f1c34
+Revises: 8c1e4d7a2b60
+Create Date: 2026-10-18 17:21:05.614233
+
+"""
+
+import sqlalchemy as sa
+import sqlalchemy_utils
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+from apollo.messaging.models import InboundMessage
+
+# revision identifiers, used by Alembic.
+revision = "5d2b7e9f1c34"
+down_revision = "8c1e4d7a2b60"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Database upgrade migration."""
+    op.create_table(
+        "inbound_message",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("gateway", sa.String(), nullable=False),
+        sa.Column("sender", sa.String(), nullable=False),
+        sa.Column("text", sa.String(), nullable=True),
+        sa.Column("timestamp", sa.Integer(), nullable=True),
+        sa.Column("event_id", sa.Integer(), nullable=False),
+        sa.Column("status", sqlalchemy_utils.types.choice.ChoiceType(InboundMessage.STATUSES), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("reply", sa.String(), nullable=True),
+        sa.Column("message_id", sa.Integer(), nullable=True),
+        sa.Column("created", sa.DateTime(), nullable=True),
+        sa.Column("processed", sa.DateTime(), nullable=True),
+        sa.Column("uuid", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.ForeignKeyConstraint(["event_id"], ["event.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["message_id"], ["message.id"], ondelete="SET NULL"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("key"),
+    )
+    op.create_index("ix_inbound_message_sender_status", "inbound_message", ["sender", "status", "id"], unique=False)
+
+
+def downgrade():
+    """Database downgrade migration."""
+    op.drop_index("ix_inbound_message_sender_status", table_name="inbound_message")
+    op.drop_table("inbound_message")
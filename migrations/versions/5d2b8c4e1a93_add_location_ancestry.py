@@ -0,0 +1,51 @@
+"""Add the denormalized location ancestry table.
+
+Revision ID: 5d2b8c4e1a93
+Revises: 79177ae7d9da
+Create Date: 2026-10-18 11:02:17.542119
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "5d2b8c4e1a93"
+down_revision = "79177ae7d9da"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Database upgrade migration."""
+    op.add_column("location_set", sa.Column("ancestry_version", sa.Integer(), server_default="0", nullable=False))
+    op.create_table(
+        "location_ancestry",
+        sa.Column("location_id", sa.Integer(), nullable=False),
+        sa.Column("location_set_id", sa.Integer(), nullable=False),
+        sa.Column("ancestors", postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.ForeignKeyConstraint(["location_id"], ["location.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["location_set_id"], ["location_set.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("location_id"),
+    )
+    op.create_index(
+        op.f("ix_location_ancestry_location_set_id"), "location_ancestry", ["location_set_id"], unique=False
+    )
+    op.execute(
+        """
+        INSERT INTO location_ancestry (location_id, location_set_id, ancestors)
+        SELECT location_path.descendant_id, location_path.location_set_id,
+            jsonb_object_agg(
+                CAST(location.location_type_id AS VARCHAR), COALESCE(location.name_translations, '{}'::jsonb))
+        FROM location_path JOIN location ON location.id = location_path.ancestor_id
+        GROUP BY location_path.descendant_id, location_path.location_set_id
+        """
+    )
+
+
+def downgrade():
+    """Database downgrade migration."""
+    op.drop_index(op.f("ix_location_ancestry_location_set_id"), table_name="location_ancestry")
+    op.drop_table("location_ancestry")
+    op.drop_column("location_set", "ancestry_version")
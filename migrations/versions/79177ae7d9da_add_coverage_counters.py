@@ -0,0 +1,54 @@
+"""Add materialized coverage counters for the response rate dashboard.
+
+Revision ID: 79177ae7d9da
+Revises: 087e5e5941ec
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "79177ae7d9da"
+down_revision = "087e5e5941ec"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Database upgrade migration."""
+    op.add_column("submission", sa.Column("coverage_status", postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+    op.create_table(
+        "coverage_counter",
+        sa.Column("event_id", sa.Integer(), nullable=False),
+        sa.Column("form_id", sa.Integer(), nullable=False),
+        sa.Column("group_name", sa.String(), nullable=False),
+        sa.Column("location_id", sa.Integer(), nullable=False),
+        sa.Column("location_type_id", sa.Integer(), nullable=False),
+        sa.Column("signature", sa.String(), nullable=False),
+        sa.Column("complete", sa.Integer(), nullable=False),
+        sa.Column("conflict", sa.Integer(), nullable=False),
+        sa.Column("missing", sa.Integer(), nullable=False),
+        sa.Column("partial", sa.Integer(), nullable=False),
+        sa.Column("offline", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["event_id"], ["event.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["form_id"], ["form.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["location_id"], ["location.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["location_type_id"], ["location_type.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("event_id", "form_id", "group_name", "location_id"),
+    )
+    op.create_index(
+        "coverage_counter_location_type_idx",
+        "coverage_counter",
+        ["event_id", "form_id", "group_name", "location_type_id"],
+        unique=False,
+    )
+
+
+def downgrade():
+    """Database downgrade migration."""
+    op.drop_index("coverage_counter_location_type_idx", table_name="coverage_counter")
+    op.drop_table("coverage_counter")
+    op.drop_column("submission", "coverage_status")
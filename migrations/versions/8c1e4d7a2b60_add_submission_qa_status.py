@@ -0,0 +1,31 @@
+"""Add the persisted submission QA statuses.
+
+Revision ID: 8c1e4d7a2b60
+Revises: 3f6a9c2d7b15
+Create Date: 2026-10-18 15:02:47.193820
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "8c1e4d7a2b60"
+down_revision = "3f6a9c2d7b15"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Database upgrade migration."""
+    op.add_column("form", sa.Column("qa_status_signature", sa.String(), nullable=True))
+    op.add_column("submission", sa.Column("qa_status", postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+    op.create_index("submission_qa_status_idx", "submission", ["qa_status"], unique=False, postgresql_using="gin")
+
+
+def downgrade():
+    """Database downgrade migration."""
+    op.drop_index("submission_qa_status_idx", table_name="submission", postgresql_using="gin")
+    op.drop_column("submission", "qa_status")
+    op.drop_column("form", "qa_status_signature")